@@ -10,15 +10,49 @@ Version: 1.0.0
 
 from fastapi import APIRouter, Request, Form, HTTPException
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from functools import lru_cache
+from pydantic import BaseModel
 from typing import Optional
+import asyncio
+import logging
 
 from vllm.config import VLLM_API_URL, AVAILABLE_MODELS
-from services.vllm_client import call_vllm
+from services.vllm_client import call_vllm, error_status
+from services.web_assets import FastJSONResponse, templates
 
-# Initialize router and templates
+# Initialize router
+logger = logging.getLogger(__name__)
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
+
+
+class GenerateRequest(BaseModel):
+    model: str
+    prompt: str
+    max_tokens: int = 50
+
+
+def validate_request(model: str, prompt: str, max_tokens: int) -> None:
+    """Raise a 400 HTTPException for an empty prompt, out-of-range max_tokens or unknown model."""
+    if not prompt.strip():
+        raise HTTPException(status_code=400, detail="Prompt cannot be empty")
+    
+    if max_tokens < 1 or max_tokens > 512:
+        raise HTTPException(status_code=400, detail="Max tokens must be between 1 and 512")
+    
+    if model not in AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail="Invalid model selection")
+
+
+@lru_cache(maxsize=1)
+def _home_page() -> str:
+    """The home page is the same for every visitor, so it is rendered once."""
+    return templates.get_template("index.html").render(
+        models=AVAILABLE_MODELS,
+        response=None,
+        selected_model=None,
+        prompt="",
+        max_tokens=50
+    )
 
 
 @router.get("/", response_class=HTMLResponse)
@@ -33,17 +67,10 @@ async def home(request: Request):
         HTMLResponse: Rendered home page template
     """
     try:
-        return templates.TemplateResponse("index.html", {
-            "request": request,
-            "models": AVAILABLE_MODELS,
-            "response": None,
-            "selected_model": None,
-            "prompt": "",
-            "max_tokens": 50
-        })
+        return HTMLResponse(_home_page())
     except Exception as e:
         # Log the error in production
-        print(f"Error rendering home page: {str(e)}")
+        logger.exception("Error rendering home page")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
@@ -71,14 +98,7 @@ async def generate(
     """
     try:
         # Input validation
-        if not prompt.strip():
-            raise HTTPException(status_code=400, detail="Prompt cannot be empty")
-        
-        if max_tokens < 1 or max_tokens > 512:
-            raise HTTPException(status_code=400, detail="Max tokens must be between 1 and 512")
-        
-        if model not in AVAILABLE_MODELS:
-            raise HTTPException(status_code=400, detail="Invalid model selection")
+        validate_request(model, prompt, max_tokens)
         
         # Prepare payload for vLLM service
         payload = {
@@ -117,5 +137,36 @@ async def generate(
         raise
     except Exception as e:
         # Log unexpected errors in production
-        print(f"Unexpected error in generate endpoint: {str(e)}")
+        logger.exception("Unexpected error in generate endpoint")
         raise HTTPException(status_code=500, detail="Internal server error during text generation")
+
+
+@router.post("/api/generate")
+async def generate_json(body: GenerateRequest):
+    """
+    JSON variant of /generate used by the page's script (static/app.js).
+    
+    Returns only the generated text instead of re-rendering the whole page, and runs
+    the blocking vLLM call in a worker thread so the event loop keeps serving.
+    
+    Args:
+        body (GenerateRequest): Model, prompt and max_tokens (1-512)
+        
+    Returns:
+        JSONResponse: {"model": ..., "response": ...}
+        
+    Raises:
+        HTTPException: 400 for invalid input or a request vLLM rejects, 503 when no replica
+            serves the model, 502 when the vLLM backend fails
+    """
+    validate_request(body.model, body.prompt, body.max_tokens)
+    payload = {
+        "model": body.model,
+        "prompt": body.prompt.strip(),
+        "max_tokens": body.max_tokens
+    }
+    result = await asyncio.to_thread(call_vllm, payload)
+    status = error_status(result)
+    if status is not None:
+        raise HTTPException(status_code=status, detail=result.lstrip("❌ "))
+    return FastJSONResponse({"model": body.model, "response": result})
@@ -8,12 +8,29 @@ Author: AI Assistant
 Version: 1.0.0
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.templating import Jinja2Templates
+from fastapi.middleware.gzip import GZipMiddleware
 from api.routes import router as ui_router
 from prometheus_fastapi_instrumentator import Instrumentator
+from services.log_pipeline import configure_logging
+from services.health import backend_monitor
+from services.web_assets import STATIC_DIR, CachedStaticFiles, precompile_templates
+
+# Queue-based, structured logging (see services/log_pipeline.py)
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background backend probes (used by /ready and /status) for the app's lifetime."""
+    backend_monitor.start()
+    yield
+    await backend_monitor.stop()
+
 
 # Initialize FastAPI application
 app = FastAPI(
@@ -21,7 +38,8 @@ app = FastAPI(
     description="Advanced Language Model Testing Interface with vLLM Backend",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Enable Prometheus metrics collection
@@ -37,21 +55,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files for CSS, JavaScript, and other assets
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Compress HTML, CSS, JavaScript and JSON bodies above 1 KB
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
-# Configure Jinja2 templates for HTML rendering
-templates = Jinja2Templates(directory="templates")
+# Mount static files for CSS, JavaScript, and other assets (long-lived browser caching)
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
+
+# Compile templates once, ahead of the first request
+precompile_templates()
 
 # Include the main UI router
 app.include_router(ui_router, prefix="", tags=["UI"])
 
-# Health check endpoint for monitoring
+# Liveness endpoint for monitoring
 @app.get("/health")
 async def health_check():
-    """Health check endpoint for monitoring and load balancers."""
+    """Liveness check: the gateway process is up. Does not look at the backends."""
     return {"status": "healthy", "service": "vLLM AI Assistant"}
 
+
+# Readiness endpoint for load balancers
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness check computed from cached backend probes.
+    
+    Returns 503 when no vLLM backend has its model loaded with an acceptable
+    error rate and queue depth, so load balancers stop routing to this gateway.
+    """
+    if backend_monitor.is_ready():
+        return {"status": "ready"}
+    return JSONResponse(status_code=503, content={"status": "not ready"})
+
+
+# Per-backend load overview
+@app.get("/status")
+async def backend_status():
+    """Cached per-backend health and load (no upstream calls are made)."""
+    return backend_monitor.status()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
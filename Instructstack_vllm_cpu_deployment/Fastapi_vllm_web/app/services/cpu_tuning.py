@@ -0,0 +1,331 @@
+"""
+CPU Inference Tuning
+
+Turns the host's CPU topology into launch settings for vLLM CPU replicas, so each
+replica gets dedicated physical cores and NUMA-local memory instead of competing
+with the other replicas (and the rest of the host) for every core:
+
+    detect_topology()   NUMA nodes, their physical cores (with SMT siblings) and memory,
+                        limited to the CPUs this process may run on
+    plan_replicas()     one ReplicaPlan per vLLM replica: the CPUs its container is pinned
+                        to (--cpuset-cpus), its NUMA node (--cpuset-mems), the OpenMP
+                        thread binding (VLLM_CPU_OMP_THREADS_BIND, OMP_NUM_THREADS) and the
+                        KV-cache size (VLLM_CPU_KVCACHE_SPACE)
+
+Profiles:
+    default     no pinning: the image's settings (the behaviour before this module)
+    all-cores   one replica on every physical core of the host
+    numa        one replica per NUMA node, on that node's cores and memory
+    split       CPU_REPLICAS_PER_NODE replicas per NUMA node, each on its own cores
+
+OpenMP threads are bound to one logical CPU per physical core; SMT siblings stay in
+the container's cpuset (so nothing else is scheduled next to a decode thread) but
+get no thread unless CPU_USE_SMT is true. CPU_RESERVED_CORES physical cores per
+replica are kept out of the binding for vLLM's API server and scheduler: a decode
+step waits for its slowest thread, so a thread sharing its core stalls all of them.
+
+VLLM_CPU_KVCACHE_SPACE is allocated up front. Unless CPU_KVCACHE_SPACE fixes it,
+each replica gets CPU_KVCACHE_FRACTION of its node's memory, less the model weights
+of the replicas on that node, split between them and capped at CPU_KVCACHE_MAX_GB.
+
+Run it on the host to see the detected topology and a plan:
+
+    python Fastapi_vllm_web/app/services/cpu_tuning.py --profile numa --model-dir models/facebook/opt-125m
+    python Fastapi_vllm_web/app/services/cpu_tuning.py --profile split --replicas-per-node 2 --format docker
+
+`switch_model.py` launches replicas with the plan for CPU_TUNING_PROFILE, and
+`benchmarks/cpu_profile_bench.py` compares the profiles on the bundled tiny models.
+
+Configuration (environment variables):
+    CPU_TUNING_PROFILE      default, all-cores, numa or split (default: default)
+    CPU_REPLICAS_PER_NODE   Replicas per NUMA node with the split profile (default: 2)
+    CPU_USE_SMT             Bind OpenMP threads to SMT siblings too (default: false)
+    CPU_RESERVED_CORES      Physical cores per replica left out of the OpenMP binding (default: 1)
+    CPU_KVCACHE_SPACE       KV-cache GiB per replica, instead of sizing it from memory (default: unset)
+    CPU_KVCACHE_FRACTION    Share of a node's memory for weights and KV cache (default: 0.5)
+    CPU_KVCACHE_MAX_GB      Largest computed KV cache per replica, in GiB (default: 32)
+"""
+
+import argparse
+import glob
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+CPU_TUNING_PROFILE = os.getenv("CPU_TUNING_PROFILE", "default")
+CPU_REPLICAS_PER_NODE = int(os.getenv("CPU_REPLICAS_PER_NODE", "2"))
+CPU_USE_SMT = os.getenv("CPU_USE_SMT", "false").lower() == "true"
+CPU_RESERVED_CORES = int(os.getenv("CPU_RESERVED_CORES", "1"))
+CPU_KVCACHE_SPACE = os.getenv("CPU_KVCACHE_SPACE")
+CPU_KVCACHE_FRACTION = float(os.getenv("CPU_KVCACHE_FRACTION", "0.5"))
+CPU_KVCACHE_MAX_GB = int(os.getenv("CPU_KVCACHE_MAX_GB", "32"))
+
+PROFILES = ("default", "all-cores", "numa", "split")
+
+SYS_NODE_DIR = "/sys/devices/system/node"
+SYS_CPU_DIR = "/sys/devices/system/cpu"
+WEIGHT_FILES = ("*.safetensors", "*.bin", "*.pt")
+GIB = 1024 ** 3
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """CPUs of a kernel cpulist such as "0-3,8,10-11"."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpulist(cpus: List[int]) -> str:
+    """Compact cpulist for `cpus`, e.g. [0, 1, 2, 3, 8] -> "0-3,8"."""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+@dataclass
+class CpuTopology:
+    """Usable CPUs grouped by NUMA node and physical core."""
+    # NUMA node -> physical cores, each the sorted list of its logical CPUs
+    nodes: Dict[int, List[List[int]]]
+    # NUMA node -> memory in GiB
+    memory_gib: Dict[int, float]
+
+    @property
+    def physical_cores(self) -> int:
+        return sum(len(cores) for cores in self.nodes.values())
+
+    @property
+    def logical_cpus(self) -> int:
+        return sum(len(core) for cores in self.nodes.values() for core in cores)
+
+    def to_dict(self) -> Dict:
+        return {
+            "nodes": {node: {"cpus": format_cpulist([cpu for core in cores for cpu in core]),
+                             "physical_cores": len(cores),
+                             "memory_gib": round(self.memory_gib.get(node, 0.0), 1)}
+                      for node, cores in self.nodes.items()},
+            "physical_cores": self.physical_cores,
+            "logical_cpus": self.logical_cpus,
+        }
+
+
+def detect_topology(sys_node_dir: str = SYS_NODE_DIR, sys_cpu_dir: str = SYS_CPU_DIR) -> CpuTopology:
+    """
+    Read the CPU topology from sysfs.
+
+    Only CPUs this process may run on are included (a container's cpuset or a
+    taskset), so a plan never pins a replica to CPUs it cannot use. Without NUMA
+    information all CPUs form node 0; without SMT information each CPU is its own core.
+
+    Returns:
+        CpuTopology: Physical cores and memory per NUMA node
+    """
+    try:
+        allowed = set(os.sched_getaffinity(0))
+    except AttributeError:
+        allowed = set(range(os.cpu_count() or 1))
+
+    node_cpus: Dict[int, List[int]] = {}
+    memory_gib: Dict[int, float] = {}
+    for path in glob.glob(os.path.join(sys_node_dir, "node[0-9]*")):
+        node = int(re.sub(r"\D", "", os.path.basename(path)))
+        cpus = [cpu for cpu in parse_cpulist(_read(os.path.join(path, "cpulist")) or "") if cpu in allowed]
+        if not cpus:
+            continue
+        node_cpus[node] = cpus
+        meminfo = re.search(r"MemTotal:\s+(\d+) kB", _read(os.path.join(path, "meminfo")) or "")
+        if meminfo:
+            memory_gib[node] = int(meminfo.group(1)) * 1024 / GIB
+    if not node_cpus:
+        node_cpus = {0: sorted(allowed)}
+    if not memory_gib:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / GIB
+        memory_gib = {node: total / len(node_cpus) for node in node_cpus}
+
+    nodes: Dict[int, List[List[int]]] = {}
+    for node, cpus in sorted(node_cpus.items()):
+        cores: Dict[int, List[int]] = {}
+        for cpu in cpus:
+            siblings = _read(os.path.join(sys_cpu_dir, f"cpu{cpu}", "topology", "thread_siblings_list"))
+            members = [c for c in parse_cpulist(siblings) if c in allowed] if siblings else [cpu]
+            cores.setdefault(min(members or [cpu]), sorted(set(members) | {cpu}))
+        nodes[node] = [cores[key] for key in sorted(cores)]
+    return CpuTopology(nodes, memory_gib)
+
+
+def model_weights_gib(model_dir: Optional[str]) -> float:
+    """Size of the weight files under a model directory in GiB (0 when unknown)."""
+    if not model_dir or not os.path.isdir(model_dir):
+        return 0.0
+    total = 0
+    for pattern in WEIGHT_FILES:
+        for path in glob.glob(os.path.join(model_dir, "**", pattern), recursive=True):
+            total += os.path.getsize(path)
+    return total / GIB
+
+
+@dataclass
+class ReplicaPlan:
+    """Launch settings for one vLLM CPU replica."""
+    index: int
+    node: Optional[int]
+    # Every logical CPU of the replica's physical cores (the container's cpuset); empty = unpinned
+    cpus: List[int]
+    # Logical CPUs OpenMP threads are bound to, one thread each
+    omp_cpus: List[int]
+    kvcache_gib: Optional[int]
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables for the vLLM process (empty for the default profile)."""
+        env = {}
+        if self.omp_cpus:
+            env["VLLM_CPU_OMP_THREADS_BIND"] = format_cpulist(self.omp_cpus)
+            env["OMP_NUM_THREADS"] = str(len(self.omp_cpus))
+        if self.kvcache_gib is not None:
+            env["VLLM_CPU_KVCACHE_SPACE"] = str(self.kvcache_gib)
+        return env
+
+    def docker_kwargs(self) -> Dict[str, str]:
+        """`docker.containers.run` arguments pinning the container to its cores and NUMA node."""
+        kwargs = {}
+        if self.cpus:
+            kwargs["cpuset_cpus"] = format_cpulist(self.cpus)
+        if self.node is not None:
+            kwargs["cpuset_mems"] = str(self.node)
+        return kwargs
+
+    def to_dict(self) -> Dict:
+        return {"replica": self.index, "node": self.node, "cpuset": format_cpulist(self.cpus),
+                "env": self.env(), "docker": self.docker_kwargs()}
+
+
+def _split(cores: List[List[int]], parts: int) -> List[List[List[int]]]:
+    """Split cores into `parts` contiguous groups whose sizes differ by at most one."""
+    parts = max(1, min(parts, len(cores)))
+    size, extra = divmod(len(cores), parts)
+    groups, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+def plan_replicas(topology: CpuTopology, profile: str = CPU_TUNING_PROFILE,
+                  replicas_per_node: int = CPU_REPLICAS_PER_NODE, use_smt: bool = CPU_USE_SMT,
+                  reserved_cores: int = CPU_RESERVED_CORES, weights_gib: float = 0.0,
+                  kvcache_gib: Optional[int] = None) -> List[ReplicaPlan]:
+    """
+    Launch settings for every replica of a profile.
+
+    Args:
+        topology: Host topology from `detect_topology()`
+        profile: One of PROFILES
+        replicas_per_node: Replicas per NUMA node for the "split" profile
+        use_smt: Bind OpenMP threads to SMT siblings as well as to the first CPU of each core
+        reserved_cores: Physical cores per replica kept free of OpenMP threads (only when the
+            replica has at least two cores more than that)
+        weights_gib: Model weights in GiB, held once per replica
+        kvcache_gib: Fixed KV-cache size per replica; sized from node memory when None
+
+    Returns:
+        List[ReplicaPlan]: One plan per replica
+
+    Raises:
+        ValueError: For an unknown profile
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown CPU tuning profile {profile!r}, expected one of {', '.join(PROFILES)}")
+    if kvcache_gib is None and CPU_KVCACHE_SPACE:
+        kvcache_gib = int(CPU_KVCACHE_SPACE)
+    if profile == "default":
+        return [ReplicaPlan(0, None, [], [], kvcache_gib)]
+
+    # (node or None for all nodes, cores, memory available to the group's replicas, replicas sharing it)
+    groups = []
+    if profile == "all-cores":
+        cores = [core for node_cores in topology.nodes.values() for core in node_cores]
+        groups.append((None if len(topology.nodes) > 1 else next(iter(topology.nodes)), cores,
+                       sum(topology.memory_gib.values()), 1))
+    else:
+        parts = replicas_per_node if profile == "split" else 1
+        for node, node_cores in topology.nodes.items():
+            node_groups = _split(node_cores, parts)
+            for cores in node_groups:
+                groups.append((node, cores, topology.memory_gib.get(node, 0.0), len(node_groups)))
+
+    plans = []
+    for index, (node, cores, memory_gib, sharing) in enumerate(groups):
+        reserve = reserved_cores if len(cores) >= reserved_cores + 2 else 0
+        omp_cores = cores[reserve:]
+        omp_cpus = [cpu for core in omp_cores for cpu in (core if use_smt else core[:1])]
+        size = kvcache_gib
+        if size is None:
+            free = memory_gib * CPU_KVCACHE_FRACTION - weights_gib * sharing
+            size = max(1, min(CPU_KVCACHE_MAX_GB, int(free / sharing)))
+        plans.append(ReplicaPlan(index, node, [cpu for core in cores for cpu in core], omp_cpus, size))
+    return plans
+
+
+def current_plan(model_dir: Optional[str] = None) -> List[ReplicaPlan]:
+    """Plans for CPU_TUNING_PROFILE on this host, sized for the model under `model_dir`."""
+    return plan_replicas(detect_topology(), weights_gib=model_weights_gib(model_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the CPU topology and vLLM launch settings per profile")
+    parser.add_argument("--profile", default=CPU_TUNING_PROFILE, choices=PROFILES)
+    parser.add_argument("--replicas-per-node", type=int, default=CPU_REPLICAS_PER_NODE)
+    parser.add_argument("--use-smt", action="store_true", default=CPU_USE_SMT)
+    parser.add_argument("--reserved-cores", type=int, default=CPU_RESERVED_CORES)
+    parser.add_argument("--model-dir", help="Model directory, for sizing the KV cache around its weights")
+    parser.add_argument("--kvcache-gib", type=int, help="Fixed KV-cache GiB per replica")
+    parser.add_argument("--format", choices=("table", "env", "docker"), default="table",
+                        help="table: summary; env: .env lines per replica; docker: `docker run` flags")
+    args = parser.parse_args()
+
+    topology = detect_topology()
+    plans = plan_replicas(topology, args.profile, args.replicas_per_node, args.use_smt, args.reserved_cores,
+                          model_weights_gib(args.model_dir), args.kvcache_gib)
+
+    if args.format == "table":
+        print(f"Physical cores: {topology.physical_cores}, logical CPUs: {topology.logical_cpus}")
+        for node, info in topology.to_dict()["nodes"].items():
+            print(f"  node {node}: cpus {info['cpus']} ({info['physical_cores']} cores), "
+                  f"{info['memory_gib']} GiB")
+        print(f"\nProfile {args.profile}: {len(plans)} replica(s)")
+        for plan in plans:
+            print(f"  replica {plan.index}: node {plan.node if plan.node is not None else '-'}, "
+                  f"cpuset {format_cpulist(plan.cpus) or 'all'}, "
+                  f"omp {format_cpulist(plan.omp_cpus) or 'image default'}, "
+                  f"kv cache {plan.kvcache_gib if plan.kvcache_gib is not None else 'image default'} GiB")
+    for plan in plans if args.format != "table" else []:
+        if args.format == "env":
+            print(f"# replica {plan.index}")
+            for key, value in plan.env().items():
+                print(f"{key}={value}")
+        else:
+            flags = [f"--{key.replace('_', '-')} {value}" for key, value in plan.docker_kwargs().items()]
+            flags += [f"-e {key}={value}" for key, value in plan.env().items()]
+            print(f"# replica {plan.index}\n{' '.join(flags)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Backend Health Monitor
+
+Probes every vLLM backend in the background and caches the result, so the
+liveness/readiness/status endpoints never do upstream work when they are called.
+
+A backend is ready when its model is loaded, its recent error rate is below
+READY_MAX_ERROR_RATE and its vLLM queue (`vllm:num_requests_waiting` from
+`/metrics`) is at most READY_MAX_QUEUE_DEPTH. The gateway is ready while at least
+one backend is ready.
+
+Each model has one backend per host in VLLM_REPLICA_HOSTS; requests go round-robin
+to the ready ones, or to those serving the model while none is ready, and get a 503
+when the last probe found no backend serving it (see `BackendMonitor.pick`).
+
+Configuration (environment variables):
+    HEALTH_PROBE_INTERVAL   Seconds between probes (default: 5)
+    HEALTH_PROBE_TIMEOUT    Timeout of each probe request in seconds (default: 2)
+    HEALTH_ERROR_WINDOW     Number of recent requests used for the error rate (default: 50)
+    READY_MAX_ERROR_RATE    Error rate above which a backend is not ready (default: 0.5)
+    READY_MAX_QUEUE_DEPTH   Waiting requests above which a backend is not ready (default: 20)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+import httpx
+
+from vllm.config import VLLM_HOST, VLLM_REPLICA_HOSTS, MODEL_PORT_MAPPING
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "5"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+HEALTH_ERROR_WINDOW = int(os.getenv("HEALTH_ERROR_WINDOW", "50"))
+READY_MAX_ERROR_RATE = float(os.getenv("READY_MAX_ERROR_RATE", "0.5"))
+READY_MAX_QUEUE_DEPTH = int(os.getenv("READY_MAX_QUEUE_DEPTH", "20"))
+
+
+@dataclass
+class BackendStatus:
+    """Cached probe results and recent request outcomes for one vLLM backend."""
+    model: str
+    port: int
+    host: str = VLLM_HOST
+    reachable: bool = False
+    model_loaded: bool = False
+    requests_running: float = 0.0
+    requests_waiting: float = 0.0
+    last_probe: float = 0.0
+    last_error: str = ""
+    outcomes: Deque[bool] = field(default_factory=lambda: deque(maxlen=HEALTH_ERROR_WINDOW))
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def ready(self) -> bool:
+        return (self.model_loaded
+                and self.error_rate <= READY_MAX_ERROR_RATE
+                and self.requests_waiting <= READY_MAX_QUEUE_DEPTH)
+
+    def to_dict(self) -> Dict:
+        return {
+            "model": self.model,
+            "host": self.host,
+            "port": self.port,
+            "ready": self.ready,
+            "reachable": self.reachable,
+            "model_loaded": self.model_loaded,
+            "requests_running": self.requests_running,
+            "requests_waiting": self.requests_waiting,
+            "error_rate": round(self.error_rate, 3),
+            "recent_requests": len(self.outcomes),
+            "last_probe_age_s": round(time.time() - self.last_probe, 1) if self.last_probe else None,
+            "last_error": self.last_error,
+        }
+
+
+def parse_queue_metrics(text: str) -> Dict[str, float]:
+    """
+    Extract running/waiting request counts from vLLM's Prometheus `/metrics` text.
+
+    Args:
+        text: Prometheus exposition text
+
+    Returns:
+        Dict[str, float]: `running` and `waiting`, summed over all label sets
+    """
+    totals = {"running": 0.0, "waiting": 0.0}
+    for line in text.splitlines():
+        if line.startswith("vllm:num_requests_running"):
+            totals["running"] += float(line.rsplit(" ", 1)[-1])
+        elif line.startswith("vllm:num_requests_waiting"):
+            totals["waiting"] += float(line.rsplit(" ", 1)[-1])
+    return totals
+
+
+class BackendMonitor:
+    """Background prober keeping a cached health view of every vLLM backend."""
+
+    def __init__(self, backends: Dict[str, int], hosts: List[str] = VLLM_REPLICA_HOSTS):
+        self.hosts = hosts
+        self.backends = {model: [BackendStatus(model, port, host) for host in hosts]
+                         for model, port in backends.items()}
+        self._next: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def all_backends(self) -> List[BackendStatus]:
+        return [backend for backends in self.backends.values() for backend in backends]
+
+    def pick(self, model: str) -> Optional[BackendStatus]:
+        """
+        Next backend for `model`, round-robin over the ready ones.
+
+        While none is ready, round-robin over those serving the model (or not probed yet),
+        so an error rate can recover. None when the last probe found no backend serving it.
+        """
+        backends = self.backends.get(model)
+        if not backends:
+            return None
+        candidates = ([backend for backend in backends if backend.ready]
+                      or [backend for backend in backends if backend.model_loaded or not backend.last_probe])
+        if not candidates:
+            return None
+        index = self._next.get(model, 0)
+        self._next[model] = index + 1
+        return candidates[index % len(candidates)]
+
+    def record_result(self, model: str, ok: bool, host: str) -> None:
+        """Record the outcome of a proxied request (O(1), called on the request path)."""
+        for backend in self.backends.get(model, []):
+            if backend.host == host:
+                backend.outcomes.append(ok)
+
+    def is_ready(self) -> bool:
+        return any(backend.ready for backend in self.all_backends())
+
+    def status(self) -> Dict:
+        return {
+            "ready": self.is_ready(),
+            "backends": [backend.to_dict() for backend in self.all_backends()],
+        }
+
+    async def _probe(self, client: httpx.AsyncClient, backend: BackendStatus) -> None:
+        base_url = f"http://{backend.host}:{backend.port}"
+        try:
+            models, metrics = await asyncio.gather(
+                client.get(f"{base_url}/v1/models"),
+                client.get(f"{base_url}/metrics"),
+            )
+            backend.reachable = True
+            data = (models.json().get("data") or []) if models.status_code == 200 else []
+            backend.model_loaded = any(backend.model in entry.get("id", "") for entry in data)
+            if metrics.status_code == 200:
+                queue = parse_queue_metrics(metrics.text)
+                backend.requests_running = queue["running"]
+                backend.requests_waiting = queue["waiting"]
+            backend.last_error = "" if backend.model_loaded else "model not loaded"
+        except (httpx.HTTPError, ValueError) as e:
+            backend.reachable = False
+            backend.model_loaded = False
+            backend.last_error = str(e) or type(e).__name__
+        backend.last_probe = time.time()
+
+    async def probe_once(self) -> None:
+        """Probe every backend concurrently and update the cached status."""
+        async with httpx.AsyncClient(timeout=HEALTH_PROBE_TIMEOUT) as client:
+            await asyncio.gather(*(self._probe(client, b) for b in self.all_backends()))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_once()
+            except Exception:
+                logger.exception("Backend probe failed")
+            await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+backend_monitor = BackendMonitor(MODEL_PORT_MAPPING)
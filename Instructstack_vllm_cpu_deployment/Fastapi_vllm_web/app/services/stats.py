@@ -0,0 +1,28 @@
+"""
+Statistics
+
+The percentile definition used by the CPU benchmarks; the same nearest-rank
+definition as the GPU deployment's services/stats.py.
+"""
+
+import math
+from typing import Iterable, Optional
+
+
+def percentile(values: Iterable[float], pct: float, default: Optional[float] = None) -> Optional[float]:
+    """
+    Nearest-rank percentile: the smallest value with at least `pct`% of the values at or below it.
+
+    Args:
+        values: Samples, in any order
+        pct: Percentile, 0-100
+        default: Returned when there are no values
+
+    Returns:
+        Optional[float]: One of the values (never interpolated), or `default`
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return default
+    rank = math.ceil(pct * len(ordered) / 100)
+    return ordered[min(len(ordered), max(1, rank)) - 1]
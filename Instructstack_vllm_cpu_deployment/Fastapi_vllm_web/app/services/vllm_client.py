@@ -13,26 +13,41 @@ import time
 import logging
 from typing import Dict, Optional
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from vllm.config import MODEL_PORT_MAPPING
+from services.log_pipeline import should_sample, prompt_fields, elapsed_ms
+from services.health import backend_monitor
+
+# Logging is configured once in main.py (queue-based, see services/log_pipeline.py)
 logger = logging.getLogger(__name__)
 
 # Configuration constants
-MODEL_PORT_MAPPING = {
-    "facebook/opt-125m": 8000,
-    "sshleifer/tiny-gpt2": 8001
-}
-
 REQUEST_TIMEOUT = 60  # seconds
 MODEL_CHECK_TIMEOUT = 5  # seconds
 
 
+def error_status(result: str) -> Optional[int]:
+    """HTTP status for an error message returned by `call_vllm`, or None for generated text."""
+    if result.startswith(("❌ No model specified", "❌ Unknown model", "❌ Rejected by vLLM")):
+        return 400
+    if result.startswith("❌ All replicas"):
+        return 503
+    if result.startswith("❌"):
+        return 502
+    return None
+
+
+def is_replica_failure(result: str) -> bool:
+    """Whether a `call_vllm` result counts against the replica: 5xx, timeouts and transport errors, not 4xx."""
+    status = error_status(result)
+    return status is not None and status != 400
+
+
 def call_vllm(payload: Dict[str, any]) -> str:
     """
     Generate text using the vLLM inference server.
     
     This function handles the complete flow of:
-    1. Model validation and port selection
+    1. Model validation, port and replica selection
     2. Current model verification
     3. Text generation request
     4. Response processing and error handling
@@ -50,6 +65,9 @@ def call_vllm(payload: Dict[str, any]) -> str:
         requests.exceptions.RequestException: For network/HTTP errors
         Exception: For unexpected errors during processing
     """
+    start = time.perf_counter()
+    sampled = should_sample()
+    model_name = host = None
     try:
         # Extract and validate model name
         model_name = payload.get("model")
@@ -61,35 +79,58 @@ def call_vllm(payload: Dict[str, any]) -> str:
         if port is None:
             return f"❌ Unknown model: {model_name}. Supported models: {list(MODEL_PORT_MAPPING.keys())}"
         
+        # Round-robin over the model's replicas (one per host in VLLM_REPLICA_HOSTS)
+        backend = backend_monitor.pick(model_name)
+        if backend is None:
+            return f"❌ All replicas of {model_name} are unavailable"
+        host = backend.host
+        
         # Transform model name to vLLM's expected format
         vllm_model_name = f"/models/{model_name}"
         payload["model"] = vllm_model_name
         
-        logger.info(f"Processing request - Original model: {model_name}, Port: {port}")
-        logger.info(f"Transformed model path: {vllm_model_name}")
+        if sampled and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Processing request",
+                         extra={"model": model_name, "vllm_model": vllm_model_name, "host": host, "port": port})
         
         # Step 1: Verify current model served on the specified port
-        if not _verify_current_model(port, model_name):
-            return f"❌ Wrong model served on port {port}. Please restart the server with the correct model."
+        if not _verify_current_model(host, port, model_name):
+            backend_monitor.record_result(model_name, False, host)
+            return f"❌ Wrong model served on {host}:{port}. Please restart the server with the correct model."
         
         # Step 2: Send text generation request
-        return _generate_text(port, payload)
+        result = _generate_text(host, port, payload, sampled)
+        # A request vLLM rejects (e.g. a prompt longer than the context) is the client's fault, not the replica's
+        backend_monitor.record_result(model_name, not is_replica_failure(result), host)
+        if sampled:
+            logger.info("Request completed", extra={
+                "model": model_name,
+                "host": host,
+                "port": port,
+                "total_ms": elapsed_ms(start),
+                "ok": not result.startswith("❌"),
+            })
+        return result
         
     except requests.exceptions.RequestException as e:
         error_msg = f"Request failed: {str(e)}"
-        logger.error(error_msg)
+        logger.error("Request failed", extra={"host": host, "error": str(e)})
+        if host is not None:
+            # Count it against the replica, so a failing one drops out of the round-robin
+            backend_monitor.record_result(model_name, False, host)
         return f"❌ {error_msg}"
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
-        logger.error(error_msg)
+        logger.exception("Unexpected error")
         return f"❌ {error_msg}"
 
 
-def _verify_current_model(port: int, expected_model: str) -> bool:
+def _verify_current_model(host: str, port: int, expected_model: str) -> bool:
     """
     Verify that the expected model is currently served on the specified port.
     
     Args:
+        host (str): Host of the vLLM replica
         port (int): Port number to check
         expected_model (str): Expected model name
         
@@ -97,8 +138,7 @@ def _verify_current_model(port: int, expected_model: str) -> bool:
         bool: True if correct model is served, False otherwise
     """
     try:
-        models_url = f"http://vllm_server:{port}/v1/models"
-        logger.info(f"Checking models endpoint: {models_url}")
+        models_url = f"http://{host}:{port}/v1/models"
         
         response = requests.get(models_url, timeout=MODEL_CHECK_TIMEOUT)
         
@@ -108,37 +148,45 @@ def _verify_current_model(port: int, expected_model: str) -> bool:
                 current_model = model_data["data"][0]["id"].split("/")[-1]
                 expected_model_name = expected_model.split("/")[-1]
                 
-                logger.info(f"Current model on port {port}: {current_model}")
-                logger.info(f"Expected model: {expected_model_name}")
-                
+                if current_model != expected_model_name:
+                    logger.warning("Unexpected model served", extra={
+                        "port": port, "current_model": current_model, "expected_model": expected_model_name,
+                    })
                 return current_model == expected_model_name
             else:
-                logger.warning(f"No model data found in response from port {port}")
+                logger.warning("No model data found in response", extra={"port": port})
                 return False
         else:
-            logger.error(f"Failed to get models from port {port}. Status: {response.status_code}")
+            logger.error("Failed to get models", extra={"port": port, "status": response.status_code})
             return False
             
     except requests.exceptions.RequestException as e:
-        logger.error(f"Request failed while checking model on port {port}: {str(e)}")
+        logger.error("Request failed while checking model", extra={"port": port, "error": str(e)})
         return False
 
 
-def _generate_text(port: int, payload: Dict[str, any]) -> str:
+def _generate_text(host: str, port: int, payload: Dict[str, any], sampled: bool = True) -> str:
     """
     Send text generation request to the vLLM server.
     
     Args:
+        host (str): Host of the vLLM replica
         port (int): Port number for the vLLM server
         payload (Dict[str, any]): Generation request payload
+        sampled (bool): Whether this request's per-request logs are emitted
         
     Returns:
         str: Generated text or error message
     """
     try:
-        api_url = f"http://vllm_server:{port}/v1/completions"
-        logger.info(f"Sending generation request to: {api_url}")
-        logger.info(f"Payload: {payload}")
+        api_url = f"http://{host}:{port}/v1/completions"
+        if sampled and logger.isEnabledFor(logging.DEBUG):
+            # Never log the raw payload: prompts can be large, so log a bounded summary instead
+            logger.debug("Sending generation request", extra={
+                "url": api_url,
+                "max_tokens": payload.get("max_tokens"),
+                **prompt_fields(payload.get("prompt", "")),
+            })
         
         response = requests.post(api_url, json=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
@@ -147,22 +195,27 @@ def _generate_text(port: int, payload: Dict[str, any]) -> str:
         response_data = response.json()
         if "choices" in response_data and len(response_data["choices"]) > 0:
             generated_text = response_data["choices"][0]["text"].strip()
-            logger.info(f"Successfully generated text with {len(generated_text)} characters")
+            if sampled and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Generated text", extra={"port": port, "output_chars": len(generated_text)})
             return generated_text
         else:
             error_msg = "No choices found in response"
-            logger.error(error_msg)
+            logger.error(error_msg, extra={"port": port})
             return f"❌ {error_msg}"
             
     except requests.exceptions.HTTPError as e:
-        error_msg = f"HTTP error {e.response.status_code}: {e.response.text}"
-        logger.error(error_msg)
+        status = e.response.status_code
+        if 400 <= status < 500:
+            logger.warning("Request rejected by vLLM", extra={"port": port, "status": status})
+            return f"❌ Rejected by vLLM (HTTP {status}): {e.response.text}"
+        error_msg = f"HTTP error {status}: {e.response.text}"
+        logger.error("HTTP error from vLLM", extra={"port": port, "status": status})
         return f"❌ {error_msg}"
     except requests.exceptions.Timeout:
         error_msg = f"Request timeout after {REQUEST_TIMEOUT} seconds"
-        logger.error(error_msg)
+        logger.error("Request timeout", extra={"port": port, "timeout_s": REQUEST_TIMEOUT})
         return f"❌ {error_msg}"
     except requests.exceptions.RequestException as e:
         error_msg = f"Request failed: {str(e)}"
-        logger.error(error_msg)
+        logger.error("Request failed", extra={"port": port, "error": str(e)})
         return f"❌ {error_msg}"
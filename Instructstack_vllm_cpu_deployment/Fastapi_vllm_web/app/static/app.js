@@ -0,0 +1,74 @@
+// vLLM AI Assistant front end: generates through the JSON API (/api/generate)
+// without reloading the page. Without JavaScript the form still posts to /generate.
+
+(function () {
+    "use strict";
+
+    // Auto-resize textarea
+    function autoResize(textarea) {
+        textarea.style.height = 'auto';
+        textarea.style.height = textarea.scrollHeight + 'px';
+    }
+
+    // Copy response to clipboard
+    function copyResponse() {
+        const responseText = document.getElementById('response-text').textContent;
+        navigator.clipboard.writeText(responseText).then(function () {
+            const copyBtn = document.querySelector('.copy-btn');
+            const icon = copyBtn.querySelector('i');
+            icon.className = 'fas fa-check';
+            copyBtn.style.background = '#4CAF50';
+
+            setTimeout(() => {
+                icon.className = 'fas fa-copy';
+                copyBtn.style.background = '#6366f1';
+            }, 2000);
+        });
+    }
+
+    // Generate without a page reload; fall back to a normal form post if the request can't be sent
+    async function generate(event) {
+        event.preventDefault();
+        const form = event.target;
+        const data = new FormData(form);
+        const overlay = document.getElementById('loadingOverlay');
+        const box = document.getElementById('response-box');
+        const text = document.getElementById('response-text');
+
+        overlay.style.display = 'flex';
+        try {
+            const resp = await fetch('/api/generate', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    model: data.get('model'),
+                    prompt: data.get('prompt'),
+                    max_tokens: Number(data.get('max_tokens')) || 50
+                })
+            });
+            const result = await resp.json();
+            text.textContent = resp.ok ? result.response : `Error: ${result.detail}`;
+            box.hidden = false;
+        } catch (err) {
+            form.submit();
+            return;
+        } finally {
+            overlay.style.display = 'none';
+        }
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        const promptTextarea = document.getElementById('prompt');
+        const charCount = document.querySelector('.char-count');
+
+        // Character counter for textarea
+        charCount.textContent = promptTextarea.value.length;
+        promptTextarea.addEventListener('input', function () {
+            charCount.textContent = this.value.length;
+            autoResize(this);
+        });
+
+        document.getElementById('generate-form').addEventListener('submit', generate);
+        document.querySelector('.copy-btn').addEventListener('click', copyResponse);
+    });
+})();
@@ -3,8 +3,16 @@ import time
 import requests
 import os
 
+from services.cpu_tuning import CPU_TUNING_PROFILE, current_plan
+
+
+def replica_name(index: int) -> str:
+    """Container (and host) name of a vLLM replica; list them in VLLM_REPLICA_HOSTS."""
+    return "vllm_server" if index == 0 else f"vllm_server_{index}"
+
+
 def switch_model(model_name: str) -> bool:
-    """Restarts the vLLM container with the specified model."""
+    """Restarts the vLLM container(s) with the specified model, tuned by CPU_TUNING_PROFILE."""
     try:
         print(model_name)
         host_models_path = os.environ["HOST_MODEL_PATH"]
@@ -19,39 +27,55 @@ def switch_model(model_name: str) -> bool:
 
         client = docker.from_env()
 
-        # 1. Stop and remove existing container
-        try:
-            container = client.containers.get('vllm_server')
-            print("🛑 Stopping existing container...")
+        # Cores, NUMA node, OpenMP binding and KV-cache size per replica (see services/cpu_tuning.py)
+        plans = current_plan(os.path.join(container_models_path, model_name))
+        print(f"⚙️ CPU tuning profile {CPU_TUNING_PROFILE}: {len(plans)} replica(s)")
+
+        # 1. Stop and remove existing containers
+        existing = client.containers.list(all=True, filters={"name": "vllm_server"})
+        if not existing:
+            print("ℹ️ No existing container found")
+        for container in existing:
+            print(f"🛑 Stopping existing container {container.name}...")
             container.stop()
-            container.remove()
+            try:
+                container.remove()
+            except docker.errors.APIError:
+                # Already removed: replicas are started with remove=True
+                pass
+        if existing:
             time.sleep(2)
-        except docker.errors.NotFound:
-            print("ℹ️ No existing container found")
-            pass
 
-        # 2. Start new container
-        print(f"\n🚀 Starting new container with model: {model_name}")
-        print("="*50)
+        # 2. Start new containers, each pinned to its own cores
+        containers = []
+        for plan in plans:
+            print(f"\n🚀 Starting {replica_name(plan.index)} with model: {model_name}")
+            print(f"   {plan.to_dict()}")
+            print("="*50)
 
-        
-        container = client.containers.run(
-            image="hamzaak4/vllm-cpu-image:Latest1.1",
-            name="vllm_server",
-            command=[
-                "/bin/bash", 
-                "-c", 
-                f"source /opt/conda/etc/profile.d/conda.sh && "
-                f"conda activate vllm_env && "
-                f"vllm serve {container_models_path}/{model_name} --device cpu --host 0.0.0.0 --port 8000"
-            ],
-            volumes={str(host_models_path): {'bind': container_models_path, 'mode': 'ro'}},
-
-            network="vllm-net",
-            privileged=True,
-            detach=True,
-            remove=True
-        )
+            containers.append(client.containers.run(
+                image="hamzaak4/vllm-cpu-image:Latest1.1",
+                name=replica_name(plan.index),
+                command=[
+                    "/bin/bash", 
+                    "-c", 
+                    f"source /opt/conda/etc/profile.d/conda.sh && "
+                    f"conda activate vllm_env && "
+                    f"vllm serve {container_models_path}/{model_name} --device cpu --host 0.0.0.0 --port 8000"
+                ],
+                volumes={str(host_models_path): {'bind': container_models_path, 'mode': 'ro'}},
+                environment=plan.env(),
+
+                network="vllm-net",
+                privileged=True,
+                detach=True,
+                remove=True,
+                **plan.docker_kwargs()
+            ))
+        if len(plans) > 1:
+            print(f"ℹ️ Route to every replica with VLLM_REPLICA_HOSTS="
+                  f"{','.join(replica_name(plan.index) for plan in plans)}")
+        container = containers[0]
 
 
         # 3. Stream logs properly
@@ -66,10 +90,14 @@ def switch_model(model_name: str) -> bool:
         print("\n⏳ Waiting for server to be ready...")
         start_time = time.time()
         timeout = 90
+        pending = [replica_name(plan.index) for plan in plans]
         while time.time() - start_time < timeout:
             try:
-                resp = requests.get("http://vllm_server:8000/v1/models", timeout=2)
-                if resp.status_code == 200:
+                for name in list(pending):
+                    resp = requests.get(f"http://{name}:8000/v1/models", timeout=2)
+                    if resp.status_code == 200:
+                        pending.remove(name)
+                if not pending:
                     print("\n✅ Server is ready!")
                     return True
                 time.sleep(1)
@@ -1,6 +1,21 @@
+import os
+
 VLLM_API_URL = "http://vllm_server:8000/v1/completions"
 
 AVAILABLE_MODELS = [
     "facebook/opt-125m",
     "sshleifer/tiny-gpt2"
 ]
+
+# Host serving the vLLM containers
+VLLM_HOST = os.getenv("VLLM_HOST", "vllm_server")
+
+# Hosts of all vLLM replicas, e.g. VLLM_REPLICA_HOSTS=vllm_server,vllm_server_1 for the
+# pinned replicas started with the numa/split CPU tuning profiles (see services/cpu_tuning.py)
+VLLM_REPLICA_HOSTS = [host for host in os.getenv("VLLM_REPLICA_HOSTS", VLLM_HOST).split(",") if host]
+
+# Port each model is served on
+MODEL_PORT_MAPPING = {
+    "facebook/opt-125m": int(os.getenv("VLLM_PORT", "8000")),
+    "sshleifer/tiny-gpt2": int(os.getenv("VLLM_PORT_1", "8001")),
+}
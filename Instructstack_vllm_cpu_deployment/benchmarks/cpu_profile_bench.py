@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+CPU Tuning Profile Benchmark
+
+Compares the CPU tuning profiles (see Fastapi_vllm_web/app/services/cpu_tuning.py)
+on the bundled tiny models, without a GPU. For every model and profile it starts
+the profile's vLLM replicas as local processes, each with its plan applied:
+
+    CPU affinity      the replica's cpuset (like docker --cpuset-cpus)
+    memory binding    `numactl --membind=<node>` when numactl is installed (like --cpuset-mems)
+    environment       VLLM_CPU_OMP_THREADS_BIND, OMP_NUM_THREADS, VLLM_CPU_KVCACHE_SPACE
+
+then sends the same closed-loop load, spread round-robin over the replicas, and
+reports throughput and latency per profile. Run it where `vllm serve` works on CPU,
+e.g. inside the vLLM CPU image with ./models mounted.
+
+Usage:
+    python benchmarks/cpu_profile_bench.py
+    python benchmarks/cpu_profile_bench.py --profiles default,numa,split --replicas-per-node 2 \\
+        --concurrency 32 --requests 400 --extra-args "--dtype float32 --enforce-eager"
+    # Only print the plans for this host:
+    python benchmarks/cpu_profile_bench.py --dry-run
+"""
+
+import argparse
+import asyncio
+import os
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEPLOY_DIR = os.path.dirname(BENCH_DIR)
+APP_DIR = os.path.join(DEPLOY_DIR, "Fastapi_vllm_web", "app")
+sys.path.insert(0, APP_DIR)
+
+from services.cpu_tuning import (PROFILES, ReplicaPlan, detect_topology, format_cpulist,  # noqa: E402
+                                 model_weights_gib, plan_replicas)
+from services.stats import percentile  # noqa: E402
+
+DEFAULT_MODELS = "facebook/opt-125m,sshleifer/tiny-gpt2"
+PROMPT = "The future of artificial intelligence is"
+
+
+def start_replica(plan: ReplicaPlan, model_path: str, port: int, extra_args: str) -> subprocess.Popen:
+    """Start `vllm serve` for one replica with its CPU affinity, memory binding and environment."""
+    cmd = ["vllm", "serve", model_path, "--device", "cpu", "--host", "127.0.0.1", "--port", str(port),
+           *shlex.split(extra_args)]
+    if plan.node is not None and plan.cpus and shutil.which("numactl"):
+        cmd = ["numactl", f"--membind={plan.node}", *cmd]
+    env = {**os.environ, **plan.env()}
+    cpus = set(plan.cpus)
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None)
+
+
+def wait_ready(ports: List[int], procs: List[subprocess.Popen], timeout: float) -> None:
+    deadline = time.time() + timeout
+    pending = list(ports)
+    while pending:
+        if any(proc.poll() is not None for proc in procs):
+            raise RuntimeError("A vLLM replica exited during startup (try running its command by hand)")
+        if time.time() > deadline:
+            raise RuntimeError(f"vLLM replicas on ports {pending} not ready within {timeout}s")
+        for port in list(pending):
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/v1/models", timeout=2).status_code == 200:
+                    pending.remove(port)
+            except httpx.HTTPError:
+                pass
+        time.sleep(1)
+
+
+async def run_load(ports: List[int], model_path: str, concurrency: int, requests: int,
+                   max_tokens: int) -> Dict[str, float]:
+    """Closed-loop load: `concurrency` workers send `requests` completions round-robin over the replicas."""
+    latencies: List[float] = []
+    tokens = 0
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal tokens, errors
+        for i in counter:
+            port = ports[i % len(ports)]
+            start = time.perf_counter()
+            try:
+                resp = await client.post(f"http://127.0.0.1:{port}/v1/completions", json={
+                    "model": model_path, "prompt": PROMPT, "max_tokens": max_tokens,
+                    "temperature": 0.0, "ignore_eos": True})
+                resp.raise_for_status()
+                tokens += resp.json()["usage"]["completion_tokens"]
+                latencies.append((time.perf_counter() - start) * 1000)
+            except (httpx.HTTPError, ValueError, KeyError):
+                errors += 1
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=300) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_sec": len(latencies) / elapsed,
+        "tokens_per_sec": tokens / elapsed,
+        "p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "p95_ms": percentile(latencies, 95, 0.0),
+        "errors": errors,
+    }
+
+
+def bench_profile(profile: str, model: str, args) -> Dict[str, float]:
+    model_path = os.path.join(args.models_dir, model)
+    plans = plan_replicas(detect_topology(), profile, args.replicas_per_node,
+                          weights_gib=model_weights_gib(model_path))
+    ports = [args.base_port + plan.index for plan in plans]
+    procs = [start_replica(plan, model_path, port, args.extra_args) for plan, port in zip(plans, ports)]
+    try:
+        wait_ready(ports, procs, args.ready_timeout)
+        # Warm-up so first-call costs (graph capture, allocation) don't count
+        asyncio.run(run_load(ports, model_path, len(ports), len(ports) * 2, args.max_tokens))
+        result = asyncio.run(run_load(ports, model_path, args.concurrency, args.requests, args.max_tokens))
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    result["replicas"] = len(plans)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vLLM CPU tuning profiles on the tiny models")
+    parser.add_argument("--models", default=DEFAULT_MODELS, help="Comma-separated models under --models-dir")
+    parser.add_argument("--models-dir", default=os.path.join(DEPLOY_DIR, "models"))
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="Comma-separated profiles to compare")
+    parser.add_argument("--replicas-per-node", type=int, default=2, help="Replicas per NUMA node for split")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per profile")
+    parser.add_argument("--max-tokens", type=int, default=64, help="Tokens generated per request")
+    parser.add_argument("--base-port", type=int, default=18100, help="Port of the first replica")
+    parser.add_argument("--ready-timeout", type=float, default=600.0, help="Seconds to wait for replicas")
+    parser.add_argument("--extra-args", default="", help="Extra `vllm serve` arguments")
+    parser.add_argument("--dry-run", action="store_true", help="Print the plans only")
+    args = parser.parse_args()
+
+    topology = detect_topology()
+    print(f"Physical cores: {topology.physical_cores}, logical CPUs: {topology.logical_cpus}, "
+          f"NUMA nodes: {len(topology.nodes)}")
+    profiles = [p for p in args.profiles.split(",") if p]
+    if args.dry_run:
+        for profile in profiles:
+            for plan in plan_replicas(topology, profile, args.replicas_per_node):
+                print(f"  {profile:<10} replica {plan.index}: cpuset {format_cpulist(plan.cpus) or 'all'}, "
+                      f"env {plan.env()}")
+        return
+    if not shutil.which("numactl") and len(topology.nodes) > 1:
+        print("numactl not found: replicas are pinned to cores but their memory is not bound to a node")
+
+    results = []
+    for model in [m for m in args.models.split(",") if m]:
+        for profile in profiles:
+            print(f"Running {model} / {profile} ...")
+            results.append((model, profile, bench_profile(profile, model, args)))
+
+    print("\n" + "=" * 92)
+    print("CPU TUNING PROFILES")
+    print("=" * 92)
+    print(f"{'model':<24} {'profile':<10} {'replicas':>8} {'req/s':>8} {'tok/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+    for model, profile, r in results:
+        print(f"{model:<24} {profile:<10} {r['replicas']:>8} {r['requests_per_sec']:>8.2f} "
+              f"{r['tokens_per_sec']:>9.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
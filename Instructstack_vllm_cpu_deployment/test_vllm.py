@@ -16,6 +16,10 @@ Usage:
     python test_vllm.py                    # Run all tests
     python test_vllm.py --python-only      # Run only Python tests
     python test_vllm.py --curl-only        # Show only curl commands
+
+    # Against a local mock server instead of a live vLLM (no model needed):
+    python ../Instructstack_vllm_gpu_deployment/benchmarks/mock_vllm.py --model facebook/opt-125m &
+    VLLM_BASE_URL=http://127.0.0.1:8000 python test_vllm.py --api-only
 """
 
 import os
@@ -99,7 +103,7 @@ def test_vllm_api_endpoints():
     print("\n🌐 Testing VLLM API Endpoints")
     print("=" * 50)
     
-    base_url = "http://localhost:8000"
+    base_url = os.getenv("VLLM_BASE_URL", "http://localhost:8000")
     
     # Test health endpoint
     try:
@@ -0,0 +1,75 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi.responses import FileResponse
+
+from services.batch_jobs import ACTIVE_STATES, COMPLETED, batch_manager
+from services.capacity import capacity_model
+from services.lora_adapters import lora_adapters
+
+router = APIRouter(prefix="/batch", tags=["batch"])
+
+
+def _get_job(job_id: str):
+    job = batch_manager.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch job: {job_id}")
+    return job
+
+
+@router.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(...),
+    model: str = Form(...),
+    max_tokens: int = Form(128),
+    temperature: float = Form(0.0),
+    stop: Optional[str] = Form(None),
+    concurrency: Optional[int] = Form(None),
+):
+    """Upload a JSONL prompt file (`{"prompt": ..., "id": ...}` per line) and queue it."""
+    if model not in capacity_model.replicas and (lora_adapters is None or lora_adapters.resolve(model) is None):
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+    job = batch_manager.new_job(model, max_tokens, temperature,
+                                [s for s in (stop or "").split(",") if s], concurrency)
+    await batch_manager.write_input(job, file)
+    batch_manager.submit(job)
+    return job.progress()
+
+
+@router.get("/jobs")
+async def list_jobs():
+    jobs = sorted(batch_manager.jobs.values(), key=lambda j: j.created_at, reverse=True)
+    return {"jobs": [job.progress() for job in jobs]}
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return _get_job(job_id).progress()
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = _get_job(job_id)
+    batch_manager.cancel(job)
+    return {"id": job.id, "state": job.state, "cancel_requested": job.state in ACTIVE_STATES}
+
+
+@router.post("/jobs/{job_id}/resume", status_code=202)
+async def resume_job(job_id: str):
+    """Continue a cancelled, failed or interrupted job from its last checkpoint."""
+    job = _get_job(job_id)
+    if job.state == COMPLETED:
+        raise HTTPException(status_code=409, detail="Job already completed")
+    batch_manager.resume(job)
+    return job.progress()
+
+
+@router.get("/jobs/{job_id}/results")
+async def job_results(job_id: str):
+    """Download the output JSONL written so far (complete once the job has completed)."""
+    job = _get_job(job_id)
+    if not os.path.exists(job.output_path):
+        raise HTTPException(status_code=409, detail=f"Job {job.state}: no results written yet")
+    return FileResponse(job.output_path, media_type="application/x-ndjson",
+                        filename=f"{job.id}.jsonl")
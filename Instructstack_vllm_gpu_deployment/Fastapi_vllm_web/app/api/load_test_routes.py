@@ -0,0 +1,90 @@
+import asyncio
+import json
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from services.load_test import DEFAULT_PROMPTS, RUNNING, LoadTestConfig, load_test_manager
+from services.request_store import request_store
+
+router = APIRouter(prefix="/load-tests", tags=["load-tests"])
+
+PROGRESS_INTERVAL_S = 0.5
+
+
+class LoadTestRequest(BaseModel):
+    model: str = "yasserrmd/Text2SQL-1.5B"
+    prompts: Optional[List[str]] = None  # Defaults to the built-in Text2SQL prompt pool
+    replay: int = 0  # Use the model's N most recent recorded prompts instead (services/request_store.py)
+    concurrency: int = 10
+    requests_per_user: int = 5
+    duration_s: float = 0.0
+    rps: float = 0.0
+    max_tokens: int = 128
+    temperature: float = 0.3
+    stop: List[str] = [";"]
+
+
+def start_run(config: LoadTestConfig):
+    """Start a run, mapping configuration errors to 400 and a busy engine to 409."""
+    try:
+        return load_test_manager.start(config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+def _get_run(run_id: str):
+    run = load_test_manager.runs.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"Unknown load test: {run_id}")
+    return run
+
+
+@router.post("", status_code=202)
+async def create_load_test(body: LoadTestRequest):
+    """Start a load test against the model's replicas; follow it on `/load-tests/{id}/events`."""
+    prompts = body.prompts or DEFAULT_PROMPTS
+    if body.replay > 0:
+        if request_store is None or not request_store.available:
+            raise HTTPException(status_code=400, detail="Replay needs the request store (REQUEST_STORE_ENABLED)")
+        prompts = await asyncio.to_thread(request_store.recorded_prompts, body.model, body.replay)
+        if not prompts:
+            raise HTTPException(status_code=400, detail=f"No recorded prompts for {body.model}")
+    config = LoadTestConfig(**{**body.model_dump(exclude={"replay"}), "prompts": prompts})
+    return start_run(config).to_dict()
+
+
+@router.get("")
+async def list_load_tests():
+    return {"runs": [run.progress() for run in reversed(load_test_manager.runs.values())]}
+
+
+@router.get("/{run_id}")
+async def load_test_status(run_id: str):
+    return _get_run(run_id).to_dict()
+
+
+@router.post("/{run_id}/cancel")
+async def cancel_load_test(run_id: str):
+    run = _get_run(run_id)
+    load_test_manager.cancel(run)
+    return run.progress()
+
+
+@router.get("/{run_id}/events")
+async def load_test_events(run_id: str):
+    """Server-sent events: `progress` while the run is going, then one `summary` with the full results."""
+    run = _get_run(run_id)
+
+    async def events():
+        while run.state == RUNNING:
+            yield f"event: progress\ndata: {json.dumps(run.progress())}\n\n"
+            await asyncio.sleep(PROGRESS_INTERVAL_S)
+        yield f"event: summary\ndata: {json.dumps(run.to_dict())}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,77 @@
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from services.capacity import capacity_model
+from services.lora_adapters import lora_adapters
+from api.routes import _home_page
+
+router = APIRouter(prefix="/lora", tags=["lora"])
+
+
+def _manager():
+    if lora_adapters is None:
+        raise HTTPException(status_code=404, detail="LoRA adapters are disabled (LORA_ENABLED)")
+    return lora_adapters
+
+
+def _adapter(name: str):
+    adapter = _manager().resolve(name)
+    if adapter is None:
+        raise HTTPException(status_code=404, detail=f"Unknown LoRA adapter: {name}")
+    return adapter
+
+
+@router.get("/adapters")
+async def list_adapters():
+    """Known adapters with their base model, and the adapters loaded on each replica (most recently used first)."""
+    return _manager().status()
+
+
+@router.post("/rescan")
+async def rescan_adapters():
+    """Re-read LORA_DIR, e.g. after copying in a new fine-tune."""
+    names = await asyncio.to_thread(_manager().rescan)
+    # The UI's model list includes the adapters
+    _home_page.cache_clear()
+    return {"adapters": names}
+
+
+@router.post("/adapters/{name}/load")
+async def load_adapter(name: str, replica: Optional[str] = None):
+    """Load an adapter ahead of traffic, on the given replica URL or the one its requests would be routed to."""
+    adapter = _adapter(name)
+    if replica is not None:
+        target = next((r for r in capacity_model.replicas.get(adapter.base, []) if r.base_url == replica.rstrip("/")),
+                      None)
+        if target is None:
+            raise HTTPException(status_code=404, detail=f"{replica} is not a replica of {adapter.base}")
+    else:
+        target = lora_adapters.select_replica(adapter)
+        if target is None:
+            raise HTTPException(status_code=503, detail=f"All replicas of {adapter.base} are unavailable")
+    try:
+        (await lora_adapters.acquire(target, adapter)).release()
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return {"adapter": name, "replica": target.base_url}
+
+
+@router.post("/adapters/{name}/unload")
+async def unload_adapter(name: str, replica: Optional[str] = None):
+    """Unload an adapter from the given replica URL, or from every replica of its base model."""
+    adapter = _adapter(name)
+    targets = [r for r in capacity_model.replicas.get(adapter.base, [])
+               if replica is None or r.base_url == replica.rstrip("/")]
+    if not targets:
+        raise HTTPException(status_code=404, detail=f"{replica} is not a replica of {adapter.base}")
+    errors = {}
+    for target in targets:
+        try:
+            await asyncio.to_thread(lora_adapters.unload, target, name)
+        except RuntimeError as e:
+            errors[target.base_url] = str(e)
+    if errors:
+        raise HTTPException(status_code=502, detail=errors)
+    return {"adapter": name, "replicas": [target.base_url for target in targets]}
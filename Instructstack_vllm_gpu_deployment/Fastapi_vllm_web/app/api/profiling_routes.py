@@ -0,0 +1,114 @@
+import asyncio
+import hmac
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import Response
+
+from services.profiling import (PROFILING_ENABLED, PROFILING_MAX_SECONDS, PROFILING_TOKEN, allocation_tracker,
+                                route_cpu, stack_sampler)
+
+
+logger = logging.getLogger(__name__)
+
+if PROFILING_ENABLED and not PROFILING_TOKEN:
+    logger.warning("PROFILING_ENABLED is set without PROFILING_TOKEN: the profiling endpoints refuse every request")
+
+
+def _authorized(x_profiling_token: Optional[str] = Header(None)):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (PROFILING_ENABLED)")
+    # The endpoints can stall the event loop and dump memory contents: never serve them unauthenticated
+    if not PROFILING_TOKEN:
+        raise HTTPException(status_code=403, detail="Profiling needs a PROFILING_TOKEN")
+    if not hmac.compare_digest(x_profiling_token or "", PROFILING_TOKEN):
+        raise HTTPException(status_code=403, detail="Missing or wrong X-Profiling-Token")
+
+
+router = APIRouter(prefix="/admin/profiling", tags=["profiling"], dependencies=[Depends(_authorized)])
+
+
+@router.get("")
+async def profiling_status():
+    """What is switched on: CPU profile in progress, tracemalloc, per-route CPU counters."""
+    return {
+        "cpu_profile_running": stack_sampler.busy,
+        "interval_ms": stack_sampler.interval_s * 1000,
+        "max_seconds": PROFILING_MAX_SECONDS,
+        "tracemalloc": allocation_tracker.status(),
+        "route_cpu": route_cpu is not None,
+    }
+
+
+@router.post("/cpu")
+async def cpu_profile(seconds: float = Query(10, gt=0, le=PROFILING_MAX_SECONDS),
+                      format: str = Query("speedscope", pattern="^(speedscope|collapsed|summary)$"),
+                      threads: str = Query("loop", pattern="^(loop|all)$"),
+                      include_idle: bool = False):
+    """
+    Sample the gateway's stacks for `seconds` and return the profile.
+
+    `speedscope` downloads a file for https://www.speedscope.app, `collapsed` gives
+    flamegraph.pl input, and `summary` lists the top functions. `threads=loop` samples
+    the event loop thread only; `all` adds the worker threads (tokenizers, logging,
+    request store).
+    """
+    # This handler runs on the event loop thread
+    thread_ids = [threading.get_ident()] if threads == "loop" else None
+    try:
+        profile = await asyncio.to_thread(stack_sampler.profile, seconds, thread_ids, include_idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if format == "summary":
+        return profile.summary()
+    if format == "collapsed":
+        return Response(profile.to_collapsed(), media_type="text/plain", headers={
+            "Content-Disposition": f'attachment; filename="gateway-{stamp}.folded"'})
+    return Response(json.dumps(profile.to_speedscope(f"gateway {stamp}")), media_type="application/json", headers={
+        "Content-Disposition": f'attachment; filename="gateway-{stamp}.speedscope.json"'})
+
+
+@router.post("/tracemalloc/start")
+async def start_tracemalloc(frames: Optional[int] = Query(None, ge=1, le=100)):
+    """Start tracing allocations (slows every allocation until stopped; stops by itself after a while)."""
+    try:
+        return allocation_tracker.start(frames)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/tracemalloc/snapshot")
+async def tracemalloc_snapshot(top: int = Query(25, ge=1, le=500),
+                               group_by: str = Query("lineno", pattern="^(lineno|traceback|filename)$"),
+                               compare: bool = False):
+    """Top allocation sites, or with `compare=true` what changed since the previous snapshot."""
+    try:
+        return await asyncio.to_thread(allocation_tracker.snapshot, top, group_by, compare)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/tracemalloc/stop")
+async def stop_tracemalloc():
+    return allocation_tracker.stop()
+
+
+@router.get("/routes")
+async def route_cpu_times():
+    """Event-loop CPU time per route since startup or the last reset, highest total first."""
+    if route_cpu is None:
+        raise HTTPException(status_code=404, detail="Per-route CPU time is disabled (PROFILING_ROUTE_CPU)")
+    return {"routes": route_cpu.snapshot()}
+
+
+@router.delete("/routes")
+async def reset_route_cpu_times():
+    if route_cpu is None:
+        raise HTTPException(status_code=404, detail="Per-route CPU time is disabled (PROFILING_ROUTE_CPU)")
+    route_cpu.reset()
+    return {"reset": True}
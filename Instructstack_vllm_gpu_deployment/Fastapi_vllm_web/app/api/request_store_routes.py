@@ -0,0 +1,50 @@
+import asyncio
+import hmac
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+
+from services.request_store import REQUEST_STORE_TOKEN, request_store
+
+logger = logging.getLogger(__name__)
+
+if request_store is not None and not REQUEST_STORE_TOKEN:
+    logger.warning("The request store is enabled without REQUEST_STORE_TOKEN: the /requests endpoints "
+                   "refuse every request")
+
+
+def _authorized(x_request_store_token: Optional[str] = Header(None)):
+    if request_store is None:
+        raise HTTPException(status_code=404, detail="Request store is disabled (REQUEST_STORE_ENABLED)")
+    # Recorded prompts and completions are user data: never serve them unauthenticated
+    if not REQUEST_STORE_TOKEN:
+        raise HTTPException(status_code=403, detail="The request store endpoints need a REQUEST_STORE_TOKEN")
+    if not hmac.compare_digest(x_request_store_token or "", REQUEST_STORE_TOKEN):
+        raise HTTPException(status_code=403, detail="Missing or wrong X-Request-Store-Token")
+
+
+router = APIRouter(prefix="/requests", tags=["requests"], dependencies=[Depends(_authorized)])
+
+
+def _store():
+    if not request_store.available:
+        detail = f"Request store is unavailable: {request_store.open_error}" if request_store.open_error \
+            else "Request store is still opening"
+        raise HTTPException(status_code=503, detail=detail)
+    return request_store
+
+
+@router.get("/report")
+async def request_report(window_s: float = Query(3600, gt=0)):
+    """Per-model request counts, error rate, latency percentiles and token totals over the window."""
+    store = _store()
+    return {"window_s": window_s, "models": await asyncio.to_thread(store.model_report, window_s)}
+
+
+@router.get("/recent")
+async def recent_requests(limit: int = Query(50, ge=1, le=1000), model: Optional[str] = None,
+                          status: Optional[str] = None):
+    """Most recent recorded requests, newest first; filter by model and status (ok, cached, error)."""
+    store = _store()
+    return {"requests": await asyncio.to_thread(store.recent, limit, model, status)}
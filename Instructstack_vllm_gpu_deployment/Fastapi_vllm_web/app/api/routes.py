@@ -1,76 +1,67 @@
-from fastapi import APIRouter, Request, Form
+from fastapi import APIRouter, HTTPException, Request, Form
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
-from services.vllm_client import call_vllm
-import asyncio
-import random
+from pydantic import BaseModel
+import logging
 import time
+from functools import lru_cache
+from typing import Optional
 
 from vllm.config import VLLM_API_URL, AVAILABLE_MODELS
-from services.vllm_client import call_vllm
+from services.vllm_client import call_vllm_async, error_status
+from services.idempotency import replay_headers, run_idempotent
+from services.web_assets import FastJSONResponse, templates
+from services.load_test import DEFAULT_PROMPTS, LoadTestConfig
+from services.lora_adapters import lora_adapters
+from api.load_test_routes import start_run
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
 MODEL = "yasserrmd/Text2SQL-1.5B"
 CONCURRENCY = 10
 REQUESTS_PER_CLIENT = 5
 
-# Shared prompt pool (backend-controlled)
-PROMPT_POOL = [
-    "### Database Schema:\nTable: employees\nColumns: id, name, department_id, salary, hire_date\n\n"
-    "### Question:\nList all employees hired after 2020.\n\n### SQL:\n",
-    "### Database Schema:\nTable: employees\nColumns: id, name, department_id, salary, hire_date\n\n"
-    "### Question:\nFind employees in department 5 earning more than 100000.\n\n### SQL:\n",
-    "### Database Schema:\nTable: employees\nColumns: id, name, department_id, salary, hire_date\n\n"
-    "### Question:\nShow employee names and salaries ordered by salary descending.\n\n### SQL:\n",
-    "### Database Schema:\nTable: employees\nColumns: id, name, department_id, salary, hire_date\n\n"
-    "### Question:\nCount the number of employees in each department.\n\n### SQL:\n",
-    "### Database Schema:\nTable: employees\nColumns: id, name, department_id, salary, hire_date\n\n"
-    "### Question:\nWhat is the average salary of employees hired after 2015?\n\n### SQL:\n"
-]
-
-results = []
-
-async def simulate_user(user_id: int):
-    prompts = random.sample(PROMPT_POOL, REQUESTS_PER_CLIENT)
-    for i, prompt in enumerate(prompts):
-        payload = {
-            "model": MODEL,
-            "prompt": prompt,
-            "max_tokens": 128,
-            "temperature": 0.3,
-            "stop": [";"]
-        }
-        start = time.perf_counter()
-        try:
-            result = await asyncio.to_thread(call_vllm, payload)
-            delta = time.perf_counter() - start
-            msg = f"[User {user_id}][Req {i+1}] {delta:.2f}s → {result}"
-        except Exception as e:
-            msg = f"[User {user_id}][Req {i+1}] ERROR: {e}"
-        print(msg)
-        results.append(msg)
-
-@router.post("/check-concurrency",response_class=HTMLResponse)
-async def check_concurrency(request: Request):
-    global results
-    results = []  # Clear old results
-    tasks = [simulate_user(i + 1) for i in range(CONCURRENCY)]
-    await asyncio.gather(*tasks)
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "concurrency_result": results
-    })
+
+def _models():
+    # Base models, then the LoRA adapters served on top of them
+    return AVAILABLE_MODELS + (lora_adapters.names() if lora_adapters is not None else [])
+
+
+@router.post("/check-concurrency", response_class=HTMLResponse)
+async def check_concurrency(
+    request: Request,
+    concurrency: int = Form(CONCURRENCY),
+    requests_per_user: int = Form(REQUESTS_PER_CLIENT),
+    rps: float = Form(0.0),
+    duration_s: float = Form(0.0),
+):
+    """Start a load test run; the page follows its progress and shows the summary when it ends."""
+    context = {"request": request, "models": _models()}
+    config = LoadTestConfig(model=MODEL, prompts=DEFAULT_PROMPTS, concurrency=concurrency,
+                            requests_per_user=requests_per_user, rps=rps, duration_s=duration_s)
+    try:
+        context["load_test"] = start_run(config).to_dict()
+    except HTTPException as e:
+        context["load_test_error"] = e.detail
+    return templates.TemplateResponse("index.html", context)
+
+
+class GenerateRequest(BaseModel):
+    model: str
+    prompt: str
+    max_tokens: Optional[int] = None
+
+
+@lru_cache(maxsize=1)
+def _home_page() -> str:
+    # The home page doesn't depend on the request, so it is rendered once
+    return templates.get_template("index.html").render(models=_models(), response=None)
 
 
 @router.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "models": AVAILABLE_MODELS,
-        "response": None
-    })
+async def home():
+    return HTMLResponse(_home_page())
 
 
 @router.post("/generate", response_class=HTMLResponse)
@@ -78,21 +69,47 @@ async def generate(
     request: Request,
     model: str = Form(...),
     prompt: str = Form(...),
-    max_tokens: int = Form(50)
+    max_tokens: Optional[int] = Form(None)
 ):
+    # Time spent waiting for a slot and a worker thread is reported as gateway.queue_wait_ms on the vllm.call span
+    queued_at = time.perf_counter()
     payload = {
         "model": model,
         "prompt": prompt,
         "max_tokens": max_tokens
     }
 
-    result = call_vllm(payload)
+    # Waits for a traffic class slot on the event loop, then runs the blocking call in a worker thread
+    result = await call_vllm_async(payload, queued_at)
 
     return templates.TemplateResponse("index.html", {
         "request": request,
-        "models": AVAILABLE_MODELS,
+        "models": _models(),
         "response": result,
         "selected_model": model,
         "prompt": prompt,
         "max_tokens": max_tokens
     })
+
+
+@router.post("/api/generate", response_class=FastJSONResponse)
+async def generate_json(body: GenerateRequest, request: Request):
+    """
+    JSON variant of /generate used by the UI's fetch-based form: no page render or reload.
+
+    Retries carrying the same Idempotency-Key get the original generation's result
+    (see services/idempotency.py).
+    """
+    queued_at = time.perf_counter()
+    payload = {
+        "model": body.model,
+        "prompt": body.prompt,
+        "max_tokens": body.max_tokens
+    }
+    result, replayed = await run_idempotent(request, payload,
+                                            lambda: call_vllm_async(payload, queued_at),
+                                            keep=lambda result: error_status(result) is None)
+    status = error_status(result)
+    if status is not None:
+        raise HTTPException(status_code=status, detail=result.lstrip("❌ "))
+    return FastJSONResponse({"model": body.model, "response": result}, headers=replay_headers(replayed))
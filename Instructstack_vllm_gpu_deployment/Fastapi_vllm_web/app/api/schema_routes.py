@@ -0,0 +1,83 @@
+import time
+from functools import partial
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import BaseModel, Field
+
+from services.schema_registry import schema_registry
+from services.vllm_client import call_vllm_async, error_status
+from services.idempotency import REPLAYED_HEADER, run_idempotent
+
+router = APIRouter(tags=["text2sql"])
+
+
+class SchemaIn(BaseModel):
+    schema_text: str = Field(..., alias="schema")
+    name: str = ""
+
+
+class SqlRequest(BaseModel):
+    schema_id: str
+    question: str
+    model: str = "yasserrmd/Text2SQL-1.5B"
+    max_tokens: Optional[int] = None  # Default from the model's generation profile
+    temperature: float = 0.0
+    stop: Optional[List[str]] = None
+
+
+@router.post("/schemas", status_code=201)
+async def register_schema(body: SchemaIn):
+    """Register a database schema once; later requests refer to it by `schema_id`."""
+    try:
+        entry = schema_registry.register(body.schema_text, body.name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return entry.to_dict()
+
+
+@router.get("/schemas")
+async def list_schemas():
+    return {"schemas": schema_registry.list()}
+
+
+@router.get("/schemas/{schema_id}")
+async def get_schema(schema_id: str):
+    entry = schema_registry.get(schema_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown schema_id; register the schema again")
+    return entry.to_dict()
+
+
+@router.delete("/schemas/{schema_id}", status_code=204)
+async def delete_schema(schema_id: str):
+    if not schema_registry.remove(schema_id):
+        raise HTTPException(status_code=404, detail="Unknown schema_id")
+
+
+@router.post("/generate/sql")
+async def generate_sql(body: SqlRequest, request: Request, response: Response):
+    """Generate SQL for a question against a registered schema; honours Idempotency-Key like /api/generate."""
+    queued_at = time.perf_counter()
+    entry = schema_registry.get(body.schema_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown schema_id; register the schema again")
+
+    payload = {
+        "model": body.model,
+        "prompt": entry.prompt(body.question),
+        "max_tokens": body.max_tokens,
+        "temperature": body.temperature,
+    }
+    if body.stop:
+        payload["stop"] = body.stop
+    counter = partial(schema_registry.count_prompt_tokens, entry, body.question)
+    result, replayed = await run_idempotent(request, payload,
+                                            lambda: call_vllm_async(payload, queued_at, counter),
+                                            keep=lambda result: error_status(result) is None)
+    status = error_status(result)
+    if status is not None:
+        raise HTTPException(status_code=status, detail=result.lstrip("❌ "))
+    if replayed:
+        response.headers[REPLAYED_HEADER] = "true"
+    return {"schema_id": entry.schema_id, "model": body.model, "sql": result}
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, HTTPException
+
+from services.traffic_classes import traffic_control
+
+router = APIRouter(prefix="/traffic", tags=["traffic"])
+
+
+def _controller():
+    if traffic_control is None:
+        raise HTTPException(status_code=404, detail="Traffic classes are disabled (TRAFFIC_CONTROL_ENABLED)")
+    return traffic_control
+
+
+def _class_name(name: str) -> str:
+    if name not in _controller().classes:
+        raise HTTPException(status_code=404, detail=f"Unknown traffic class: {name}")
+    return name
+
+
+@router.get("")
+async def traffic_status():
+    """Per-class slots in use, queue, queue-wait percentiles, rejections and preemptions."""
+    return _controller().status()
+
+
+@router.post("/{name}/pause")
+async def pause_class(name: str):
+    """Stop dispatching new requests of the class until resumed; requests in flight finish."""
+    _controller().pause(_class_name(name))
+    return _controller().status()["classes"][name]
+
+
+@router.post("/{name}/resume")
+async def resume_class(name: str):
+    _controller().resume(_class_name(name))
+    return _controller().status()["classes"][name]
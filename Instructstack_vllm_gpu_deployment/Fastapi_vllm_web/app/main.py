@@ -1,23 +1,94 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.templating import Jinja2Templates
 from api.routes import router as ui_router
+from api.batch_routes import router as batch_router
+from api.schema_routes import router as schema_router
+from api.load_test_routes import router as load_test_router
+from api.request_store_routes import router as request_store_router
+from api.lora_routes import router as lora_router
+from api.profiling_routes import router as profiling_router
+from api.traffic_routes import router as traffic_router
 from prometheus_fastapi_instrumentator import Instrumentator
+from services.log_pipeline import configure_logging
+from services.tracing import configure_tracing
+from services.capacity import capacity_model
+from services.autoscaler import build_autoscaler
+from services.batch_jobs import batch_manager
+from services.load_test import load_test_manager
+from services.async_client import close_async_client
+from services.web_assets import CachedStaticFiles, STATIC_DIR, precompile_templates
+from services.compression import CompressionMiddleware
+from services.semantic_cache import semantic_cache
+from services.request_store import request_store
+from services.lora_adapters import lora_adapters
+from services.profiling import RouteCpuMiddleware, route_cpu
+from services.loop_monitor import loop_monitor
+from services.traffic_classes import TrafficClassMiddleware, traffic_control
+from services.idempotency import idempotency_store
+from services.vllm_client import get_tokenizer_for_model
+from services.warmup import warmup
+from services import health
+from vllm.config import AVAILABLE_MODELS
 import logfire
-import os
 
 
-app = FastAPI()
+
+# Queue-based, structured logging (see services/log_pipeline.py)
+configure_logging()
+
+# Replica autoscaler, off unless AUTOSCALER_ENABLED=true (see services/autoscaler.py)
+autoscaler = build_autoscaler()
+
+# Loaded in the background after startup instead of by the first requests; /ready waits for it
+warmup.add_step("templates", precompile_templates)
+warmup.add_step("tokenizers", lambda: [get_tokenizer_for_model(model) for model in AVAILABLE_MODELS])
+if semantic_cache is not None and hasattr(semantic_cache.embedder, "load"):
+    warmup.add_step("semantic_cache_embedder", semantic_cache.embedder.load)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Event-loop lag and thread pool metrics; installs the instrumented executor used by asyncio.to_thread
+    if loop_monitor is not None:
+        loop_monitor.start()
+    warmup.start()
+    # Background capacity scrapes feed routing, admission control, /ready and /status
+    capacity_model.start()
+    if autoscaler is not None:
+        autoscaler.start()
+    # Interactive queue-wait SLO checks that pause and preempt batch work (see services/traffic_classes.py)
+    if traffic_control is not None:
+        traffic_control.start()
+    # Resumes batch jobs interrupted by the last shutdown or crash
+    batch_manager.start()
+    # Opens the SQLite database and writes recorded requests off the request path (see services/request_store.py)
+    if request_store is not None:
+        request_store.start()
+    yield
+    await load_test_manager.stop()
+    await batch_manager.stop()
+    if traffic_control is not None:
+        await traffic_control.stop()
+    if autoscaler is not None:
+        await autoscaler.stop()
+    await capacity_model.stop()
+    await warmup.stop()
+    if request_store is not None:
+        await request_store.stop()
+    await close_async_client()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 Instrumentator().instrument(app).expose(app)
 
 
 
-logfire.configure(
-    service_name="llm-fastapi",        # override default name
-    environment=os.getenv("ENVIRONMENT", "production"),
-    # you can also pass things like service_version, if needed
-)
+# Logfire / OpenTelemetry with sampling and optional local collector (see services/tracing.py)
+configure_tracing()
 
 # AUTO-INSTRUMENT your FastAPI HTTP handlers
 logfire.instrument_fastapi(app)
@@ -45,9 +116,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files and templates
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# Brotli/gzip for larger responses, flushed per chunk for SSE streams (see services/compression.py)
+app.add_middleware(CompressionMiddleware)
+
+# Traffic class of each request from its API key, X-Traffic-Class header or path (see services/traffic_classes.py)
+if traffic_control is not None:
+    app.add_middleware(TrafficClassMiddleware)
+
+# CPU time per route, off unless PROFILING_ROUTE_CPU=true (see services/profiling.py); outermost, so it
+# includes compression
+if route_cpu is not None:
+    app.add_middleware(RouteCpuMiddleware)
+
+# Static files with long-lived caching (see services/web_assets.py); templates compiled once during warm-up
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 
 # Include routes
 app.include_router(ui_router)
+app.include_router(batch_router)
+app.include_router(schema_router)
+app.include_router(load_test_router)
+app.include_router(request_store_router)
+app.include_router(lora_router)
+app.include_router(profiling_router)
+app.include_router(traffic_router)
+
+
+@app.get("/health")
+async def health_check():
+    """Liveness: the gateway process is up and serving requests."""
+    return {"status": "healthy", "service": "llm-fastapi"}
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: warm-up finished and at least one vLLM replica is loaded, healthy and not saturated."""
+    if warmup.is_warm() and health.is_ready():
+        return {"status": "ready"}
+    return JSONResponse(status_code=503, content={"status": "not ready"})
+
+
+@app.get("/status")
+async def backend_status():
+    """Cached per-replica capacity and health."""
+    status = health.status()
+    status["warmup"] = warmup.status()
+    if autoscaler is not None:
+        status["autoscaler"] = autoscaler.status()
+    if semantic_cache is not None:
+        status["semantic_cache"] = semantic_cache.stats()
+    if request_store is not None:
+        status["request_store"] = request_store.stats()
+    if lora_adapters is not None:
+        status["lora"] = lora_adapters.status()
+    if loop_monitor is not None:
+        status["event_loop"] = loop_monitor.status()
+    if traffic_control is not None:
+        status["traffic"] = traffic_control.status()
+    if idempotency_store is not None:
+        status["idempotency"] = idempotency_store.stats()
+    return status
@@ -0,0 +1,92 @@
+"""
+Gateway Server Launcher
+
+Starts the FastAPI gateway with connection settings suited to long generations and
+many concurrent streams (the Dockerfile runs `python serve.py`):
+
+- uvicorn (default): HTTP/1.1 with a keep-alive timeout longer than typical load
+  balancer idle timeouts (60s), so a proxy never reuses a connection the gateway
+  has just closed.
+- hypercorn (SERVER=hypercorn, optional package): adds HTTP/2, which multiplexes
+  many SSE streams and API calls over one connection. Without TLS it speaks h2c
+  (prior knowledge or upgrade), which is what reverse proxies use; browsers only
+  use HTTP/2 over TLS (set SSL_CERTFILE and SSL_KEYFILE).
+
+Background tasks (capacity scrapes, batch jobs, load tests) run per worker, so keep
+WEB_WORKERS at 1 unless batch jobs and the autoscaler are disabled.
+
+Configuration (environment variables):
+    SERVER              "uvicorn" or "hypercorn" (default: uvicorn)
+    HOST                Bind address (default: 0.0.0.0)
+    PORT                Bind port (default: 9000)
+    WEB_WORKERS         Worker processes (default: 1)
+    KEEPALIVE_TIMEOUT   Seconds an idle keep-alive connection stays open (default: 75)
+    BACKLOG             Pending connections queued by the OS (default: 2048)
+    LIMIT_CONCURRENCY   Connections served at once before 503s, uvicorn only, 0 = unlimited (default: 0)
+    HTTP2_MAX_STREAMS   Concurrent HTTP/2 streams per connection, hypercorn only (default: 256)
+    SSL_CERTFILE        TLS certificate, enables HTTPS (and h2 for browsers with hypercorn)
+    SSL_KEYFILE         TLS private key
+"""
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+SERVER = os.getenv("SERVER", "uvicorn").lower()
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "9000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "75"))
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+LIMIT_CONCURRENCY = int(os.getenv("LIMIT_CONCURRENCY", "0"))
+HTTP2_MAX_STREAMS = int(os.getenv("HTTP2_MAX_STREAMS", "256"))
+SSL_CERTFILE = os.getenv("SSL_CERTFILE")
+SSL_KEYFILE = os.getenv("SSL_KEYFILE")
+
+
+def run_uvicorn() -> None:
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_WORKERS,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        backlog=BACKLOG,
+        limit_concurrency=LIMIT_CONCURRENCY or None,
+        ssl_certfile=SSL_CERTFILE,
+        ssl_keyfile=SSL_KEYFILE,
+    )
+
+
+def run_hypercorn() -> bool:
+    """Serve with hypercorn (HTTP/1.1 + HTTP/2); False when it is not installed."""
+    try:
+        # Imported lazily: optional dependency
+        from hypercorn.config import Config
+        from hypercorn.run import run
+    except ImportError:
+        logger.warning("hypercorn is not installed; falling back to uvicorn without HTTP/2")
+        return False
+
+    config = Config()
+    config.application_path = "main:app"
+    config.bind = [f"{HOST}:{PORT}"]
+    config.workers = WEB_WORKERS
+    config.keep_alive_timeout = KEEPALIVE_TIMEOUT
+    config.backlog = BACKLOG
+    config.h2_max_concurrent_streams = HTTP2_MAX_STREAMS
+    config.accesslog = None
+    if SSL_CERTFILE and SSL_KEYFILE:
+        config.certfile = SSL_CERTFILE
+        config.keyfile = SSL_KEYFILE
+    run(config)
+    return True
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if SERVER != "hypercorn" or not run_hypercorn():
+        run_uvicorn()
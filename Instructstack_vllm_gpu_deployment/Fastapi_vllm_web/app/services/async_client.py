@@ -0,0 +1,55 @@
+"""
+Shared Async HTTP Client
+
+One pooled `httpx.AsyncClient` for gateway work that talks to vLLM from the event
+loop (batch jobs, ...), so connections to the replicas are reused instead of
+opened per request. Created on first use and closed on shutdown. `pool_stats()`
+reports how much of the pool is in use (see services/loop_monitor.py).
+
+Configuration (environment variables):
+    UPSTREAM_MAX_CONNECTIONS   Max open connections to all replicas (default: 100)
+    UPSTREAM_MAX_KEEPALIVE     Idle connections kept for reuse (default: 20)
+"""
+
+import os
+from typing import Dict, Optional
+
+import httpx
+
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+    return _client
+
+
+def pool_stats() -> Dict:
+    """Connections open, in use and idle, and requests waiting for a connection; {} before first use."""
+    try:
+        pool = _client._transport._pool
+        connections = list(pool.connections)
+        queued = sum(1 for request in pool._requests if request.is_queued())
+    except AttributeError:
+        # Not created yet, or an httpx/httpcore version with a different pool layout
+        return {}
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {"max_connections": UPSTREAM_MAX_CONNECTIONS, "connections": len(connections),
+            "active": len(connections) - idle, "idle": idle, "queued_requests": queued}
+
+
+async def close_async_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
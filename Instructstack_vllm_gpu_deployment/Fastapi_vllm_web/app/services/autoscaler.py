@@ -0,0 +1,410 @@
+"""
+Replica Autoscaler
+
+Adds and removes vLLM replica containers per model based on the capacity model's
+signals (see services/capacity.py):
+    - gateway queue depth: requests in flight from the gateway to the model
+    - vLLM waiting sequences: `vllm:num_requests_waiting` summed over replicas
+    - latency SLO: p95 of recent request latencies against AUTOSCALER_LATENCY_SLO_MS
+    - rejections: requests turned away because no replica could take them
+
+New replicas are registered with the router once their model is loaded; replicas
+being removed are taken out of routing first and stopped once drained. Replicas
+still booting count towards the total when deciding to scale up, but not when
+choosing how many to drain, so a ready replica is never drained for one that isn't.
+
+Only containers started by the autoscaler are ever stopped; replicas configured in
+VLLM_BACKENDS count towards the total but are left alone. Scale-to-zero therefore
+needs a model with no configured replicas (`VLLM_BACKENDS='{"<model>": []}'`);
+otherwise the model only scales down to its configured replicas. New replicas are launched
+with the same flags as the compose services: VLLM_PROFILE_ARGS (see
+vllm/launch_profiles.py), then VLLM_EXTRA_ARGS.
+
+Containers are managed through a ContainerRuntime: DockerRuntime in production,
+or a simulated runtime (see benchmarks/autoscaler_sim.py) to exercise the policy
+against synthetic load.
+
+Configuration (environment variables):
+    AUTOSCALER_ENABLED               Run the autoscaler in the gateway (default: false)
+    AUTOSCALER_MODELS                Comma-separated models to scale (default: all configured models)
+    AUTOSCALER_INTERVAL              Seconds between scaling decisions (default: 15)
+    AUTOSCALER_MIN_REPLICAS          Lower bound per model; 0 enables scale-to-zero (default: 1)
+    AUTOSCALER_MAX_REPLICAS          Upper bound per model (default: 2)
+    AUTOSCALER_TARGET_WAITING        vLLM waiting requests per replica to aim for (default: 2)
+    AUTOSCALER_TARGET_INFLIGHT       Gateway in-flight requests per replica to aim for (default: 8)
+    AUTOSCALER_LATENCY_SLO_MS        p95 latency target, 0 disables the latency signal (default: 5000)
+    AUTOSCALER_SCALE_DOWN_THRESHOLD  Max projected load, relative to target, after removing a replica (default: 0.6)
+    AUTOSCALER_SCALE_UP_COOLDOWN     Seconds between scale-ups of a model (default: 60)
+    AUTOSCALER_SCALE_DOWN_COOLDOWN   Seconds after any scaling before a scale-down (default: 300)
+    AUTOSCALER_IDLE_TIMEOUT          Seconds without requests before scaling to zero (default: 900)
+    AUTOSCALER_BOOT_TIMEOUT          Seconds a new replica may take to load its model (default: 600)
+    AUTOSCALER_DRAIN_TIMEOUT         Seconds to wait for in-flight requests before stopping (default: 120)
+    AUTOSCALER_IMAGE                 vLLM image for new replicas (default: vllm-gpu-image:latest)
+    AUTOSCALER_NETWORK               Docker network for new replicas (default: vllm-net)
+    AUTOSCALER_GPU_DEVICES           GPU device ids for new replicas, or "all" (default: all)
+    HOST_MODEL_PATH                  Host directory with the models, mounted at /models
+"""
+
+import asyncio
+import logging
+import math
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Protocol, Tuple
+
+import logfire
+import requests
+
+from services.capacity import CapacityModel, ReplicaCapacity, capacity_model
+from vllm.launch_profiles import configured_args
+from services.token_budget import MAX_MODEL_LEN
+
+logger = logging.getLogger(__name__)
+
+AUTOSCALER_ENABLED = os.getenv("AUTOSCALER_ENABLED", "false").lower() == "true"
+AUTOSCALER_MODELS = [m.strip() for m in os.getenv("AUTOSCALER_MODELS", "").split(",") if m.strip()]
+AUTOSCALER_INTERVAL = float(os.getenv("AUTOSCALER_INTERVAL", "15"))
+AUTOSCALER_BOOT_TIMEOUT = float(os.getenv("AUTOSCALER_BOOT_TIMEOUT", "600"))
+AUTOSCALER_DRAIN_TIMEOUT = float(os.getenv("AUTOSCALER_DRAIN_TIMEOUT", "120"))
+AUTOSCALER_IMAGE = os.getenv("AUTOSCALER_IMAGE", "vllm-gpu-image:latest")
+AUTOSCALER_NETWORK = os.getenv("AUTOSCALER_NETWORK", "vllm-net")
+AUTOSCALER_GPU_DEVICES = os.getenv("AUTOSCALER_GPU_DEVICES", "all")
+
+# Labels identifying containers owned by the autoscaler
+LABEL_MANAGED = "instructstack.autoscaled"
+LABEL_MODEL = "instructstack.model"
+
+scale_events = logfire.metric_counter("autoscaler.scale_events", unit="1",
+                                      description="Replica start/stop actions taken by the autoscaler")
+
+
+@dataclass
+class ModelSignals:
+    """Load signals for one model at one point in time."""
+    replicas: int           # registered replicas plus replicas still booting
+    waiting: float = 0.0    # vLLM waiting requests over all replicas
+    inflight: int = 0       # gateway requests in flight to the model
+    latency_p95_ms: float = 0.0
+    rejected: int = 0       # requests rejected since the previous decision
+    idle_for: float = math.inf
+
+
+@dataclass
+class ScalingPolicy:
+    """Replica bounds, load targets and cooldowns used to size each model."""
+    min_replicas: int = int(os.getenv("AUTOSCALER_MIN_REPLICAS", "1"))
+    max_replicas: int = int(os.getenv("AUTOSCALER_MAX_REPLICAS", "2"))
+    target_waiting: float = float(os.getenv("AUTOSCALER_TARGET_WAITING", "2"))
+    target_inflight: float = float(os.getenv("AUTOSCALER_TARGET_INFLIGHT", "8"))
+    latency_slo_ms: float = float(os.getenv("AUTOSCALER_LATENCY_SLO_MS", "5000"))
+    scale_down_threshold: float = float(os.getenv("AUTOSCALER_SCALE_DOWN_THRESHOLD", "0.6"))
+    scale_up_cooldown: float = float(os.getenv("AUTOSCALER_SCALE_UP_COOLDOWN", "60"))
+    scale_down_cooldown: float = float(os.getenv("AUTOSCALER_SCALE_DOWN_COOLDOWN", "300"))
+    idle_timeout: float = float(os.getenv("AUTOSCALER_IDLE_TIMEOUT", "900"))
+
+    def pressure(self, signals: ModelSignals, replicas: int) -> float:
+        """Load relative to target if spread over `replicas` (1.0 = exactly on target)."""
+        ratios = [
+            signals.waiting / (self.target_waiting * replicas),
+            signals.inflight / (self.target_inflight * replicas),
+        ]
+        if self.latency_slo_ms > 0:
+            ratios.append(signals.latency_p95_ms / self.latency_slo_ms)
+        return max(ratios)
+
+    def desired_replicas(self, signals: ModelSignals) -> int:
+        """
+        Replica count the model should have, ignoring cooldowns.
+
+        Scales up proportionally to the load over target, down one replica at a time
+        when the remaining replicas would stay under `scale_down_threshold`, and to
+        zero (if `min_replicas` is 0) after `idle_timeout` without requests.
+
+        Args:
+            signals: Current load signals of the model
+
+        Returns:
+            int: Desired number of replicas within [min_replicas, max_replicas]
+        """
+        current = signals.replicas
+        if current == 0:
+            # Cold start on any demand
+            wanted = 1 if signals.rejected or signals.inflight or signals.idle_for < self.idle_timeout else 0
+        elif (self.min_replicas == 0 and signals.idle_for >= self.idle_timeout
+              and not signals.inflight and not signals.waiting):
+            wanted = 0
+        else:
+            pressure = self.pressure(signals, current)
+            if pressure > 1.0 or signals.rejected:
+                wanted = max(current + 1, math.ceil(current * pressure))
+            elif current > 1 and self.pressure(signals, current - 1) < self.scale_down_threshold:
+                wanted = current - 1
+            else:
+                wanted = current
+        return max(self.min_replicas, min(self.max_replicas, wanted))
+
+
+@dataclass
+class ScalingEvent:
+    """One action taken by the autoscaler."""
+    at: float
+    model: str
+    action: str             # start, ready, drain, stop, failed
+    replica: str
+    detail: str = ""
+
+
+class ContainerRuntime(Protocol):
+    """Starts and stops vLLM replica containers for the autoscaler."""
+
+    def start_replica(self, model: str) -> str:
+        """Start a replica serving `model` and return its base URL."""
+
+    def replica_ready(self, model: str, base_url: str) -> bool:
+        """Whether the replica has loaded its model and can take traffic."""
+
+    def stop_replica(self, base_url: str) -> None:
+        """Stop and remove the replica."""
+
+    def list_replicas(self, model: str) -> List[str]:
+        """Base URLs of running replicas this runtime started for `model`."""
+
+
+class DockerRuntime:
+    """Runs vLLM replicas as containers on the local Docker daemon, like switch_model.py."""
+
+    def __init__(self, image: str = AUTOSCALER_IMAGE, network: str = AUTOSCALER_NETWORK,
+                 models_path: Optional[str] = None, port: int = 8000):
+        self.image = image
+        self.network = network
+        self.models_path = models_path or os.getenv("HOST_MODEL_PATH", "")
+        self.port = port
+        self._docker = None
+
+    @property
+    def client(self):
+        # Imported lazily: the docker SDK is only needed when autoscaling is enabled
+        if self._docker is None:
+            import docker
+            self._docker = docker.from_env()
+        return self._docker
+
+    def _device_requests(self) -> list:
+        from docker.types import DeviceRequest
+        if AUTOSCALER_GPU_DEVICES == "all":
+            return [DeviceRequest(count=-1, capabilities=[["gpu"]])]
+        return [DeviceRequest(device_ids=AUTOSCALER_GPU_DEVICES.split(","), capabilities=[["gpu"]])]
+
+    def start_replica(self, model: str) -> str:
+        name = f"vllm_{re.sub(r'[^a-zA-Z0-9]+', '_', model).lower()}_{uuid.uuid4().hex[:6]}"
+        extra_args = os.getenv("VLLM_EXTRA_ARGS", "")
+        serve = (
+            f"vllm serve /models/{model} --port {self.port} "
+            f"--max-num-seqs {os.getenv('MAX_NUM_SEQS', '10')} "
+            f"--gpu-memory-utilization {os.getenv('GPU_MEMORY_UTILIZATION', '0.3')} "
+            f"--max-model-len {MAX_MODEL_LEN} "
+            f"{configured_args()} {extra_args}"
+        )
+        environment = {"PYTORCH_CUDA_ALLOC_CONF": "expandable_segments:True"}
+        if "--enable-lora" in extra_args:
+            # The gateway loads LoRA adapters at runtime (see services/lora_adapters.py)
+            environment["VLLM_ALLOW_RUNTIME_LORA_UPDATING"] = "True"
+        self.client.containers.run(
+            image=self.image,
+            name=name,
+            command=["/bin/bash", "-c",
+                     f"source /opt/conda/etc/profile.d/conda.sh && conda activate vllm_env && {serve}"],
+            volumes={self.models_path: {"bind": "/models", "mode": "ro"}},
+            environment=environment,
+            labels={LABEL_MANAGED: "true", LABEL_MODEL: model},
+            device_requests=self._device_requests(),
+            network=self.network,
+            detach=True,
+            remove=True,
+        )
+        return f"http://{name}:{self.port}"
+
+    def replica_ready(self, model: str, base_url: str) -> bool:
+        try:
+            resp = requests.get(f"{base_url}/v1/models", timeout=2)
+            return resp.status_code == 200 and any(model in m.get("id", "") for m in resp.json()["data"])
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            return False
+
+    def stop_replica(self, base_url: str) -> None:
+        import docker
+        name = base_url.split("://", 1)[-1].rsplit(":", 1)[0]
+        try:
+            self.client.containers.get(name).stop()
+        except docker.errors.NotFound:
+            pass
+
+    def list_replicas(self, model: str) -> List[str]:
+        containers = self.client.containers.list(
+            filters={"label": [f"{LABEL_MANAGED}=true", f"{LABEL_MODEL}={model}"]})
+        return [f"http://{c.name}:{self.port}" for c in containers]
+
+
+class Autoscaler:
+    """Periodically resizes each model's replica set to match its load."""
+
+    def __init__(self, runtime: ContainerRuntime, capacity: CapacityModel = capacity_model,
+                 policy: Optional[ScalingPolicy] = None, models: Optional[List[str]] = None,
+                 clock: Callable[[], float] = time.time):
+        self.runtime = runtime
+        self.capacity = capacity
+        self.policy = policy or ScalingPolicy()
+        self.models = models or AUTOSCALER_MODELS or capacity.models
+        self.clock = clock
+        self.managed: Dict[str, str] = {}                       # base_url -> model
+        self.pending: Dict[str, Tuple[str, float]] = {}         # base_url -> (model, started_at)
+        self.draining: Dict[str, Tuple[ReplicaCapacity, float]] = {}
+        self.events: List[ScalingEvent] = []
+        self._last_up: Dict[str, float] = {}
+        self._last_change: Dict[str, float] = {}
+        self._rejected_seen: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        if self.policy.min_replicas == 0:
+            configured = [m for m in self.models if self.capacity.replicas.get(m)]
+            if configured:
+                logger.warning("Scale-to-zero never stops replicas configured in VLLM_BACKENDS; these models "
+                               "only scale down to them", extra={"models": configured})
+
+    def adopt_existing(self) -> None:
+        """Register replicas a previous gateway process started (e.g. after a restart)."""
+        for model in self.models:
+            for base_url in self.runtime.list_replicas(model):
+                self.capacity.add_replica(model, base_url)
+                self.managed[base_url] = model
+
+    def signals(self, model: str, now: float) -> ModelSignals:
+        replicas = self.capacity.replicas.get(model, [])
+        rejected = self.capacity.rejected.get(model, 0)
+        last_request = self.capacity.last_request.get(model)
+        idle_for = now - last_request if last_request is not None else math.inf
+        signals = ModelSignals(
+            replicas=len(replicas) + sum(1 for m, _ in self.pending.values() if m == model),
+            waiting=sum(r.requests_waiting for r in replicas),
+            inflight=sum(r.inflight for r in replicas),
+            rejected=rejected - self._rejected_seen.get(model, 0),
+            idle_for=idle_for,
+        )
+        # Latencies are a window of past requests; only trust them while traffic is flowing
+        if idle_for < 2 * AUTOSCALER_INTERVAL:
+            signals.latency_p95_ms = max((r.latency_p95_ms for r in replicas), default=0.0)
+        self._rejected_seen[model] = rejected
+        return signals
+
+    def _record(self, event: ScalingEvent) -> None:
+        self.events.append(event)
+        del self.events[:-100]
+        scale_events.add(1, {"model": event.model, "action": event.action})
+        logger.info("Autoscaler %s", event.action, extra={
+            "model": event.model, "replica": event.replica, "detail": event.detail})
+
+    def _promote_pending(self, now: float) -> None:
+        for base_url, (model, started_at) in list(self.pending.items()):
+            if self.runtime.replica_ready(model, base_url):
+                del self.pending[base_url]
+                self.capacity.add_replica(model, base_url)
+                self._record(ScalingEvent(now, model, "ready", base_url,
+                                          f"booted in {now - started_at:.0f}s"))
+            elif now - started_at > AUTOSCALER_BOOT_TIMEOUT:
+                del self.pending[base_url]
+                self.managed.pop(base_url, None)
+                self.runtime.stop_replica(base_url)
+                self._record(ScalingEvent(now, model, "failed", base_url, "boot timeout"))
+
+    def _finish_draining(self, now: float) -> None:
+        for base_url, (replica, since) in list(self.draining.items()):
+            if replica.inflight == 0 or now - since > AUTOSCALER_DRAIN_TIMEOUT:
+                del self.draining[base_url]
+                self.managed.pop(base_url, None)
+                self.runtime.stop_replica(base_url)
+                self._record(ScalingEvent(now, replica.model, "stop", base_url))
+
+    def _scale(self, model: str, signals: ModelSignals, desired: int, now: float) -> None:
+        current = signals.replicas
+        reason = (f"waiting={signals.waiting:g} inflight={signals.inflight} "
+                  f"p95={signals.latency_p95_ms:.0f}ms rejected={signals.rejected}")
+        if desired > current:
+            # Cold starts skip the cooldown: requests are being rejected meanwhile
+            if current > 0 and now - self._last_up.get(model, -math.inf) < self.policy.scale_up_cooldown:
+                return
+            for _ in range(desired - current):
+                try:
+                    base_url = self.runtime.start_replica(model)
+                except Exception as e:
+                    logger.exception("Failed to start replica", extra={"model": model})
+                    self._record(ScalingEvent(now, model, "failed", "", str(e)))
+                    break
+                self.managed[base_url] = model
+                self.pending[base_url] = (model, now)
+                self._record(ScalingEvent(now, model, "start", base_url, reason))
+            self._last_up[model] = self._last_change[model] = now
+        elif desired < current:
+            if now - self._last_change.get(model, -math.inf) < self.policy.scale_down_cooldown:
+                return
+            # Booting replicas can't be drained, so they don't count here: draining a ready replica
+            # in their place would leave the model with none that can serve
+            registered = self.capacity.replicas.get(model, [])
+            excess = len(registered) - desired
+            # Only replicas this autoscaler started are removed, least busy first
+            removable = sorted((r for r in registered if r.base_url in self.managed), key=lambda r: r.inflight)
+            for replica in removable[:max(0, excess)]:
+                self.capacity.remove_replica(model, replica.base_url)
+                self.draining[replica.base_url] = (replica, now)
+                self._record(ScalingEvent(now, model, "drain", replica.base_url, reason))
+                self._last_change[model] = now
+
+    def tick(self, now: Optional[float] = None) -> None:
+        """Make one round of scaling decisions for every model."""
+        now = self.clock() if now is None else now
+        self._promote_pending(now)
+        self._finish_draining(now)
+        for model in self.models:
+            signals = self.signals(model, now)
+            self._scale(model, signals, self.policy.desired_replicas(signals), now)
+
+    def status(self) -> Dict:
+        return {
+            "models": self.models,
+            "managed": sorted(self.managed),
+            "pending": sorted(self.pending),
+            "draining": sorted(self.draining),
+            "recent_events": [vars(e) for e in self.events[-10:]],
+        }
+
+    async def _run(self) -> None:
+        try:
+            await asyncio.to_thread(self.adopt_existing)
+        except Exception:
+            logger.exception("Autoscaler could not list existing replicas")
+        while True:
+            try:
+                # Docker API calls block; keep them off the event loop
+                await asyncio.to_thread(self.tick)
+            except Exception:
+                logger.exception("Autoscaler tick failed")
+            await asyncio.sleep(AUTOSCALER_INTERVAL)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def build_autoscaler() -> Optional[Autoscaler]:
+    """The gateway's autoscaler over Docker, or None unless AUTOSCALER_ENABLED is set."""
+    return Autoscaler(DockerRuntime()) if AUTOSCALER_ENABLED else None
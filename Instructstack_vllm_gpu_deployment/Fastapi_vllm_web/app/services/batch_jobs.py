@@ -0,0 +1,490 @@
+"""
+Batch Jobs
+
+Offline processing of large JSONL prompt files. The input is streamed from disk,
+sent to vLLM as multi-prompt completion requests at a bounded concurrency, and the
+results are streamed to an output JSONL file in input order. Memory stays bounded
+by the number of requests in flight, whatever the size of the file.
+
+Input: one JSON object per line, `{"prompt": "...", "id": "optional"}`; blank lines
+are skipped and invalid lines produce an error record. Sampling parameters
+(max_tokens, temperature, stop) are set per job.
+
+Prompts go through the gateway's token budget (see services/token_budget.py):
+a prompt that can't fit the context window gets an error record without a vLLM
+request, and a chunk is sent with the smallest max_tokens that fits all of its
+prompts.
+
+Output: one line per input line, `{"id", "line", "text", "finish_reason"}` or
+`{"id", "line", "error"}`.
+
+Each job lives in its own directory:
+    <BATCH_DATA_DIR>/<job_id>/input.jsonl    uploaded prompts
+    <BATCH_DATA_DIR>/<job_id>/output.jsonl   results, appended in input order
+    <BATCH_DATA_DIR>/<job_id>/job.json       state and checkpoint, replaced atomically
+
+The checkpoint (input and output byte offsets) advances after every flushed chunk,
+so a job interrupted by a crash or restart resumes where it stopped without
+duplicating or losing results.
+
+Batch requests run in the batch traffic class (see services/traffic_classes.py):
+with traffic control on they wait for a batch slot, and a request cancelled to make
+room for interactive traffic is requeued without counting as a retry.
+
+Configuration (environment variables):
+    BATCH_DATA_DIR              Directory holding job files (default: batch_jobs)
+    BATCH_CONCURRENCY           Default vLLM requests in flight per job (default: 4)
+    BATCH_MAX_CONCURRENCY       Upper bound for a job's concurrency (default: 16)
+    BATCH_PROMPTS_PER_REQUEST   Prompts sent in one completion request (default: 8)
+    BATCH_MAX_RUNNING_JOBS      Jobs processed at the same time; others wait (default: 2)
+    BATCH_MAX_RETRIES           Retries of a failed request before its prompts are marked failed (default: 3);
+                                4xx responses are not retried, the chunk's prompts are sent one by one instead
+    BATCH_REQUEST_TIMEOUT       Timeout of one completion request in seconds (default: 300)
+    BATCH_RESUME_ON_STARTUP     Resume interrupted jobs when the gateway starts (default: true)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from typing import Any, BinaryIO, Deque, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import logfire
+
+from services.async_client import get_async_client
+from services.generation_profiles import apply_profile, prompt_type
+from services.capacity import HEALTH_PROBE_INTERVAL, capacity_model, is_replica_failure
+from services.lora_adapters import lora_adapters
+from services.traffic_classes import BATCH, traffic_slot
+from services import token_budget
+
+logger = logging.getLogger(__name__)
+
+BATCH_DATA_DIR = os.getenv("BATCH_DATA_DIR", "batch_jobs")
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_PROMPTS_PER_REQUEST = int(os.getenv("BATCH_PROMPTS_PER_REQUEST", "8"))
+BATCH_MAX_RUNNING_JOBS = int(os.getenv("BATCH_MAX_RUNNING_JOBS", "2"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "3"))
+BATCH_REQUEST_TIMEOUT = float(os.getenv("BATCH_REQUEST_TIMEOUT", "300"))
+BATCH_RESUME_ON_STARTUP = os.getenv("BATCH_RESUME_ON_STARTUP", "true").lower() == "true"
+
+batch_prompts = logfire.metric_counter("batch.prompts", unit="1",
+                                       description="Batch prompts processed, by outcome")
+
+# Job states
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED, INTERRUPTED = (
+    "queued", "running", "completed", "failed", "cancelled", "interrupted")
+ACTIVE_STATES = {QUEUED, RUNNING}
+
+
+# Client errors that are still worth retrying
+RETRYABLE_STATUS = {408, 429}
+
+
+class _RejectedRequest(Exception):
+    """vLLM answered a batch request with a non-retryable 4xx."""
+
+
+@dataclass
+class BatchJob:
+    """Persisted state of one batch job (job.json)."""
+    id: str
+    model: str
+    max_tokens: int = 128
+    temperature: float = 0.0
+    stop: List[str] = field(default_factory=list)
+    concurrency: int = BATCH_CONCURRENCY
+    state: str = QUEUED
+    total: int = 0                  # prompt lines in the input file
+    processed: int = 0              # lines written to the output, including failures
+    failed: int = 0
+    input_offset: int = 0           # checkpoint: input bytes fully processed
+    output_offset: int = 0          # checkpoint: output bytes written for them
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    started_processed: int = 0      # `processed` when the current run started, for the rate
+    finished_at: Optional[float] = None
+    error: str = ""
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(BATCH_DATA_DIR, self.id)
+
+    @property
+    def input_path(self) -> str:
+        return os.path.join(self.directory, "input.jsonl")
+
+    @property
+    def output_path(self) -> str:
+        return os.path.join(self.directory, "output.jsonl")
+
+    def save(self) -> None:
+        """Write job.json atomically so a crash never leaves a torn checkpoint."""
+        path = os.path.join(self.directory, "job.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(asdict(self), f)
+        os.replace(tmp_path, path)
+
+    def progress(self) -> Dict[str, Any]:
+        info = asdict(self)
+        info["percent"] = round(100 * self.processed / self.total, 1) if self.total else 0.0
+        if self.state == RUNNING and self.started_at:
+            elapsed = time.time() - self.started_at
+            rate = (self.processed - self.started_processed) / elapsed if elapsed > 0 else 0.0
+            info["prompts_per_sec"] = round(rate, 2)
+            info["eta_s"] = round((self.total - self.processed) / rate) if rate > 0 else None
+        return info
+
+
+@dataclass
+class _Chunk:
+    """Consecutive input lines sent to vLLM in one request."""
+    end_offset: int
+    lines: List[Tuple[int, Any, Optional[str], str]] = field(default_factory=list)  # (line, id, prompt, error)
+
+
+def _read_chunks(src: BinaryIO, first_line: int, size: int) -> Iterator[_Chunk]:
+    """Yield chunks of up to `size` prompts, reading the file one line at a time."""
+    chunk = _Chunk(src.tell())
+    line_no = first_line
+    for raw in iter(src.readline, b""):
+        line_no += 1
+        chunk.end_offset = src.tell()
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+            prompt = record["prompt"]
+            if not isinstance(prompt, str):
+                raise ValueError("prompt must be a string")
+            chunk.lines.append((line_no, record.get("id", line_no), prompt, ""))
+        except (ValueError, KeyError, TypeError) as e:
+            chunk.lines.append((line_no, line_no, None, f"invalid input line: {e}"))
+        if len(chunk.lines) >= size:
+            yield chunk
+            chunk = _Chunk(src.tell())
+    if chunk.lines:
+        yield chunk
+
+
+class BatchJobManager:
+    """Creates, runs, resumes and cancels batch jobs; job state is kept on disk."""
+
+    def __init__(self):
+        self.jobs: Dict[str, BatchJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancel_requested: set = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def load(self) -> None:
+        """Load the jobs found in BATCH_DATA_DIR."""
+        if not os.path.isdir(BATCH_DATA_DIR):
+            return
+        for job_id in os.listdir(BATCH_DATA_DIR):
+            path = os.path.join(BATCH_DATA_DIR, job_id, "job.json")
+            try:
+                with open(path) as f:
+                    self.jobs[job_id] = BatchJob(**json.load(f))
+            except (OSError, ValueError, TypeError):
+                logger.warning("Skipping unreadable batch job", extra={"job_id": job_id})
+
+    def start(self) -> None:
+        """Load jobs and resume (or mark interrupted) those that were running at shutdown or crash."""
+        self._slots = asyncio.Semaphore(BATCH_MAX_RUNNING_JOBS)
+        self.load()
+        for job in self.jobs.values():
+            if job.state not in ACTIVE_STATES | {INTERRUPTED}:
+                continue
+            if BATCH_RESUME_ON_STARTUP:
+                self._schedule(job)
+            elif job.state != INTERRUPTED:
+                job.state = INTERRUPTED
+                job.save()
+
+    async def stop(self) -> None:
+        """Stop running jobs at their last checkpoint; they resume on the next start."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def new_job(self, model: str, max_tokens: int, temperature: float, stop: List[str],
+                concurrency: Optional[int] = None) -> BatchJob:
+        job = BatchJob(
+            id=uuid.uuid4().hex[:12],
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stop=stop,
+            concurrency=max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY)),
+        )
+        os.makedirs(job.directory, exist_ok=True)
+        return job
+
+    async def write_input(self, job: BatchJob, upload) -> None:
+        """
+        Stream an uploaded file to the job's input.jsonl, counting its prompt lines.
+
+        Args:
+            job: Job created with `new_job`
+            upload: Object with an async `read(size)` (e.g. FastAPI's UploadFile)
+        """
+        total = 0
+        tail = b""
+        with open(job.input_path, "wb") as dst:
+            while True:
+                block = await upload.read(1 << 20)
+                if not block:
+                    break
+                dst.write(block)
+                lines = (tail + block).split(b"\n")
+                tail = lines.pop()
+                total += sum(1 for line in lines if line.strip())
+        job.total = total + (1 if tail.strip() else 0)
+
+    def submit(self, job: BatchJob) -> None:
+        """Register a job whose input file is in place and queue it."""
+        self.jobs[job.id] = job
+        self._schedule(job)
+
+    def cancel(self, job: BatchJob) -> None:
+        task = self._tasks.get(job.id)
+        if task is not None:
+            self._cancel_requested.add(job.id)
+            task.cancel()
+        elif job.state in ACTIVE_STATES | {INTERRUPTED}:
+            job.state = CANCELLED
+            job.save()
+
+    def resume(self, job: BatchJob) -> None:
+        if job.id not in self._tasks:
+            self._schedule(job)
+
+    def _schedule(self, job: BatchJob) -> None:
+        job.state = QUEUED
+        job.save()
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+
+    async def _run(self, job: BatchJob) -> None:
+        try:
+            async with self._slots:
+                job.state = RUNNING
+                job.started_at = time.time()
+                job.started_processed = job.processed
+                job.save()
+                with logfire.span("batch.job {job_id}", job_id=job.id, model=job.model):
+                    await self._process(job)
+                job.state = COMPLETED
+        except asyncio.CancelledError:
+            # User cancellations are final; shutdowns leave the job to be resumed
+            job.state = CANCELLED if job.id in self._cancel_requested else INTERRUPTED
+            self._cancel_requested.discard(job.id)
+        except Exception as e:
+            logger.exception("Batch job failed", extra={"job_id": job.id})
+            job.state = FAILED
+            job.error = str(e)
+        job.finished_at = time.time() if job.state in (COMPLETED, FAILED, CANCELLED) else None
+        job.save()
+        logger.info("Batch job %s", job.state, extra={
+            "job_id": job.id, "processed": job.processed, "failed": job.failed, "total": job.total})
+
+    async def _process(self, job: BatchJob) -> None:
+        requests_slots = asyncio.Semaphore(job.concurrency)
+        # Chunks are written in input order; keeping at most 2x concurrency chunks
+        # outstanding lets requests overlap while bounding the reorder buffer
+        window = 2 * job.concurrency
+        outstanding: Deque[Tuple[_Chunk, asyncio.Task]] = deque()
+
+        with open(job.input_path, "rb") as src, open(job.output_path, "ab") as out:
+            # Drop anything written after the last checkpoint (a crash mid-chunk)
+            out.truncate(job.output_offset)
+            src.seek(job.input_offset)
+            first_line = self._lines_before(job)
+            try:
+                for chunk in _read_chunks(src, first_line, BATCH_PROMPTS_PER_REQUEST):
+                    outstanding.append((chunk, asyncio.create_task(self._complete(job, chunk, requests_slots))))
+                    if len(outstanding) >= window:
+                        await self._write_next(job, outstanding, out)
+                while outstanding:
+                    await self._write_next(job, outstanding, out)
+            finally:
+                for _, task in outstanding:
+                    task.cancel()
+
+    @staticmethod
+    def _lines_before(job: BatchJob) -> int:
+        """Number of input lines before the checkpoint, counted in 1 MiB blocks."""
+        count = 0
+        remaining = job.input_offset
+        with open(job.input_path, "rb") as f:
+            while remaining > 0:
+                block = f.read(min(1 << 20, remaining))
+                if not block:
+                    break
+                count += block.count(b"\n")
+                remaining -= len(block)
+        return count
+
+    async def _write_next(self, job: BatchJob, outstanding: Deque, out: BinaryIO) -> None:
+        chunk, task = outstanding[0]
+        records = await task
+        outstanding.popleft()
+        out.write(b"".join(json.dumps(r).encode() + b"\n" for r in records))
+        out.flush()
+        failed = sum(1 for r in records if "error" in r)
+        job.processed += len(records)
+        job.failed += failed
+        job.input_offset = chunk.end_offset
+        job.output_offset = out.tell()
+        job.save()
+        batch_prompts.add(len(records) - failed, {"outcome": "ok"})
+        if failed:
+            batch_prompts.add(failed, {"outcome": "error"})
+
+    async def _complete(self, job: BatchJob, chunk: _Chunk, slots: asyncio.Semaphore) -> List[Dict]:
+        """Run one chunk through vLLM and return its output records in input order."""
+        records: Dict[int, Dict] = {}
+        todo = []
+        for line_no, item_id, prompt, error in chunk.lines:
+            if error:
+                records[line_no] = {"id": item_id, "line": line_no, "error": error}
+            else:
+                todo.append((line_no, item_id, prompt))
+
+        if todo:
+            # Counting tokens is CPU work: keep it off the event loop
+            todo, max_tokens = await asyncio.to_thread(self._fit_context, job, todo, records)
+        if todo:
+            async with slots:
+                choices, errors = await self._send(job, [prompt for _, _, prompt in todo], max_tokens)
+            for index, (line_no, item_id, _) in enumerate(todo):
+                choice = choices.get(index)
+                if choice is None:
+                    records[line_no] = {"id": item_id, "line": line_no, "error": errors[index]}
+                else:
+                    records[line_no] = {"id": item_id, "line": line_no, "text": choice.get("text", "").strip(),
+                                        "finish_reason": choice.get("finish_reason")}
+        return [records[line_no] for line_no, *_ in chunk.lines]
+
+    @staticmethod
+    def _fit_context(job: BatchJob, todo: List[Tuple[int, Any, str]],
+                     records: Dict[int, Dict]) -> Tuple[List[Tuple[int, Any, str]], int]:
+        """
+        Apply the token budget to a chunk's prompts.
+
+        Prompts that can't be served get an error record in `records`.
+
+        Returns:
+            Tuple: The remaining prompts, and the largest max_tokens that fits all of them
+        """
+        adapter = lora_adapters.resolve(job.model) if lora_adapters is not None else None
+        base_model = adapter.base if adapter is not None else job.model
+        tokenizer = token_budget.get_model_tokenizer(base_model)
+        remaining, max_tokens = [], job.max_tokens
+        for line_no, item_id, prompt in todo:
+            budget = token_budget.plan(base_model, prompt_type(prompt), len(tokenizer.encode(prompt)),
+                                       job.max_tokens, tokenizer.exact)
+            if budget.error:
+                records[line_no] = {"id": item_id, "line": line_no, "error": budget.error.lstrip("❌ ")}
+            else:
+                remaining.append((line_no, item_id, prompt))
+                max_tokens = min(max_tokens, budget.max_tokens)
+        return remaining, max_tokens
+
+    async def _send(self, job: BatchJob, prompts: List[str], max_tokens: int) -> Tuple[Dict[int, Dict], Dict[int, str]]:
+        """
+        Complete prompts in one request; when vLLM rejects it, send them one by one so only the bad ones fail.
+
+        Returns:
+            Tuple: Choices by prompt index, and errors by index for the prompts without a choice
+        """
+        try:
+            choices, error = await self._request(job, prompts, max_tokens)
+        except _RejectedRequest as e:
+            if len(prompts) == 1:
+                return {}, {0: str(e)}
+            logger.info("Batch request rejected, sending its prompts one by one",
+                        extra={"job_id": job.id, "prompts": len(prompts), "error": str(e)})
+            choices, errors = {}, {}
+            # One at a time: the job's concurrency slot is still held
+            for index, prompt in enumerate(prompts):
+                single_choices, single_errors = await self._send(job, [prompt], max_tokens)
+                if 0 in single_choices:
+                    choices[index] = single_choices[0]
+                else:
+                    errors[index] = single_errors[0]
+            return choices, errors
+        return choices, {index: error or "missing choice" for index in range(len(prompts)) if index not in choices}
+
+    async def _request(self, job: BatchJob, prompts: List[str], max_tokens: int) -> Tuple[Dict[int, Dict], str]:
+        """
+        Send one multi-prompt completion request, retrying on errors and waiting out saturation.
+
+        Raises:
+            _RejectedRequest: vLLM rejected the request with a 4xx; retrying would not help
+        """
+        # A LoRA adapter runs on its base model's replicas (see services/lora_adapters.py)
+        adapter = lora_adapters.resolve(job.model) if lora_adapters is not None else None
+        base_model = adapter.base if adapter is not None else job.model
+        payload = {
+            "model": adapter.name if adapter is not None else f"/models/{job.model}",
+            "prompt": prompts,
+            "max_tokens": max_tokens,
+            "temperature": job.temperature,
+        }
+        if job.stop:
+            payload["stop"] = job.stop
+        apply_profile(payload, base_model)
+        client = get_async_client()
+        error = ""
+        attempt = 0
+        while attempt <= BATCH_MAX_RETRIES:
+            replica = None
+            try:
+                async with traffic_slot(base_model, BATCH) as lease:
+                    if adapter is not None:
+                        replica = lora_adapters.select_replica(adapter)
+                    else:
+                        replica = capacity_model.select_replica(job.model)
+                    if replica is not None:
+                        start = time.perf_counter()
+                        in_use = await lora_adapters.acquire(replica, adapter) if adapter is not None else nullcontext()
+                        with replica.track_inflight(), in_use:
+                            resp = await client.post(f"{replica.base_url}/v1/completions", json=payload,
+                                                     timeout=BATCH_REQUEST_TIMEOUT)
+                if replica is None:
+                    if base_model not in capacity_model.replicas:
+                        return {}, f"unknown model: {job.model}"
+                    # Batch work yields to interactive traffic: wait for capacity instead of failing
+                    await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+                    continue
+                if lease is not None and lease.preempted:
+                    # Cancelled to make room for interactive traffic: requeue without using up a retry
+                    continue
+                if 400 <= resp.status_code < 500 and resp.status_code not in RETRYABLE_STATUS:
+                    # The request itself is bad (e.g. an oversized prompt), not the replica
+                    raise _RejectedRequest(f"vLLM rejected the request ({resp.status_code}): {resp.text[:200]}")
+                resp.raise_for_status()
+                choices = {c["index"]: c for c in resp.json()["choices"]}
+                replica.record_result(True, (time.perf_counter() - start) * 1000)
+                return choices, ""
+            except (httpx.HTTPError, ValueError, KeyError, RuntimeError) as e:
+                if replica is not None and is_replica_failure(e):
+                    replica.record_result(False)
+                error = str(e) or type(e).__name__
+                attempt += 1
+                await asyncio.sleep(min(30.0, 2 ** attempt))
+        return {}, f"request failed after {BATCH_MAX_RETRIES} retries: {error}"
+
+
+batch_manager = BatchJobManager()
@@ -0,0 +1,349 @@
+"""
+Capacity Model
+
+Keeps a live, gateway-side view of every vLLM replica by polling its `/v1/models`
+and `/metrics` endpoints in the background. The view drives replica routing,
+admission control and the `/ready` and `/status` endpoints, so none of them make
+upstream calls on the request path.
+
+Per replica it tracks:
+    - running and waiting requests (`vllm:num_requests_running` / `vllm:num_requests_waiting`)
+    - KV-cache utilization (`vllm:kv_cache_usage_perc`, or the older gpu/cpu variants)
+    - prompt and generation tokens/sec, derived from the token counters between scrapes
+    - requests currently in flight from this gateway, its recent error rate and latency
+    - LoRA adapters it has loaded (`/v1/models` entries with a parent model)
+
+Per model it also records when the last request arrived and how many were rejected,
+which the autoscaler (services/autoscaler.py) uses as demand signals.
+
+Scrape cost is bounded: one scrape per replica per interval, a short timeout, and
+at most CAPACITY_MAX_METRICS_BYTES of `/metrics` read, parsing only the families above.
+
+Configuration (environment variables):
+    HEALTH_PROBE_INTERVAL        Seconds between scrapes (default: 5)
+    HEALTH_PROBE_TIMEOUT         Timeout of each scrape request in seconds (default: 2)
+    HEALTH_ERROR_WINDOW          Number of recent requests used for the error rate (default: 50)
+    READY_MAX_ERROR_RATE         Error rate above which a replica is not ready (default: 0.5)
+    READY_MAX_QUEUE_DEPTH        Waiting requests at which a replica is saturated (default: 20)
+    CAPACITY_MAX_KV_USAGE        KV-cache utilization at which a replica is saturated (default: 0.95)
+    CAPACITY_MAX_METRICS_BYTES   Max bytes of `/metrics` read per scrape (default: 524288)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional
+
+import httpx
+import logfire
+
+from services.stats import percentile
+from vllm.config import VLLM_BACKENDS
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "5"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+HEALTH_ERROR_WINDOW = int(os.getenv("HEALTH_ERROR_WINDOW", "50"))
+READY_MAX_ERROR_RATE = float(os.getenv("READY_MAX_ERROR_RATE", "0.5"))
+READY_MAX_QUEUE_DEPTH = int(os.getenv("READY_MAX_QUEUE_DEPTH", "20"))
+CAPACITY_MAX_KV_USAGE = float(os.getenv("CAPACITY_MAX_KV_USAGE", "0.95"))
+CAPACITY_MAX_METRICS_BYTES = int(os.getenv("CAPACITY_MAX_METRICS_BYTES", str(512 * 1024)))
+
+# vLLM metric family -> field of the parsed sample dict. KV-cache usage was renamed across
+# vLLM versions (gpu_/cpu_ prefixes in v0, kv_ in v1); whichever is present is used.
+METRIC_FAMILIES = {
+    "vllm:num_requests_running": "running",
+    "vllm:num_requests_waiting": "waiting",
+    "vllm:kv_cache_usage_perc": "kv_cache_usage",
+    "vllm:gpu_cache_usage_perc": "kv_cache_usage",
+    "vllm:cpu_cache_usage_perc": "kv_cache_usage",
+    "vllm:prompt_tokens_total": "prompt_tokens_total",
+    "vllm:generation_tokens_total": "generation_tokens_total",
+}
+
+
+def parse_vllm_metrics(lines: Iterable[str]) -> Dict[str, float]:
+    """
+    Parse the capacity-relevant samples out of vLLM's Prometheus exposition text.
+
+    Gauges and counters are summed over label sets; KV-cache usage takes the
+    maximum. Families not listed in METRIC_FAMILIES are skipped without parsing.
+
+    Args:
+        lines: Lines of a `/metrics` response
+
+    Returns:
+        Dict[str, float]: Values for the fields present, e.g. `running`, `waiting`,
+        `kv_cache_usage`, `prompt_tokens_total`, `generation_tokens_total`
+    """
+    values: Dict[str, float] = {}
+    for line in lines:
+        if not line.startswith("vllm:"):
+            continue
+        name_end = len(line)
+        for sep in ("{", " "):
+            index = line.find(sep)
+            if index != -1:
+                name_end = min(name_end, index)
+        key = METRIC_FAMILIES.get(line[:name_end])
+        if key is None:
+            continue
+        try:
+            value = float(line.rsplit(" ", 1)[-1])
+        except ValueError:
+            continue
+        if key == "kv_cache_usage":
+            values[key] = max(values.get(key, 0.0), value)
+        else:
+            values[key] = values.get(key, 0.0) + value
+    return values
+
+
+def is_replica_failure(error: BaseException) -> bool:
+    """
+    Whether a failed upstream request counts against the replica's error rate.
+
+    Transport errors, 5xx responses and broken response bodies do; a 4xx is about
+    the request (bad payload, prompt too long, rate limited), not the replica.
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status >= 500
+
+
+@dataclass
+class ReplicaCapacity:
+    """Live capacity view of one vLLM replica serving one model."""
+    model: str
+    base_url: str
+    reachable: bool = False
+    model_loaded: bool = False
+    requests_running: float = 0.0
+    requests_waiting: float = 0.0
+    kv_cache_usage: float = 0.0
+    prompt_tokens_per_sec: float = 0.0
+    generation_tokens_per_sec: float = 0.0
+    inflight: int = 0
+    adapters: List[str] = field(default_factory=list)
+    adapters_listed_at: float = 0.0
+    last_scrape: float = 0.0
+    last_error: str = ""
+    outcomes: Deque[bool] = field(default_factory=lambda: deque(maxlen=HEALTH_ERROR_WINDOW))
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=HEALTH_ERROR_WINDOW))
+    _counters: Dict[str, float] = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def latency_p95_ms(self) -> float:
+        return percentile(self.latencies, 95, default=0.0)
+
+    @property
+    def fresh(self) -> bool:
+        """Whether the last scrape is recent enough to trust."""
+        return self.last_scrape > 0 and time.time() - self.last_scrape < 3 * HEALTH_PROBE_INTERVAL
+
+    @property
+    def saturated(self) -> bool:
+        return (self.requests_waiting >= READY_MAX_QUEUE_DEPTH
+                or self.kv_cache_usage >= CAPACITY_MAX_KV_USAGE)
+
+    @property
+    def ready(self) -> bool:
+        return self.model_loaded and self.error_rate <= READY_MAX_ERROR_RATE and not self.saturated
+
+    def record_result(self, ok: bool, latency_ms: Optional[float] = None) -> None:
+        """Record the outcome of a proxied request (O(1), called on the request path)."""
+        self.outcomes.append(ok)
+        if latency_ms is not None:
+            self.latencies.append(latency_ms)
+
+    @contextmanager
+    def track_inflight(self) -> Iterator[None]:
+        """Count a request as in flight from this gateway while the block runs."""
+        # Requests are proxied from worker threads, so the counter needs a lock
+        with self._lock:
+            self.inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+    def update(self, sample: Dict[str, float], now: float) -> None:
+        """Apply a parsed `/metrics` sample, deriving token rates from counter deltas."""
+        self.requests_running = sample.get("running", 0.0)
+        self.requests_waiting = sample.get("waiting", 0.0)
+        self.kv_cache_usage = sample.get("kv_cache_usage", 0.0)
+        for counter, rate_attr in (("prompt_tokens_total", "prompt_tokens_per_sec"),
+                                   ("generation_tokens_total", "generation_tokens_per_sec")):
+            if counter not in sample:
+                continue
+            previous = self._counters.get(counter)
+            elapsed = now - self._counters.get("_at", now)
+            # Skip the first sample and counter resets (replica restarted)
+            if previous is not None and elapsed > 0 and sample[counter] >= previous:
+                setattr(self, rate_attr, (sample[counter] - previous) / elapsed)
+            self._counters[counter] = sample[counter]
+        self._counters["_at"] = now
+
+    def to_dict(self) -> Dict:
+        return {
+            "model": self.model,
+            "url": self.base_url,
+            "ready": self.ready,
+            "reachable": self.reachable,
+            "model_loaded": self.model_loaded,
+            "lora_adapters": self.adapters,
+            "saturated": self.saturated,
+            "requests_running": self.requests_running,
+            "requests_waiting": self.requests_waiting,
+            "kv_cache_usage": round(self.kv_cache_usage, 4),
+            "prompt_tokens_per_sec": round(self.prompt_tokens_per_sec, 1),
+            "generation_tokens_per_sec": round(self.generation_tokens_per_sec, 1),
+            "inflight": self.inflight,
+            "error_rate": round(self.error_rate, 3),
+            "latency_p95_ms": round(self.latency_p95_ms, 1),
+            "recent_requests": len(self.outcomes),
+            "last_scrape_age_s": round(time.time() - self.last_scrape, 1) if self.last_scrape else None,
+            "last_error": self.last_error,
+        }
+
+
+class CapacityModel:
+    """Registry of replicas per model, kept up to date by a background scraper."""
+
+    def __init__(self, backends: Dict[str, List[str]]):
+        self.replicas: Dict[str, List[ReplicaCapacity]] = {
+            model: [ReplicaCapacity(model, url.rstrip("/")) for url in urls]
+            for model, urls in backends.items()
+        }
+        self.last_request: Dict[str, float] = {}
+        self.rejected: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def models(self) -> List[str]:
+        return list(self.replicas)
+
+    def all_replicas(self) -> List[ReplicaCapacity]:
+        return [replica for replicas in self.replicas.values() for replica in replicas]
+
+    def add_replica(self, model: str, base_url: str) -> ReplicaCapacity:
+        """Register a replica (no-op if it is already known) and return it."""
+        base_url = base_url.rstrip("/")
+        replicas = self.replicas.setdefault(model, [])
+        for replica in replicas:
+            if replica.base_url == base_url:
+                return replica
+        replica = ReplicaCapacity(model, base_url)
+        replicas.append(replica)
+        return replica
+
+    def remove_replica(self, model: str, base_url: str) -> None:
+        base_url = base_url.rstrip("/")
+        self.replicas[model] = [r for r in self.replicas.get(model, []) if r.base_url != base_url]
+
+    def select_replica(self, model: str,
+                       prefer: Optional[Callable[[ReplicaCapacity], bool]] = None) -> Optional[ReplicaCapacity]:
+        """
+        Pick the replica to send a request for `model` to.
+
+        Replicas known to be down or saturated are skipped (admission control);
+        among the rest the one with the shortest vLLM queue wins, then the fewest
+        requests in flight from this gateway, then the lowest KV-cache usage.
+        Replicas without a recent scrape are treated as available. The call is also
+        recorded as demand for the model (and as a rejection when None is returned).
+
+        Args:
+            model: Gateway model name
+            prefer: Available replicas for which this returns True win over the others
+                regardless of load (e.g. those with a LoRA adapter already loaded)
+
+        Returns:
+            Optional[ReplicaCapacity]: The chosen replica, or None when every replica
+            is unavailable or at capacity
+        """
+        if model not in self.replicas:
+            return None
+        self.last_request[model] = time.time()
+        candidates = [
+            r for r in self.replicas[model]
+            if not r.fresh or (r.model_loaded and not r.saturated)
+        ]
+        if not candidates:
+            self.rejected[model] = self.rejected.get(model, 0) + 1
+            return None
+        if prefer is not None:
+            return min(candidates, key=lambda r: (not prefer(r), r.requests_waiting, r.inflight, r.kv_cache_usage))
+        return min(candidates, key=lambda r: (r.requests_waiting, r.inflight, r.kv_cache_usage))
+
+    async def _scrape(self, client: httpx.AsyncClient, replica: ReplicaCapacity) -> None:
+        try:
+            listed_at = time.time()
+            models = await client.get(f"{replica.base_url}/v1/models")
+            data = (models.json().get("data") or []) if models.status_code == 200 else []
+            replica.model_loaded = any(replica.model in entry.get("id", "") for entry in data)
+            # vLLM lists each loaded LoRA adapter as its own model, with the base model as parent
+            replica.adapters = [entry["id"] for entry in data if entry.get("parent")]
+            replica.adapters_listed_at = listed_at
+
+            received = 0
+            lines = []
+            async with client.stream("GET", f"{replica.base_url}/metrics") as metrics:
+                if metrics.status_code == 200:
+                    async for line in metrics.aiter_lines():
+                        received += len(line) + 1
+                        if received > CAPACITY_MAX_METRICS_BYTES:
+                            break
+                        lines.append(line)
+            now = time.time()
+            replica.update(parse_vllm_metrics(lines), now)
+            replica.reachable = True
+            replica.last_error = "" if replica.model_loaded else "model not loaded"
+        except (httpx.HTTPError, ValueError) as e:
+            replica.reachable = False
+            replica.model_loaded = False
+            replica.last_error = str(e) or type(e).__name__
+        replica.last_scrape = time.time()
+
+    async def scrape_once(self) -> None:
+        """Scrape every replica concurrently and update the capacity view."""
+        # Scrapes run every few seconds; keep them out of traces and HTTP instrumentation
+        with logfire.suppress_instrumentation():
+            async with httpx.AsyncClient(timeout=HEALTH_PROBE_TIMEOUT) as client:
+                await asyncio.gather(*(self._scrape(client, r) for r in self.all_replicas()))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.scrape_once()
+            except Exception:
+                logger.exception("Capacity scrape failed")
+            await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+capacity_model = CapacityModel(VLLM_BACKENDS)
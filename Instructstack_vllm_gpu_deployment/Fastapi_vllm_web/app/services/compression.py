@@ -0,0 +1,217 @@
+"""
+Response Compression
+
+ASGI middleware that compresses gateway responses with brotli or gzip, whichever
+the client accepts:
+
+- Complete responses (JSON, HTML, CSS, JavaScript) are compressed when the body
+  is at least COMPRESSION_MIN_SIZE bytes; smaller bodies cost more CPU than they
+  save. Brotli is preferred; without the `brotli` package (it is listed in
+  requirements.txt) responses fall back to gzip.
+- Streamed responses (server-sent events, batch result downloads) are compressed
+  chunk by chunk with a sync flush after every chunk, so each event reaches the
+  client as soon as it is sent instead of waiting in the compressor's buffer.
+  They prefer gzip: flushing brotli after every small event compresses far worse.
+
+Raw and sent bytes per encoding are counted in the `http.response.bytes` metric;
+`benchmarks/compression_bench.py` measures size and CPU per setting.
+
+Configuration (environment variables):
+    COMPRESSION_ENABLED        Compress responses at all (default: true)
+    COMPRESSION_MIN_SIZE       Smallest complete body to compress, in bytes (default: 1024)
+    COMPRESSION_GZIP_LEVEL     gzip level 1-9 (default: 6)
+    COMPRESSION_BROTLI_QUALITY brotli quality 0-11 (default: 4)
+    COMPRESSION_BROTLI         Offer brotli when the package is installed (default: true)
+    COMPRESSION_STREAMING      Compress streamed responses, including SSE (default: true)
+"""
+
+import logging
+import os
+import zlib
+from typing import List, Optional
+
+import logfire
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_BROTLI = os.getenv("COMPRESSION_BROTLI", "true").lower() == "true"
+COMPRESSION_STREAMING = os.getenv("COMPRESSION_STREAMING", "true").lower() == "true"
+
+# Content types worth compressing; images, archives and already-encoded bodies are not
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript",
+                      "application/xml", "image/svg+xml")
+
+try:
+    # In requirements.txt; guarded so an install without it still serves gzip
+    import brotli
+except ImportError:
+    brotli = None
+
+response_bytes = logfire.metric_counter("http.response.bytes", unit="By",
+                                        description="Response body bytes before and after compression, by encoding")
+
+
+class GzipEncoder:
+    """Incremental gzip stream; `compress(flush=True)` ends a chunk on a byte boundary."""
+
+    name = "gzip"
+
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    """Incremental brotli stream with the same interface as GzipEncoder."""
+
+    name = "br"
+
+    def __init__(self, quality: int = COMPRESSION_BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._compressor.process(data)
+        return out + self._compressor.flush() if flush else out
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+def available_encodings() -> List[str]:
+    """Encodings the gateway can produce, in order of preference."""
+    if brotli is not None and COMPRESSION_BROTLI:
+        return ["br", "gzip"]
+    return ["gzip"]
+
+
+def make_encoder(encoding: str, level: Optional[int] = None):
+    """Encoder for "br" or "gzip", at the configured level unless one is given."""
+    if encoding == "br":
+        return BrotliEncoder() if level is None else BrotliEncoder(level)
+    return GzipEncoder() if level is None else GzipEncoder(level)
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """Encodings the client accepts, in the gateway's order of preference (q=0 excludes one)."""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(name.strip())
+    return [encoding for encoding in available_encodings() if encoding in accepted or "*" in accepted]
+
+
+class CompressionMiddleware:
+    """Compresses complete and streamed HTTP responses (see the module docstring)."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+        if brotli is None and COMPRESSION_BROTLI:
+            logger.info("brotli is not installed; compressing responses with gzip only")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encodings = accepted_encodings(accept) if accept else []
+        if not encodings:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(send, encodings, self.minimum_size))
+
+
+class _CompressingSender:
+    """Wraps `send` for one response, deciding on compression when the first body chunk arrives."""
+
+    def __init__(self, send, encodings: List[str], minimum_size: int):
+        self.send = send
+        self.encodings = encodings
+        self.encoding = encodings[0]
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.encoder = None
+        self.passthrough = False
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def _compressible(self) -> bool:
+        headers = dict(self.start_message.get("headers", []))
+        if b"content-encoding" in headers:
+            return False
+        content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _set_headers(self, content_length: Optional[int]) -> None:
+        headers = [(k, v) for k, v in self.start_message.get("headers", [])
+                   if k not in (b"content-length", b"vary")]
+        vary = [v for k, v in self.start_message.get("headers", []) if k == b"vary"]
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        self.start_message["headers"] = headers
+
+    def _record(self) -> None:
+        response_bytes.add(self.raw_bytes, {"encoding": self.encoding, "stage": "raw"})
+        response_bytes.add(self.sent_bytes, {"encoding": self.encoding, "stage": "sent"})
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            # First body chunk: decide how to send the whole response
+            streaming = more_body
+            if (not self._compressible()
+                    or (streaming and not COMPRESSION_STREAMING)
+                    or (not streaming and len(body) < self.minimum_size)):
+                self.passthrough = True
+                await self.send(self.start_message)
+                self.start_message = None
+                await self.send(message)
+                return
+            if streaming and "gzip" in self.encodings:
+                self.encoding = "gzip"
+            self.encoder = make_encoder(self.encoding)
+            if not streaming:
+                compressed = self.encoder.finish(body)
+                self.raw_bytes, self.sent_bytes = len(body), len(compressed)
+                self._set_headers(len(compressed))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": compressed})
+                self._record()
+                return
+            self._set_headers(None)
+            await self.send(self.start_message)
+            self.start_message = None
+
+        # Streamed chunk: flush so the client can decode it right away (SSE events, NDJSON lines)
+        self.raw_bytes += len(body)
+        out = self.encoder.compress(body, flush=True) if more_body else self.encoder.finish(body)
+        self.sent_bytes += len(out)
+        await self.send({"type": "http.response.body", "body": out, "more_body": more_body})
+        if not more_body:
+            self._record()
@@ -0,0 +1,149 @@
+"""
+Generation Profiles
+
+Per-model generation defaults, so requests that don't set them (e.g. `/generate`)
+don't decode past the answer:
+
+    stop          Stop sequences added when the request sets none
+    max_tokens    Token budget by prompt type ("sql" for the Text2SQL template, "text" otherwise),
+                  used when the request sets none
+    early_stop    Stream "sql" completions and end the upstream request as soon as a
+                  complete SQL statement has been generated
+
+Early stop catches what stop sequences can't: a model that finishes the statement
+without a ";" and carries on with an explanation, another "### Question:", or a
+code fence. Closing the stream makes vLLM abort the sequence, freeing its decode
+slot and KV cache for other requests. The tokens left in the request's max_tokens
+budget are counted as saved (an upper bound: the model might have hit EOS sooner).
+
+Configuration (environment variables):
+    GENERATION_EARLY_STOP   Stream and cut SQL completions for profiles that enable it (default: true)
+    GENERATION_PROFILES     JSON map of model -> profile fields, merged over the built-in profiles, e.g.
+                            '{"premai-io/prem-1B-SQL": {"stop": [";"], "max_tokens": {"sql": 96}}}'
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional
+
+import logfire
+
+GENERATION_EARLY_STOP = os.getenv("GENERATION_EARLY_STOP", "true").lower() == "true"
+
+tokens_saved = logfire.metric_counter("llm.tokens.saved", unit="tokens",
+                                      description="Decode tokens not spent because a completion was stopped early")
+
+SQL_MARKER = "### SQL:"
+
+
+@dataclass
+class GenerationProfile:
+    stop: List[str] = field(default_factory=list)
+    max_tokens: Dict[str, int] = field(default_factory=lambda: {"sql": 128, "text": 256})
+    early_stop: bool = False
+
+
+TEXT2SQL_PROFILE = GenerationProfile(stop=[";", "\n\n###"], max_tokens={"sql": 128, "text": 256}, early_stop=True)
+DEFAULT_PROFILE = GenerationProfile()
+
+PROFILES: Dict[str, GenerationProfile] = {
+    "yasserrmd/Text2SQL-1.5B": TEXT2SQL_PROFILE,
+    "premai-io/prem-1B-SQL": TEXT2SQL_PROFILE,
+}
+for _model, _overrides in json.loads(os.getenv("GENERATION_PROFILES", "") or "{}").items():
+    PROFILES[_model] = replace(PROFILES.get(_model, DEFAULT_PROFILE), **_overrides)
+
+
+def get_profile(model: str) -> GenerationProfile:
+    return PROFILES.get(model, DEFAULT_PROFILE)
+
+
+def prompt_type(prompt) -> str:
+    """"sql" for Text2SQL template prompts (ending in "### SQL:"), "text" otherwise."""
+    first = prompt[0] if isinstance(prompt, list) and prompt else prompt
+    return "sql" if isinstance(first, str) and first.rstrip().endswith(SQL_MARKER) else "text"
+
+
+def apply_profile(payload: dict, model: str) -> bool:
+    """
+    Fill in the model's default stop sequences and max_tokens where the request left them unset.
+
+    Args:
+        payload: Completion request, updated in place
+        model: Gateway model name
+
+    Returns:
+        bool: Whether the completion should be streamed with SQL early stop
+    """
+    profile = get_profile(model)
+    kind = prompt_type(payload.get("prompt"))
+    if not payload.get("stop") and profile.stop:
+        payload["stop"] = list(profile.stop)
+    if not payload.get("max_tokens"):
+        payload["max_tokens"] = profile.max_tokens.get(kind, DEFAULT_PROFILE.max_tokens[kind])
+    return (GENERATION_EARLY_STOP and profile.early_stop and kind == "sql"
+            and isinstance(payload.get("prompt"), str))
+
+
+_SQL_START = re.compile(r"\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+_SQL_LINE = re.compile(
+    r"\s*(\(|\)|,|SELECT|FROM|WHERE|AND|OR|NOT|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|OUTER|ON|GROUP|ORDER|"
+    r"HAVING|LIMIT|OFFSET|UNION|INTERSECT|EXCEPT|CASE|WHEN|THEN|ELSE|END|AS|WITH|VALUES|SET|INTO)\b",
+    re.IGNORECASE,
+)
+_FIRST_WORD = re.compile(r"\s*\S+\s")
+_TRAILER = re.compile(r"\s*(###|```|Explanation|Question|Note|Answer|Output)", re.IGNORECASE)
+
+
+class SqlStatementEnd:
+    """
+    Incremental detector for the end of the first SQL statement in a streamed completion.
+
+    The statement ends at a ";" outside string literals, or before the first line
+    that is clearly not SQL: a trailer ("###", a code fence, "Explanation", ...)
+    or a non-SQL line after a blank line. Completions that don't start with a SQL
+    keyword are never cut.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._quote: Optional[str] = None
+
+    def feed(self, chunk: str) -> Optional[int]:
+        """
+        Add streamed text.
+
+        Returns:
+            Optional[int]: Length of the text that makes up the complete statement, or None
+        """
+        self.text += chunk
+        if not _SQL_START.match(self.text):
+            return None
+        while self._pos < len(self.text):
+            char = self.text[self._pos]
+            self._pos += 1
+            if self._quote:
+                if char == self._quote:
+                    self._quote = None
+            elif char in "'\"":
+                self._quote = char
+            elif char == ";":
+                return self._pos
+        if self._quote:
+            return None
+
+        # The last, partial line is judged once its first word is complete
+        lines = self.text.split("\n")
+        if not (_FIRST_WORD.match(lines[-1]) or _TRAILER.match(lines[-1])):
+            lines.pop()
+        if len(lines) < 2:
+            return None
+        offset = len(lines[0]) + 1
+        for previous, line in zip(lines, lines[1:]):
+            if _TRAILER.match(line) or (not previous.strip() and line.strip() and not _SQL_LINE.match(line)):
+                return len(self.text[:offset].rstrip())
+            offset += len(line) + 1
+        return None
@@ -0,0 +1,39 @@
+"""
+Backend Health
+
+Readiness and status views over the capacity model (see services/capacity.py),
+which scrapes every vLLM replica in the background, so the liveness/readiness/status
+endpoints never do upstream work when they are called.
+
+A replica is ready when its model is loaded, its recent error rate is at most
+READY_MAX_ERROR_RATE and it is not saturated (vLLM queue below READY_MAX_QUEUE_DEPTH
+and KV-cache usage below CAPACITY_MAX_KV_USAGE). The gateway is ready while at
+least one replica is ready.
+"""
+
+from typing import Dict
+
+from services.capacity import capacity_model
+
+
+def is_ready() -> bool:
+    return any(replica.ready for replica in capacity_model.all_replicas())
+
+
+def status() -> Dict:
+    """
+    Cached per-replica load and health, grouped by model.
+
+    Returns:
+        Dict: Overall readiness plus, for each model, its replicas' capacity view
+    """
+    return {
+        "ready": is_ready(),
+        "models": {
+            model: {
+                "ready": any(replica.ready for replica in replicas),
+                "replicas": [replica.to_dict() for replica in replicas],
+            }
+            for model, replicas in capacity_model.replicas.items()
+        },
+    }
@@ -0,0 +1,227 @@
+"""
+Idempotency Keys
+
+Clients that give up on a slow generation (their own timeout, or the gateway's
+VLLM_REQUEST_TIMEOUT towards vLLM) usually retry. The first generation is still
+running in vLLM, so every retry adds a sequence exactly when the replicas are
+already overloaded. With an `Idempotency-Key` header, a retry is answered from
+the original generation instead:
+
+    in flight    the retry waits for the running generation and gets its result
+    completed    the stored result is returned right away (until IDEMPOTENCY_TTL)
+    new key      the request runs normally and its result is stored under the key
+
+Generations keep running when the client that started them disconnects, so the
+result is there for the retry. Replayed responses carry `Idempotent-Replayed: true`.
+A key reused with a different request body is rejected with 422, and keys are
+scoped per API key (`Authorization: Bearer` or `X-API-Key`) and per endpoint.
+
+Errors are not stored: a retry of a failed or rejected request (e.g. every
+replica busy) runs again. Concurrent duplicates of a request that fails get the
+same error.
+
+The store is in memory and per gateway process: least recently used keys are
+evicted beyond IDEMPOTENCY_MAX_ENTRIES. Counts of absorbed duplicates are on
+/status under "idempotency" and in the `idempotency.requests` metric.
+
+Configuration (environment variables):
+    IDEMPOTENCY_ENABLED        Honour Idempotency-Key headers (default: true)
+    IDEMPOTENCY_TTL            Seconds a completed result is kept (default: 600)
+    IDEMPOTENCY_MAX_ENTRIES    Keys kept, least recently used evicted (default: 10000)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import logfire
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Outcomes of a request carrying a key
+NEW = "new"
+ATTACHED = "attached"  # Waited for the in-flight original
+REPLAYED = "replayed"  # Served from a completed original
+CONFLICT = "conflict"  # Same key, different request body
+
+idempotency_requests = logfire.metric_counter("idempotency.requests", unit="1",
+                                              description="Requests with an Idempotency-Key, by outcome")
+
+
+class IdempotencyConflict(ValueError):
+    """The key was already used for a different request."""
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    task: asyncio.Task
+    created: float
+    completed: Optional[float] = None
+    duplicates: int = 0
+
+
+def fingerprint(payload: Dict) -> str:
+    """Hash of a request body; a key may only be reused for the same body."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def request_key(request: Request) -> Optional[Tuple[str, str, str]]:
+    """
+    Store key for a request: (caller, endpoint, Idempotency-Key), or None without the header.
+
+    Raises:
+        HTTPException: 400 for an empty or overlong key
+    """
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+    api_key = request.headers.get("x-api-key") or request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    caller = hashlib.sha256(api_key.encode()).hexdigest()[:16] if api_key else ""
+    return caller, request.url.path, key
+
+
+class IdempotencyStore:
+    """In-flight and completed results by idempotency key, bounded by count and TTL."""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, str], _Entry]" = OrderedDict()
+        self.counts = {NEW: 0, ATTACHED: 0, REPLAYED: 0, CONFLICT: 0}
+        self.evicted = 0
+
+    async def run(self, key: Tuple[str, str, str], payload_fingerprint: str,
+                  produce: Callable[[], Awaitable[str]], keep: Callable[[str], bool]) -> Tuple[str, bool]:
+        """
+        Result of `produce()` for the key: the in-flight or stored one if there is one, else a new run.
+
+        Args:
+            key: From `request_key`
+            payload_fingerprint: From `fingerprint`; must match the original request's
+            produce: Runs the request; called at most once per key while its result is kept
+            keep: Whether a result may be stored and replayed (False for errors)
+
+        Returns:
+            Tuple[str, bool]: The result, and whether it came from an earlier request
+
+        Raises:
+            IdempotencyConflict: The key belongs to a request with a different body
+        """
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry, time.monotonic()):
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            if entry.fingerprint != payload_fingerprint:
+                self._count(CONFLICT)
+                raise IdempotencyConflict(f"{HEADER} was already used for a different request")
+            self._entries.move_to_end(key)
+            entry.duplicates += 1
+            self._count(REPLAYED if entry.task.done() else ATTACHED)
+            logger.info("Duplicate request absorbed", extra={
+                "route": key[1], "in_flight": not entry.task.done(), "duplicates": entry.duplicates})
+            # Shielded: a retry that disconnects too must not cancel the original
+            return await asyncio.shield(entry.task), True
+
+        self._count(NEW)
+        # A task, so the generation finishes and is stored even if this client disconnects
+        task = asyncio.create_task(produce())
+        entry = _Entry(fingerprint=payload_fingerprint, task=task, created=time.monotonic())
+        self._entries[key] = entry
+        task.add_done_callback(lambda t: self._settle(key, entry, keep))
+        self._evict()
+        return await asyncio.shield(task), False
+
+    def _settle(self, key: Tuple[str, str, str], entry: _Entry, keep: Callable[[str], bool]) -> None:
+        """Keep a successful result for replays; forget failed ones so a retry runs again."""
+        entry.completed = time.monotonic()
+        task = entry.task
+        if task.cancelled() or task.exception() is not None or not keep(task.result()):
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return entry.completed is not None and now - entry.completed > self.ttl
+
+    def _expire(self) -> None:
+        # Lookups drop an expired key they hit and eviction bounds the rest; this full sweep is for /status
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+        for key in expired:
+            del self._entries[key]
+
+    def _evict(self) -> None:
+        # In-flight entries are evicted too when the store is full; their waiters hold the task
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def _count(self, outcome: str) -> None:
+        self.counts[outcome] += 1
+        idempotency_requests.add(1, {"outcome": outcome})
+
+    def stats(self) -> Dict:
+        self._expire()
+        in_flight = sum(1 for entry in self._entries.values() if not entry.task.done())
+        return {
+            "entries": len(self._entries),
+            "in_flight": in_flight,
+            "requests": dict(self.counts),
+            "duplicates_absorbed": self.counts[ATTACHED] + self.counts[REPLAYED],
+            "evicted": self.evicted,
+            "ttl_s": self.ttl,
+            "max_entries": self.max_entries,
+        }
+
+
+def replay_headers(replayed: bool) -> Optional[Dict[str, str]]:
+    """Response headers marking a result that came from an earlier request."""
+    return {REPLAYED_HEADER: "true"} if replayed else None
+
+
+async def run_idempotent(request: Request, payload: Dict,
+                         produce: Callable[[], Awaitable[str]], keep: Callable[[str], bool]) -> Tuple[str, bool]:
+    """
+    Run `produce()` once per Idempotency-Key; without the header (or when disabled) just run it.
+
+    Returns:
+        Tuple[str, bool]: The result, and whether it was replayed from an earlier request
+
+    Raises:
+        HTTPException: 400 for an invalid key, 422 for a key reused with a different body
+    """
+    key = request_key(request) if idempotency_store is not None else None
+    if key is None:
+        return await produce(), False
+    try:
+        return await idempotency_store.run(key, fingerprint(payload), produce, keep)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def build_idempotency_store() -> Optional[IdempotencyStore]:
+    if not IDEMPOTENCY_ENABLED:
+        return None
+    return IdempotencyStore()
+
+
+idempotency_store = build_idempotency_store()
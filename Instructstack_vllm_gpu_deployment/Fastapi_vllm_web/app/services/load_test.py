@@ -0,0 +1,376 @@
+"""
+Load Tests
+
+In-process load generator for the vLLM replicas behind the gateway. Each run gets
+an id, its own results and a summary (latency and time-to-first-token
+percentiles, throughput), and streams its progress while it runs.
+
+Two modes:
+    closed loop (rps = 0)   `concurrency` simulated users, each sending requests back to back,
+                            `requests_per_user` each or until `duration_s` has passed
+    open loop (rps > 0)     requests start at a fixed rate, at most `concurrency` in flight;
+                            arrivals wait for a free slot, so saturation shows up as a lower rate
+
+Load tests must not disturb the serving path: they use their own async HTTP client
+(never the request thread pool or the shared connection pool), at most
+LOAD_TEST_MAX_CONCURRENCY requests in flight, and LOAD_TEST_MAX_RUNNING runs at a
+time. Their requests go through the capacity model like any other, so they count
+as in-flight load when routing user traffic. They run in the batch traffic class
+(see services/traffic_classes.py): with traffic control on they wait for a batch
+slot, which counts towards their latency, and requests preempted by interactive
+traffic are retried.
+
+Configuration (environment variables):
+    LOAD_TEST_MAX_CONCURRENCY   Upper bound for a run's concurrency (default: 32)
+    LOAD_TEST_MAX_DURATION      Longest run in seconds (default: 600)
+    LOAD_TEST_MAX_RUNNING       Runs at the same time; others are rejected (default: 1)
+    LOAD_TEST_KEEP_RUNS         Finished runs kept for viewing (default: 20)
+    LOAD_TEST_SAMPLES           Recent responses kept per run for display (default: 50)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+import logfire
+
+from services.capacity import capacity_model, is_replica_failure
+from services.lora_adapters import lora_adapters
+from services.generation_profiles import apply_profile
+from services.schema_registry import render_prompt
+from services.stats import percentile
+from services.tracing import trace_headers
+from services.traffic_classes import BATCH, traffic_slot
+
+logger = logging.getLogger(__name__)
+
+LOAD_TEST_MAX_CONCURRENCY = int(os.getenv("LOAD_TEST_MAX_CONCURRENCY", "32"))
+LOAD_TEST_MAX_DURATION = float(os.getenv("LOAD_TEST_MAX_DURATION", "600"))
+LOAD_TEST_MAX_RUNNING = int(os.getenv("LOAD_TEST_MAX_RUNNING", "1"))
+LOAD_TEST_KEEP_RUNS = int(os.getenv("LOAD_TEST_KEEP_RUNS", "20"))
+LOAD_TEST_SAMPLES = int(os.getenv("LOAD_TEST_SAMPLES", "50"))
+
+load_test_requests = logfire.metric_counter("load_test.requests", unit="1",
+                                            description="Load test requests sent, by outcome")
+
+# Default prompt pool: Text2SQL questions against a small employees table
+EMPLOYEES_SCHEMA = "Table: employees\nColumns: id, name, department_id, salary, hire_date"
+DEFAULT_PROMPTS = [
+    render_prompt(EMPLOYEES_SCHEMA, question) for question in (
+        "List all employees hired after 2020.",
+        "Find employees in department 5 earning more than 100000.",
+        "Show employee names and salaries ordered by salary descending.",
+        "Count the number of employees in each department.",
+        "What is the average salary of employees hired after 2015?",
+    )
+]
+
+# Run states
+RUNNING, COMPLETED, CANCELLED, FAILED = "running", "completed", "cancelled", "failed"
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+
+@dataclass
+class LoadTestConfig:
+    model: str
+    prompts: List[str]
+    concurrency: int = 10
+    requests_per_user: int = 5      # closed loop without a duration
+    duration_s: float = 0.0         # 0 = until every user sent requests_per_user requests
+    rps: float = 0.0                # 0 = closed loop
+    max_tokens: int = 128
+    temperature: float = 0.3
+    stop: List[str] = field(default_factory=lambda: [";"])
+
+    def validate(self) -> None:
+        """
+        Raises:
+            ValueError: If the configuration is out of bounds
+        """
+        if not self.prompts:
+            raise ValueError("At least one prompt is required")
+        if not 1 <= self.concurrency <= LOAD_TEST_MAX_CONCURRENCY:
+            raise ValueError(f"concurrency must be between 1 and {LOAD_TEST_MAX_CONCURRENCY}")
+        if not 0 <= self.duration_s <= LOAD_TEST_MAX_DURATION:
+            raise ValueError(f"duration_s must be between 0 and {LOAD_TEST_MAX_DURATION:g}")
+        if self.rps < 0 or self.requests_per_user < 1:
+            raise ValueError("rps must be >= 0 and requests_per_user >= 1")
+
+    @property
+    def total_requests(self) -> Optional[int]:
+        return None if self.duration_s else self.concurrency * self.requests_per_user
+
+
+@dataclass
+class LoadTestRun:
+    """One load test run and its results, isolated from every other run."""
+    id: str
+    config: LoadTestConfig
+    state: str = RUNNING
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    in_flight: int = 0
+    errors: int = 0
+    output_tokens: int = 0
+    latencies_ms: List[float] = field(default_factory=list)
+    ttft_ms: List[float] = field(default_factory=list)
+    samples: Deque[str] = field(default_factory=lambda: deque(maxlen=LOAD_TEST_SAMPLES))
+    error: str = ""
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def completed(self) -> int:
+        return len(self.latencies_ms)
+
+    @property
+    def elapsed_s(self) -> float:
+        return (self.finished_at or time.time()) - self.created_at
+
+    def record(self, latency_ms: float, ttft_ms: Optional[float], tokens: int, sample: str) -> None:
+        self.latencies_ms.append(latency_ms)
+        if ttft_ms is not None:
+            self.ttft_ms.append(ttft_ms)
+        self.output_tokens += tokens
+        self.samples.append(sample)
+
+    def record_error(self, sample: str) -> None:
+        self.errors += 1
+        self.samples.append(sample)
+
+    def progress(self) -> Dict[str, Any]:
+        total = self.config.total_requests
+        done = self.completed + self.errors
+        if total:
+            percent = 100 * done / total
+        else:
+            percent = 100 * min(1.0, self.elapsed_s / self.config.duration_s)
+        return {
+            "id": self.id,
+            "state": self.state,
+            "completed": self.completed,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "total": total,
+            "percent": round(percent if self.state == RUNNING else 100.0, 1),
+            "elapsed_s": round(self.elapsed_s, 2),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = max(self.elapsed_s, 1e-9)
+        done = self.completed + self.errors
+        return {
+            "requests": done,
+            "error_rate": round(self.errors / done, 4) if done else 0.0,
+            "throughput_rps": round(self.completed / elapsed, 2),
+            "output_tokens_per_sec": round(self.output_tokens / elapsed, 1),
+            "latency_ms": {
+                **{f"p{p}": _ms(percentile(self.latencies_ms, p)) for p in (50, 90, 95, 99)},
+                "mean": round(sum(self.latencies_ms) / len(self.latencies_ms), 2) if self.latencies_ms else None,
+                "max": round(max(self.latencies_ms), 2) if self.latencies_ms else None,
+            },
+            "ttft_ms": {f"p{p}": _ms(percentile(self.ttft_ms, p)) for p in (50, 95, 99)},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        cfg = self.config
+        return {
+            **self.progress(),
+            "config": {"model": cfg.model, "concurrency": cfg.concurrency, "requests_per_user": cfg.requests_per_user,
+                       "duration_s": cfg.duration_s, "rps": cfg.rps, "max_tokens": cfg.max_tokens,
+                       "temperature": cfg.temperature, "prompts": len(cfg.prompts)},
+            "summary": self.summary(),
+            "samples": list(self.samples),
+            "error": self.error,
+        }
+
+
+class LoadTestManager:
+    """Starts, tracks and cancels load test runs."""
+
+    def __init__(self):
+        self.runs: "OrderedDict[str, LoadTestRun]" = OrderedDict()
+
+    def running(self) -> List[LoadTestRun]:
+        return [run for run in self.runs.values() if run.state == RUNNING]
+
+    def start(self, config: LoadTestConfig) -> LoadTestRun:
+        """
+        Validate a configuration and start a run in the background.
+
+        Raises:
+            ValueError: If the configuration is invalid
+            RuntimeError: If LOAD_TEST_MAX_RUNNING runs are already running
+        """
+        config.validate()
+        if config.model not in capacity_model.replicas and (lora_adapters is None
+                                                            or lora_adapters.resolve(config.model) is None):
+            raise ValueError(f"Unknown model: {config.model}")
+        if len(self.running()) >= LOAD_TEST_MAX_RUNNING:
+            raise RuntimeError("A load test is already running; wait for it or cancel it")
+        run = LoadTestRun(id=uuid.uuid4().hex[:12], config=config)
+        self.runs[run.id] = run
+        finished = [r for r in self.runs.values() if r.state != RUNNING]
+        for old in finished[:max(0, len(finished) - LOAD_TEST_KEEP_RUNS)]:
+            del self.runs[old.id]
+        run.task = asyncio.create_task(self._run(run))
+        return run
+
+    def cancel(self, run: LoadTestRun) -> None:
+        if run.state == RUNNING and run.task is not None:
+            run.task.cancel()
+
+    async def stop(self) -> None:
+        tasks = [run.task for run in self.running() if run.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, run: LoadTestRun) -> None:
+        cfg = run.config
+        with logfire.span("load_test.run {run_id}", run_id=run.id, model=cfg.model,
+                          concurrency=cfg.concurrency, rps=cfg.rps):
+            # A dedicated client, sized to the run, keeps load tests off the serving path's connection pool
+            limits = httpx.Limits(max_connections=cfg.concurrency, max_keepalive_connections=cfg.concurrency)
+            try:
+                async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(60.0, connect=5.0)) as client:
+                    deadline = time.perf_counter() + cfg.duration_s if cfg.duration_s else None
+                    if cfg.rps > 0:
+                        await self._open_loop(run, client, deadline)
+                    else:
+                        await asyncio.gather(*(self._user(run, client, user, deadline)
+                                               for user in range(1, cfg.concurrency + 1)))
+                run.state = COMPLETED
+            except asyncio.CancelledError:
+                run.state = CANCELLED
+            except Exception as e:
+                run.state = FAILED
+                run.error = str(e)
+                logger.exception("Load test failed", extra={"run_id": run.id})
+            finally:
+                run.finished_at = time.time()
+                logger.info("Load test finished", extra={"run_id": run.id, "state": run.state,
+                                                         "completed": run.completed, "errors": run.errors})
+
+    async def _user(self, run: LoadTestRun, client: httpx.AsyncClient, user: int,
+                    deadline: Optional[float]) -> None:
+        """Closed loop: one simulated user sending requests back to back."""
+        cfg = run.config
+        i = 0
+        while (deadline is None and i < cfg.requests_per_user) or (deadline and time.perf_counter() < deadline):
+            await self._request(run, client, f"[User {user}][Req {i + 1}]", cfg.prompts[(user + i) % len(cfg.prompts)])
+            i += 1
+
+    async def _open_loop(self, run: LoadTestRun, client: httpx.AsyncClient, deadline: Optional[float]) -> None:
+        """Open loop: start requests at `rps`, with at most `concurrency` in flight."""
+        cfg = run.config
+        slots = asyncio.Semaphore(cfg.concurrency)
+        tasks = set()
+        next_at = time.perf_counter()
+        i = 0
+        try:
+            while (deadline is None and i < cfg.total_requests) or (deadline and time.perf_counter() < deadline):
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                await slots.acquire()
+                task = asyncio.create_task(self._request(run, client, f"[Req {i + 1}]",
+                                                         cfg.prompts[i % len(cfg.prompts)]))
+                task.add_done_callback(lambda _: slots.release())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                next_at += 1 / cfg.rps
+                i += 1
+            await asyncio.gather(*tasks)
+        finally:
+            # Cancelled (or stopped at shutdown): end the requests already started before _run closes
+            # the client, so they neither record errors on the cancelled run nor count against replicas
+            pending = list(tasks)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _request(self, run: LoadTestRun, client: httpx.AsyncClient, label: str, prompt: str) -> None:
+        """Send one streamed completion and record its latency, time to first token and token count."""
+        cfg = run.config
+        adapter = lora_adapters.resolve(cfg.model) if lora_adapters is not None else None
+        payload = {
+            "model": adapter.name if adapter is not None else f"/models/{cfg.model}",
+            "prompt": prompt,
+            "max_tokens": cfg.max_tokens,
+            "temperature": cfg.temperature,
+            "stop": list(cfg.stop),
+        }
+        base_model = adapter.base if adapter is not None else cfg.model
+        apply_profile(payload, base_model)
+        payload["stream"] = True
+        # vLLM may put several tokens in one chunk; the last chunk then carries the exact count
+        payload["stream_options"] = {"include_usage": True}
+
+        start = time.perf_counter()
+        replica = None
+        run.in_flight += 1
+        try:
+            while True:
+                async with traffic_slot(base_model, BATCH) as lease:
+                    if adapter is not None:
+                        replica = lora_adapters.select_replica(adapter)
+                    else:
+                        replica = capacity_model.select_replica(cfg.model)
+                    if replica is not None:
+                        ttft_ms = None
+                        parts = []
+                        usage = None
+                        in_use = await lora_adapters.acquire(replica, adapter) if adapter is not None else nullcontext()
+                        with replica.track_inflight(), in_use:
+                            async with client.stream("POST", f"{replica.base_url}/v1/completions", json=payload,
+                                                     headers=trace_headers()) as resp:
+                                resp.raise_for_status()
+                                async for line in resp.aiter_lines():
+                                    if not line.startswith("data: "):
+                                        continue
+                                    data = line[len("data: "):]
+                                    if data == "[DONE]":
+                                        break
+                                    chunk = json.loads(data)
+                                    usage = chunk.get("usage") or usage
+                                    if not chunk.get("choices"):
+                                        continue  # The usage chunk
+                                    if ttft_ms is None:
+                                        ttft_ms = (time.perf_counter() - start) * 1000
+                                    parts.append(chunk["choices"][0]["text"])
+                if lease is None or not lease.preempted:
+                    break
+                load_test_requests.add(1, {"outcome": "preempted"})
+        except (httpx.HTTPError, ValueError, KeyError, RuntimeError) as e:
+            if replica is not None and is_replica_failure(e):
+                replica.record_result(False)
+            load_test_requests.add(1, {"outcome": "error"})
+            run.record_error(f"{label} ERROR: {e}")
+            return
+        finally:
+            run.in_flight -= 1
+
+        if replica is None:
+            load_test_requests.add(1, {"outcome": "rejected"})
+            run.record_error(f"{label} ERROR: all replicas of {cfg.model} are at capacity or unavailable")
+            return
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        replica.record_result(True, latency_ms)
+        load_test_requests.add(1, {"outcome": "ok"})
+        text = "".join(parts).strip()
+        # Servers that ignore include_usage: count chunks, a lower bound on the tokens
+        tokens = usage["completion_tokens"] if usage else len(parts)
+        run.record(latency_ms, ttft_ms, tokens, f"{label} {latency_ms / 1000:.2f}s → {text}")
+
+
+load_test_manager = LoadTestManager()
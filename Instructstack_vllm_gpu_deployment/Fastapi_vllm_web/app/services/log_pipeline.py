@@ -0,0 +1,162 @@
+"""
+Logging Pipeline
+
+Keeps logging off the request hot path. Records are handed to a bounded queue and
+written to stdout by a background listener thread, so request handlers never block
+on I/O. Per-request logs are sampled, carry structured fields instead of formatted
+strings, and only ever include a truncated preview and hash of large prompts.
+
+Configuration (environment variables):
+    LOG_LEVEL              Root log level (default: INFO)
+    LOG_FORMAT             "json" or "text" (default: json)
+    LOG_SAMPLE_RATE        Fraction of requests whose per-request logs are kept (default: 1.0)
+    LOG_PROMPT_MAX_CHARS   Prompt preview length in logs (default: 200)
+    LOG_QUEUE_SIZE         Max records buffered before new ones are dropped (default: 10000)
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_PROMPT_MAX_CHARS = int(os.getenv("LOG_PROMPT_MAX_CHARS", "200"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is a structured field
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Render a record and its structured `extra` fields as one JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable format that appends structured fields as key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = [f"{k}={v}" for k, v in record.__dict__.items()
+                  if k not in _RESERVED_ATTRS and not k.startswith("_")]
+        return f"{line} {' '.join(fields)}" if fields else line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks the caller.
+
+    Unlike the stdlib handler it does not format the record in the calling thread;
+    formatting happens in the listener thread. When the queue is full the record
+    is dropped and counted instead of waiting for space.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging() -> None:
+    """Install the queue-based pipeline on the root logger (idempotent)."""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    queue_handler = _queue_handler = NonBlockingQueueHandler(log_queue)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    # Uvicorn's access/error loggers write to stdout synchronously; route them through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        if uvicorn_logger.handlers:
+            uvicorn_logger.handlers = [queue_handler]
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records() -> int:
+    """Number of log records dropped because the queue was full."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def should_sample() -> bool:
+    """Decide once per request whether its per-request logs are emitted."""
+    return LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+
+
+def prompt_fields(prompt: Any) -> Dict[str, Any]:
+    """
+    Structured, size-bounded description of a prompt for logging.
+
+    Args:
+        prompt: The prompt text (or list of prompts)
+
+    Returns:
+        Dict[str, Any]: Length, short SHA-256 and a truncated preview of the prompt
+    """
+    text = prompt if isinstance(prompt, str) else json.dumps(prompt, default=str)
+    return {
+        "prompt_chars": len(text),
+        "prompt_sha256": hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()[:16],
+        "prompt_preview": text[:LOG_PROMPT_MAX_CHARS],
+    }
+
+
+def elapsed_ms(start: float) -> float:
+    """Milliseconds since a `time.perf_counter()` timestamp, rounded for logging."""
+    return round((time.perf_counter() - start) * 1000, 2)
@@ -0,0 +1,239 @@
+"""
+Event Loop and Thread Pool Monitoring
+
+Makes a stalled event loop or an exhausted thread pool visible. Either one stalls
+every request on the gateway, not just the slow one:
+
+- Event-loop lag: a background task sleeps for LOOP_MONITOR_INTERVAL and records
+  how late it wakes up (`gateway.event_loop.lag_ms`). Lag means something ran on
+  the loop without yielding: a synchronous call in an `async def` route, a large
+  JSON encode, a regex over a long prompt.
+- Thread pool saturation: the loop's default executor, which runs every
+  `asyncio.to_thread` call (call_vllm, SQLite reads, LoRA loads), is replaced by
+  an instrumented one of GATEWAY_THREADPOOL_SIZE workers. It reports jobs waiting
+  for a worker (`gateway.executor.queue_depth`), busy workers
+  (`gateway.executor.active_threads`) and the time jobs wait for a worker
+  (`gateway.executor.queue_wait_ms`). The wait time is latency added before vLLM
+  sees the request at all.
+- Upstream connection pool: connections open, in use and idle, and requests
+  waiting for a connection, for the shared httpx client (services/async_client.py).
+
+With LOOP_BLOCK_DEBUG=true a watchdog thread checks the monitor's heartbeat. When
+the loop has not come back for LOOP_BLOCK_THRESHOLD_MS, it logs the event loop
+thread's current stack, which is the code that is blocking it. It works with uvloop
+too, unlike asyncio's own debug mode. The stack is logged once per stall.
+
+Current values and recent lag percentiles are on /status under "event_loop".
+
+Configuration (environment variables):
+    LOOP_MONITOR_ENABLED        Measure loop lag and executor/pool usage (default: true)
+    LOOP_MONITOR_INTERVAL       Seconds between lag measurements (default: 0.5)
+    GATEWAY_THREADPOOL_SIZE     Workers for asyncio.to_thread (default: Python's min(32, CPUs + 4))
+    LOOP_BLOCK_DEBUG            Log the stack of callbacks that block the loop (default: false)
+    LOOP_BLOCK_THRESHOLD_MS     How long the loop must be blocked before its stack is logged (default: 100)
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import logfire
+from opentelemetry.metrics import Observation
+
+from services.async_client import pool_stats
+from services.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.5"))
+GATEWAY_THREADPOOL_SIZE = int(os.getenv("GATEWAY_THREADPOOL_SIZE", str(min(32, (os.cpu_count() or 1) + 4))))
+LOOP_BLOCK_DEBUG = os.getenv("LOOP_BLOCK_DEBUG", "false").lower() == "true"
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+
+# Lag samples kept for the /status percentiles
+LAG_WINDOW = 600
+
+loop_lag_ms = logfire.metric_histogram("gateway.event_loop.lag_ms", unit="ms",
+                                       description="How late the event loop ran a timer callback")
+loop_blocked = logfire.metric_counter("gateway.event_loop.blocked", unit="1",
+                                      description="Stalls longer than LOOP_BLOCK_THRESHOLD_MS (debug mode)")
+executor_wait_ms = logfire.metric_histogram("gateway.executor.queue_wait_ms", unit="ms",
+                                            description="Time asyncio.to_thread jobs waited for a worker thread")
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that counts queued and running jobs and how long jobs wait for a worker."""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "gateway-worker"):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.max_wait_ms = 0.0  # Since startup
+        self._counts_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted = time.perf_counter()
+        with self._counts_lock:
+            self.queued += 1
+
+        def run():
+            wait_ms = (time.perf_counter() - submitted) * 1000
+            with self._counts_lock:
+                self.queued -= 1
+                self.active += 1
+                self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            executor_wait_ms.record(wait_ms)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counts_lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        try:
+            return super().submit(run)
+        except RuntimeError:
+            # Shut down: undo the count
+            with self._counts_lock:
+                self.queued -= 1
+            raise
+
+    def stats(self) -> Dict:
+        with self._counts_lock:
+            return {"max_workers": self._max_workers, "threads": len(self._threads), "active": self.active,
+                    "queued": self.queued, "completed": self.completed,
+                    "max_queue_wait_ms": round(self.max_wait_ms, 2)}
+
+
+class LoopMonitor:
+    """Background lag measurement, instrumented default executor and the blocking-callback watchdog."""
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threadpool_size: int = GATEWAY_THREADPOOL_SIZE,
+                 block_debug: bool = LOOP_BLOCK_DEBUG, block_threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS):
+        self.block_debug = block_debug
+        self.block_threshold_s = block_threshold_ms / 1000
+        # The watchdog needs heartbeats well inside the threshold
+        self.interval = min(interval, self.block_threshold_s / 2) if block_debug else interval
+        self.executor = InstrumentedThreadPoolExecutor(threadpool_size)
+        self.lags = deque(maxlen=LAG_WINDOW)
+        self.max_lag_ms = 0.0
+        self.blocked_count = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._gauges_registered = False
+
+    def start(self) -> None:
+        """Install the executor and start measuring; call from the event loop (app startup)."""
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._register_gauges()
+        self._task = asyncio.create_task(self._run())
+        if self.block_debug:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+        logger.info("Event loop monitor started", extra={
+            "interval_s": self.interval, "threadpool_size": self.executor._max_workers,
+            "block_debug": self.block_debug})
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=5)
+            self._watchdog = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, (now - expected) * 1000)
+            self.lags.append(lag)
+            self.max_lag_ms = max(self.max_lag_ms, lag)
+            loop_lag_ms.record(lag)
+
+    def _watch(self) -> None:
+        """Watchdog thread: log the loop thread's stack once per stall longer than the threshold."""
+        reported = None
+        while not self._stopping.wait(self.block_threshold_s / 4):
+            heartbeat = self._heartbeat
+            stalled_s = time.monotonic() - heartbeat - self.interval
+            if stalled_s < self.block_threshold_s or heartbeat == reported:
+                continue
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            self.blocked_count += 1
+            loop_blocked.add(1)
+            logger.warning("Event loop blocked", extra={"blocked_ms": round(stalled_s * 1000, 1), "stack": stack})
+
+    def _register_gauges(self) -> None:
+        if self._gauges_registered:
+            return
+        self._gauges_registered = True
+
+        def observe(name: str, read, description: str):
+            def callback(_options):
+                yield Observation(read())
+            logfire.metric_gauge_callback(name, [callback], description=description)
+
+        observe("gateway.executor.queue_depth", lambda: self.executor.queued,
+                "asyncio.to_thread jobs waiting for a worker thread")
+        observe("gateway.executor.active_threads", lambda: self.executor.active,
+                "Worker threads running a job")
+        observe("gateway.upstream.pool.connections", lambda: pool_stats().get("connections", 0),
+                "Open connections of the shared upstream client")
+        observe("gateway.upstream.pool.active", lambda: pool_stats().get("active", 0),
+                "Upstream connections serving a request")
+        observe("gateway.upstream.pool.queued", lambda: pool_stats().get("queued_requests", 0),
+                "Upstream requests waiting for a connection")
+
+    def status(self) -> Dict:
+        lags = sorted(self.lags)
+
+        def pct(p: float) -> Optional[float]:
+            value = percentile(lags, p)
+            return round(value, 2) if value is not None else None
+
+        status = {
+            "lag_ms": {"last": round(self.lags[-1], 2) if self.lags else None, "p50": pct(50), "p99": pct(99),
+                       "max": round(self.max_lag_ms, 2), "window_s": round(len(lags) * self.interval)},
+            "executor": self.executor.stats(),
+            "upstream_pool": pool_stats(),
+        }
+        if self.block_debug:
+            status["blocked"] = {"count": self.blocked_count, "threshold_ms": self.block_threshold_s * 1000}
+        return status
+
+
+def build_loop_monitor() -> Optional[LoopMonitor]:
+    if not LOOP_MONITOR_ENABLED:
+        return None
+    return LoopMonitor()
+
+
+loop_monitor = build_loop_monitor()
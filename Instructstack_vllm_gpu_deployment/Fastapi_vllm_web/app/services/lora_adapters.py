@@ -0,0 +1,341 @@
+"""
+LoRA Adapters
+
+Serves fine-tunes as LoRA adapters on the replicas of their base model instead of
+giving each one its own vLLM container: any number of adapters share one copy of
+the base weights in GPU memory, and a request selects a fine-tune by naming its
+adapter as the model.
+
+Adapters are discovered under LORA_DIR, one directory per adapter holding a PEFT
+`adapter_config.json` whose `base_model_name_or_path` names a gateway model (e.g.
+`yasserrmd/Text2SQL-1.5B` or `/models/yasserrmd/Text2SQL-1.5B`); the directory
+name is the adapter name. LORA_ADAPTERS adds adapters stored elsewhere.
+`POST /lora/rescan` picks up new directories without a restart.
+
+Adapters are loaded on a replica on first use through vLLM's runtime adapter API
+(`/v1/load_lora_adapter` and `/v1/unload_lora_adapter`), which needs the replica
+started with `--enable-lora` and VLLM_ALLOW_RUNTIME_LORA_UPDATING=True (off by default,
+see VLLM_EXTRA_ARGS in docker-compose.yml):
+
+- A request for an adapter goes to the least-loaded replica of the base model that
+  already has the adapter loaded; only when none of them can take it is the adapter
+  loaded on the least-loaded replica.
+- A replica keeps at most LORA_MAX_PER_REPLICA adapters loaded (match vLLM's
+  `--max-cpu-loras`). Loading one more first unloads the least recently used
+  adapter that has no request in flight. `ensure_loaded` marks the request in flight
+  in the same step that finds or loads the adapter, so a concurrent load of another
+  adapter can never pick it as the idle victim before the request is sent.
+- Which adapters a replica has loaded is taken from the capacity scrape of its
+  `/v1/models` (see services/capacity.py), so adapters loaded before a gateway
+  restart are reused and adapters lost in a replica restart are loaded again.
+
+Configuration (environment variables):
+    LORA_ENABLED            Route requests to LoRA adapters (default: true)
+    LORA_DIR                Directory of adapters, as mounted in the vLLM containers (default: /models/lora)
+    LORA_ADAPTERS           JSON map of adapter name -> {"base": gateway model, "path": adapter path on the
+                            replicas}, merged over the discovered adapters
+    LORA_MAX_PER_REPLICA    Adapters kept loaded per replica before the least recently used is unloaded
+                            (default: 4)
+    LORA_LOAD_TIMEOUT       Seconds to wait for a replica to load or unload an adapter (default: 60)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import logfire
+import requests
+
+from services.capacity import CapacityModel, ReplicaCapacity, capacity_model
+from services.tracing import trace_headers
+
+logger = logging.getLogger(__name__)
+
+LORA_ENABLED = os.getenv("LORA_ENABLED", "true").lower() == "true"
+LORA_DIR = os.getenv("LORA_DIR", "/models/lora")
+LORA_ADAPTERS = json.loads(os.getenv("LORA_ADAPTERS", "") or "{}")
+LORA_MAX_PER_REPLICA = int(os.getenv("LORA_MAX_PER_REPLICA", "4"))
+LORA_LOAD_TIMEOUT = float(os.getenv("LORA_LOAD_TIMEOUT", "60"))
+
+adapter_events = logfire.metric_counter("lora.adapter.events", unit="1",
+                                        description="LoRA adapter requests served resident, loads and unloads")
+load_latency_ms = logfire.metric_histogram("lora.adapter.load_ms", unit="ms",
+                                           description="Time for a replica to load a LoRA adapter")
+
+
+@dataclass
+class LoraAdapter:
+    """A LoRA adapter and the gateway model it applies to."""
+    name: str
+    base: str
+    path: str
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "base": self.base, "path": self.path}
+
+
+def match_base_model(base_model: str, models: Iterable[str]) -> Optional[str]:
+    """The gateway model an adapter's `base_model_name_or_path` refers to, by name or by path suffix."""
+    base_model = base_model.rstrip("/")
+    for model in models:
+        if base_model == model or base_model.endswith(f"/{model}"):
+            return model
+    return None
+
+
+def discover_adapters(directory: str, models: Iterable[str]) -> Dict[str, LoraAdapter]:
+    """
+    Find the LoRA adapters stored under `directory`.
+
+    Args:
+        directory: Directory with one subdirectory per adapter
+        models: Gateway models an adapter's base model may be
+
+    Returns:
+        Dict[str, LoraAdapter]: Adapters by name; directories without an
+        `adapter_config.json`, or whose base model the gateway doesn't serve, are skipped
+    """
+    models = list(models)
+    adapters: Dict[str, LoraAdapter] = {}
+    if not os.path.isdir(directory):
+        return adapters
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        config_path = os.path.join(path, "adapter_config.json")
+        if not os.path.isfile(config_path):
+            continue
+        try:
+            with open(config_path, encoding="utf-8") as f:
+                base_model = json.load(f).get("base_model_name_or_path") or ""
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping LoRA adapter: unreadable adapter_config.json",
+                           extra={"adapter": name, "error": str(e)})
+            continue
+        base = match_base_model(base_model, models)
+        if base is None:
+            logger.warning("Skipping LoRA adapter: its base model is not served by the gateway",
+                           extra={"adapter": name, "base_model": base_model})
+            continue
+        adapters[name] = LoraAdapter(name, base, path)
+    return adapters
+
+
+class AdapterUse:
+    """A request's in-flight mark on an adapter; released on exit from `with`, or by `release()`."""
+
+    def __init__(self, manager: "LoraAdapterManager", key: Tuple[str, str]):
+        self.manager = manager
+        self.key = key
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.manager._release(self.key)
+
+    def __enter__(self) -> "AdapterUse":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class LoraAdapterManager:
+    """Adapter registry plus the per-replica set of loaded adapters, in least recently used order."""
+
+    def __init__(self, capacity: CapacityModel = capacity_model, directory: str = LORA_DIR,
+                 max_per_replica: int = LORA_MAX_PER_REPLICA):
+        self.capacity = capacity
+        self.directory = directory
+        self.max_per_replica = max_per_replica
+        self.adapters: Dict[str, LoraAdapter] = {}
+        # replica URL -> adapter name -> when it was loaded, least recently used first
+        self._resident: Dict[str, "OrderedDict[str, float]"] = {}
+        # replica URL -> adapter name -> when it was dropped from the resident set to be unloaded
+        self._unloaded: Dict[str, Dict[str, float]] = {}
+        self._inflight: Dict[Tuple[str, str], int] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.rescan()
+
+    def rescan(self) -> List[str]:
+        """Re-read LORA_DIR and LORA_ADAPTERS; returns the adapter names."""
+        adapters = discover_adapters(self.directory, self.capacity.models)
+        for name, spec in LORA_ADAPTERS.items():
+            adapters[name] = LoraAdapter(name, spec["base"], spec["path"])
+        for name in [name for name in adapters if name in self.capacity.replicas]:
+            logger.warning("Skipping LoRA adapter named like a base model", extra={"adapter": name})
+            del adapters[name]
+        self.adapters = adapters
+        return self.names()
+
+    def names(self) -> List[str]:
+        return sorted(self.adapters)
+
+    def resolve(self, model: str) -> Optional[LoraAdapter]:
+        """The adapter a request's model name refers to, or None for a base model."""
+        return self.adapters.get(model)
+
+    def _sync(self, replica: ReplicaCapacity) -> "OrderedDict[str, float]":
+        # Reconcile with the last `/v1/models` listing (caller holds self._lock). Adapters
+        # loaded after that listing was taken are kept even though it doesn't show them.
+        resident = self._resident.setdefault(replica.base_url, OrderedDict())
+        if replica.adapters_listed_at:
+            listed = set(replica.adapters)
+            unloaded = self._unloaded.get(replica.base_url, {})
+            for name in [n for n, loaded_at in resident.items()
+                         if n not in listed and loaded_at < replica.adapters_listed_at]:
+                del resident[name]
+            for name in listed - set(resident):
+                if unloaded.get(name, 0.0) > replica.adapters_listed_at:
+                    continue
+                # Loaded outside this process (e.g. before a restart): least recently used
+                resident[name] = replica.adapters_listed_at
+                resident.move_to_end(name, last=False)
+        return resident
+
+    def _drop(self, replica: ReplicaCapacity, resident: "OrderedDict[str, float]", name: str) -> None:
+        # Caller holds self._lock; the adapter is about to be unloaded, so listings taken
+        # before now must not bring it back
+        resident.pop(name, None)
+        self._unloaded.setdefault(replica.base_url, {})[name] = time.time()
+
+    def select_replica(self, adapter: LoraAdapter) -> Optional[ReplicaCapacity]:
+        """Least-loaded available replica of the base model, preferring those with the adapter loaded."""
+        with self._lock:
+            loaded = {replica.base_url for replica in self.capacity.replicas.get(adapter.base, [])
+                      if adapter.name in self._sync(replica)}
+        return self.capacity.select_replica(adapter.base, prefer=lambda replica: replica.base_url in loaded)
+
+    @staticmethod
+    def _post(replica: ReplicaCapacity, endpoint: str, body: Dict, done_already: str) -> None:
+        try:
+            resp = requests.post(f"{replica.base_url}/v1/{endpoint}", json=body, headers=trace_headers(),
+                                 timeout=LORA_LOAD_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            raise RuntimeError(f"{endpoint} failed: {e}") from e
+        # vLLM answers 400/404 when the adapter was already loaded or unloaded, e.g. by another
+        # gateway or a replica restart since the last listing; the outcome is the one wanted
+        if resp.status_code != 200 and done_already not in resp.text:
+            raise RuntimeError(f"{endpoint} returned {resp.status_code}: {resp.text[:200]}")
+
+    def _unload(self, replica: ReplicaCapacity, name: str) -> None:
+        self._post(replica, "unload_lora_adapter", {"lora_name": name}, done_already="cannot be found")
+        adapter_events.add(1, {"event": "unload"})
+        logger.info("LoRA adapter unloaded", extra={"adapter": name, "replica": replica.base_url})
+
+    def ensure_loaded(self, replica: ReplicaCapacity, adapter: LoraAdapter) -> AdapterUse:
+        """
+        Make sure `adapter` is loaded on `replica`, unloading least recently used adapters to stay
+        within LORA_MAX_PER_REPLICA. Blocking: call from a worker thread, or use `acquire`.
+
+        Returns:
+            AdapterUse: The request's in-flight mark, taken while the adapter is known to be
+            resident; hold it until the request ends
+
+        Raises:
+            RuntimeError: If the replica fails to load the adapter
+        """
+        key = (replica.base_url, adapter.name)
+        with self._lock:
+            resident = self._sync(replica)
+            if adapter.name in resident:
+                resident.move_to_end(adapter.name)
+                adapter_events.add(1, {"event": "resident"})
+                return self._mark(key)
+            load_lock = self._load_locks.setdefault(replica.base_url, threading.Lock())
+
+        # One load at a time per replica, so concurrent first requests load an adapter once
+        with load_lock:
+            with self._lock:
+                resident = self._sync(replica)
+                if adapter.name in resident:
+                    resident.move_to_end(adapter.name)
+                    adapter_events.add(1, {"event": "resident"})
+                    return self._mark(key)
+                # Adapters with requests in flight are never unloaded; over the limit is
+                # better than failing those requests
+                idle = [name for name in resident if not self._inflight.get((replica.base_url, name))]
+                victims = idle[:max(0, len(resident) + 1 - self.max_per_replica)]
+                for name in victims:
+                    self._drop(replica, resident, name)
+
+            for name in victims:
+                try:
+                    self._unload(replica, name)
+                except RuntimeError as e:
+                    logger.warning("LoRA adapter unload failed",
+                                   extra={"adapter": name, "replica": replica.base_url, "error": str(e)})
+
+            start = time.perf_counter()
+            with logfire.span("lora.load {adapter}", adapter=adapter.name, replica=replica.base_url):
+                self._post(replica, "load_lora_adapter", {"lora_name": adapter.name, "lora_path": adapter.path},
+                           done_already="has already been loaded")
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._sync(replica)[adapter.name] = time.time()
+                use = self._mark(key)
+            adapter_events.add(1, {"event": "load"})
+            load_latency_ms.record(elapsed)
+            logger.info("LoRA adapter loaded", extra={"adapter": adapter.name, "replica": replica.base_url,
+                                                      "load_ms": round(elapsed, 1)})
+            return use
+
+    async def acquire(self, replica: ReplicaCapacity, adapter: LoraAdapter) -> AdapterUse:
+        """`ensure_loaded` from the event loop; the mark is released if the caller is cancelled meanwhile."""
+        task = asyncio.ensure_future(asyncio.to_thread(self.ensure_loaded, replica, adapter))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            task.add_done_callback(lambda t: t.cancelled() or t.exception() is not None or t.result().release())
+            raise
+
+    def unload(self, replica: ReplicaCapacity, name: str) -> None:
+        """Unload an adapter from a replica now (admin API); the next request for it loads it again."""
+        with self._load_locks.setdefault(replica.base_url, threading.Lock()):
+            with self._lock:
+                self._drop(replica, self._sync(replica), name)
+            self._unload(replica, name)
+
+    def _mark(self, key: Tuple[str, str]) -> AdapterUse:
+        # Caller holds self._lock; an adapter with requests in flight is never picked for unloading
+        self._inflight[key] = self._inflight.get(key, 0) + 1
+        return AdapterUse(self, key)
+
+    def _release(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            self._inflight[key] -= 1
+            if not self._inflight[key]:
+                del self._inflight[key]
+
+    def status(self) -> Dict:
+        with self._lock:
+            loaded = {}
+            for replica in self.capacity.all_replicas():
+                resident = self._sync(replica)
+                if resident:
+                    loaded[replica.base_url] = list(reversed(resident))
+            inflight = {f"{name}@{url}": count for (url, name), count in self._inflight.items()}
+        return {
+            "directory": self.directory,
+            "max_per_replica": self.max_per_replica,
+            "adapters": [adapter.to_dict() for adapter in sorted(self.adapters.values(), key=lambda a: a.name)],
+            "loaded": loaded,
+            "inflight": inflight,
+        }
+
+
+def build_lora_manager() -> Optional[LoraAdapterManager]:
+    """The gateway's LoRA adapter manager, or None when LORA_ENABLED is false."""
+    if not LORA_ENABLED:
+        return None
+    return LoraAdapterManager()
+
+
+lora_adapters = build_lora_manager()
@@ -0,0 +1,366 @@
+"""
+Gateway Profiling
+
+Low-overhead profiling controls for finding out where gateway CPU goes under load
+(template rendering, JSON parsing, tiktoken, logging, ...). Everything is off by
+default, and nothing costs anything until it is switched on:
+
+- Sampling CPU profiler: a background thread records the Python stack of the event
+  loop thread (or of every thread) every PROFILING_INTERVAL_MS for a fixed number of
+  seconds, then returns a speedscope file (https://www.speedscope.app), collapsed
+  stacks for flamegraph.pl, or a top-functions summary. The sampler only reads frame
+  objects, so the profiled code is not instrumented or slowed beyond the sampler
+  taking the GIL for a moment per sample. One profile runs at a time.
+- Allocation tracking: tracemalloc, started and stopped on demand (it slows every
+  allocation while on, and stops itself after PROFILING_TRACEMALLOC_MAX_SECONDS).
+  Snapshots list the top allocation sites, optionally as the change since the
+  previous snapshot, which is how a leak shows up.
+- Per-route CPU time: with PROFILING_ROUTE_CPU=true, a middleware measures the
+  thread CPU time spent in each request's own coroutine steps, so time the event
+  loop spends on other requests in between is not counted. Work handed to threads
+  or separate tasks is not included. The totals are on /admin/profiling/routes and
+  in the `gateway.route.cpu_ms` metric.
+
+The admin endpoints are in api/profiling_routes.py.
+
+Configuration (environment variables):
+    PROFILING_ENABLED                 Serve the /admin/profiling endpoints (default: false)
+    PROFILING_TOKEN                   Required in X-Profiling-Token; without it every request is refused (default: none)
+    PROFILING_INTERVAL_MS             Sampling interval of the CPU profiler (default: 10)
+    PROFILING_MAX_SECONDS             Longest CPU profile a request may ask for (default: 60)
+    PROFILING_TRACEMALLOC_FRAMES      Stack frames kept per allocation (default: 5)
+    PROFILING_TRACEMALLOC_MAX_SECONDS tracemalloc stops itself after this long (default: 600)
+    PROFILING_ROUTE_CPU               Count CPU time per route (default: false)
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import logfire
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "10"))
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+PROFILING_TRACEMALLOC_FRAMES = int(os.getenv("PROFILING_TRACEMALLOC_FRAMES", "5"))
+PROFILING_TRACEMALLOC_MAX_SECONDS = float(os.getenv("PROFILING_TRACEMALLOC_MAX_SECONDS", "600"))
+PROFILING_ROUTE_CPU = os.getenv("PROFILING_ROUTE_CPU", "false").lower() == "true"
+
+# (file name, function) of frames a thread sits in while it waits for work
+IDLE_LEAVES = {
+    ("selectors.py", "select"), ("runners.py", "run"), ("base_events.py", "run_forever"),
+    ("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker"),
+}
+
+# A stack frame: (function, file, first line)
+Frame = Tuple[str, str, int]
+
+route_cpu_ms = logfire.metric_histogram("gateway.route.cpu_ms", unit="ms",
+                                        description="Event-loop CPU time per request, by route")
+
+
+@dataclass
+class SampledProfile:
+    """Stacks recorded by the sampler, root first, with how many samples hit each."""
+
+    interval_s: float
+    duration_s: float = 0.0
+    stacks: Counter = field(default_factory=Counter)
+    idle_samples: int = 0
+
+    def to_speedscope(self, name: str = "gateway") -> Dict:
+        """Speedscope's "sampled" file format, one profile per thread."""
+        frame_index: Dict[Frame, int] = {}
+        profiles: Dict[str, Dict] = {}
+        for (thread, stack), count in self.stacks.items():
+            profile = profiles.setdefault(thread, {
+                "type": "sampled", "name": thread, "unit": "seconds", "startValue": 0,
+                "endValue": self.duration_s, "samples": [], "weights": []})
+            profile["samples"].append([frame_index.setdefault(frame, len(frame_index)) for frame in stack])
+            profile["weights"].append(count * self.interval_s)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "instructstack-gateway",
+            "shared": {"frames": [{"name": fn, "file": path, "line": line} for fn, path, line in frame_index]},
+            "profiles": list(profiles.values()),
+        }
+
+    def to_collapsed(self) -> str:
+        """Collapsed stacks ("thread;outer;inner count" per line) for flamegraph.pl or speedscope."""
+        lines = []
+        for (thread, stack), count in self.stacks.most_common():
+            frames = ";".join(f"{fn} ({os.path.basename(path)}:{line})" for fn, path, line in stack)
+            lines.append(f"{thread};{frames} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top: int = 30) -> Dict:
+        """Functions with the most samples on top of the stack (self) and anywhere in it (total)."""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for (_, stack), count in self.stacks.items():
+            self_counts[stack[-1]] += count
+            for frame in set(stack):
+                total_counts[frame] += count
+        samples = sum(self.stacks.values())
+
+        def rows(counter: Counter) -> List[Dict]:
+            return [{"function": fn, "location": f"{path}:{line}", "samples": count,
+                     "percent": round(100 * count / samples, 1)}
+                    for (fn, path, line), count in counter.most_common(top)]
+
+        return {"duration_s": round(self.duration_s, 3), "interval_ms": self.interval_s * 1000,
+                "samples": samples, "idle_samples": self.idle_samples,
+                "self": rows(self_counts), "total": rows(total_counts)}
+
+
+class StackSampler:
+    """Samples thread stacks with sys._current_frames() from a worker thread; one profile at a time."""
+
+    def __init__(self, interval_ms: float = PROFILING_INTERVAL_MS):
+        self.interval_s = interval_ms / 1000
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float, thread_ids: Optional[List[int]] = None,
+                include_idle: bool = False) -> SampledProfile:
+        """
+        Sample stacks for `seconds` (blocking; run it in a worker thread).
+
+        Args:
+            seconds: How long to sample
+            thread_ids: Threads to sample; None samples every thread except the sampler
+            include_idle: Keep samples of threads waiting for work (event loop in select, idle workers)
+
+        Returns:
+            SampledProfile: The recorded stacks
+
+        Raises:
+            RuntimeError: If another profile is already running
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A CPU profile is already running")
+        try:
+            return self._sample(seconds, thread_ids, include_idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, thread_ids: Optional[List[int]], include_idle: bool) -> SampledProfile:
+        result = SampledProfile(interval_s=self.interval_s)
+        own = threading.get_ident()
+        wanted = set(thread_ids) if thread_ids is not None else None
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        start = time.perf_counter()
+        deadline = start + seconds
+        with logfire.span("profiling.cpu", seconds=seconds, interval_ms=self.interval_s * 1000):
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own or (wanted is not None and ident not in wanted):
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+                        frame = frame.f_back
+                    if not stack:
+                        continue
+                    stack.reverse()
+                    leaf_fn, leaf_path, _ = stack[-1]
+                    if not include_idle and (os.path.basename(leaf_path), leaf_fn.rsplit(".", 1)[-1]) in IDLE_LEAVES:
+                        result.idle_samples += 1
+                        continue
+                    thread = names.get(ident) or f"thread-{ident}"
+                    result.stacks[(thread, tuple(stack))] += 1
+                time.sleep(self.interval_s)
+        result.duration_s = time.perf_counter() - start
+        logger.info("CPU profile recorded", extra={"seconds": round(result.duration_s, 2),
+                                                   "samples": sum(result.stacks.values())})
+        return result
+
+
+class AllocationTracker:
+    """Starts and stops tracemalloc on demand and diffs consecutive snapshots."""
+
+    def __init__(self, frames: int = PROFILING_TRACEMALLOC_FRAMES,
+                 max_seconds: float = PROFILING_TRACEMALLOC_MAX_SECONDS):
+        self.frames = frames
+        self.max_seconds = max_seconds
+        self.started_at: Optional[float] = None
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self, frames: Optional[int] = None) -> Dict:
+        """Start tracing allocations; stops by itself after `max_seconds`. Call from the event loop."""
+        if tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is already running")
+        tracemalloc.start(frames or self.frames)
+        self.started_at = time.monotonic()
+        self._previous = None
+        self._stop_handle = asyncio.get_running_loop().call_later(self.max_seconds, self._expire)
+        logger.info("tracemalloc started", extra={"frames": frames or self.frames})
+        return self.status()
+
+    def _expire(self) -> None:
+        logger.warning("tracemalloc stopped after PROFILING_TRACEMALLOC_MAX_SECONDS",
+                       extra={"max_seconds": self.max_seconds})
+        self.stop()
+
+    def stop(self) -> Dict:
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+        tracemalloc.stop()
+        self.started_at = None
+        self._previous = None
+        return self.status()
+
+    def status(self) -> Dict:
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": True, "frames": tracemalloc.get_traceback_limit(),
+                "running_s": round(time.monotonic() - self.started_at, 1) if self.started_at else None,
+                "traced_kib": round(current / 1024, 1), "peak_kib": round(peak / 1024, 1),
+                "expires_in_s": round(self.max_seconds - (time.monotonic() - self.started_at), 1)
+                if self.started_at else None}
+
+    def snapshot(self, top: int = 25, group_by: str = "lineno", compare: bool = False) -> Dict:
+        """
+        Top allocation sites (blocking; run it in a worker thread).
+
+        Args:
+            top: Number of sites to return
+            group_by: "lineno" (one line per site), "traceback" (full stacks) or "filename"
+            compare: Report the change since the previous snapshot instead of the totals
+
+        Returns:
+            Dict: Traced memory and the top sites by size
+
+        Raises:
+            RuntimeError: If tracemalloc is not running
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start it first")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        sites = []
+        if compare and self._previous is not None:
+            for stat in snapshot.compare_to(self._previous, group_by)[:top]:
+                sites.append({**self._site(stat.traceback, group_by), "size_kib": round(stat.size / 1024, 1),
+                              "size_diff_kib": round(stat.size_diff / 1024, 1), "count": stat.count,
+                              "count_diff": stat.count_diff})
+        else:
+            for stat in snapshot.statistics(group_by)[:top]:
+                sites.append({**self._site(stat.traceback, group_by), "size_kib": round(stat.size / 1024, 1),
+                              "count": stat.count})
+        compared = compare and self._previous is not None
+        self._previous = snapshot
+        return {**self.status(), "group_by": group_by, "compared_to_previous": compared, "sites": sites}
+
+    @staticmethod
+    def _site(traceback: tracemalloc.Traceback, group_by: str) -> Dict:
+        # Frames are oldest first; the last one made the allocation
+        if group_by == "traceback":
+            return {"site": str(traceback[-1]), "traceback": [str(frame) for frame in traceback]}
+        return {"site": str(traceback[-1])}
+
+
+class RouteCpuStats:
+    """Requests and CPU time per route, fed by RouteCpuMiddleware."""
+
+    def __init__(self):
+        self.routes: Dict[str, List[float]] = {}
+
+    def record(self, route: str, cpu_s: float) -> None:
+        entry = self.routes.setdefault(route, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += cpu_s
+        entry[2] = max(entry[2], cpu_s)
+        route_cpu_ms.record(cpu_s * 1000, attributes={"route": route})
+
+    def reset(self) -> None:
+        self.routes.clear()
+
+    def snapshot(self) -> List[Dict]:
+        """Routes by total CPU time, highest first."""
+        rows = [{"route": route, "requests": int(requests), "cpu_ms_total": round(total * 1000, 1),
+                 "cpu_ms_mean": round(total * 1000 / requests, 3), "cpu_ms_max": round(peak * 1000, 3)}
+                for route, (requests, total, peak) in self.routes.items()]
+        return sorted(rows, key=lambda row: row["cpu_ms_total"], reverse=True)
+
+
+class _CpuTimed:
+    """Awaits a coroutine step by step, adding up the thread CPU time of each step."""
+
+    def __init__(self, coro):
+        self.coro = coro
+        self.cpu_s = 0.0
+
+    def __await__(self):
+        coro = self.coro
+        value, error = None, None
+        while True:
+            start = time.thread_time()
+            try:
+                yielded = coro.throw(error) if error is not None else coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.cpu_s += time.thread_time() - start
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+
+
+def _route_name(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return f"{scope['method']} {route.path}"
+    if scope.get("root_path"):
+        # Mounted apps (static files)
+        return f"{scope['method']} {scope['root_path']}/{{path}}"
+    return f"{scope['method']} <unmatched>"
+
+
+class RouteCpuMiddleware:
+    """Records the CPU time of every HTTP request against its route (see the module docstring)."""
+
+    def __init__(self, app, stats: Optional[RouteCpuStats] = None):
+        self.app = app
+        self.stats = stats or route_cpu
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timed = _CpuTimed(self.app(scope, receive, send))
+        try:
+            await timed
+        finally:
+            self.stats.record(_route_name(scope), timed.cpu_s)
+
+
+stack_sampler = StackSampler()
+allocation_tracker = AllocationTracker()
+route_cpu = RouteCpuStats() if PROFILING_ROUTE_CPU else None
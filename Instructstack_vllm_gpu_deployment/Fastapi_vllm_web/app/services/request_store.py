@@ -0,0 +1,320 @@
+"""
+Request Store
+
+Append-only record of every completion the gateway serves (prompt, completion,
+status, latency, token counts, replica), kept in a local SQLite database in WAL mode
+for audits and per-model latency and token reports.
+
+`call_vllm` never waits on the disk: `record()` only puts the row on a bounded
+in-memory queue. A background writer thread drains the queue and inserts rows in
+batches of up to REQUEST_STORE_BATCH_SIZE, one transaction per batch. When the
+queue is full (the disk can't keep up), new rows are dropped and counted, never
+blocking requests. Prompts and completions are cut to REQUEST_STORE_MAX_TEXT
+characters, so queue memory is bounded.
+
+Every REQUEST_STORE_COMPACT_INTERVAL the writer deletes rows older than the
+retention window (and the oldest rows beyond REQUEST_STORE_MAX_ROWS), returns the
+freed pages to the filesystem and truncates the WAL.
+
+The database is opened (and, if needed, converted with a one-off VACUUM) by the
+writer thread when the gateway starts, not at import. Rows recorded meanwhile wait
+in the queue. /requests returns prompts and completions, so it needs
+REQUEST_STORE_TOKEN in the `X-Request-Store-Token` header (api/request_store_routes.py).
+
+Recorded prompts can also be replayed by load tests (see services/load_test.py).
+
+Configuration (environment variables):
+    REQUEST_STORE_ENABLED           Record requests (default: true)
+    REQUEST_STORE_PATH              SQLite database file (default: /data/request_store/requests.db)
+    REQUEST_STORE_TOKEN             Required by the /requests endpoints; unset refuses them all (default: unset)
+    REQUEST_STORE_QUEUE_SIZE        Rows waiting to be written before new ones are dropped (default: 10000)
+    REQUEST_STORE_BATCH_SIZE        Rows inserted per transaction (default: 500)
+    REQUEST_STORE_FLUSH_INTERVAL    Max seconds a row waits in the queue (default: 1.0)
+    REQUEST_STORE_MAX_TEXT          Characters of prompt / completion kept (default: 8000)
+    REQUEST_STORE_RETENTION_DAYS    Days of requests kept (default: 30)
+    REQUEST_STORE_MAX_ROWS          Rows kept at most, 0 = no limit (default: 5000000)
+    REQUEST_STORE_COMPACT_INTERVAL  Seconds between retention / compaction passes (default: 3600)
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import logfire
+
+from services.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+REQUEST_STORE_ENABLED = os.getenv("REQUEST_STORE_ENABLED", "true").lower() == "true"
+REQUEST_STORE_PATH = os.getenv("REQUEST_STORE_PATH", "/data/request_store/requests.db")
+REQUEST_STORE_TOKEN = os.getenv("REQUEST_STORE_TOKEN", "")
+REQUEST_STORE_QUEUE_SIZE = int(os.getenv("REQUEST_STORE_QUEUE_SIZE", "10000"))
+REQUEST_STORE_BATCH_SIZE = int(os.getenv("REQUEST_STORE_BATCH_SIZE", "500"))
+REQUEST_STORE_FLUSH_INTERVAL = float(os.getenv("REQUEST_STORE_FLUSH_INTERVAL", "1.0"))
+REQUEST_STORE_MAX_TEXT = int(os.getenv("REQUEST_STORE_MAX_TEXT", "8000"))
+REQUEST_STORE_RETENTION_DAYS = float(os.getenv("REQUEST_STORE_RETENTION_DAYS", "30"))
+REQUEST_STORE_MAX_ROWS = int(os.getenv("REQUEST_STORE_MAX_ROWS", "5000000"))
+REQUEST_STORE_COMPACT_INTERVAL = float(os.getenv("REQUEST_STORE_COMPACT_INTERVAL", "3600"))
+
+store_records = logfire.metric_counter("request_store.records", unit="1",
+                                       description="Request store rows by outcome (written, dropped, failed)")
+
+COLUMNS = ("ts", "model", "kind", "replica", "status", "error", "prompt", "completion", "max_tokens",
+           "prompt_tokens", "completion_tokens", "latency_ms", "upstream_ms", "stopped_early")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,               -- Unix time the request finished
+    model TEXT NOT NULL,
+    kind TEXT,                      -- Prompt type: "sql" or "text"
+    replica TEXT,
+    status TEXT NOT NULL,           -- "ok", "cached" or "error"
+    error TEXT,
+    prompt TEXT,
+    completion TEXT,
+    max_tokens INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    latency_ms REAL,                -- Total time in call_vllm
+    upstream_ms REAL,               -- Time spent waiting on vLLM
+    stopped_early INTEGER
+);
+CREATE INDEX IF NOT EXISTS requests_model_ts ON requests (model, ts);
+CREATE INDEX IF NOT EXISTS requests_ts ON requests (ts);
+"""
+
+_STOP = object()
+
+
+class RequestStore:
+    """SQLite request log with a non-blocking `record()` and a batching writer thread."""
+
+    def __init__(self, path: str = REQUEST_STORE_PATH, queue_size: int = REQUEST_STORE_QUEUE_SIZE):
+        self.path = path
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread: Optional[threading.Thread] = None
+        self._last_compaction = time.monotonic()
+        self._opened = threading.Event()
+        self.open_error: Optional[str] = None
+
+    @property
+    def available(self) -> bool:
+        """Whether the database is open and can be queried."""
+        return self._opened.is_set()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: commits don't fsync; a crash can lose the last batch but never corrupts the file
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def open(self) -> None:
+        """Create the database and schema, with incremental auto_vacuum so `compact()` can shrink the file."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # auto_vacuum only takes effect on an empty database, so it is set before anything else:
+        # switching to WAL (in _connect) already initialises the file
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # Created without it (by an older gateway): a one-off VACUUM converts the file
+                logger.info("Converting the request store to incremental auto_vacuum", extra={"path": self.path})
+                conn.execute("VACUUM")
+        finally:
+            conn.close()
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    # ----- hot path -----
+
+    def record(self, **row: Any) -> None:
+        """Queue one request for writing; never blocks (drops the row when the queue is full)."""
+        if self.open_error is not None:
+            return
+        for field in ("prompt", "completion", "error"):
+            value = row.get(field)
+            if isinstance(value, str) and len(value) > REQUEST_STORE_MAX_TEXT:
+                row[field] = value[:REQUEST_STORE_MAX_TEXT]
+        row.setdefault("ts", time.time())
+        try:
+            self.queue.put_nowait(tuple(row.get(column) for column in COLUMNS))
+        except queue.Full:
+            self.dropped += 1
+            store_records.add(1, {"outcome": "dropped"})
+
+    # ----- writer thread -----
+
+    def _write(self, conn: sqlite3.Connection, rows: List[tuple]) -> None:
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        try:
+            with conn:
+                conn.executemany(f"INSERT INTO requests ({', '.join(COLUMNS)}) VALUES ({placeholders})", rows)
+            self.written += len(rows)
+            store_records.add(len(rows), {"outcome": "written"})
+        except sqlite3.Error as e:
+            self.failed += len(rows)
+            store_records.add(len(rows), {"outcome": "failed"})
+            logger.warning("Request store write failed", extra={"rows": len(rows), "error": str(e)})
+
+    def compact(self, conn: sqlite3.Connection) -> None:
+        """Apply retention, then return free pages to the filesystem and truncate the WAL."""
+        with conn:
+            conn.execute("DELETE FROM requests WHERE ts < ?",
+                         (time.time() - REQUEST_STORE_RETENTION_DAYS * 86400,))
+            if REQUEST_STORE_MAX_ROWS:
+                conn.execute("DELETE FROM requests WHERE id <= (SELECT MAX(id) FROM requests) - ?",
+                             (REQUEST_STORE_MAX_ROWS,))
+        conn.execute("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _run(self) -> None:
+        try:
+            self.open()
+        except (OSError, sqlite3.Error) as e:
+            self.open_error = str(e)
+            logger.warning("Request store disabled: cannot open database", extra={"path": self.path, "error": str(e)})
+            return
+        self._opened.set()
+        conn = self._connect()
+        try:
+            while True:
+                try:
+                    first = self.queue.get(timeout=REQUEST_STORE_FLUSH_INTERVAL)
+                except queue.Empty:
+                    first = None
+                rows = [] if first is None or first is _STOP else [first]
+                stopping = first is _STOP
+                while not stopping and len(rows) < REQUEST_STORE_BATCH_SIZE:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                    else:
+                        rows.append(item)
+                if rows:
+                    self._write(conn, rows)
+                if stopping:
+                    return
+                if time.monotonic() - self._last_compaction > REQUEST_STORE_COMPACT_INTERVAL:
+                    self._last_compaction = time.monotonic()
+                    try:
+                        self.compact(conn)
+                    except sqlite3.Error as e:
+                        logger.warning("Request store compaction failed", extra={"error": str(e)})
+        finally:
+            conn.close()
+
+    def start(self) -> None:
+        """Start the writer thread, which opens the database first; call from the app's startup."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="request-store-writer", daemon=True)
+            self._thread.start()
+
+    async def stop(self) -> None:
+        """Write what is still queued, then stop the writer."""
+        if self._thread is not None:
+            thread, self._thread = self._thread, None
+            if self.open_error is not None:
+                return
+            # Waits for room, so rows queued before shutdown are not lost
+            try:
+                await asyncio.to_thread(self.queue.put, _STOP, True, 30)
+            except queue.Full:
+                logger.warning("Request store writer is stuck; queued rows are lost", extra=self.stats())
+                return
+            await asyncio.to_thread(thread.join, 30)
+
+    # ----- queries (run off the event loop; WAL lets them read while the writer writes) -----
+
+    def query(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+        conn.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def model_report(self, window_s: float = 3600) -> List[Dict[str, Any]]:
+        """
+        Per-model request counts, latency percentiles and token totals.
+
+        Args:
+            window_s: Only requests finished in the last `window_s` seconds
+
+        Returns:
+            List[Dict]: One entry per model, busiest first
+        """
+        since = time.time() - window_s
+        totals = self.query(
+            """SELECT model, COUNT(*) AS requests,
+                      SUM(status = 'error') AS errors, SUM(status = 'cached') AS cached,
+                      SUM(stopped_early) AS stopped_early,
+                      SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens,
+                      AVG(prompt_tokens) AS avg_prompt_tokens, AVG(completion_tokens) AS avg_completion_tokens
+               FROM requests WHERE ts >= ? GROUP BY model ORDER BY requests DESC""", (since,))
+        for entry in totals:
+            latencies = [round(row["latency_ms"], 2) for row in self.query(
+                "SELECT latency_ms FROM requests WHERE model = ? AND ts >= ? AND status = 'ok' "
+                "ORDER BY latency_ms", (entry["model"], since))]
+            entry["error_rate"] = round(entry["errors"] / entry["requests"], 4)
+            entry["latency_ms"] = {f"p{p}": percentile(latencies, p) for p in (50, 90, 95, 99)}
+            for key in ("avg_prompt_tokens", "avg_completion_tokens"):
+                entry[key] = round(entry[key], 1) if entry[key] is not None else None
+        return totals
+
+    def recent(self, limit: int = 50, model: Optional[str] = None,
+               status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recent requests, newest first."""
+        sql, params = "SELECT * FROM requests WHERE 1 = 1", []
+        if model:
+            sql += " AND model = ?"
+            params.append(model)
+        if status:
+            sql += " AND status = ?"
+            params.append(status)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        return self.query(sql, tuple(params))
+
+    def recorded_prompts(self, model: str, limit: int) -> List[str]:
+        """The most recent distinct successful prompts for a model (newest first), for replay."""
+        return [row["prompt"] for row in self.query(
+            "SELECT prompt FROM requests WHERE model = ? AND status = 'ok' AND prompt IS NOT NULL "
+            "GROUP BY prompt ORDER BY MAX(id) DESC LIMIT ?", (model, limit))]
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            size = sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+        except OSError:
+            size = None
+        return {"path": self.path, "available": self.available, "open_error": self.open_error,
+                "queued": self.queue.qsize(), "written": self.written,
+                "dropped": self.dropped, "failed": self.failed, "size_bytes": size}
+
+
+def build_request_store() -> Optional[RequestStore]:
+    """The gateway's request store, or None when disabled; the database is opened by `start()`."""
+    if not REQUEST_STORE_ENABLED:
+        return None
+    return RequestStore()
+
+
+request_store = build_request_store()
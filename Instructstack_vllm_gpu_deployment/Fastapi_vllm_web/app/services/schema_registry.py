@@ -0,0 +1,148 @@
+"""
+Schema Registry
+
+Text2SQL prompts repeat the same, often large, database schema for every question.
+Clients register a schema once and then send only its `schema_id` and the question;
+the gateway assembles the prompt from a fixed template:
+
+    ### Database Schema:
+    <schema>
+
+    ### Question:
+    <question>
+
+    ### SQL:
+
+The schema always comes first and is rendered byte-identically, so vLLM's prefix
+cache (`--enable-prefix-caching`, see VLLM_PROFILE_ARGS in docker-compose.yml) can
+reuse its KV blocks across questions instead of prefilling it again. The gateway
+also keeps the schema prefix's token count per tokenizer, so only the question is
+tokenized per request.
+
+Schema ids are content hashes: registering the same schema again returns the same
+id, and a client whose id was evicted (or lost on restart) can simply re-register.
+
+Configuration (environment variables):
+    SCHEMA_REGISTRY_MAX_ENTRIES   Schemas kept, least recently used evicted first (default: 256)
+    SCHEMA_MAX_CHARS              Largest schema accepted (default: 200000)
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+SCHEMA_REGISTRY_MAX_ENTRIES = int(os.getenv("SCHEMA_REGISTRY_MAX_ENTRIES", "256"))
+SCHEMA_MAX_CHARS = int(os.getenv("SCHEMA_MAX_CHARS", "200000"))
+
+PREFIX_TEMPLATE = "### Database Schema:\n{schema}\n\n### Question:\n"
+SUFFIX_TEMPLATE = "{question}\n\n### SQL:\n"
+
+
+def normalize_schema(schema: str) -> str:
+    """Strip trailing whitespace so equivalent schemas share an id and a prefix."""
+    return "\n".join(line.rstrip() for line in schema.strip().splitlines())
+
+
+def render_prompt(schema: str, question: str) -> str:
+    """Build a Text2SQL prompt from a schema and a question."""
+    return PREFIX_TEMPLATE.format(schema=normalize_schema(schema)) + SUFFIX_TEMPLATE.format(question=question.strip())
+
+
+@dataclass
+class SchemaEntry:
+    """A registered schema and its rendered, partly tokenized prompt prefix."""
+    schema_id: str
+    name: str
+    prefix: str
+    prefix_tokens: Dict[str, int] = field(default_factory=dict)  # tokenizer name -> token count
+
+    def prompt(self, question: str) -> str:
+        return self.prefix + SUFFIX_TEMPLATE.format(question=question.strip())
+
+    def to_dict(self) -> Dict:
+        return {
+            "schema_id": self.schema_id,
+            "name": self.name,
+            "prefix_chars": len(self.prefix),
+            "prefix_tokens": self.prefix_tokens,
+        }
+
+
+class SchemaRegistry:
+    """Bounded LRU of registered schemas, shared by all requests."""
+
+    def __init__(self, max_entries: int = SCHEMA_REGISTRY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, SchemaEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, schema: str, name: str = "") -> SchemaEntry:
+        """
+        Register a schema, or refresh it if it is already known.
+
+        Args:
+            schema: Schema description (DDL, or "Table: ... Columns: ..." text)
+            name: Optional label for listing
+
+        Returns:
+            SchemaEntry: The entry; its `schema_id` is derived from the normalized schema
+
+        Raises:
+            ValueError: If the schema is empty or larger than SCHEMA_MAX_CHARS
+        """
+        normalized = normalize_schema(schema)
+        if not normalized:
+            raise ValueError("Schema is empty")
+        if len(normalized) > SCHEMA_MAX_CHARS:
+            raise ValueError(f"Schema exceeds {SCHEMA_MAX_CHARS} characters")
+        schema_id = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            entry = self._entries.get(schema_id)
+            if entry is None:
+                entry = SchemaEntry(schema_id, name, PREFIX_TEMPLATE.format(schema=normalized))
+                self._entries[schema_id] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            elif name:
+                entry.name = name
+            self._entries.move_to_end(schema_id)
+        return entry
+
+    def get(self, schema_id: str) -> Optional[SchemaEntry]:
+        with self._lock:
+            entry = self._entries.get(schema_id)
+            if entry is not None:
+                self._entries.move_to_end(schema_id)
+            return entry
+
+    def remove(self, schema_id: str) -> bool:
+        with self._lock:
+            return self._entries.pop(schema_id, None) is not None
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            return [entry.to_dict() for entry in reversed(self._entries.values())]
+
+    @staticmethod
+    def count_prompt_tokens(entry: SchemaEntry, question: str, encoding) -> int:
+        """
+        Token count of the assembled prompt, tokenizing the schema prefix only once per tokenizer.
+
+        Args:
+            entry: Registered schema
+            question: The question appended to the prefix
+            encoding: tiktoken encoding used for the gateway's token metrics
+
+        Returns:
+            int: Prefix tokens (cached) plus the tokens of the question suffix
+        """
+        prefix_tokens = entry.prefix_tokens.get(encoding.name)
+        if prefix_tokens is None:
+            prefix_tokens = entry.prefix_tokens[encoding.name] = len(encoding.encode(entry.prefix))
+        return prefix_tokens + len(encoding.encode(SUFFIX_TEMPLATE.format(question=question.strip())))
+
+
+schema_registry = SchemaRegistry()
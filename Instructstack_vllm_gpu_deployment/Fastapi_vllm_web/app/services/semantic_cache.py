@@ -0,0 +1,421 @@
+"""
+Semantic Answer Cache
+
+Opt-in cache in front of `call_vllm` for Text2SQL prompts. Questions are embedded
+with a small local CPU embedding model and compared against previously answered questions
+for the same schema, model and sampling parameters; above SEMANTIC_CACHE_THRESHOLD
+cosine similarity the cached SQL is returned without calling vLLM.
+
+Only prompts following the Text2SQL template (see services/schema_registry.py)
+are cached: the schema prefix scopes the index and the question is what gets
+embedded. Errors are never cached.
+
+Paraphrases embed close together, but so do questions that differ in the one
+detail that matters for SQL ("after 2020" / "after 2015", "more than" / "less
+than"). A hit therefore also requires the same constraint tokens: numbers,
+quoted literals and comparison, ordering and negation words. Numbers keep their
+unit ("100k" is not "50k"). Synonyms count as the same constraint ("post-2020" and
+"after 2020", "over 10" and "more than 10", "2020 or later" and "since 2020"), but
+inclusive and exclusive bounds don't ("since 2020" is not "after 2020", "5 or more"
+is not "more than 5").
+
+Embedders:
+    BAAI/bge-small-en-v1.5 (default)   Small embedding model run on CPU with ONNX Runtime through
+                                      fastembed (no torch). Optional: install requirements-semantic-cache.txt,
+                                      or build the image with SEMANTIC_CACHE=true to bake it in
+    <model name>                       Another fastembed model, or a sentence-transformers model when
+                                      fastembed is not installed
+    hashing                            Lexical matching on hashed word and character n-grams. Needs no
+                                      model, but only matches near-exact rewordings ("List all employees"
+                                      / "Show all employees"), not paraphrases ("hired after 2020" /
+                                      "who joined after 2020")
+
+A model that can't be loaded (package missing, download failed) falls back to hashing.
+The hashing threshold is calibrated with benchmarks/semantic_cache_bench.py; run it
+with the model to calibrate the model's.
+
+Configuration (environment variables):
+    SEMANTIC_CACHE_ENABLED        Turn the cache on (default: false)
+    SEMANTIC_CACHE_EMBEDDER       A model name or "hashing" (default: BAAI/bge-small-en-v1.5)
+    SEMANTIC_CACHE_THRESHOLD      Minimum cosine similarity for a hit (default: 0.85 for embedding models,
+                                  0.8 for hashing)
+    SEMANTIC_CACHE_MAX_ENTRIES    Questions kept per scope, least recently used evicted (default: 512)
+    SEMANTIC_CACHE_MAX_SCOPES     Schema/model/parameter scopes kept (default: 64)
+    SEMANTIC_CACHE_TTL            Seconds before an entry expires, 0 = never (default: 86400)
+"""
+
+import hashlib
+import importlib.util
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Hashable, Optional, Tuple
+
+import logfire
+
+from services.schema_registry import PREFIX_TEMPLATE
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_EMBEDDER = os.getenv("SEMANTIC_CACHE_EMBEDDER", "BAAI/bge-small-en-v1.5")
+# Unset: the embedder's own default (see `default_threshold`)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD") or 0) or None
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+SEMANTIC_CACHE_MAX_SCOPES = int(os.getenv("SEMANTIC_CACHE_MAX_SCOPES", "64"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+
+cache_lookups = logfire.metric_counter("semantic_cache.lookups", unit="1",
+                                       description="Semantic cache lookups, by outcome")
+
+Vector = Dict[int, float]
+
+_WORD_RE = re.compile(r"[a-z0-9_]+(?:\.[0-9]+)?")
+_LITERAL_RE = re.compile(r"'[^']*'|\"[^\"]*\"|\b\d+(?:\.\d+)?(?:[a-z]+\b|%|\b)")
+_QUESTION_MARKER = "### Question:\n"
+_SQL_MARKER = "\n\n### SQL:\n"
+
+# Words that change the query's meaning while barely moving its embedding, mapped to the
+# constraint they express so that synonyms ("over" / "more", "post-2020" / "after 2020") match
+CONSTRAINT_WORDS = {
+    **dict.fromkeys(("after", "post", "later", "beyond"), "after"),
+    **dict.fromkeys(("before", "pre", "prior", "earlier"), "before"),
+    **dict.fromkeys(("since", "onward", "onwards", "starting"), "since"),  # Inclusive, unlike "after"
+    **dict.fromkeys(("until", "till", "through"), "until"),
+    "between": "between",
+    **dict.fromkeys(("above", "over", "more", "greater", "exceeding", "exceeds", "exceed"), "more"),
+    **dict.fromkeys(("below", "under", "less", "fewer", "lower"), "less"),
+    **dict.fromkeys(("most", "max", "maximum", "highest", "top", "largest", "biggest"), "max"),
+    **dict.fromkeys(("least", "min", "minimum", "lowest", "bottom", "smallest"), "min"),
+    **dict.fromkeys(("first", "earliest", "oldest"), "first"),
+    **dict.fromkeys(("last", "latest", "newest", "recent"), "last"),
+    **dict.fromkeys(("asc", "ascending"), "asc"),
+    **dict.fromkeys(("desc", "descending"), "desc"),
+    **dict.fromkeys(("not", "no", "without", "except", "exclude", "excluding", "never"), "not"),
+    "count": "count",
+    **dict.fromkeys(("sum", "total"), "sum"),
+    **dict.fromkeys(("average", "avg", "mean"), "avg"),
+    **dict.fromkeys(("distinct", "unique"), "distinct"),
+    **dict.fromkeys(("each", "per"), "per"),
+}
+# Inclusive bounds, matched before single words: "5 or more" is not "more than 5"
+CONSTRAINT_PHRASES = {
+    **dict.fromkeys(("or later", "and later", "or after", "and after"), "since"),
+    **dict.fromkeys(("or earlier", "and earlier", "or before", "and before"), "until"),
+    **dict.fromkeys(("at least", "or more", "and more", "or above", "and above", "or over", "and over",
+                     "or greater", "or higher", "and up", "no less than", "not less than", "no fewer than"),
+                    "at_least"),
+    **dict.fromkeys(("at most", "or less", "or fewer", "or below", "and below", "or under", "and under",
+                     "or lower", "up to", "no more than", "not more than"), "at_most"),
+}
+_PHRASE_RE = re.compile(r"\b(?:" + "|".join(sorted(map(re.escape, CONSTRAINT_PHRASES), key=len, reverse=True))
+                        + r")\b")
+# Request phrasing with no bearing on the SQL
+STOP_WORDS = frozenset({
+    "a", "an", "the", "of", "for", "in", "on", "to", "all", "any", "me", "please", "show", "list",
+    "find", "get", "give", "display", "return", "what", "which", "who", "is", "are", "was", "were",
+    "that", "those", "their", "there", "with", "and", "do", "does", "i", "we", "want", "need", "can", "you",
+})
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def constraint_tokens(question: str) -> FrozenSet[str]:
+    """Literals and meaning-changing words that must match for two questions to share an answer."""
+    lowered = question.lower()
+    literals = {m.strip("'\"") for m in _LITERAL_RE.findall(lowered)}
+    phrases = {CONSTRAINT_PHRASES[m] for m in _PHRASE_RE.findall(lowered)}
+    # Phrases are cut out so their words ("least", "more") don't add the exclusive constraint too
+    words = {CONSTRAINT_WORDS[w] for w in _WORD_RE.findall(_PHRASE_RE.sub(" ", lowered)) if w in CONSTRAINT_WORDS}
+    return frozenset(literals | phrases | words)
+
+
+def _normalize(vector: Vector) -> Vector:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {k: v / norm for k, v in vector.items()} if norm else vector
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    """Dot product of two normalized sparse vectors."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class HashingEmbedder:
+    """Bag of hashed word unigrams, bigrams and character trigrams: lexical matching, dependency-free."""
+
+    name = "hashing"
+    default_threshold = 0.8
+
+    def __init__(self, buckets: int = 1 << 18):
+        self.buckets = buckets
+
+    def _bucket(self, feature: str) -> int:
+        return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little") % self.buckets
+
+    def embed(self, text: str) -> Vector:
+        words = [_stem(w) for w in _WORD_RE.findall(text.lower()) if w not in STOP_WORDS]
+        vector: Vector = {}
+        features = [(f"w:{w}", 1.0) for w in words]
+        features += [(f"b:{a} {b}", 0.5) for a, b in zip(words, words[1:])]
+        features += [(f"c:{w[i:i + 3]}", 0.3) for w in (f"<{w}>" for w in words) for i in range(len(w) - 2)]
+        for feature, weight in features:
+            bucket = self._bucket(feature)
+            vector[bucket] = vector.get(bucket, 0.0) + weight
+        return _normalize(vector)
+
+
+class SentenceTransformerEmbedder:
+    """
+    Dense embeddings from a local sentence-transformers model (CPU).
+
+    The model (and torch) take seconds to load, so loading waits for `load()`,
+    called by the startup warm-up, or the first `embed()`.
+    """
+
+    default_threshold = 0.8
+
+    def __init__(self, model_name: str):
+        if importlib.util.find_spec("sentence_transformers") is None:
+            raise ImportError("sentence_transformers")
+        self.name = model_name
+        self.model = None
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        with self._lock:
+            if self.model is None:
+                # Imported lazily: optional dependency, only needed when configured
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(self.name, device="cpu")
+
+    def embed(self, text: str) -> Vector:
+        if self.model is None:
+            self.load()
+        values = self.model.encode(text, normalize_embeddings=True)
+        return {i: float(v) for i, v in enumerate(values)}
+
+
+class FastEmbedEmbedder:
+    """
+    Dense embeddings from a small ONNX model through fastembed (CPU, no torch).
+
+    Loading takes about a second, so it waits for `load()`, called by the startup
+    warm-up, or the first `embed()`. Models are read from FASTEMBED_CACHE_PATH, where
+    an image built with SEMANTIC_CACHE=true bakes in the default one, and downloaded
+    there otherwise. If the model can't be loaded, the hashing embedder is used instead.
+    """
+
+    def __init__(self, model_name: str):
+        if importlib.util.find_spec("fastembed") is None:
+            raise ImportError("fastembed")
+        self.name = model_name
+        self.model = None
+        self.fallback: Optional[HashingEmbedder] = None
+        self._lock = threading.Lock()
+
+    @property
+    def default_threshold(self) -> float:
+        return self.fallback.default_threshold if self.fallback is not None else 0.85
+
+    def load(self) -> None:
+        with self._lock:
+            if self.model is not None or self.fallback is not None:
+                return
+            try:
+                # Imported lazily: importing onnxruntime takes a while
+                from fastembed import TextEmbedding
+                self.model = TextEmbedding(self.name)
+            except Exception as e:
+                logger.warning("Could not load the semantic cache embedding model; using the hashing embedder",
+                               extra={"embedder": self.name, "error": str(e)})
+                self.fallback = HashingEmbedder()
+                raise
+
+    def embed(self, text: str) -> Vector:
+        if self.model is None and self.fallback is None:
+            try:
+                self.load()
+            except Exception:
+                pass
+        if self.fallback is not None:
+            return self.fallback.embed(text)
+        values = next(iter(self.model.embed([text])))
+        return _normalize({i: float(v) for i, v in enumerate(values)})
+
+
+def load_embedder(name: str = SEMANTIC_CACHE_EMBEDDER):
+    """The embedder for a model name or "hashing": fastembed, else sentence-transformers, else hashing."""
+    if name == "hashing":
+        return HashingEmbedder()
+    for embedder in (FastEmbedEmbedder, SentenceTransformerEmbedder):
+        try:
+            return embedder(name)
+        except ImportError:
+            continue
+    logger.warning("Neither fastembed nor sentence-transformers is installed (see requirements-semantic-cache.txt); "
+                   "semantic cache uses the hashing embedder", extra={"embedder": name})
+    return HashingEmbedder()
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    vector: Vector
+    constraints: FrozenSet[str]
+    answer: str
+    stored_at: float
+
+
+@dataclass
+class CacheHit:
+    answer: str
+    question: str
+    similarity: float
+
+
+def split_prompt(prompt: str) -> Optional[Tuple[str, str]]:
+    """
+    Split a Text2SQL template prompt into its schema prefix and question.
+
+    Returns:
+        Optional[Tuple[str, str]]: (prefix, question), or None for other prompts
+    """
+    if not prompt.startswith(PREFIX_TEMPLATE.split("{", 1)[0]) or not prompt.endswith(_SQL_MARKER):
+        return None
+    prefix, marker, question = prompt.rpartition(_QUESTION_MARKER)
+    if not marker:
+        return None
+    return prefix + marker, question[:-len(_SQL_MARKER)].strip()
+
+
+class SemanticCache:
+    """Per-scope, size-bounded vector indexes of answered questions."""
+
+    def __init__(self, embedder, threshold: Optional[float] = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 max_scopes: int = SEMANTIC_CACHE_MAX_SCOPES, ttl: float = SEMANTIC_CACHE_TTL):
+        self.embedder = embedder
+        self._threshold = threshold
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self.ttl = ttl
+        self._scopes: "OrderedDict[Hashable, OrderedDict[str, CacheEntry]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def threshold(self) -> float:
+        """SEMANTIC_CACHE_THRESHOLD, or the embedder's default (which changes if a model falls back to hashing)."""
+        if self._threshold is not None:
+            return self._threshold
+        return getattr(self.embedder, "default_threshold", 0.8)
+
+    @staticmethod
+    def key_for(model: str, payload: dict) -> Optional[Tuple[Hashable, str]]:
+        """
+        Cache scope and question for a completion payload, or None if it is not cacheable.
+
+        The scope covers everything besides the question that shapes the answer: the
+        schema prefix, the model and the sampling parameters.
+        """
+        prompt = payload.get("prompt")
+        if not isinstance(prompt, str):
+            return None
+        parts = split_prompt(prompt)
+        if parts is None:
+            return None
+        prefix, question = parts
+        stop = payload.get("stop")
+        scope = (
+            hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16],
+            model,
+            payload.get("max_tokens"),
+            payload.get("temperature"),
+            tuple(stop) if isinstance(stop, list) else stop,
+        )
+        return scope, question
+
+    def lookup(self, scope: Hashable, question: str) -> Optional[CacheHit]:
+        """Return the cached answer of the most similar question in scope, if similar enough."""
+        key = question.strip().lower()
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None:
+                cache_lookups.add(1, {"outcome": "miss"})
+                return None
+            self._scopes.move_to_end(scope)
+            self._expire(entries)
+            exact = entries.get(key)
+            if exact is not None:
+                entries.move_to_end(key)
+                cache_lookups.add(1, {"outcome": "hit"})
+                return CacheHit(exact.answer, exact.question, 1.0)
+            candidates = list(entries.values())
+
+        # Embedding and scoring happen outside the lock; the index is small and bounded
+        vector = self.embedder.embed(question)
+        constraints = constraint_tokens(question)
+        best, best_score = None, self.threshold
+        for entry in candidates:
+            if entry.constraints != constraints:
+                continue
+            score = cosine(vector, entry.vector)
+            if score >= best_score:
+                best, best_score = entry, score
+        cache_lookups.add(1, {"outcome": "hit" if best else "miss"})
+        if best is None:
+            return None
+        best_key = best.question.strip().lower()
+        with self._lock:
+            if best_key in entries:
+                entries.move_to_end(best_key)
+        return CacheHit(best.answer, best.question, best_score)
+
+    def store(self, scope: Hashable, question: str, answer: str) -> None:
+        entry = CacheEntry(question, self.embedder.embed(question), constraint_tokens(question),
+                           answer, time.time())
+        key = question.strip().lower()
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries is None:
+                entries = self._scopes[scope] = OrderedDict()
+                while len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            self._scopes.move_to_end(scope)
+            entries[key] = entry
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def _expire(self, entries: "OrderedDict[str, CacheEntry]") -> None:
+        if self.ttl <= 0:
+            return
+        cutoff = time.time() - self.ttl
+        for key in [k for k, e in entries.items() if e.stored_at < cutoff]:
+            del entries[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "embedder": getattr(self.embedder, "name", type(self.embedder).__name__),
+                "embedder_fallback": getattr(self.embedder, "fallback", None) is not None,
+                "threshold": self.threshold,
+                "scopes": len(self._scopes),
+                "entries": sum(len(e) for e in self._scopes.values()),
+            }
+
+
+semantic_cache: Optional[SemanticCache] = (
+    SemanticCache(load_embedder()) if SEMANTIC_CACHE_ENABLED else None
+)
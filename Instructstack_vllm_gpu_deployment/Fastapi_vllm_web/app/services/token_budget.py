@@ -0,0 +1,170 @@
+"""
+Token Budget
+
+Checks each request against the model's context window before it is routed, so
+an oversized request fails fast at the gateway instead of taking a vLLM sequence
+slot first:
+
+    prompt tokens >= MAX_MODEL_LEN                 rejected
+    prompt tokens + max_tokens > MAX_MODEL_LEN     max_tokens clamped to what fits
+                                                   (or rejected with CONTEXT_OVERFLOW=reject)
+
+Prompts are counted with the model's own tokenizer (`tokenizer.json` under
+TOKENIZER_DIR, loaded once per model) when the `tokenizers` package and the file
+are available, otherwise estimated with tiktoken plus a safety margin. Tokenizers
+are loaded by the startup warm-up (services/warmup.py), not on the first request.
+
+With ADAPTIVE_MAX_TOKENS=true, max_tokens is also capped at a high quantile of the
+output lengths seen for the model and prompt type (times ADAPTIVE_HEADROOM), so
+vLLM reserves KV cache for the answers it actually produces. Truncated outputs are
+recorded at their cap, so the cap grows back if it starts cutting answers short.
+
+Configuration (environment variables):
+    MAX_MODEL_LEN                  Context window of the served models (default: 2048)
+    CONTEXT_OVERFLOW               "clamp" or "reject" requests that don't fit (default: clamp)
+    TOKENIZER_DIR                  Directory holding <model>/tokenizer.json (default: /models)
+    TOKEN_ESTIMATE_MARGIN          Extra fraction added to tiktoken estimates (default: 0.15)
+    ADAPTIVE_MAX_TOKENS            Cap max_tokens from observed output lengths (default: false)
+    ADAPTIVE_QUANTILE              Output-length quantile used for the cap (default: 0.99)
+    ADAPTIVE_HEADROOM              Multiplier applied to that quantile (default: 1.25)
+    ADAPTIVE_MIN_SAMPLES           Outputs observed before the cap applies (default: 50)
+    ADAPTIVE_WINDOW                Recent outputs kept per model and prompt type (default: 1000)
+"""
+
+import logging
+import math
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Tuple
+
+import logfire
+
+from services.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+MAX_MODEL_LEN = int(os.getenv("MAX_MODEL_LEN", "2048"))
+CONTEXT_OVERFLOW = os.getenv("CONTEXT_OVERFLOW", "clamp").lower()
+TOKENIZER_DIR = os.getenv("TOKENIZER_DIR", "/models")
+TOKEN_ESTIMATE_MARGIN = float(os.getenv("TOKEN_ESTIMATE_MARGIN", "0.15"))
+ADAPTIVE_MAX_TOKENS = os.getenv("ADAPTIVE_MAX_TOKENS", "false").lower() == "true"
+ADAPTIVE_QUANTILE = float(os.getenv("ADAPTIVE_QUANTILE", "0.99"))
+ADAPTIVE_HEADROOM = float(os.getenv("ADAPTIVE_HEADROOM", "1.25"))
+ADAPTIVE_MIN_SAMPLES = int(os.getenv("ADAPTIVE_MIN_SAMPLES", "50"))
+ADAPTIVE_WINDOW = int(os.getenv("ADAPTIVE_WINDOW", "1000"))
+
+budget_actions = logfire.metric_counter("llm.budget.actions", unit="1",
+                                        description="Requests clamped or rejected by the token budget, by action")
+
+PROMPT_TOO_LONG = "❌ Prompt too long"
+
+
+class ModelTokenizer:
+    """Uniform `name` / `encode()` over a Hugging Face tokenizer or a tiktoken encoding."""
+
+    def __init__(self, name: str, encode, exact: bool):
+        self.name = name
+        self.encode = encode
+        self.exact = exact  # False for tiktoken estimates of a different model's tokenizer
+
+
+@lru_cache(maxsize=32)
+def get_model_tokenizer(model_name: str) -> ModelTokenizer:
+    """Load the model's tokenizer once; fall back to tiktoken when it isn't available."""
+    path = os.path.join(TOKENIZER_DIR, model_name, "tokenizer.json")
+    if os.path.isfile(path):
+        try:
+            # Imported lazily: optional dependency
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(path)
+            return ModelTokenizer(model_name, lambda text: tokenizer.encode(text, add_special_tokens=False).ids, True)
+        except ImportError:
+            logger.warning("tokenizers is not installed; estimating prompt tokens with tiktoken",
+                           extra={"model": model_name})
+        except Exception as e:
+            logger.warning("Could not load model tokenizer", extra={"model": model_name, "error": str(e)})
+    # Imported lazily: only needed without the model's own tokenizer
+    import tiktoken
+    try:
+        encoding = tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return ModelTokenizer(encoding.name, encoding.encode, False)
+
+
+@dataclass
+class BudgetDecision:
+    max_tokens: int
+    error: Optional[str] = None
+
+
+class OutputLengthHistory:
+    """Recent completion lengths per (model, prompt type), for adaptive max_tokens."""
+
+    def __init__(self, window: int = ADAPTIVE_WINDOW):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, kind: str, output_tokens: int) -> None:
+        with self._lock:
+            samples = self._samples.get((model, kind))
+            if samples is None:
+                samples = self._samples[(model, kind)] = deque(maxlen=self.window)
+            samples.append(output_tokens)
+
+    def cap(self, model: str, kind: str) -> Optional[int]:
+        """max_tokens cap from the recent quantile, or None until enough outputs were seen."""
+        with self._lock:
+            samples: List[int] = list(self._samples.get((model, kind), ()))
+        if len(samples) < ADAPTIVE_MIN_SAMPLES:
+            return None
+        quantile = percentile(samples, ADAPTIVE_QUANTILE * 100)
+        return max(1, math.ceil(quantile * ADAPTIVE_HEADROOM))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {f"{model}:{kind}": len(samples) for (model, kind), samples in self._samples.items()}
+
+
+output_history = OutputLengthHistory()
+
+
+def plan(model: str, kind: str, prompt_tokens: int, max_tokens: int, exact: bool = True) -> BudgetDecision:
+    """
+    Fit a request into the context window.
+
+    Args:
+        model: Gateway model name
+        kind: Prompt type ("sql" or "text", see services/generation_profiles.py)
+        prompt_tokens: Prompt length as counted by the gateway
+        max_tokens: Requested completion budget
+        exact: Whether prompt_tokens came from the model's own tokenizer
+
+    Returns:
+        BudgetDecision: The max_tokens to send, or an error for requests that cannot be served
+    """
+    if not exact:
+        prompt_tokens = math.ceil(prompt_tokens * (1 + TOKEN_ESTIMATE_MARGIN))
+    if ADAPTIVE_MAX_TOKENS:
+        cap = output_history.cap(model, kind)
+        if cap is not None and cap < max_tokens:
+            budget_actions.add(1, {"action": "adaptive"})
+            max_tokens = cap
+
+    available = MAX_MODEL_LEN - prompt_tokens
+    if available < 1:
+        budget_actions.add(1, {"action": "rejected"})
+        return BudgetDecision(0, f"{PROMPT_TOO_LONG}: about {prompt_tokens} tokens, "
+                                 f"the model's context is {MAX_MODEL_LEN}")
+    if max_tokens > available:
+        if CONTEXT_OVERFLOW == "reject":
+            budget_actions.add(1, {"action": "rejected"})
+            return BudgetDecision(0, f"{PROMPT_TOO_LONG}: about {prompt_tokens} prompt tokens + {max_tokens} "
+                                     f"max_tokens exceed the model's context of {MAX_MODEL_LEN}")
+        budget_actions.add(1, {"action": "clamped"})
+        max_tokens = available
+    return BudgetDecision(max_tokens)
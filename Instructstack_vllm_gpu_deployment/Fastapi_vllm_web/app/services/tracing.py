@@ -0,0 +1,53 @@
+"""
+Tracing Configuration
+
+Sets up OpenTelemetry tracing through Logfire and exposes helpers for propagating
+trace context to vLLM. Spans are exported to Logfire when LOGFIRE_TOKEN is set and,
+optionally, to a local OTLP collector (Jaeger, Tempo, otel-collector, ...).
+
+Configuration (environment variables):
+    TRACE_SAMPLE_RATE          Head sampling ratio for new traces, 0.0-1.0 (default: 1.0)
+    TRACE_COLLECTOR_ENDPOINT   OTLP/HTTP traces endpoint, e.g. http://otel-collector:4318/v1/traces
+    ENVIRONMENT                Deployment environment attached to every span (default: production)
+"""
+
+import os
+from typing import Dict
+
+import logfire
+from opentelemetry import propagate
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_COLLECTOR_ENDPOINT = os.getenv("TRACE_COLLECTOR_ENDPOINT", "")
+
+
+def configure_tracing() -> None:
+    """Configure Logfire/OpenTelemetry with sampling and an optional local collector."""
+    processors = []
+    if TRACE_COLLECTOR_ENDPOINT:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        processors.append(BatchSpanProcessor(OTLPSpanExporter(endpoint=TRACE_COLLECTOR_ENDPOINT)))
+
+    logfire.configure(
+        service_name="llm-fastapi",        # override default name
+        environment=os.getenv("ENVIRONMENT", "production"),
+        additional_span_processors=processors or None,
+        sampling=logfire.SamplingOptions(head=TRACE_SAMPLE_RATE),
+    )
+
+
+def trace_headers() -> Dict[str, str]:
+    """
+    W3C trace context headers for the current span.
+
+    Passing these on upstream calls lets vLLM (started with --otlp-traces-endpoint)
+    attach its own spans to the gateway's trace.
+
+    Returns:
+        Dict[str, str]: `traceparent` / `tracestate` headers, empty outside a span
+    """
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    return carrier
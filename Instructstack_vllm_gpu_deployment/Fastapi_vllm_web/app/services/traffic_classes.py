@@ -0,0 +1,500 @@
+"""
+Traffic Classes
+
+Interactive requests (the UI, API clients) and background load (batch jobs, load
+tests) share the same vLLM sequence slots (`--max-num-seqs`). Without separation a
+batch run fills every slot and interactive latency collapses. With
+TRAFFIC_CONTROL_ENABLED=true the gateway admits requests to a model's replicas per
+traffic class:
+
+- Slots: each model gets TRAFFIC_SLOTS_PER_REPLICA slots per reachable replica. Set
+  it to the replicas' max-num-seqs so requests queue on the gateway, where queue
+  time is visible per class, instead of inside vLLM.
+- Reserved capacity and borrowing: a class may always use its reserved share of
+  the slots. Beyond that it may borrow idle slots up to its limit, as long as the
+  unused reservations of the other classes stay free. By default interactive
+  traffic reserves half of the slots and may use all of them; batch traffic
+  reserves none and may borrow up to half.
+- Queueing: requests that cannot be admitted wait, highest priority class first
+  and first-come-first-served within a class. Interactive requests waiting longer
+  than TRAFFIC_INTERACTIVE_MAX_WAIT are rejected with 503.
+- SLO protection: when an interactive request has waited longer than
+  TRAFFIC_INTERACTIVE_SLO_MS, no new batch work is dispatched for the next
+  TRAFFIC_PAUSE_HOLD seconds. With TRAFFIC_PREEMPT=true, in-flight batch
+  generations are also cancelled, newest first, one per waiting interactive
+  request. Closing the upstream request makes vLLM free the sequence, and the batch
+  request is requeued without using up a retry.
+
+Batch jobs (services/batch_jobs.py) and load tests (services/load_test.py) always
+run as batch. HTTP requests are classified by API key (TRAFFIC_API_KEYS, matched
+against `Authorization: Bearer` or `X-API-Key`), then by the `X-Traffic-Class`
+header, then by path prefix (TRAFFIC_ROUTE_CLASSES), and are interactive otherwise.
+Only the gateway's own batch work can be preempted; batch-class HTTP requests are
+held back by the pause and their limit but not cancelled.
+
+Per-class metrics: `traffic.requests` (by outcome), `traffic.queue_wait_ms`,
+`traffic.in_flight`, `traffic.waiting` and `traffic.slo_breaches`. Current values are
+on /status under "traffic" and on /traffic (api/traffic_routes.py), which can also
+pause and resume a class by hand.
+
+Configuration (environment variables):
+    TRAFFIC_CONTROL_ENABLED         Admit requests per traffic class (default: false)
+    TRAFFIC_SLOTS_PER_REPLICA       Sequence slots per replica (default: MAX_NUM_SEQS, or 10)
+    TRAFFIC_INTERACTIVE_RESERVED    Share of slots reserved for interactive traffic (default: 0.5)
+    TRAFFIC_INTERACTIVE_LIMIT       Largest share of slots interactive traffic may use (default: 1.0)
+    TRAFFIC_INTERACTIVE_SLO_MS      Interactive queue-wait SLO (default: 500)
+    TRAFFIC_INTERACTIVE_MAX_WAIT    Seconds an interactive request may wait for a slot (default: 30)
+    TRAFFIC_BATCH_RESERVED          Share of slots reserved for batch traffic (default: 0)
+    TRAFFIC_BATCH_LIMIT             Largest share of slots batch traffic may use (default: 0.5)
+    TRAFFIC_PREEMPT                 Cancel and requeue in-flight batch work on an SLO breach (default: true)
+    TRAFFIC_PAUSE_HOLD              Seconds batch dispatch stays paused after a breach (default: 5)
+    TRAFFIC_CHECK_INTERVAL          Seconds between SLO checks (default: 0.1)
+    TRAFFIC_API_KEYS                JSON object of API key -> class (default: none)
+    TRAFFIC_ROUTE_CLASSES           JSON object of path prefix -> class (default: none)
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+import logfire
+from opentelemetry.metrics import Observation
+
+from services.capacity import CapacityModel, capacity_model
+from services.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+TRAFFIC_CONTROL_ENABLED = os.getenv("TRAFFIC_CONTROL_ENABLED", "false").lower() == "true"
+TRAFFIC_SLOTS_PER_REPLICA = int(os.getenv("TRAFFIC_SLOTS_PER_REPLICA", os.getenv("MAX_NUM_SEQS", "10")))
+TRAFFIC_INTERACTIVE_RESERVED = float(os.getenv("TRAFFIC_INTERACTIVE_RESERVED", "0.5"))
+TRAFFIC_INTERACTIVE_LIMIT = float(os.getenv("TRAFFIC_INTERACTIVE_LIMIT", "1.0"))
+TRAFFIC_INTERACTIVE_SLO_MS = float(os.getenv("TRAFFIC_INTERACTIVE_SLO_MS", "500"))
+TRAFFIC_INTERACTIVE_MAX_WAIT = float(os.getenv("TRAFFIC_INTERACTIVE_MAX_WAIT", "30"))
+TRAFFIC_BATCH_RESERVED = float(os.getenv("TRAFFIC_BATCH_RESERVED", "0"))
+TRAFFIC_BATCH_LIMIT = float(os.getenv("TRAFFIC_BATCH_LIMIT", "0.5"))
+TRAFFIC_PREEMPT = os.getenv("TRAFFIC_PREEMPT", "true").lower() == "true"
+TRAFFIC_PAUSE_HOLD = float(os.getenv("TRAFFIC_PAUSE_HOLD", "5"))
+TRAFFIC_CHECK_INTERVAL = float(os.getenv("TRAFFIC_CHECK_INTERVAL", "0.1"))
+TRAFFIC_API_KEYS = json.loads(os.getenv("TRAFFIC_API_KEYS", "") or "{}")
+TRAFFIC_ROUTE_CLASSES = json.loads(os.getenv("TRAFFIC_ROUTE_CLASSES", "") or "{}")
+
+# Queue waits kept per class for the /status percentiles
+QUEUE_WAIT_WINDOW = 500
+
+traffic_requests = logfire.metric_counter("traffic.requests", unit="1",
+                                          description="Requests by traffic class and admission outcome")
+traffic_queue_wait_ms = logfire.metric_histogram("traffic.queue_wait_ms", unit="ms",
+                                                 description="Time requests waited for a slot, by traffic class")
+traffic_slo_breaches = logfire.metric_counter("traffic.slo_breaches", unit="1",
+                                              description="Queue-wait SLO breaches, by traffic class")
+
+# Traffic class of the HTTP request being handled, read by `call_vllm_async` when it waits for a slot
+current_traffic_class: contextvars.ContextVar[str] = contextvars.ContextVar("traffic_class", default=INTERACTIVE)
+
+
+@dataclass
+class TrafficClass:
+    """Admission rules of one traffic class; shares are fractions of a model's slots."""
+    name: str
+    priority: int                       # Lower is dispatched first
+    reserved: float                     # Share no other class may use
+    limit: float                        # Largest share, including borrowed slots
+    slo_ms: Optional[float] = None      # Queue-wait SLO; a breach pauses and preempts lower-priority classes
+    max_wait_s: Optional[float] = None  # Requests waiting longer are rejected; None waits indefinitely
+    preemptible: bool = False
+
+
+@dataclass
+class Lease:
+    """One admitted request holding a slot."""
+    traffic_class: str
+    model: str
+    queue_ms: float = 0.0
+    granted_at: float = field(default_factory=time.monotonic)
+    active: bool = True
+    preempt_requested: bool = False
+    preempted: bool = False
+    cancel: Optional[Callable[[], None]] = field(default=None, repr=False)  # Set for preemptible async holders
+
+
+@dataclass
+class _Waiter:
+    traffic_class: TrafficClass
+    model: str
+    wake: Callable[[], None]
+    enqueued: float = field(default_factory=time.monotonic)
+    lease: Optional[Lease] = None
+
+
+@dataclass
+class ClassStats:
+    admitted: int = 0
+    rejected: int = 0
+    preempted: int = 0
+    slo_breaches: int = 0
+    queue_ms: Deque[float] = field(default_factory=lambda: deque(maxlen=QUEUE_WAIT_WINDOW))
+
+
+class TrafficController:
+    """Per-model slot accounting, class-aware queueing, batch pausing and preemption."""
+
+    def __init__(self, classes: List[TrafficClass], capacity: CapacityModel,
+                 slots_per_replica: int = TRAFFIC_SLOTS_PER_REPLICA, preempt: bool = TRAFFIC_PREEMPT,
+                 pause_hold: float = TRAFFIC_PAUSE_HOLD, check_interval: float = TRAFFIC_CHECK_INTERVAL):
+        self.classes = {c.name: c for c in sorted(classes, key=lambda c: c.priority)}
+        self.capacity = capacity
+        self.slots_per_replica = slots_per_replica
+        self.preempt = preempt
+        self.pause_hold = pause_hold
+        self.check_interval = check_interval
+        self.stats = {name: ClassStats() for name in self.classes}
+        self._in_use: Dict[str, Dict[str, int]] = {}
+        self._leases: Dict[str, List[Lease]] = {}
+        self._waiting: Dict[str, Dict[str, Deque[_Waiter]]] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._paused_manually: set = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._gauges_registered = False
+
+    def start(self) -> None:
+        """Start the SLO checks; call from the event loop (app startup)."""
+        self._register_gauges()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def resolve(self, name: Optional[str]) -> TrafficClass:
+        """The named class, or interactive for unknown names."""
+        return self.classes.get((name or "").lower()) or self.classes[INTERACTIVE]
+
+    def slots(self, model: str) -> int:
+        replicas = self.capacity.replicas.get(model, [])
+        # Before the first scrape nothing is reachable yet; assume every replica is
+        reachable = sum(1 for r in replicas if r.reachable) or len(replicas)
+        return reachable * self.slots_per_replica
+
+    def _paused(self, name: str, now: float) -> bool:
+        return name in self._paused_manually or self._paused_until.get(name, 0.0) > now
+
+    def _admissible(self, model: str, cls: TrafficClass, now: float) -> bool:
+        slots = self.slots(model)
+        used = self._in_use.setdefault(model, {})
+        total = sum(used.values())
+        if total >= slots or self._paused(cls.name, now):
+            return False
+        own = used.get(cls.name, 0)
+        if own < int(cls.reserved * slots):
+            return True
+        if own >= (max(1, int(cls.limit * slots)) if cls.limit > 0 else 0):
+            return False
+        # Borrowing leaves the other classes' unused reservations free
+        held = sum(max(0, int(other.reserved * slots) - used.get(other.name, 0))
+                   for other in self.classes.values() if other is not cls)
+        return slots - total > held
+
+    def _grant(self, waiter: _Waiter, now: float) -> Lease:
+        cls = waiter.traffic_class
+        lease = Lease(cls.name, waiter.model, queue_ms=(now - waiter.enqueued) * 1000, granted_at=now)
+        used = self._in_use.setdefault(waiter.model, {})
+        used[cls.name] = used.get(cls.name, 0) + 1
+        self._leases.setdefault(waiter.model, []).append(lease)
+        stats = self.stats[cls.name]
+        stats.admitted += 1
+        stats.queue_ms.append(lease.queue_ms)
+        traffic_requests.add(1, {"class": cls.name, "outcome": "admitted"})
+        traffic_queue_wait_ms.record(lease.queue_ms, {"class": cls.name})
+        waiter.lease = lease
+        return lease
+
+    def _dispatch(self, model: str, now: float) -> None:
+        """Grant slots to waiting requests, highest priority class first."""
+        queues = self._waiting.get(model, {})
+        for name, cls in self.classes.items():
+            queue = queues.get(name)
+            while queue and self._admissible(model, cls, now):
+                waiter = queue.popleft()
+                self._grant(waiter, now)
+                waiter.wake()
+
+    def _enqueue(self, model: str, cls: TrafficClass, wake: Callable[[], None]) -> _Waiter:
+        waiter = _Waiter(cls, model, wake)
+        with self._lock:
+            queue = self._waiting.setdefault(model, {}).setdefault(cls.name, deque())
+            if not queue and self._admissible(model, cls, waiter.enqueued):
+                self._grant(waiter, waiter.enqueued)
+            else:
+                queue.append(waiter)
+        return waiter
+
+    def _settle(self, waiter: _Waiter) -> Optional[Lease]:
+        """The waiter's lease, or None after taking it out of the queue (timed out or cancelled)."""
+        with self._lock:
+            if waiter.lease is None:
+                self._waiting[waiter.model][waiter.traffic_class.name].remove(waiter)
+                self.stats[waiter.traffic_class.name].rejected += 1
+                traffic_requests.add(1, {"class": waiter.traffic_class.name, "outcome": "rejected"})
+            return waiter.lease
+
+    async def acquire(self, model: str, name: str) -> Optional[Lease]:
+        """
+        Wait for a slot on the event loop.
+
+        Requests wait here rather than in a worker thread, so a queue of them holds no
+        threads. The lease may be released from any thread.
+
+        Args:
+            model: Base model whose replicas serve the request
+            name: Traffic class
+
+        Returns:
+            Optional[Lease]: The lease to release, or None when the class's max wait ran out
+        """
+        cls = self.resolve(name)
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enqueue(model, cls, wake)
+        if waiter.lease is None:
+            try:
+                await asyncio.wait_for(granted, cls.max_wait_s)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                lease = self._settle(waiter)
+                if lease is not None:
+                    self.release(lease)
+                raise
+        return self._settle(waiter)
+
+    def release(self, lease: Lease) -> None:
+        with self._lock:
+            if not lease.active:
+                return
+            lease.active = False
+            self._in_use[lease.model][lease.traffic_class] -= 1
+            self._leases[lease.model].remove(lease)
+            self._dispatch(lease.model, time.monotonic())
+
+    @asynccontextmanager
+    async def slot(self, model: str, name: str = BATCH):
+        """
+        Hold a slot for the body of an `async with` block.
+
+        If the class is preemptible, the block's task may be cancelled to free the slot
+        for higher-priority traffic. The cancellation is then absorbed here and
+        `lease.preempted` is set, so the caller can requeue the work. Yields None when
+        the class's max wait runs out.
+        """
+        cls = self.resolve(name)
+        lease = await self.acquire(model, cls.name)
+        if lease is None:
+            yield None
+            return
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+
+        def cancel_on_loop():
+            # Runs on the loop thread, so the block cannot finish between the check and the cancel
+            if lease.active:
+                lease.preempted = True
+                task.cancel()
+
+        if cls.preemptible:
+            lease.cancel = lambda: loop.call_soon_threadsafe(cancel_on_loop)
+        try:
+            yield lease
+        except asyncio.CancelledError:
+            if not lease.preempted:
+                raise
+            task.uncancel()
+            self.stats[cls.name].preempted += 1
+            traffic_requests.add(1, {"class": cls.name, "outcome": "preempted"})
+        finally:
+            self.release(lease)
+
+    def pause(self, name: str) -> None:
+        with self._lock:
+            self._paused_manually.add(self.resolve(name).name)
+
+    def resume(self, name: str) -> None:
+        with self._lock:
+            self._paused_manually.discard(self.resolve(name).name)
+            now = time.monotonic()
+            for model in list(self._waiting):
+                self._dispatch(model, now)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                self.check_slo()
+            except Exception:
+                logger.exception("Traffic class SLO check failed")
+
+    def check_slo(self) -> None:
+        """Pause, and optionally preempt, lower-priority classes while a class's queue wait is over its SLO."""
+        now = time.monotonic()
+        preempt: List[Lease] = []
+        with self._lock:
+            for cls in self.classes.values():
+                if cls.slo_ms is None:
+                    continue
+                breached = False
+                for model, queues in self._waiting.items():
+                    queue = queues.get(cls.name)
+                    if not queue or (now - queue[0].enqueued) * 1000 <= cls.slo_ms:
+                        continue
+                    breached = True
+                    if self.preempt:
+                        preempt.extend(self._victims(model, cls, len(queue)))
+                if not breached:
+                    continue
+                lower = [other.name for other in self.classes.values() if other.priority > cls.priority]
+                if not any(self._paused(name, now) for name in lower):
+                    self.stats[cls.name].slo_breaches += 1
+                    traffic_slo_breaches.add(1, {"class": cls.name})
+                    logger.warning("Traffic class queue wait over SLO, pausing lower-priority classes", extra={
+                        "traffic_class": cls.name, "slo_ms": cls.slo_ms, "paused": lower,
+                        "preempting": len(preempt)})
+                for name in lower:
+                    self._paused_until[name] = now + self.pause_hold
+            for lease in preempt:
+                lease.preempt_requested = True
+            # Pauses run out and replicas come back without a release to trigger dispatch
+            for model in list(self._waiting):
+                self._dispatch(model, now)
+        for lease in preempt:
+            lease.cancel()
+
+    def _victims(self, model: str, cls: TrafficClass, waiting: int) -> List[Lease]:
+        """Newest preemptible lower-priority leases, one per waiting request not already covered."""
+        pending = sum(1 for lease in self._leases.get(model, []) if lease.preempt_requested and lease.active)
+        candidates = [lease for lease in self._leases.get(model, [])
+                      if lease.cancel is not None and not lease.preempt_requested
+                      and self.classes[lease.traffic_class].priority > cls.priority]
+        candidates.sort(key=lambda lease: lease.granted_at, reverse=True)
+        return candidates[:max(0, waiting - pending)]
+
+    def _register_gauges(self) -> None:
+        if self._gauges_registered:
+            return
+        self._gauges_registered = True
+
+        def in_flight(_options):
+            for name in self.classes:
+                yield Observation(sum(used.get(name, 0) for used in self._in_use.values()), {"class": name})
+
+        def waiting(_options):
+            for name in self.classes:
+                yield Observation(sum(len(queues.get(name, ())) for queues in self._waiting.values()),
+                                  {"class": name})
+
+        logfire.metric_gauge_callback("traffic.in_flight", [in_flight],
+                                      description="Requests holding a slot, by traffic class")
+        logfire.metric_gauge_callback("traffic.waiting", [waiting],
+                                      description="Requests waiting for a slot, by traffic class")
+
+    def status(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            classes = {}
+            for name, cls in self.classes.items():
+                stats = self.stats[name]
+                waits = sorted(stats.queue_ms)
+
+                def pct(p: float) -> Optional[float]:
+                    value = percentile(waits, p)
+                    return round(value, 2) if value is not None else None
+
+                classes[name] = {
+                    "priority": cls.priority, "reserved": cls.reserved, "limit": cls.limit,
+                    "slo_ms": cls.slo_ms, "preemptible": cls.preemptible,
+                    "paused": self._paused(name, now),
+                    "in_flight": sum(used.get(name, 0) for used in self._in_use.values()),
+                    "waiting": sum(len(queues.get(name, ())) for queues in self._waiting.values()),
+                    "admitted": stats.admitted, "rejected": stats.rejected, "preempted": stats.preempted,
+                    "slo_breaches": stats.slo_breaches,
+                    "queue_ms": {"p50": pct(50), "p95": pct(95), "max": round(waits[-1], 2) if waits else None},
+                }
+            models = {model: {"slots": self.slots(model), "in_use": dict(self._in_use.get(model, {}))}
+                      for model in self.capacity.replicas}
+        return {"classes": classes, "models": models, "preempt": self.preempt}
+
+
+class TrafficClassMiddleware:
+    """Sets `current_traffic_class` for each HTTP request from its API key, header or path."""
+
+    def __init__(self, app, controller: Optional[TrafficController] = None):
+        self.app = app
+        self.controller = controller or traffic_control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_traffic_class.set(self.classify(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_traffic_class.reset(token)
+
+    def classify(self, scope) -> str:
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        api_key = headers.get("x-api-key") or headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if api_key and api_key in TRAFFIC_API_KEYS:
+            return self.controller.resolve(TRAFFIC_API_KEYS[api_key]).name
+        if "x-traffic-class" in headers:
+            return self.controller.resolve(headers["x-traffic-class"]).name
+        path = scope.get("path", "")
+        for prefix, name in TRAFFIC_ROUTE_CLASSES.items():
+            if path.startswith(prefix):
+                return self.controller.resolve(name).name
+        return INTERACTIVE
+
+
+def traffic_slot(model: str, name: str = BATCH):
+    """`async with` a slot of the class, or a no-op (yielding None) when traffic control is off."""
+    return traffic_control.slot(model, name) if traffic_control is not None else nullcontext()
+
+
+def build_traffic_controller() -> Optional[TrafficController]:
+    if not TRAFFIC_CONTROL_ENABLED:
+        return None
+    for name in list(TRAFFIC_API_KEYS.values()) + list(TRAFFIC_ROUTE_CLASSES.values()):
+        if name not in (INTERACTIVE, BATCH):
+            raise ValueError(f"Unknown traffic class {name!r}; expected {INTERACTIVE!r} or {BATCH!r}")
+    classes = [
+        TrafficClass(INTERACTIVE, priority=0, reserved=TRAFFIC_INTERACTIVE_RESERVED, limit=TRAFFIC_INTERACTIVE_LIMIT,
+                     slo_ms=TRAFFIC_INTERACTIVE_SLO_MS, max_wait_s=TRAFFIC_INTERACTIVE_MAX_WAIT),
+        TrafficClass(BATCH, priority=1, reserved=TRAFFIC_BATCH_RESERVED, limit=TRAFFIC_BATCH_LIMIT,
+                     preemptible=True),
+    ]
+    if sum(c.reserved for c in classes) > 1:
+        raise ValueError("Traffic class reservations add up to more than all slots")
+    return TrafficController(classes, capacity_model)
+
+
+traffic_control = build_traffic_controller()
@@ -1,10 +1,28 @@
+import asyncio
+import json
+import logging
 import requests
 import time
+from contextlib import nullcontext
+from typing import Callable, Dict, Optional, Tuple
+
 import logfire
-import tiktoken
 
-VLLM_API_URL_TEMPLATE = "http://vllm_server:{port}/v1/completions"
-VLLM_MODELS_URL_TEMPLATE = "http://vllm_server:{port}/v1/models"
+from vllm.config import VLLM_REQUEST_TIMEOUT
+from services.log_pipeline import should_sample, prompt_fields, elapsed_ms
+from services.tracing import trace_headers
+from services.capacity import capacity_model, is_replica_failure
+from services.semantic_cache import semantic_cache
+from services.request_store import request_store
+from services.lora_adapters import lora_adapters
+from services.traffic_classes import Lease, current_traffic_class, traffic_control
+from services.generation_profiles import SqlStatementEnd, apply_profile, prompt_type, tokens_saved
+from services import token_budget
+
+logger = logging.getLogger(__name__)
+
+VLLM_API_URL_TEMPLATE = "{base_url}/v1/completions"
+VLLM_MODELS_URL_TEMPLATE = "{base_url}/v1/models"
 
 llm_calls = logfire.metric_counter("llm.calls", unit="1",
                                     description="Total vLLM inference requests")
@@ -14,74 +32,321 @@ llm_out = logfire.metric_counter("llm.tokens.output", unit="tokens",
                                  description="Output tokens returned from vLLM")
 latency_ms = logfire.metric_histogram("llm.latency_ms", unit="ms",
                                       description="vLLM request latency")
+llm_rejected = logfire.metric_counter("llm.admission.rejected", unit="1",
+                                      description="Requests rejected because every replica was at capacity")
 
 
 def get_tokenizer_for_model(model_name: str):
-    try:
-        return tiktoken.encoding_for_model(model_name)
-    except KeyError:
-        return tiktoken.get_encoding("cl100k_base")
+    return token_budget.get_model_tokenizer(model_name)
+
+
+def error_status(result: str) -> Optional[int]:
+    """HTTP status for an error message returned by `call_vllm`, or None for generated text."""
+    if result.startswith((token_budget.PROMPT_TOO_LONG, "❌ Unknown model")):
+        return 400
+    if result.startswith("❌ All replicas"):
+        return 503
+    if result.startswith(("❌", "Request failed", "Unexpected error")):
+        return 502
+    return None
+
+
+def _stream_until_statement_end(url: str, payload: dict) -> Tuple[str, bool]:
+    """
+    Stream a completion and close the upstream request once a complete SQL statement has arrived.
+
+    Closing the connection makes vLLM abort the sequence instead of decoding the rest
+    of the max_tokens budget.
+
+    Returns:
+        Tuple[str, bool]: Generated text, and whether it was cut short
+    """
+    detector = SqlStatementEnd()
+    with requests.post(url, json={**payload, "stream": True}, headers=trace_headers(),
+                       timeout=VLLM_REQUEST_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            data = line[len(b"data: "):]
+            if data == b"[DONE]":
+                break
+            end = detector.feed(json.loads(data)["choices"][0]["text"])
+            if end is not None:
+                return detector.text[:end], True
+    return detector.text, False
+
+
+def _at_capacity(base_model: str) -> str:
+    return f"❌ All replicas of {base_model} are at capacity or unavailable, try again shortly"
+
+
+def call_vllm(payload: dict, queued_at: Optional[float] = None,
+              input_token_counter: Optional[Callable] = None, lease: Optional[Lease] = None) -> str:
+    """
+    Send a completion request to the vLLM server serving `payload["model"]`.
 
+    The request goes to the least-loaded replica of the model according to the
+    capacity model, and is rejected up front when every replica is at capacity.
+    Unset stop sequences and max_tokens come from the model's generation profile,
+    and Text2SQL completions are streamed and cut at the end of the SQL statement
+    (see services/generation_profiles.py). max_tokens is then fitted into the
+    model's context window, and prompts that cannot fit are rejected before they
+    reach vLLM (see services/token_budget.py). With the semantic cache enabled,
+    Text2SQL prompts similar enough to an already answered question are served
+    from the cache without calling vLLM. A model naming a LoRA adapter is served
+    by a replica of its base model, preferring one that already has the adapter
+    loaded (see services/lora_adapters.py). With traffic control on, callers go
+    through `call_vllm_async`, which waits for a slot of the request's traffic class
+    on the event loop and passes the lease in (see services/traffic_classes.py).
+    Each stage (routing, model check, upstream call, parsing, tokenization) is
+    recorded as a child span of `vllm.call`, and trace context is forwarded to vLLM.
 
-def call_vllm(payload: dict) -> str:
-    try:
-        llm_calls.add(1)
-        logfire.info("LLM call starting", model=payload.get("model"), payload_size=len(str(payload)))
+    Every call is recorded in the request store (see services/request_store.py)
+    without waiting on the disk.
 
-        model_name = payload["model"]
-        vllm_model_name = f"/models/{model_name}"
-        payload["model"] = vllm_model_name
+    Args:
+        payload: Completion request; `model` is the gateway model name
+        queued_at: `time.perf_counter()` when the request was queued, recorded as queue wait
+        input_token_counter: Counts the prompt's tokens given the model tokenizer, for callers
+            that can avoid re-tokenizing a known prefix (see services/schema_registry.py)
+        lease: Traffic class slot granted by `call_vllm_async`; released when the call ends
 
-        print(f"Original model: {model_name}")
-        print(f"Transformed model: {vllm_model_name}")
+    Returns:
+        str: Generated text, or an error message
+    """
+    start = time.perf_counter()
+    model_name, prompt = payload.get("model"), payload.get("prompt")
+    usage: Dict = {}
+    result = _call_vllm(payload, queued_at, input_token_counter, usage, lease)
+    _record_request(model_name, prompt, payload, result, usage, start)
+    return result
 
-        # Select port based on model
-        if model_name == "yasserrmd/Text2SQL-1.5B":
-            port = 8000
-        elif model_name == "premai-io/prem-1B-SQL":
-            port = 8001
-        else:
-            return f"❌ Unknown model: {model_name}"
 
-        # ✅ Check if the correct model is currently served on this port
+async def call_vllm_async(payload: dict, queued_at: Optional[float] = None,
+                          input_token_counter: Optional[Callable] = None) -> str:
+    """
+    `call_vllm` for the event loop: waits for a traffic class slot here, then runs the call in a worker thread.
+
+    Waiting for the slot on the event loop keeps queued requests out of the thread pool,
+    which they would otherwise hold for up to the class's max wait. There they would also
+    block the request store and LoRA loads, and sit in the executor's queue, where the
+    SLO checks and preemption can't see them.
+    """
+    lease = None
+    if traffic_control is not None:
+        model_name = payload.get("model")
+        adapter = lora_adapters.resolve(model_name) if lora_adapters is not None else None
+        base_model = adapter.base if adapter is not None else model_name
+        if base_model in capacity_model.replicas:
+            start = time.perf_counter()
+            traffic_class = current_traffic_class.get()
+            with logfire.span("vllm.admit", traffic_class=traffic_class):
+                lease = await traffic_control.acquire(base_model, traffic_class)
+            if lease is None:
+                llm_rejected.add(1)
+                result = _at_capacity(base_model)
+                _record_request(model_name, payload.get("prompt"), payload, result, {}, start)
+                return result
+    # Shielded: once admitted, the call runs to the end and releases the lease even if the client disconnects
+    return await asyncio.shield(asyncio.to_thread(call_vllm, payload, queued_at, input_token_counter, lease))
+
+
+def _record_request(model_name: Optional[str], prompt: Optional[str], payload: dict, result: str,
+                    usage: Dict, start: float) -> None:
+    if request_store is not None:
+        failed = error_status(result) is not None
+        request_store.record(
+            model=model_name,
+            kind=prompt_type(prompt),
+            replica=usage.get("replica"),
+            status="error" if failed else usage.get("status", "ok"),
+            error=result if failed else None,
+            prompt=prompt,
+            completion=None if failed else result,
+            max_tokens=payload.get("max_tokens"),
+            prompt_tokens=usage.get("input_tokens"),
+            completion_tokens=usage.get("output_tokens"),
+            latency_ms=(time.perf_counter() - start) * 1000,
+            upstream_ms=usage.get("upstream_ms"),
+            stopped_early=usage.get("stopped_early"),
+        )
+
+
+def _call_vllm(payload: dict, queued_at: Optional[float], input_token_counter: Optional[Callable],
+               usage: Dict, lease: Optional[Lease]) -> str:
+    """Body of `call_vllm`; fills `usage` (replica, token counts, upstream latency) for the request store."""
+    start = time.perf_counter()
+    sampled = should_sample()
+    model_name = payload.get("model")
+    replica = None
+    adapter = lora_adapters.resolve(model_name) if lora_adapters is not None else None
+    # Adapters share their base model's replicas, tokenizer, generation profile and context window
+    base_model = adapter.base if adapter is not None else model_name
+    early_stop = apply_profile(payload, base_model)
+    kind = prompt_type(payload.get("prompt"))
+    cache_key = semantic_cache.key_for(model_name, payload) if semantic_cache is not None else None
+    with logfire.span("vllm.call {model}", model=model_name) as call_span:
+        if queued_at is not None:
+            call_span.set_attribute("gateway.queue_wait_ms", round((start - queued_at) * 1000, 2))
         try:
-            resp = requests.get(VLLM_MODELS_URL_TEMPLATE.format(port=port), timeout=2)
-            if not (resp.status_code == 200 and model_name in resp.json()["data"][0]["id"]):
-                return f"❌ Model {model_name} is not currently loaded on port {port}"
-        except requests.exceptions.RequestException as e:
-            return f"❌ Could not connect to vLLM server on port {port}: {str(e)}"
+            if cache_key is not None:
+                with logfire.span("vllm.semantic_cache") as cache_span:
+                    hit = semantic_cache.lookup(*cache_key)
+                    cache_span.set_attribute("cache.hit", hit is not None)
+                if hit is not None:
+                    call_span.set_attribute("cache.similarity", round(hit.similarity, 4))
+                    usage["status"] = "cached"
+                    return hit.answer
 
-        # Send request if model check passed
-        VLLM_API_URL = VLLM_API_URL_TEMPLATE.format(port=port)
-        response = requests.post(VLLM_API_URL, json=payload, timeout=60)
-        response.raise_for_status()
+            llm_calls.add(1)
 
-        latency = response.elapsed.total_seconds() * 1000
-        latency_ms.record(latency)
+            # vLLM serves a loaded adapter under its adapter name
+            vllm_model_name = adapter.name if adapter is not None else f"/models/{model_name}"
+            payload["model"] = vllm_model_name
 
-        text = response.json()["choices"][0]["text"].strip()
+            if sampled:
+                logfire.info("LLM call starting", model=model_name,
+                             prompt_chars=len(payload.get("prompt") or ""))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("LLM call starting", extra={
+                        "model": model_name,
+                        "vllm_model": vllm_model_name,
+                        "max_tokens": payload.get("max_tokens"),
+                        **prompt_fields(payload.get("prompt", "")),
+                    })
 
-        encoding = get_tokenizer_for_model(model_name)
+            if lease is not None:
+                call_span.set_attribute("traffic.class", lease.traffic_class)
+                call_span.set_attribute("traffic.queue_wait_ms", round(lease.queue_ms, 2))
 
-        input_tokens = len(encoding.encode(payload.get("prompt", "") or ""))
-        output_tokens = len(encoding.encode(text))
+            # Pick the least-loaded replica serving this model
+            with logfire.span("vllm.route"):
+                if adapter is not None:
+                    replica = lora_adapters.select_replica(adapter)
+                else:
+                    replica = capacity_model.select_replica(model_name)
+            if replica is None:
+                if base_model not in capacity_model.replicas:
+                    return f"❌ Unknown model: {model_name}"
+                llm_rejected.add(1)
+                return _at_capacity(base_model)
+            call_span.set_attribute("vllm.replica", replica.base_url)
+            usage["replica"] = replica.base_url
 
-        llm_in.add(input_tokens)
-        llm_out.add(output_tokens)
+            # Fit max_tokens into the context window before the request takes a sequence slot
+            with logfire.span("vllm.budget") as budget_span:
+                tokenizer = get_tokenizer_for_model(base_model)
+                if input_token_counter is not None:
+                    input_tokens = input_token_counter(tokenizer)
+                else:
+                    input_tokens = len(tokenizer.encode(payload.get("prompt", "") or ""))
+                budget = token_budget.plan(base_model, kind, input_tokens, payload["max_tokens"], tokenizer.exact)
+                budget_span.set_attribute("gen_ai.usage.input_tokens", input_tokens)
+                budget_span.set_attribute("gen_ai.request.max_tokens", budget.max_tokens)
+            usage["input_tokens"] = input_tokens
+            if budget.error:
+                return budget.error
+            payload["max_tokens"] = budget.max_tokens
 
-        gen_ai_attrs = {
-            "gen_ai.request.model": payload["model"],
-            "gen_ai.response.model": payload["model"],
-            "gen_ai.latency.ms": latency,
-            "gen_ai.usage.input_tokens": input_tokens,
-            "gen_ai.usage.output_tokens": output_tokens,
-            "gen_ai.usage.total_tokens": input_tokens + output_tokens,
-        }
+            # ✅ Check the model is served by this replica, unless a recent scrape already confirmed it
+            if not (replica.fresh and replica.model_loaded):
+                with logfire.span("vllm.model_check", replica=replica.base_url):
+                    try:
+                        resp = requests.get(VLLM_MODELS_URL_TEMPLATE.format(base_url=replica.base_url),
+                                            headers=trace_headers(), timeout=2)
+                        if not (resp.status_code == 200 and base_model in resp.json()["data"][0]["id"]):
+                            replica.record_result(False)
+                            return f"❌ Model {base_model} is not currently loaded on {replica.base_url}"
+                    except requests.exceptions.RequestException as e:
+                        replica.record_result(False)
+                        return f"❌ Could not connect to vLLM server at {replica.base_url}: {str(e)}"
 
-        logfire.info("LLM completion", **gen_ai_attrs)
-        return text
+            # Load the adapter on this replica unless it is already resident; from here until the
+            # response, the adapter is marked in flight so it can't be unloaded
+            in_use = nullcontext()
+            if adapter is not None:
+                call_span.set_attribute("lora.adapter", adapter.name)
+                try:
+                    in_use = lora_adapters.ensure_loaded(replica, adapter)
+                except RuntimeError as e:
+                    replica.record_result(False)
+                    return f"❌ Could not load LoRA adapter {adapter.name} on {replica.base_url}: {e}"
 
-    except requests.exceptions.RequestException as e:
-        return f"Request failed: {str(e)}"
-    except Exception as e:
-        return f"Unexpected error: {str(e)}"
+            # Send request if model check passed
+            VLLM_API_URL = VLLM_API_URL_TEMPLATE.format(base_url=replica.base_url)
+            stopped_early = False
+            with logfire.span("vllm.upstream", url=VLLM_API_URL, max_tokens=payload.get("max_tokens"),
+                              stream=early_stop):
+                with replica.track_inflight(), in_use:
+                    if early_stop:
+                        upstream_start = time.perf_counter()
+                        text, stopped_early = _stream_until_statement_end(VLLM_API_URL, payload)
+                        latency = (time.perf_counter() - upstream_start) * 1000
+                    else:
+                        response = requests.post(VLLM_API_URL, json=payload, headers=trace_headers(),
+                                                 timeout=VLLM_REQUEST_TIMEOUT)
+                if not early_stop:
+                    response.raise_for_status()
+                    latency = response.elapsed.total_seconds() * 1000
+
+            latency_ms.record(latency)
+            usage["upstream_ms"] = latency
+
+            with logfire.span("vllm.parse"):
+                text = (text if early_stop else response.json()["choices"][0]["text"]).strip()
+
+            with logfire.span("vllm.tokenize") as token_span:
+                output_tokens = len(tokenizer.encode(text))
+                token_span.set_attribute("gen_ai.usage.output_tokens", output_tokens)
+            usage["output_tokens"] = output_tokens
+            usage["stopped_early"] = stopped_early
+            token_budget.output_history.record(base_model, kind, output_tokens)
+
+            replica.record_result(True, latency)
+            if stopped_early:
+                # Decode steps left in the budget when the stream was closed
+                saved = max(0, payload["max_tokens"] - output_tokens)
+                tokens_saved.add(saved)
+                call_span.set_attribute("gen_ai.early_stop.saved_tokens", saved)
+            if cache_key is not None and text:
+                semantic_cache.store(*cache_key, text)
+            llm_in.add(input_tokens)
+            llm_out.add(output_tokens)
+            call_span.set_attribute("gen_ai.usage.input_tokens", input_tokens)
+            call_span.set_attribute("gen_ai.usage.output_tokens", output_tokens)
+            call_span.set_attribute("gen_ai.latency.ms", latency)
+
+            if sampled:
+                gen_ai_attrs = {
+                    "gen_ai.request.model": payload["model"],
+                    "gen_ai.response.model": payload["model"],
+                    "gen_ai.latency.ms": latency,
+                    "gen_ai.usage.input_tokens": input_tokens,
+                    "gen_ai.usage.output_tokens": output_tokens,
+                    "gen_ai.usage.total_tokens": input_tokens + output_tokens,
+                }
+                logfire.info("LLM completion", **gen_ai_attrs)
+                logger.info("LLM completion", extra={
+                    "model": model_name,
+                    "replica": replica.base_url,
+                    "latency_ms": round(latency, 2),
+                    "total_ms": elapsed_ms(start),
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                })
+            return text
+
+        except requests.exceptions.RequestException as e:
+            call_span.record_exception(e)
+            if replica is not None and is_replica_failure(e):
+                replica.record_result(False)
+            logger.warning("vLLM request failed", extra={"model": model_name, "error": str(e)})
+            return f"Request failed: {str(e)}"
+        except Exception as e:
+            call_span.record_exception(e)
+            logger.exception("Unexpected error in vLLM call", extra={"model": model_name})
+            return f"Unexpected error: {str(e)}"
+        finally:
+            if lease is not None:
+                traffic_control.release(lease)
@@ -0,0 +1,97 @@
+"""
+Startup Warm-up
+
+Loads what the request path would otherwise load on first use (model tokenizers,
+the semantic cache's embedding model, compiled templates), in a background task
+that starts once the gateway is listening. The process answers `/health` right
+away; `/ready` stays 503 until warm-up has finished, so a new gateway replica only
+gets traffic once its first requests won't pay these costs.
+
+Steps run in order in a worker thread, so the event loop keeps serving while they
+load. A failed step is logged and skipped; its work then happens on first use.
+Step durations are shown on `/status`; `benchmarks/startup_profile.py` measures
+import time, time to `/health` and time to `/ready`.
+
+Configuration (environment variables):
+    WARMUP_ENABLED   Warm up in the background before reporting ready (default: true)
+    WARMUP_TIMEOUT   Seconds after which the gateway reports ready anyway (default: 60)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import logfire
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "60"))
+
+
+class Warmup:
+    """Named warm-up steps, run once in the background; `is_warm()` gates readiness."""
+
+    def __init__(self, enabled: bool = WARMUP_ENABLED, timeout: float = WARMUP_TIMEOUT):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.steps: List[Tuple[str, Callable[[], None]]] = []
+        self.durations: Dict[str, float] = {}
+        self.failed: Dict[str, str] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add_step(self, name: str, step: Callable[[], None]) -> None:
+        self.steps.append((name, step))
+
+    def is_warm(self) -> bool:
+        if not self.enabled or self.finished_at is not None:
+            return True
+        # A stuck step must not keep the replica out of rotation forever
+        return self.started_at is not None and time.monotonic() - self.started_at > self.timeout
+
+    def status(self) -> Dict:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return {
+            "enabled": self.enabled,
+            "warm": self.is_warm(),
+            "elapsed_s": round(elapsed, 3) if elapsed is not None else None,
+            "steps_ms": {name: round(1000 * s, 1) for name, s in self.durations.items()},
+            "failed": self.failed,
+        }
+
+    async def _run(self) -> None:
+        with logfire.span("gateway.warmup"):
+            for name, step in self.steps:
+                start = time.monotonic()
+                try:
+                    await asyncio.to_thread(step)
+                except Exception as e:
+                    self.failed[name] = str(e)
+                    logger.warning("Warm-up step failed", extra={"step": name, "error": str(e)})
+                self.durations[name] = time.monotonic() - start
+        self.finished_at = time.monotonic()
+        logger.info("Gateway warm", extra={"elapsed_s": round(self.finished_at - self.started_at, 3),
+                                           "steps_ms": self.status()["steps_ms"]})
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self.started_at = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+warmup = Warmup()
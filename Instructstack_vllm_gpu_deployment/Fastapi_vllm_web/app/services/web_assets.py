@@ -0,0 +1,61 @@
+"""
+Web Assets
+
+Static files, templates and JSON responses for the UI, set up for the request path:
+
+- Static assets are served with long-lived Cache-Control headers. Templates link
+  them through `asset_url()`, which appends a hash of the file's content, so a
+  changed file gets a new URL instead of a stale cached copy.
+- Templates are compiled once at startup and not re-checked on disk for every
+  render (TEMPLATE_AUTO_RELOAD=true restores reloading while editing them).
+- JSON responses are serialized with orjson when it is installed.
+
+Configuration (environment variables):
+    STATIC_MAX_AGE          Cache lifetime of static assets in seconds (default: 31536000)
+    TEMPLATE_AUTO_RELOAD    Re-read templates when they change on disk (default: false)
+"""
+
+import hashlib
+import importlib.util
+import os
+from functools import lru_cache
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+
+# ORJSONResponse needs the optional orjson package
+FastJSONResponse = ORJSONResponse if importlib.util.find_spec("orjson") else JSONResponse
+
+STATIC_DIR = "static"
+TEMPLATE_DIR = "templates"
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "31536000"))
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "false").lower() == "true"
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with a Cache-Control header; URLs from `asset_url()` change with the content."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        return response
+
+
+@lru_cache(maxsize=None)
+def asset_url(path: str) -> str:
+    """URL of a static file, versioned by its content hash."""
+    with open(os.path.join(STATIC_DIR, path), "rb") as f:
+        version = hashlib.md5(f.read()).hexdigest()[:10]
+    return f"/static/{path}?v={version}"
+
+
+templates = Jinja2Templates(directory=TEMPLATE_DIR)
+templates.env.auto_reload = TEMPLATE_AUTO_RELOAD
+templates.env.globals["asset_url"] = asset_url
+
+
+def precompile_templates() -> None:
+    """Compile every template into the environment's cache ahead of the first request."""
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
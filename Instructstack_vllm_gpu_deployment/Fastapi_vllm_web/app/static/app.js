@@ -0,0 +1,90 @@
+// vLLM Prompt Tester front end: generates through the JSON API without reloading
+// the page, and follows load test runs started from the concurrency form.
+// Without JavaScript the forms still post to /generate and /check-concurrency.
+
+(function () {
+    "use strict";
+
+    function setupGenerate() {
+        const form = document.getElementById("generate-form");
+        if (!form) {
+            return;
+        }
+        const box = document.getElementById("response-box");
+        const text = document.getElementById("response-text");
+        const button = form.querySelector('input[type="submit"]');
+
+        form.addEventListener("submit", async (event) => {
+            event.preventDefault();
+            const data = new FormData(form);
+            const body = {
+                model: data.get("model"),
+                prompt: data.get("prompt"),
+                max_tokens: data.get("max_tokens") ? Number(data.get("max_tokens")) : null,
+            };
+            button.disabled = true;
+            text.textContent = "Generating...";
+            box.hidden = false;
+            try {
+                const resp = await fetch("/api/generate", {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify(body),
+                });
+                const result = await resp.json();
+                text.textContent = resp.ok ? result.response : `Error: ${result.detail}`;
+            } catch (err) {
+                text.textContent = `Error: ${err}`;
+            } finally {
+                button.disabled = false;
+            }
+        });
+    }
+
+    function setupLoadTest() {
+        const box = document.getElementById("load-test");
+        if (!box) {
+            return;
+        }
+        const progress = document.getElementById("load-test-progress");
+        const events = new EventSource(`/load-tests/${box.dataset.runId}/events`);
+        events.addEventListener("progress", (e) => {
+            const p = JSON.parse(e.data);
+            progress.textContent = `Run ${p.id}: ${p.percent}% - ${p.completed} done, ` +
+                `${p.errors} errors, ${p.in_flight} in flight, ${p.elapsed_s}s`;
+        });
+        events.addEventListener("summary", (e) => {
+            events.close();
+            const run = JSON.parse(e.data);
+            const s = run.summary;
+            progress.textContent = `Run ${run.id} ${run.state} in ${run.elapsed_s}s`;
+            const rows = [
+                ["Requests", s.requests], ["Error rate", `${(100 * s.error_rate).toFixed(1)}%`],
+                ["Throughput", `${s.throughput_rps} req/s, ${s.output_tokens_per_sec} tokens/s`],
+                ["Latency p50 / p90 / p95 / p99 (ms)",
+                 [s.latency_ms.p50, s.latency_ms.p90, s.latency_ms.p95, s.latency_ms.p99].join(" / ")],
+                ["Latency mean / max (ms)", `${s.latency_ms.mean} / ${s.latency_ms.max}`],
+                ["Time to first token p50 / p95 / p99 (ms)",
+                 [s.ttft_ms.p50, s.ttft_ms.p95, s.ttft_ms.p99].join(" / ")],
+            ];
+            const table = document.getElementById("load-test-summary");
+            for (const [name, value] of rows) {
+                const row = table.insertRow();
+                row.insertCell().textContent = name;
+                row.insertCell().textContent = value;
+            }
+            table.hidden = false;
+            const list = document.getElementById("load-test-samples");
+            for (const line of run.samples) {
+                const item = document.createElement("li");
+                item.textContent = line;
+                list.appendChild(item);
+            }
+        });
+    }
+
+    document.addEventListener("DOMContentLoaded", () => {
+        setupGenerate();
+        setupLoadTest();
+    });
+})();
@@ -1,7 +1,30 @@
+import json
+import os
+
 VLLM_API_URL = "http://vllm_server:8000/v1/completions"
 
 AVAILABLE_MODELS = [
     "yasserrmd/Text2SQL-1.5B",
     "premai-io/prem-1B-SQL",
-    
+
 ]
+
+# Host serving the vLLM containers (override to point the gateway at a mock backend)
+VLLM_HOST = os.getenv("VLLM_HOST", "vllm_server")
+
+# Port each model is served on
+MODEL_PORT_MAPPING = {
+    "yasserrmd/Text2SQL-1.5B": int(os.getenv("VLLM_PORT", "8000")),
+    "premai-io/prem-1B-SQL": int(os.getenv("VLLM_PORT_1", "8001")),
+}
+
+# Seconds the gateway waits for a vLLM completion; clients retrying sooner should send an
+# Idempotency-Key (see services/idempotency.py)
+VLLM_REQUEST_TIMEOUT = float(os.getenv("VLLM_REQUEST_TIMEOUT", "60"))
+
+# Replica base URLs per model, e.g.
+# VLLM_BACKENDS='{"yasserrmd/Text2SQL-1.5B": ["http://vllm_server:8000", "http://vllm_server_2:8000"]}'
+# Defaults to one replica per model on VLLM_HOST / MODEL_PORT_MAPPING
+VLLM_BACKENDS = json.loads(os.getenv("VLLM_BACKENDS", "") or "{}") or {
+    model: [f"http://{VLLM_HOST}:{port}"] for model, port in MODEL_PORT_MAPPING.items()
+}
@@ -0,0 +1,98 @@
+"""
+vLLM Launch Profiles
+
+Named sets of `vllm serve` engine flags for the features that matter for our
+prompts, which share long schema prefixes:
+
+    prefix caching    KV-cache blocks of a prompt prefix already seen are reused, so only
+                      the new suffix (the question) is prefilled
+    chunked prefill   long prefills are split into chunks of --max-num-batched-tokens and
+                      batched with running decodes, so one long prompt does not stall
+                      every other sequence's next token
+
+The vLLM containers take the flags from VLLM_PROFILE_ARGS (see docker-compose.yml),
+and autoscaled replicas use the same variable. benchmarks/prefix_cache_bench.py
+starts a server per profile to compare them. Flags are spelled out both ways
+(`--enable-x` / `--no-enable-x`), because newer vLLM versions turn both features on
+by default.
+
+Usage:
+    python vllm/launch_profiles.py                      # list the profiles
+    python vllm/launch_profiles.py prefix-cache --env   # the VLLM_PROFILE_ARGS line for .env
+
+Configuration (environment variables):
+    VLLM_PROFILE_ARGS             Flags of the profile in use (default: the prefix-cache-chunked flags)
+    VLLM_MAX_NUM_BATCHED_TOKENS   Tokens per engine step with chunked prefill (default: 2048)
+"""
+
+import argparse
+import os
+import shlex
+from dataclasses import dataclass
+from typing import List
+
+VLLM_MAX_NUM_BATCHED_TOKENS = int(os.getenv("VLLM_MAX_NUM_BATCHED_TOKENS", "2048"))
+
+
+@dataclass(frozen=True)
+class LaunchProfile:
+    name: str
+    description: str
+    prefix_caching: bool
+    chunked_prefill: bool
+
+    def args(self, max_num_batched_tokens: int = VLLM_MAX_NUM_BATCHED_TOKENS) -> List[str]:
+        """`vllm serve` flags of the profile."""
+        args = ["--enable-prefix-caching" if self.prefix_caching else "--no-enable-prefix-caching"]
+        if self.chunked_prefill:
+            args += ["--enable-chunked-prefill", "--max-num-batched-tokens", str(max_num_batched_tokens)]
+        else:
+            args.append("--no-enable-chunked-prefill")
+        return args
+
+
+LAUNCH_PROFILES = {
+    profile.name: profile for profile in (
+        LaunchProfile("baseline", "No prefix caching, no chunked prefill", False, False),
+        LaunchProfile("prefix-cache", "Reuse the KV cache of shared prompt prefixes", True, False),
+        LaunchProfile("chunked-prefill", "Split long prefills and batch them with decodes", False, True),
+        LaunchProfile("prefix-cache-chunked", "Both; the default for Text2SQL prompts", True, True),
+    )
+}
+DEFAULT_PROFILE = "prefix-cache-chunked"
+
+
+def profile_args(name: str = DEFAULT_PROFILE, max_num_batched_tokens: int = VLLM_MAX_NUM_BATCHED_TOKENS) -> List[str]:
+    """
+    `vllm serve` flags of a launch profile.
+
+    Raises:
+        ValueError: Unknown profile name
+    """
+    if name not in LAUNCH_PROFILES:
+        raise ValueError(f"Unknown launch profile {name!r}; choose from {', '.join(LAUNCH_PROFILES)}")
+    return LAUNCH_PROFILES[name].args(max_num_batched_tokens)
+
+
+def configured_args() -> str:
+    """Flags of the profile in use: VLLM_PROFILE_ARGS, or the default profile's."""
+    return os.getenv("VLLM_PROFILE_ARGS") or shlex.join(profile_args())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print vLLM launch profile flags")
+    parser.add_argument("profile", nargs="?", help="Profile to print; lists all when omitted")
+    parser.add_argument("--max-num-batched-tokens", type=int, default=VLLM_MAX_NUM_BATCHED_TOKENS)
+    parser.add_argument("--env", action="store_true", help="Print a VLLM_PROFILE_ARGS= line for .env")
+    args = parser.parse_args()
+
+    if args.profile is None:
+        for profile in LAUNCH_PROFILES.values():
+            print(f"{profile.name:<22} {profile.description}\n{'':<22} {shlex.join(profile.args())}")
+        return
+    flags = shlex.join(profile_args(args.profile, args.max_num_batched_tokens))
+    print(f"VLLM_PROFILE_ARGS={flags}" if args.env else flags)
+
+
+if __name__ == "__main__":
+    main()
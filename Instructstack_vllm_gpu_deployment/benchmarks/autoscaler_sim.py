@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Autoscaler Simulation
+
+Runs the gateway's autoscaler (Fastapi_vllm_web/app/services/autoscaler.py) in
+virtual time against a simulated container runtime and a synthetic load model,
+so scaling policies can be tuned without GPUs or Docker.
+
+The load model treats each replica as `--slots` concurrent sequences that take
+`--service-s` seconds each. Requests arriving while no replica is ready are
+rejected (which is what triggers a cold start). Latency is the service time plus
+the time spent queued behind the replicas that are up; gateway in-flight counts
+follow Little's law (serving rate x service time, plus the queue).
+
+Scenarios:
+    spike     steady low load, a 10x spike, then idle (scale-up, scale-down; scale-to-zero with --min-replicas 0)
+    diurnal   slow sinusoidal day/night cycle
+    bursty    idle periods broken by short bursts (exercises cold starts)
+
+Usage:
+    python benchmarks/autoscaler_sim.py --scenario spike
+    python benchmarks/autoscaler_sim.py --scenario bursty --min-replicas 0 --idle-timeout 300 --boot-s 90
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "Fastapi_vllm_web", "app")
+sys.path.insert(0, APP_DIR)
+
+from services.autoscaler import AUTOSCALER_INTERVAL, Autoscaler, ScalingPolicy  # noqa: E402
+from services.capacity import CapacityModel  # noqa: E402
+from services.stats import percentile  # noqa: E402
+
+MODEL = "yasserrmd/Text2SQL-1.5B"
+
+SCENARIOS: Dict[str, Callable[[float], float]] = {
+    # Requests per second at time t (seconds)
+    "spike": lambda t: 1.0 if t < 900 else 10.0 if t < 1800 else 1.0 if t < 2700 else 0.0,
+    "diurnal": lambda t: max(0.0, 4.0 + 4.0 * math.sin(2 * math.pi * t / 3600)),
+    "bursty": lambda t: 6.0 if (t % 1800) < 300 else 0.0,
+}
+
+
+class SimulatedRuntime:
+    """ContainerRuntime whose replicas become ready `boot_s` seconds of virtual time after starting."""
+
+    def __init__(self, clock: Callable[[], float], boot_s: float):
+        self.clock = clock
+        self.boot_s = boot_s
+        self.started: Dict[str, float] = {}
+        self.replica_seconds = 0.0
+        self._next_id = 0
+
+    def start_replica(self, model: str) -> str:
+        self._next_id += 1
+        base_url = f"http://sim-replica-{self._next_id}:8000"
+        self.started[base_url] = self.clock()
+        return base_url
+
+    def replica_ready(self, model: str, base_url: str) -> bool:
+        return self.clock() - self.started[base_url] >= self.boot_s
+
+    def stop_replica(self, base_url: str) -> None:
+        self.started.pop(base_url, None)
+
+    def list_replicas(self, model: str) -> List[str]:
+        return []
+
+
+def simulate(args) -> None:
+    rng = random.Random(args.seed)
+    now = 0.0
+    capacity = CapacityModel({MODEL: []})
+    runtime = SimulatedRuntime(lambda: now, args.boot_s)
+    policy = ScalingPolicy(
+        min_replicas=args.min_replicas,
+        max_replicas=args.max_replicas,
+        latency_slo_ms=args.slo_ms,
+        idle_timeout=args.idle_timeout,
+        scale_up_cooldown=args.up_cooldown,
+        scale_down_cooldown=args.down_cooldown,
+    )
+    autoscaler = Autoscaler(runtime, capacity, policy, models=[MODEL], clock=lambda: now)
+    rate_fn = SCENARIOS[args.scenario]
+    per_replica_rps = args.slots / args.service_s
+
+    # Start from the minimum, as a deployment would
+    for _ in range(args.min_replicas):
+        capacity.add_replica(MODEL, runtime.start_replica(MODEL))
+
+    backlog = 0.0
+    arrived = rejected = 0
+    latencies: List[float] = []
+    window: List[float] = []
+
+    print(f"{'time':>6} {'rps':>6} {'ready':>6} {'boot':>5} {'waiting':>8} {'p95 ms':>8}  events")
+    events_seen = 0
+    while now < args.duration:
+        replicas = capacity.replicas[MODEL]
+        arrivals = _poisson(rng, rate_fn(now) * args.step)
+        arrived += arrivals
+        if arrivals:
+            capacity.last_request[MODEL] = now
+        if not replicas:
+            rejected += arrivals
+            capacity.rejected[MODEL] = capacity.rejected.get(MODEL, 0) + arrivals
+        else:
+            backlog += arrivals
+
+        # Serve the backlog with the replicas that are up; by Little's law the
+        # sequences being decoded are the serving rate times the service time
+        served = min(backlog, len(replicas) * per_replica_rps * args.step)
+        backlog -= served
+        running = min(served / args.step * args.service_s, len(replicas) * args.slots)
+        queue_s = backlog / (len(replicas) * per_replica_rps) if replicas else 0.0
+        latency_ms = (args.service_s + queue_s) * 1000
+        for _ in range(int(round(served))):
+            latencies.append(latency_ms)
+            window.append(latency_ms)
+        for replica in replicas:
+            replica.requests_waiting = backlog / len(replicas)
+            replica.requests_running = running / len(replicas)
+            replica.inflight = int(math.ceil((running + backlog) / len(replicas)))
+            replica.model_loaded = True
+            if served:
+                replica.record_result(True, latency_ms)
+        # Replicas taken out of routing finish their in-flight work within one step
+        for replica, _ in autoscaler.draining.values():
+            replica.inflight = 0
+        runtime.replica_seconds += len(runtime.started) * args.step
+
+        if now % AUTOSCALER_INTERVAL < args.step:
+            autoscaler.tick(now)
+        if now % args.report_every < args.step:
+            new_events = autoscaler.events[events_seen:]
+            events_seen = len(autoscaler.events)
+            print(f"{now:>6.0f} {rate_fn(now):>6.1f} {len(capacity.replicas[MODEL]):>6} "
+                  f"{len(autoscaler.pending):>5} {backlog:>8.1f} {percentile(window, 95, 0.0):>8.0f}  "
+                  + ", ".join(f"{e.action}" for e in new_events))
+            window.clear()
+        now += args.step
+
+    slo_misses = sum(1 for latency in latencies if latency > args.slo_ms)
+    print("\nSummary")
+    print(f"  requests:          {arrived} ({rejected} rejected while scaled to zero or booting)")
+    print(f"  latency p50/p95:   {percentile(latencies, 50, 0.0):.0f} / {percentile(latencies, 95, 0.0):.0f} ms")
+    print(f"  SLO misses:        {slo_misses} ({100 * slo_misses / max(1, len(latencies)):.1f}% over {args.slo_ms:.0f} ms)")
+    print(f"  replica-hours:     {runtime.replica_seconds / 3600:.2f}")
+    print("  scaling actions:   " + ", ".join(
+        f"{action}={sum(1 for e in autoscaler.events if e.action == action)}"
+        for action in ("start", "ready", "drain", "stop", "failed")))
+
+
+def _poisson(rng: random.Random, lam: float) -> int:
+    """Knuth's Poisson sampler; fine for the small per-step rates simulated here."""
+    if lam <= 0:
+        return 0
+    limit, k, p = math.exp(-lam), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the replica autoscaler against synthetic load")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="spike")
+    parser.add_argument("--duration", type=float, default=3600, help="Simulated seconds")
+    parser.add_argument("--step", type=float, default=1.0, help="Simulation step in seconds")
+    parser.add_argument("--report-every", type=float, default=60, help="Seconds between timeline rows")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--slots", type=int, default=10, help="Concurrent sequences per replica (max-num-seqs)")
+    parser.add_argument("--service-s", type=float, default=2.0, help="Seconds to serve one request")
+    parser.add_argument("--boot-s", type=float, default=120, help="Seconds for a replica to load its model")
+    parser.add_argument("--min-replicas", type=int, default=1)
+    parser.add_argument("--max-replicas", type=int, default=4)
+    parser.add_argument("--slo-ms", type=float, default=5000)
+    parser.add_argument("--idle-timeout", type=float, default=600)
+    parser.add_argument("--up-cooldown", type=float, default=60)
+    parser.add_argument("--down-cooldown", type=float, default=300)
+    simulate(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Response Compression Benchmark
+
+Measures the bandwidth / CPU trade-off of the gateway's response compression
+(Fastapi_vllm_web/app/services/compression.py) for each encoding and level, on
+payloads shaped like the gateway's real responses:
+
+    completion   /api/generate JSON with a long SQL answer
+    batch        Batch job results download (JSONL, 2000 lines)
+    page         The rendered home page
+    sse          Load test progress events, compressed and flushed one event at a time
+
+For each setting it reports the bytes sent, the compression ratio, the CPU time
+spent compressing per response, and the transfer time saved on a link of
+--link-mbps. Compression pays off when the time saved exceeds the CPU spent (and
+the gateway has CPU to spare at its peak request rate).
+
+Usage:
+    python benchmarks/compression_bench.py
+    python benchmarks/compression_bench.py --link-mbps 100 --settings gzip:1,gzip:6,br:4
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "Fastapi_vllm_web", "app")
+sys.path.insert(0, APP_DIR)
+
+from services.compression import brotli, make_encoder  # noqa: E402
+
+DEFAULT_SETTINGS = "gzip:1,gzip:6,gzip:9,br:1,br:4,br:8"
+
+SQL_ANSWER = (
+    "SELECT d.name AS department, COUNT(e.id) AS employees, AVG(e.salary) AS avg_salary, "
+    "MAX(e.hire_date) AS latest_hire FROM employees e JOIN departments d ON d.id = e.department_id "
+    "WHERE e.hire_date > '2020-01-01' AND e.salary BETWEEN 40000 AND 120000 "
+    "GROUP BY d.name HAVING COUNT(e.id) > 5 ORDER BY avg_salary DESC;"
+)
+
+
+def completion_payload(rng: random.Random) -> List[bytes]:
+    answer = " ".join([SQL_ANSWER] * 6)
+    return [json.dumps({"model": "yasserrmd/Text2SQL-1.5B", "response": answer}).encode()]
+
+
+def batch_payload(rng: random.Random) -> List[bytes]:
+    lines = []
+    for i in range(2000):
+        year = rng.choice([2015, 2018, 2020, 2022])
+        limit = rng.randint(1, 50)
+        text = f"SELECT name, salary FROM employees WHERE hire_date > '{year}-01-01' ORDER BY salary DESC LIMIT {limit};"
+        lines.append(json.dumps({"id": f"q-{i:06d}", "line": i, "text": text, "finish_reason": "stop"}))
+    return ["\n".join(lines).encode() + b"\n"]
+
+
+def page_payload(rng: random.Random) -> List[bytes]:
+    with open(os.path.join(APP_DIR, "templates", "index.html"), "rb") as f:
+        return [f.read()]
+
+
+def sse_payload(rng: random.Random) -> List[bytes]:
+    events = []
+    completed = errors = 0
+    for tick in range(240):
+        completed += rng.randint(0, 6)
+        errors += rng.random() < 0.05
+        progress = {"id": "3f9c2a1b7d4e", "state": "running", "completed": completed, "errors": errors,
+                    "in_flight": rng.randint(0, 32), "total": 1000, "percent": round(completed / 10, 1),
+                    "elapsed_s": round(tick * 0.5, 2)}
+        events.append(f"event: progress\ndata: {json.dumps(progress)}\n\n".encode())
+    return events
+
+
+PAYLOADS: Dict[str, Callable[[random.Random], List[bytes]]] = {
+    "completion": completion_payload,
+    "batch": batch_payload,
+    "page": page_payload,
+    "sse": sse_payload,
+}
+
+
+def compress(encoding: str, level: int, chunks: List[bytes]) -> int:
+    """Compress a response the way the middleware does; return the bytes sent."""
+    encoder = make_encoder(encoding, level)
+    if len(chunks) == 1:
+        return len(encoder.finish(chunks[0]))
+    sent = sum(len(encoder.compress(chunk, flush=True)) for chunk in chunks)
+    return sent + len(encoder.finish())
+
+
+def measure(encoding: str, level: int, chunks: List[bytes], min_time: float) -> Dict[str, float]:
+    """Bytes sent and CPU milliseconds per response for one setting."""
+    sent = compress(encoding, level, chunks)
+    runs = 0
+    start = time.process_time()
+    while True:
+        compress(encoding, level, chunks)
+        runs += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_time:
+            break
+    return {"bytes": sent, "cpu_ms": elapsed * 1000 / runs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bandwidth and CPU cost of response compression settings")
+    parser.add_argument("--settings", default=DEFAULT_SETTINGS, help="Comma-separated encoding:level pairs")
+    parser.add_argument("--link-mbps", type=float, default=20.0, help="Client link speed for transfer times")
+    parser.add_argument("--min-time", type=float, default=0.3, help="CPU seconds spent timing each setting")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    settings = []
+    for item in args.settings.split(","):
+        encoding, _, level = item.partition(":")
+        if encoding == "br" and brotli is None:
+            print(f"Skipping {item}: brotli is not installed")
+            continue
+        settings.append((encoding, int(level)))
+
+    transfer_ms = lambda size: size * 8 / (args.link_mbps * 1000)
+    print(f"Link: {args.link_mbps} Mbit/s (transfer time = bytes / link speed)\n")
+    header = (f"{'payload':<11} {'setting':<8} {'bytes':>9} {'ratio':>7} {'CPU ms':>8} "
+              f"{'xfer ms':>8} {'saved ms':>9} {'net ms':>8}")
+    print(header)
+    print("-" * len(header))
+    for name, build in PAYLOADS.items():
+        chunks = build(random.Random(args.seed))
+        raw = sum(len(chunk) for chunk in chunks)
+        print(f"{name:<11} {'none':<8} {raw:>9} {1.0:>7.2f} {0.0:>8.3f} {transfer_ms(raw):>8.2f} "
+              f"{0.0:>9.2f} {0.0:>8.2f}")
+        for encoding, level in settings:
+            m = measure(encoding, level, chunks, args.min_time)
+            saved = transfer_ms(raw) - transfer_ms(m["bytes"])
+            print(f"{'':<11} {f'{encoding}:{level}':<8} {m['bytes']:>9} {raw / m['bytes']:>7.2f} "
+                  f"{m['cpu_ms']:>8.3f} {transfer_ms(m['bytes']):>8.2f} {saved:>9.2f} {saved - m['cpu_ms']:>8.2f}")
+    print("\nnet ms = transfer time saved - CPU spent compressing (positive: compression pays off)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Gateway Overhead Benchmark
+
+Measures how much the FastAPI gateway adds on top of vLLM. The gateway is started
+against a mock vLLM backend (see mock_vllm.py) with a known latency, so anything
+above the mock's own latency is gateway overhead: template rendering, logging,
+tokenization and the extra `/v1/models` round trip.
+
+For every endpoint it reports:
+    - latency percentiles and overhead over the direct mock call
+    - gateway CPU time per request (from /proc/<pid>/stat, Linux only)
+    - a throughput ceiling across increasing concurrency levels
+    - peak Python allocations per request (tracemalloc, in-process)
+
+A saved baseline can be compared against, and the script exits with status 1 when
+a metric regresses by more than the threshold.
+
+Usage:
+    python benchmarks/gateway_overhead.py
+    # Save a baseline, then compare later runs against it:
+    python benchmarks/gateway_overhead.py --save-baseline baseline.json
+    python benchmarks/gateway_overhead.py --baseline baseline.json --threshold 0.2
+    # Store the run (with its latency samples and environment) for `results.py compare`:
+    python benchmarks/gateway_overhead.py --save-result --label orjson
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+from urllib.parse import urlencode
+
+import httpx
+
+from results import collect_environment, latency_series, percentile, save_run
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "Fastapi_vllm_web", "app")
+
+MODEL = "yasserrmd/Text2SQL-1.5B"
+PROMPT = (
+    "### Database Schema:\nTable: employees\nColumns: id, name, department_id, salary, hire_date\n\n"
+    "### Question:\nList all employees hired after 2020.\n\n### SQL:\n"
+)
+
+
+class JsonBody(dict):
+    """Request body sent as JSON instead of a form."""
+
+
+# Endpoints exercised on the gateway: name -> (method, path, form or JSON body)
+ENDPOINTS = {
+    "home": ("GET", "/", None),
+    "generate": ("POST", "/generate", {"model": MODEL, "prompt": PROMPT, "max_tokens": "32"}),
+    "api_gen": ("POST", "/api/generate", JsonBody(model=MODEL, prompt=PROMPT, max_tokens=32)),
+    "static": ("GET", "/static/style.css", None),
+    "metrics": ("GET", "/metrics", None),
+}
+
+# Endpoints that call the backend and so include the mock's own latency
+PROXIED = {"generate", "api_gen"}
+
+# Metrics where a higher value is an improvement; everything else is "lower is better"
+HIGHER_IS_BETTER = {"throughput_rps"}
+
+
+def free_port() -> int:
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float = 30.0) -> None:
+    """Poll a URL until it answers or the timeout expires."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def gateway_env(mock_port: int) -> Dict[str, str]:
+    """Environment pointing the gateway at the mock backend."""
+    env = dict(os.environ)
+    env.update({
+        "VLLM_HOST": "127.0.0.1",
+        "VLLM_PORT": str(mock_port),
+        "LOGFIRE_SEND_TO_LOGFIRE": env.get("LOGFIRE_SEND_TO_LOGFIRE", "false"),
+        "LOGFIRE_CONSOLE": "false",
+    })
+    return env
+
+
+def encode_body(form):
+    """Encoded request body and its content type (None for requests without a body)."""
+    if form is None:
+        return b"", None
+    if isinstance(form, JsonBody):
+        return json.dumps(form).encode(), "application/json"
+    return urlencode(form).encode(), "application/x-www-form-urlencoded"
+
+
+def process_cpu_seconds(pid: int):
+    """User + system CPU time of a process from /proc, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are fields 14 and 15 of stat(5); fields[0] here is field 3
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def timed_request(client: httpx.AsyncClient, method: str, url: str, form) -> float:
+    """Send one request and return its latency in milliseconds."""
+    body, content_type = encode_body(form)
+    start = time.perf_counter()
+    if content_type is not None:
+        resp = await client.request(method, url, content=body, headers={"Content-Type": content_type})
+    else:
+        resp = await client.request(method, url)
+    elapsed = (time.perf_counter() - start) * 1000
+    if resp.status_code >= 400:
+        raise RuntimeError(f"{method} {url} returned {resp.status_code}")
+    return elapsed
+
+
+async def measure_latency(base_url: str, method: str, path: str, form, requests: int,
+                          warmup: int) -> List[float]:
+    """Sequential latencies (concurrency 1) for one endpoint."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        for _ in range(warmup):
+            await timed_request(client, method, path, form)
+        return [await timed_request(client, method, path, form) for _ in range(requests)]
+
+
+async def measure_throughput(base_url: str, method: str, path: str, form, requests: int,
+                             concurrency: int) -> float:
+    """Requests per second with `concurrency` workers sharing `requests` requests."""
+    remaining = requests
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                await timed_request(client, method, path, form)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - start)
+
+
+async def _asgi_call(app, method: str, path: str, form) -> int:
+    """Drive one request through an ASGI app without a network client."""
+    body, content_type = encode_body(form)
+    headers = [(b"host", b"bench")]
+    if content_type is not None:
+        headers.append((b"content-type", content_type.encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "headers": headers,
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    done = asyncio.Event()
+    sent_body = False
+    status = {}
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            done.set()
+
+    await app(scope, receive, send)
+    return status.get("code", 0)
+
+
+async def _measure_allocations(requests: int) -> Dict[str, float]:
+    """Peak traced allocation per request for every endpoint (runs inside APP_DIR)."""
+    sys.path.insert(0, APP_DIR)
+    import main  # noqa: E402  (imported here so the env and cwd are already set)
+
+    app = main.app
+    results = {}
+    async with app.router.lifespan_context(app):
+        for name, (method, path, form) in ENDPOINTS.items():
+            for _ in range(5):
+                await _asgi_call(app, method, path, form)
+
+            tracemalloc.start()
+            peaks = []
+            for _ in range(requests):
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                await _asgi_call(app, method, path, form)
+                _, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+            tracemalloc.stop()
+            results[name] = statistics.mean(peaks) / 1024
+    return results
+
+
+def run_alloc_worker(args) -> None:
+    """Entry point of the in-process allocation worker subprocess."""
+    os.chdir(APP_DIR)
+    result = asyncio.run(_measure_allocations(args.alloc_requests))
+    print(json.dumps(result))
+
+
+def measure_allocations_subprocess(args, mock_port: int) -> Dict[str, float]:
+    """Run the allocation worker in its own interpreter so it does not skew timing."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--alloc-worker",
+           "--alloc-requests", str(args.alloc_requests)]
+    proc = subprocess.run(cmd, env=gateway_env(mock_port), capture_output=True, text=True, timeout=600)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Allocation worker failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(current: Dict, baseline: Dict, threshold: float, min_delta_ms: float) -> List[str]:
+    """
+    Compare a run against a baseline.
+
+    Args:
+        current: Metrics from this run, keyed by endpoint
+        baseline: Metrics from the baseline file
+        threshold: Allowed relative regression (0.2 = 20%)
+        min_delta_ms: Ignore latency changes smaller than this (noise floor)
+
+    Returns:
+        List[str]: Human-readable description of every regression found
+    """
+    regressions = []
+    for endpoint, metrics in current.items():
+        for metric, value in metrics.items():
+            base = baseline.get(endpoint, {}).get(metric)
+            if not base:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                change = (base - value) / base
+            else:
+                change = (value - base) / base
+                if metric.endswith("_ms") and value - base < min_delta_ms:
+                    continue
+            if change > threshold:
+                regressions.append(f"{endpoint}.{metric}: {base:.2f} -> {value:.2f} ({change:+.0%})")
+    return regressions
+
+
+def print_report(report: Dict) -> None:
+    """Print a summary table of the run."""
+    print("\n" + "=" * 78)
+    print("GATEWAY OVERHEAD BENCHMARK")
+    print("=" * 78)
+    cfg = report["config"]
+    print(f"Mock latency: {cfg['latency_ms']}ms, tokens/sec: {cfg['tokens_per_sec'] or 'instant'}, "
+          f"requests: {cfg['requests']}, concurrency levels: {cfg['concurrency']}")
+    print(f"Direct mock p50: {report['mock_direct']['p50_ms']:.2f}ms, "
+          f"p99: {report['mock_direct']['p99_ms']:.2f}ms\n")
+    header = (f"{'endpoint':<10} {'p50 ms':>9} {'p99 ms':>9} {'ovh p50':>9} {'ovh p99':>9} "
+              f"{'CPU ms':>9} {'max rps':>9} {'KiB/req':>9}")
+    print(header)
+    print("-" * len(header))
+    for name, m in report["endpoints"].items():
+        print(f"{name:<10} {m['p50_ms']:>9.2f} {m['p99_ms']:>9.2f} {m['overhead_p50_ms']:>9.2f} "
+              f"{m['overhead_p99_ms']:>9.2f} {m.get('cpu_ms_per_request', 0):>9.2f} "
+              f"{m['throughput_rps']:>9.1f} {m.get('alloc_peak_kib', 0):>9.1f}")
+
+
+async def run_benchmark(args, gateway_url: str, mock_url: str, gateway_pid: int) -> Dict:
+    """Collect latency, overhead and throughput metrics for every endpoint."""
+    mock_payload = {"model": f"/models/{MODEL}", "prompt": PROMPT, "max_tokens": 32}
+    async with httpx.AsyncClient(timeout=60) as client:
+        mock_latencies = []
+        for i in range(args.requests + args.warmup):
+            start = time.perf_counter()
+            (await client.post(f"{mock_url}/v1/completions", json=mock_payload)).raise_for_status()
+            if i >= args.warmup:
+                mock_latencies.append((time.perf_counter() - start) * 1000)
+    mock_p50, mock_p99 = percentile(mock_latencies, 50, 0.0), percentile(mock_latencies, 99, 0.0)
+
+    endpoints = {}
+    samples = {"mock_direct": mock_latencies}
+    for name, (method, path, form) in ENDPOINTS.items():
+        cpu_before = process_cpu_seconds(gateway_pid)
+        latencies = await measure_latency(gateway_url, method, path, form, args.requests, args.warmup)
+        cpu_after = process_cpu_seconds(gateway_pid)
+        samples[name] = latencies
+        # Only the proxied endpoints pay the upstream latency; the others are pure overhead
+        upstream_p50, upstream_p99 = (mock_p50, mock_p99) if name in PROXIED else (0.0, 0.0)
+        rps = [await measure_throughput(gateway_url, method, path, form, args.requests, c)
+               for c in args.concurrency]
+        endpoints[name] = {
+            "p50_ms": percentile(latencies, 50, 0.0),
+            "p99_ms": percentile(latencies, 99, 0.0),
+            "overhead_p50_ms": percentile(latencies, 50, 0.0) - upstream_p50,
+            "overhead_p99_ms": percentile(latencies, 99, 0.0) - upstream_p99,
+            "throughput_rps": max(rps),
+            "throughput_by_concurrency": dict(zip(map(str, args.concurrency), rps)),
+        }
+        if cpu_before is not None and cpu_after is not None:
+            endpoints[name]["cpu_ms_per_request"] = (
+                (cpu_after - cpu_before) * 1000 / (args.requests + args.warmup))
+    return {"mock_direct": {"p50_ms": mock_p50, "p99_ms": mock_p99}, "endpoints": endpoints, "samples": samples}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure FastAPI gateway overhead against a mock vLLM")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per measurement")
+    parser.add_argument("--warmup", type=int, default=10, help="Warm-up requests per endpoint")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Mock backend latency")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="Mock decode rate (0 = instant)")
+    parser.add_argument("--alloc-requests", type=int, default=50, help="Requests per allocation measurement")
+    parser.add_argument("--skip-alloc", action="store_true", help="Skip the tracemalloc measurement")
+    parser.add_argument("--output", help="Write the full report as JSON")
+    parser.add_argument("--baseline", help="Baseline report to compare against")
+    parser.add_argument("--save-baseline", help="Save this run as a baseline report")
+    parser.add_argument("--save-result", action="store_true", help="Save this run to the benchmark results store")
+    parser.add_argument("--label", help="Label for the stored result")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Latency noise floor for regressions")
+    parser.add_argument("--alloc-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    if args.alloc_worker:
+        run_alloc_worker(args)
+        return
+
+    mock_port, gateway_port = free_port(), free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    gateway_url = f"http://127.0.0.1:{gateway_port}"
+
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "mock_vllm.py"), "--port", str(mock_port),
+             "--model", MODEL, "--latency-ms", str(args.latency_ms),
+             "--tokens-per-sec", str(args.tokens_per_sec)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(gateway_port), "--log-level", "warning"],
+            cwd=APP_DIR, env=gateway_env(mock_port),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+    ]
+    try:
+        wait_for(f"{mock_url}/v1/models")
+        wait_for(f"{gateway_url}/")
+        print(f"Mock vLLM on {mock_url}, gateway on {gateway_url}")
+
+        report = asyncio.run(run_benchmark(args, gateway_url, mock_url, processes[1].pid))
+        if not args.skip_alloc:
+            for name, kib in measure_allocations_subprocess(args, mock_port).items():
+                report["endpoints"][name]["alloc_peak_kib"] = kib
+    finally:
+        for proc in processes:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    report["config"] = {
+        "latency_ms": args.latency_ms,
+        "tokens_per_sec": args.tokens_per_sec,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+    }
+    samples = report.pop("samples")
+    print_report(report)
+    if args.save_result:
+        series = {f"{name}.latency": latency_series(values) for name, values in samples.items()}
+        path = save_run("gateway_overhead", {"mock_direct": report["mock_direct"], **report["endpoints"]},
+                        series, report["config"], collect_environment(), label=args.label)
+        print(f"\nResult saved to {path}")
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        scalar = lambda metrics: {k: v for k, v in metrics.items() if isinstance(v, (int, float))}
+        current = {name: scalar(m) for name, m in report["endpoints"].items()}
+        previous = {name: scalar(m) for name, m in baseline["endpoints"].items()}
+        regressions = compare(current, previous, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) above {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\n✅ No regressions above {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Mock vLLM Server
+
+A lightweight stand-in for the vLLM OpenAI-compatible API, so the FastAPI gateway,
+`concurrency_test.py` and the benchmarks can run without a GPU or network. It serves
+one model on `/v1/models`, `/v1/completions` (streamed and not), `/metrics` and
+`/health`, with a latency model shaped like vLLM's:
+
+    queueing    at most --max-num-seqs sequences run at once; the rest wait in order,
+                and show up as `vllm:num_requests_waiting`
+    prefill     --latency-ms fixed, plus --prefill-ms-per-token per prompt token
+    decode      --tokens-per-sec per sequence, one SSE event per --tokens-per-chunk tokens
+                when streaming (vLLM groups tokens with --stream-interval or speculative
+                decoding, so only `usage` gives the token count)
+    KV cache    prompt plus generated tokens of the running sequences, out of
+                --kv-cache-tokens, reported as `vllm:kv_cache_usage_perc`
+    prefix      with --enable-prefix-caching, full --block-size blocks of prompt tokens
+    caching     are cached (least recently used evicted beyond --kv-cache-tokens), and
+                the cached prefix of a prompt is not prefilled again; reported as
+                `vllm:prefix_cache_queries_total` / `vllm:prefix_cache_hits_total` and
+                in `usage.prompt_tokens_details.cached_tokens`
+
+Failures can be injected with --error-rate (an HTTP error instead of a completion)
+and --slow-rate/--slow-ms (an extra stall before prefill), and changed on a running
+server with `POST /mock/faults`, e.g. `{"error_rate": 1.0}` to take it down.
+
+Usage:
+    python mock_vllm.py --model yasserrmd/Text2SQL-1.5B --port 8000
+    # Or with custom latency:
+    python mock_vllm.py --latency-ms 50 --tokens-per-sec 200
+    # Like a real replica: 10 sequences at once, 0.2 ms prefill per prompt token, 40 tokens/s each
+    python mock_vllm.py --max-num-seqs 10 --prefill-ms-per-token 0.2 --tokens-per-sec 40
+    # 5% of requests fail with 500, 1% stall for 2 s (reproducible with --seed):
+    python mock_vllm.py --error-rate 0.05 --slow-rate 0.01 --slow-ms 2000 --seed 1
+    # Serve recorded vLLM metrics (re-read on every scrape, so the file can be swapped mid-run):
+    python mock_vllm.py --metrics-fixture fixtures/vllm_metrics_saturated.prom
+    # A model that rambles on after the SQL statement (exercises the gateway's early stop):
+    python mock_vllm.py --completion $'SELECT name FROM employees\\n\\nExplanation: this query lists ...'
+    # Runtime LoRA adapter loading (/v1/load_lora_adapter, /v1/unload_lora_adapter), 300 ms per load:
+    python mock_vllm.py --lora-load-ms 300
+    # Prefix caching, so shared prompt prefixes skip prefill (see prefix_cache_bench.py):
+    python mock_vllm.py --prefill-ms-per-token 0.2 --enable-prefix-caching
+    # Stream 4 tokens per SSE event, like vLLM with --stream-interval 4:
+    python mock_vllm.py --tokens-per-chunk 4
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+DEFAULT_MODEL = "yasserrmd/Text2SQL-1.5B"
+DEFAULT_COMPLETION = (
+    "SELECT name, salary FROM employees WHERE hire_date > '2020-01-01' "
+    "ORDER BY salary DESC"
+)
+# Upper bounds (seconds) of the latency histograms on /metrics
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FAULT_FIELDS = ("error_rate", "error_status", "slow_rate", "slow_ms")
+
+
+class Histogram:
+    """Cumulative Prometheus histogram."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def lines(self, labels: str) -> List[str]:
+        out = [f"# TYPE {self.name} histogram"]
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            out.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+        out.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {self.total}')
+        out.append(f"{self.name}_sum{{{labels}}} {self.sum}")
+        out.append(f"{self.name}_count{{{labels}}} {self.total}")
+        return out
+
+
+class PrefixCache:
+    """
+    Block-level prefix cache like vLLM's automatic prefix caching.
+
+    A block holds `block_size` prompt tokens and is identified by a hash of its tokens
+    and of every token before it, so a block only matches after an identical prefix.
+    """
+
+    def __init__(self, block_size: int, capacity_tokens: int):
+        self.block_size = block_size
+        self.capacity_blocks = max(1, capacity_tokens // block_size)
+        self.blocks: OrderedDict = OrderedDict()
+        self.queries = 0
+        self.hits = 0
+
+    def lookup(self, tokens: List[str]) -> int:
+        """Return how many leading tokens are cached, and cache the prompt's full blocks."""
+        cached = 0
+        matching = True
+        block_hash = None
+        for start in range(0, len(tokens) - len(tokens) % self.block_size, self.block_size):
+            block_hash = hash((block_hash, tuple(tokens[start:start + self.block_size])))
+            if matching and block_hash in self.blocks:
+                cached += self.block_size
+                self.blocks.move_to_end(block_hash)
+                continue
+            matching = False
+            self.blocks[block_hash] = None
+            if len(self.blocks) > self.capacity_blocks:
+                self.blocks.popitem(last=False)
+        # Like vLLM, the last prompt token is always computed to produce the first output token
+        cached = min(cached, max(0, len(tokens) - 1))
+        self.queries += len(tokens)
+        self.hits += cached
+        return cached
+
+
+class MockEngine:
+    """Sequence slots, KV-cache occupancy and the counters behind `/metrics`."""
+
+    def __init__(self, max_num_seqs: int, kv_cache_tokens: int, prefix_cache: Optional[PrefixCache] = None):
+        self.max_num_seqs = max_num_seqs
+        self.kv_cache_tokens = kv_cache_tokens
+        self.prefix_cache = prefix_cache
+        self.slots = asyncio.Semaphore(max_num_seqs) if max_num_seqs > 0 else None
+        self.running = 0
+        self.waiting = 0
+        self.kv_tokens = 0
+        self.prompt_tokens_total = 0
+        self.generation_tokens_total = 0
+        self.finished: Dict[str, int] = {}
+        self.ttft = Histogram("vllm:time_to_first_token_seconds")
+        self.e2e = Histogram("vllm:e2e_request_latency_seconds")
+        self.queue = Histogram("vllm:request_queue_time_seconds")
+
+    @asynccontextmanager
+    async def sequence(self, prompt_tokens: int):
+        """Hold a sequence slot (waiting for one if all are busy) and the prompt's KV cache."""
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            if self.slots is not None:
+                await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.queue.observe(time.perf_counter() - queued)
+        self.running += 1
+        self.kv_tokens += prompt_tokens
+        held = [prompt_tokens]
+        try:
+            yield held
+        finally:
+            self.running -= 1
+            self.kv_tokens -= held[0]
+            if self.slots is not None:
+                self.slots.release()
+
+    def metrics(self, model_id: str) -> str:
+        labels = f'model_name="{model_id}"'
+        usage = min(1.0, self.kv_tokens / self.kv_cache_tokens) if self.kv_cache_tokens > 0 else 0.0
+        lines = [
+            "# TYPE vllm:num_requests_running gauge",
+            f"vllm:num_requests_running{{{labels}}} {self.running}",
+            "# TYPE vllm:num_requests_waiting gauge",
+            f"vllm:num_requests_waiting{{{labels}}} {self.waiting}",
+            "# TYPE vllm:kv_cache_usage_perc gauge",
+            f"vllm:kv_cache_usage_perc{{{labels}}} {usage}",
+            "# TYPE vllm:prompt_tokens_total counter",
+            f"vllm:prompt_tokens_total{{{labels}}} {self.prompt_tokens_total}",
+            "# TYPE vllm:generation_tokens_total counter",
+            f"vllm:generation_tokens_total{{{labels}}} {self.generation_tokens_total}",
+            "# TYPE vllm:request_success_total counter",
+        ]
+        for reason, count in sorted(self.finished.items()):
+            lines.append(f'vllm:request_success_total{{{labels},finished_reason="{reason}"}} {count}')
+        if self.prefix_cache is not None:
+            lines += [
+                "# TYPE vllm:prefix_cache_queries_total counter",
+                f"vllm:prefix_cache_queries_total{{{labels}}} {self.prefix_cache.queries}",
+                "# TYPE vllm:prefix_cache_hits_total counter",
+                f"vllm:prefix_cache_hits_total{{{labels}}} {self.prefix_cache.hits}",
+            ]
+        for histogram in (self.ttft, self.e2e, self.queue):
+            lines.extend(histogram.lines(labels))
+        return "\n".join(lines) + "\n"
+
+
+def create_app(model: str = DEFAULT_MODEL, latency_ms: float = 20.0,
+               tokens_per_sec: float = 0.0, completion: str = DEFAULT_COMPLETION,
+               metrics_fixture: Optional[str] = None, lora_load_ms: float = 0.0,
+               prefill_ms_per_token: float = 0.0, max_num_seqs: int = 0, kv_cache_tokens: int = 65536,
+               error_rate: float = 0.0, error_status: int = 500, slow_rate: float = 0.0,
+               slow_ms: float = 0.0, seed: Optional[int] = None, enable_prefix_caching: bool = False,
+               block_size: int = 16, tokens_per_chunk: int = 1) -> FastAPI:
+    """
+    Build the mock vLLM application.
+
+    Args:
+        model: Model name served, reported as `/models/<model>` like the real containers
+            (requests may name it either way)
+        latency_ms: Fixed delay added to every completion
+        tokens_per_sec: Simulated decode rate per sequence; 0 disables the per-token delay
+        completion: Text returned for every completion (split into whitespace-prefixed "tokens")
+        metrics_fixture: Prometheus text file served on `/metrics` instead of the live metrics
+        lora_load_ms: Time `/v1/load_lora_adapter` takes; adapters are listed on `/v1/models`
+            with the base model as parent and can be named as the model, like vLLM with
+            `--enable-lora` and VLLM_ALLOW_RUNTIME_LORA_UPDATING=True
+        prefill_ms_per_token: Prefill time per prompt token (whitespace-separated words)
+        max_num_seqs: Sequences processed at once, like vLLM's --max-num-seqs; 0 = unlimited
+        kv_cache_tokens: KV-cache capacity in tokens, for `vllm:kv_cache_usage_perc`
+        error_rate: Fraction of completions answered with `error_status` instead
+        error_status: HTTP status of injected errors
+        slow_rate: Fraction of completions stalled for an extra `slow_ms`
+        slow_ms: Length of an injected stall
+        seed: Seed for the fault injection, for reproducible runs
+        enable_prefix_caching: Skip prefill for the cached prefix of each prompt
+        block_size: Tokens per prefix cache block, like vLLM's --block-size
+        tokens_per_chunk: Tokens per streamed SSE event, like vLLM's --stream-interval
+
+    Returns:
+        FastAPI: The mock application
+    """
+    app = FastAPI(title="Mock vLLM")
+    model_id = f"/models/{model}"
+    words = re.findall(r"\s*\S+", completion)
+    loras = {}
+    prefix_cache = PrefixCache(block_size, kv_cache_tokens) if enable_prefix_caching else None
+    engine = MockEngine(max_num_seqs, kv_cache_tokens, prefix_cache)
+    faults = {"error_rate": error_rate, "error_status": error_status, "slow_rate": slow_rate, "slow_ms": slow_ms}
+    rng = random.Random(seed)
+
+    @app.get("/health")
+    async def health():
+        return Response(status_code=200)
+
+    @app.get("/v1/models")
+    async def list_models():
+        data = [{"id": model_id, "object": "model", "owned_by": "vllm", "root": model_id, "parent": None}]
+        data += [{"id": name, "object": "model", "owned_by": "vllm", "root": path, "parent": model_id}
+                 for name, path in loras.items()]
+        return {"object": "list", "data": data}
+
+    # Same status codes and messages as vLLM's runtime LoRA API
+    @app.post("/v1/load_lora_adapter")
+    async def load_lora_adapter(body: dict):
+        name = body.get("lora_name")
+        if name in loras:
+            return JSONResponse(status_code=400, content={
+                "object": "error", "message": f"The lora adapter '{name}' has already been loaded."})
+        await asyncio.sleep(lora_load_ms / 1000)
+        loras[name] = body.get("lora_path")
+        return PlainTextResponse(f"Success: LoRA adapter '{name}' added successfully.")
+
+    @app.post("/v1/unload_lora_adapter")
+    async def unload_lora_adapter(body: dict):
+        name = body.get("lora_name")
+        if loras.pop(name, None) is None:
+            return JSONResponse(status_code=404, content={
+                "object": "error", "message": f"The lora adapter '{name}' cannot be found."})
+        return PlainTextResponse(f"Success: LoRA adapter '{name}' removed successfully.")
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        if metrics_fixture:
+            return Path(metrics_fixture).read_text()
+        return engine.metrics(model_id)
+
+    @app.get("/mock/faults")
+    async def get_faults():
+        return faults
+
+    @app.post("/mock/faults")
+    async def set_faults(body: dict):
+        """Change fault injection on the running server (fields as on the command line)."""
+        faults.update({key: type(faults[key])(value) for key, value in body.items() if key in FAULT_FIELDS})
+        return faults
+
+    def prefill_delay(prompt_tokens: int, cached_tokens: int = 0) -> float:
+        delay = (latency_ms + (prompt_tokens - cached_tokens) * prefill_ms_per_token) / 1000
+        if faults["slow_rate"] > 0 and rng.random() < faults["slow_rate"]:
+            delay += faults["slow_ms"] / 1000
+        return delay
+
+    def finish(start: float, first_token_at: Optional[float], reason: str) -> None:
+        end = time.perf_counter()
+        engine.finished[reason] = engine.finished.get(reason, 0) + 1
+        engine.e2e.observe(end - start)
+        engine.ttft.observe((first_token_at or end) - start)
+
+    def usage(prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> dict:
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if prefix_cache is not None:
+            usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+        return usage
+
+    async def stream(output, served_model: str, created: float, prompts: List[str], include_usage: bool):
+        # One SSE event per tokens_per_chunk tokens, like vLLM with "stream": true; a client disconnect
+        # stops decoding
+        start = time.perf_counter()
+        first_token_at = None
+        prompt_tokens = sum(len(p) for p in prompts)
+        async with engine.sequence(prompt_tokens) as held:
+            engine.prompt_tokens_total += prompt_tokens
+            # Looked up once the sequence is scheduled, like vLLM
+            cached_tokens = sum(prefix_cache.lookup(p) for p in prompts) if prefix_cache is not None else 0
+            await asyncio.sleep(prefill_delay(prompt_tokens, cached_tokens))
+            text = ""
+            for i, token in enumerate(output):
+                if tokens_per_sec > 0 and i:
+                    await asyncio.sleep(1 / tokens_per_sec)
+                first_token_at = first_token_at or time.perf_counter()
+                engine.generation_tokens_total += 1
+                engine.kv_tokens += 1
+                held[0] += 1
+                text += token if i else " " + token.lstrip(" ")
+                last = i == len(output) - 1
+                if (i + 1) % tokens_per_chunk and not last:
+                    continue
+                chunk = {"id": f"cmpl-mock-{int(created * 1000)}", "object": "text_completion",
+                         "created": int(created), "model": served_model,
+                         "choices": [{"index": 0, "text": text, "finish_reason": "length" if last else None}]}
+                text = ""
+                yield f"data: {json.dumps(chunk)}\n\n"
+        finish(start, first_token_at, "length")
+        if include_usage:
+            # stream_options.include_usage: a last chunk without choices
+            chunk = {"id": f"cmpl-mock-{int(created * 1000)}", "object": "text_completion",
+                     "created": int(created), "model": served_model, "choices": [],
+                     "usage": usage(prompt_tokens, cached_tokens, len(output))}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/completions")
+    async def completions(payload: dict):
+        created = time.time()
+        served_model = payload.get("model", model_id)
+        if served_model not in (model_id, model, *loras):
+            return JSONResponse(status_code=404, content={
+                "object": "error", "message": f"The model `{served_model}` does not exist."})
+        if faults["error_rate"] > 0 and rng.random() < faults["error_rate"]:
+            return JSONResponse(status_code=faults["error_status"], content={
+                "object": "error", "message": "Injected failure (mock_vllm --error-rate)"})
+        max_tokens = int(payload.get("max_tokens") or 16)
+        output = words[:max_tokens]
+        # Like vLLM, `prompt` may be a list; every prompt gets its own choice from one batched step
+        prompts = payload.get("prompt", "")
+        prompts = [str(p).split() for p in (prompts if isinstance(prompts, list) else [prompts])]
+        prompt_tokens = sum(len(p) for p in prompts)
+
+        if payload.get("stream"):
+            include_usage = bool((payload.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(stream(output, served_model, created, prompts, include_usage),
+                                     media_type="text/event-stream")
+
+        start = time.perf_counter()
+        async with engine.sequence(prompt_tokens) as held:
+            engine.prompt_tokens_total += prompt_tokens
+            cached_tokens = sum(prefix_cache.lookup(p) for p in prompts) if prefix_cache is not None else 0
+            delay = prefill_delay(prompt_tokens, cached_tokens)
+            if tokens_per_sec > 0:
+                delay += len(output) / tokens_per_sec
+            if delay > 0:
+                await asyncio.sleep(delay)
+            generated = len(output) * len(prompts)
+            engine.generation_tokens_total += generated
+            held[0] += generated
+        finish(start, None, "length")
+
+        return {
+            "id": f"cmpl-mock-{int(created * 1000)}",
+            "object": "text_completion",
+            "created": int(created),
+            "model": served_model,
+            "choices": [{"index": i, "text": " " + "".join(output).lstrip(" "), "finish_reason": "length"}
+                        for i in range(len(prompts))],
+            "usage": usage(prompt_tokens, cached_tokens, len(output) * len(prompts)),
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock vLLM server")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Model name to serve")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Fixed latency per completion")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.0, help="Prefill time per prompt token")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0,
+                        help="Simulated decode rate per sequence (0 = instant)")
+    parser.add_argument("--max-num-seqs", type=int, default=0, help="Sequences run at once; others queue (0 = no limit)")
+    parser.add_argument("--kv-cache-tokens", type=int, default=65536, help="KV-cache capacity in tokens")
+    parser.add_argument("--completion", default=DEFAULT_COMPLETION, help="Text returned for every completion")
+    parser.add_argument("--metrics-fixture", help="Recorded vLLM /metrics text to serve (see fixtures/)")
+    parser.add_argument("--lora-load-ms", type=float, default=0.0, help="Time to load a LoRA adapter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of completions that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status of injected failures")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of completions that stall")
+    parser.add_argument("--slow-ms", type=float, default=0.0, help="Length of an injected stall")
+    parser.add_argument("--seed", type=int, help="Seed for fault injection")
+    parser.add_argument("--enable-prefix-caching", action="store_true",
+                        help="Cache prompt prefix blocks and skip their prefill")
+    parser.add_argument("--block-size", type=int, default=16, help="Tokens per prefix cache block")
+    parser.add_argument("--tokens-per-chunk", type=int, default=1, help="Tokens per streamed SSE event")
+    args = parser.parse_args()
+
+    app = create_app(args.model, args.latency_ms, args.tokens_per_sec, args.completion,
+                     metrics_fixture=args.metrics_fixture, lora_load_ms=args.lora_load_ms,
+                     prefill_ms_per_token=args.prefill_ms_per_token, max_num_seqs=args.max_num_seqs,
+                     kv_cache_tokens=args.kv_cache_tokens, error_rate=args.error_rate,
+                     error_status=args.error_status, slow_rate=args.slow_rate, slow_ms=args.slow_ms,
+                     seed=args.seed, enable_prefix_caching=args.enable_prefix_caching,
+                     block_size=args.block_size, tokens_per_chunk=args.tokens_per_chunk)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
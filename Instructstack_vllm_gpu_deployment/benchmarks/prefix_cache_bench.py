@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Prefix Cache Benchmark
+
+Measures what prefix caching and chunked prefill buy for prompts that share a
+prefix, the way Text2SQL prompts share their schema. The workload generator builds
+prompts of --prompt-words words, of which a --sharing fraction is a prefix shared
+within one of --prefix-groups groups (a synthetic schema). The remaining words are
+unique per request (the question). Sharing 0 means every prompt is unique, and
+sharing 0.9 means 90% of every prompt is a prefix that was already seen. Requests
+of all groups are interleaved.
+
+Every request is streamed, and for each configuration and sharing ratio the script
+reports throughput (requests and output tokens per second), time to first token
+(TTFT) and end-to-end latency percentiles, and the prefix cache hit rate. The hit
+rate comes from `vllm:prefix_cache_hits_total` / `vllm:prefix_cache_queries_total`
+on /metrics, or from `usage.prompt_tokens_details` when the server reports it.
+
+Configurations:
+    --base-url URL          a running server (mock or real), run as one configuration
+                            named by --label
+    --mock                  starts mock_vllm.py twice, without and with
+                            --enable-prefix-caching (no GPU needed)
+    --launch PROFILES       starts `vllm serve --model-path` once per launch profile
+                            (see Fastapi_vllm_web/app/vllm/launch_profiles.py)
+
+Words are not tokens. Sizes are in whitespace-separated words, and the mock counts
+words as tokens. On a real server a word is about 1.3 tokens.
+
+Usage:
+    python benchmarks/prefix_cache_bench.py --mock
+    python benchmarks/prefix_cache_bench.py --mock --sharing 0,0.5,0.8,0.95 --concurrency 16 --requests 300
+    # Real server(s), one run each; compare the stored runs with results.py:
+    python benchmarks/prefix_cache_bench.py --base-url http://localhost:8000 --label prefix-cache --save-result
+    # Launch profiles on a local GPU:
+    python benchmarks/prefix_cache_bench.py --launch baseline,prefix-cache,prefix-cache-chunked \\
+        --model-path models/yasserrmd/Text2SQL-1.5B --extra-args "--gpu-memory-utilization 0.5"
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from results import collect_environment, latency_series, percentile, rate_series, save_run, windowed_rate
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "Fastapi_vllm_web", "app")
+# The app's `vllm` config directory would shadow an installed vLLM, so import the module directly
+sys.path.insert(0, os.path.join(APP_DIR, "vllm"))
+
+from launch_profiles import LAUNCH_PROFILES, profile_args  # noqa: E402
+
+MOCK_MODEL = "yasserrmd/Text2SQL-1.5B"
+SCHEMA_TYPES = ("INT", "TEXT", "DATE", "DECIMAL(10,2)", "BOOLEAN", "VARCHAR(255)")
+QUESTION_WORDS = ("list", "employees", "salary", "department", "hired", "after", "average", "total",
+                  "orders", "customers", "between", "highest", "count", "per", "region", "month")
+
+
+def schema_words(rng: random.Random, group: str, count: int) -> List[str]:
+    """A synthetic CREATE TABLE schema of `count` words."""
+    words = ["###", "Database", "Schema:"]
+    table = 0
+    while len(words) < count:
+        words += ["CREATE", "TABLE", f"{group}_t{table}", "("]
+        for column in range(rng.randint(4, 12)):
+            words += [f"c{column}_{rng.randrange(10 ** 6)}", rng.choice(SCHEMA_TYPES) + ","]
+        words.append(");")
+        table += 1
+    return words[:count]
+
+
+def build_workload(requests: int, prompt_words: int, sharing: float, groups: int,
+                   seed: int = 0) -> List[str]:
+    """
+    Prompts with a controlled shared-prefix ratio.
+
+    Args:
+        requests: Number of prompts
+        prompt_words: Length of every prompt in words
+        sharing: Fraction of each prompt that is its group's shared prefix (0 to 1)
+        groups: Number of distinct shared prefixes, e.g. database schemas
+        seed: Seed of the generator; the sharing ratio is mixed in, so prefixes of one
+            ratio never hit the cache entries of another on a long-running server
+
+    Returns:
+        List[str]: Prompts, groups interleaved in random order
+    """
+    rng = random.Random(f"{seed}-{sharing}")
+    prefix_words = int(round(prompt_words * sharing))
+    prefixes = [schema_words(rng, f"g{rng.randrange(10 ** 9)}", prefix_words) for _ in range(max(1, groups))]
+    prompts = []
+    for i in range(requests):
+        prefix = rng.choice(prefixes)
+        # The unique part starts with the request id, so nothing after the prefix matches
+        question = [f"Question{i}-{rng.randrange(10 ** 9)}:"]
+        question += [rng.choice(QUESTION_WORDS) for _ in range(max(0, prompt_words - prefix_words - 3))]
+        prompts.append(" ".join(prefix + question + ["###", "SQL:"]))
+    return prompts
+
+
+def scrape_prefix_cache(client: httpx.Client, base_url: str) -> Optional[Tuple[float, float]]:
+    """(queries, hits) from vLLM's prefix cache counters, or None when the server has none."""
+    try:
+        text = client.get(f"{base_url}/metrics", timeout=5).text
+    except httpx.HTTPError:
+        return None
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        for name in ("vllm:prefix_cache_queries_total", "vllm:prefix_cache_hits_total"):
+            if line.startswith(name):
+                values[name] = values.get(name, 0.0) + float(line.rsplit(" ", 1)[-1])
+    if len(values) < 2:
+        return None
+    return values["vllm:prefix_cache_queries_total"], values["vllm:prefix_cache_hits_total"]
+
+
+async def run_load(base_url: str, model: str, prompts: List[str], concurrency: int,
+                   max_tokens: int) -> Dict:
+    """Closed-loop load: `concurrency` workers stream the prompts in order."""
+    ttfts: List[float] = []
+    latencies: List[float] = []
+    end_times: List[float] = []
+    output_tokens = 0
+    prompt_tokens = 0
+    cached_tokens: Optional[int] = None
+    errors = 0
+    queue = iter(prompts)
+
+    async def one(client: httpx.AsyncClient, prompt: str) -> None:
+        nonlocal output_tokens, prompt_tokens, cached_tokens, errors
+        start = time.perf_counter()
+        first = None
+        usage = None
+        chunks = 0
+        try:
+            async with client.stream("POST", f"{base_url}/v1/completions", json={
+                    "model": model, "prompt": prompt, "max_tokens": max_tokens, "temperature": 0.0,
+                    "ignore_eos": True, "stream": True, "stream_options": {"include_usage": True}}) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    data = json.loads(line[len("data: "):])
+                    if data.get("choices"):
+                        first = first or time.perf_counter()
+                        chunks += 1
+                    usage = data.get("usage") or usage
+        except (httpx.HTTPError, ValueError, KeyError):
+            errors += 1
+            return
+        end = time.perf_counter()
+        ttfts.append(((first or end) - start) * 1000)
+        latencies.append((end - start) * 1000)
+        end_times.append(end)
+        output_tokens += (usage or {}).get("completion_tokens", chunks)
+        prompt_tokens += (usage or {}).get("prompt_tokens", len(prompt.split()))
+        details = (usage or {}).get("prompt_tokens_details") or {}
+        if "cached_tokens" in details:
+            cached_tokens = (cached_tokens or 0) + (details["cached_tokens"] or 0)
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for prompt in queue:
+            await one(client, prompt)
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=600) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "start": start, "elapsed": elapsed, "ttfts": ttfts, "latencies": latencies, "end_times": end_times,
+        "output_tokens": output_tokens, "prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens,
+        "errors": errors,
+    }
+
+
+def bench_config(name: str, base_url: str, args) -> List[Dict]:
+    """Run every sharing ratio against one server; returns one result per ratio."""
+    with httpx.Client() as client:
+        model = args.model or client.get(f"{base_url}/v1/models", timeout=10).json()["data"][0]["id"]
+        results = []
+        for sharing in args.sharing:
+            prompts = build_workload(args.requests, args.prompt_words, sharing, args.prefix_groups, args.seed)
+            before = scrape_prefix_cache(client, base_url)
+            run = asyncio.run(run_load(base_url, model, prompts, args.concurrency, args.max_tokens))
+            after = scrape_prefix_cache(client, base_url)
+            if before is not None and after is not None and after[0] > before[0]:
+                hit_rate = (after[1] - before[1]) / (after[0] - before[0])
+            elif run["cached_tokens"] is not None and run["prompt_tokens"]:
+                hit_rate = run["cached_tokens"] / run["prompt_tokens"]
+            else:
+                hit_rate = None
+            elapsed = run["elapsed"]
+            metrics = {
+                "requests_per_sec": len(run["latencies"]) / elapsed,
+                "output_tokens_per_sec": run["output_tokens"] / elapsed,
+                "prompt_tokens_per_sec": run["prompt_tokens"] / elapsed,
+                "ttft_p50_ms": percentile(run["ttfts"], 50, 0.0),
+                "ttft_p95_ms": percentile(run["ttfts"], 95, 0.0),
+                "latency_p50_ms": percentile(run["latencies"], 50, 0.0),
+                "latency_p95_ms": percentile(run["latencies"], 95, 0.0),
+                "prefix_cache_hit_rate": hit_rate,
+                "errors": run["errors"],
+            }
+            results.append({"config": name, "sharing": sharing, "metrics": metrics, "run": run})
+            print(f"  {name:<22} sharing {sharing:<5} {metrics['requests_per_sec']:>7.2f} req/s, "
+                  f"TTFT p50 {metrics['ttft_p50_ms']:.1f} ms")
+    return results
+
+
+def start_mock(port: int, prefix_caching: bool, args) -> subprocess.Popen:
+    cmd = [sys.executable, os.path.join(BENCH_DIR, "mock_vllm.py"), "--port", str(port), "--model", MOCK_MODEL,
+           "--latency-ms", str(args.mock_latency_ms), "--prefill-ms-per-token", str(args.mock_prefill_ms_per_token),
+           "--tokens-per-sec", str(args.mock_tokens_per_sec), "--max-num-seqs", str(args.mock_max_num_seqs)]
+    if prefix_caching:
+        cmd.append("--enable-prefix-caching")
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def start_vllm(profile: str, port: int, args) -> subprocess.Popen:
+    cmd = ["vllm", "serve", args.model_path, "--host", "127.0.0.1", "--port", str(port),
+           *profile_args(profile, args.max_num_batched_tokens), *shlex.split(args.extra_args)]
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(base_url: str, proc: subprocess.Popen, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server for {base_url} exited during startup (try running its command by hand)")
+        try:
+            if httpx.get(f"{base_url}/v1/models", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.time() > deadline:
+            raise RuntimeError(f"{base_url} not ready within {timeout}s")
+        time.sleep(0.5)
+
+
+def bench_launched(name: str, start, args) -> List[Dict]:
+    """Start a server with `start(port)`, run the sharing ratios against it, and stop it."""
+    base_url = f"http://127.0.0.1:{args.port}"
+    proc = start(args.port)
+    try:
+        wait_ready(base_url, proc, args.ready_timeout)
+        return bench_config(name, base_url, args)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_report(results: List[Dict]) -> None:
+    print("\n" + "=" * 110)
+    print("PREFIX CACHE BENCHMARK")
+    print("=" * 110)
+    print(f"{'config':<22} {'sharing':>7} {'req/s':>8} {'out tok/s':>10} {'TTFT p50':>9} {'TTFT p95':>9} "
+          f"{'e2e p50':>9} {'e2e p95':>9} {'hit rate':>9} {'errors':>7}")
+    for r in results:
+        m = r["metrics"]
+        hit = f"{m['prefix_cache_hit_rate']:.1%}" if m["prefix_cache_hit_rate"] is not None else "n/a"
+        print(f"{r['config']:<22} {r['sharing']:>7.2f} {m['requests_per_sec']:>8.2f} "
+              f"{m['output_tokens_per_sec']:>10.1f} {m['ttft_p50_ms']:>9.1f} {m['ttft_p95_ms']:>9.1f} "
+              f"{m['latency_p50_ms']:>9.1f} {m['latency_p95_ms']:>9.1f} {hit:>9} {m['errors']:>7}")
+
+    configs = list(dict.fromkeys(r["config"] for r in results))
+    if len(configs) < 2:
+        return
+    print(f"\nRelative to {configs[0]} (TTFT p50 speedup / throughput gain):")
+    baseline = {r["sharing"]: r["metrics"] for r in results if r["config"] == configs[0]}
+    for r in results:
+        base = baseline.get(r["sharing"])
+        if r["config"] == configs[0] or base is None:
+            continue
+        m = r["metrics"]
+        speedup = base["ttft_p50_ms"] / m["ttft_p50_ms"] if m["ttft_p50_ms"] else 0.0
+        gain = m["requests_per_sec"] / base["requests_per_sec"] - 1 if base["requests_per_sec"] else 0.0
+        print(f"  {r['config']:<22} sharing {r['sharing']:<5} TTFT {speedup:.2f}x, throughput {gain:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure TTFT and throughput for shared-prefix workloads")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--base-url", help="Benchmark a running vLLM or mock server")
+    target.add_argument("--mock", action="store_true", help="Compare the mock without and with prefix caching")
+    target.add_argument("--launch", help="Comma-separated launch profiles to start with `vllm serve`")
+    parser.add_argument("--label", default="server", help="Configuration name for --base-url")
+    parser.add_argument("--model", help="Model name to request (default: the first on /v1/models)")
+    parser.add_argument("--model-path", help="Model directory for --launch")
+    parser.add_argument("--extra-args", default="", help="Extra `vllm serve` arguments for --launch")
+    parser.add_argument("--max-num-batched-tokens", type=int, default=2048, help="Chunked prefill token budget")
+    parser.add_argument("--port", type=int, default=18200, help="Port for launched servers")
+    parser.add_argument("--ready-timeout", type=float, default=900.0, help="Seconds to wait for a launched server")
+    parser.add_argument("--sharing", default="0,0.5,0.9", help="Comma-separated shared-prefix fractions")
+    parser.add_argument("--prompt-words", type=int, default=800, help="Prompt length in words")
+    parser.add_argument("--prefix-groups", type=int, default=4, help="Distinct shared prefixes (schemas)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per sharing ratio")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    parser.add_argument("--max-tokens", type=int, default=32, help="Tokens generated per request")
+    parser.add_argument("--seed", type=int, default=0, help="Workload seed")
+    parser.add_argument("--mock-latency-ms", type=float, default=5.0, help="Mock fixed latency")
+    parser.add_argument("--mock-prefill-ms-per-token", type=float, default=0.05, help="Mock prefill cost")
+    parser.add_argument("--mock-tokens-per-sec", type=float, default=200.0, help="Mock decode rate")
+    parser.add_argument("--mock-max-num-seqs", type=int, default=8, help="Mock sequences at once")
+    parser.add_argument("--save-result", action="store_true", help="Save each run to the benchmark results store")
+    args = parser.parse_args()
+    args.sharing = [float(s) for s in args.sharing.split(",")]
+    if any(not 0 <= s <= 1 for s in args.sharing):
+        parser.error("--sharing values must be between 0 and 1")
+
+    if args.base_url:
+        results = bench_config(args.label, args.base_url.rstrip("/"), args)
+    elif args.mock:
+        results = []
+        for name, caching in (("mock", False), ("mock-prefix-cache", True)):
+            print(f"Running {name} ...")
+            results += bench_launched(name, lambda port: start_mock(port, caching, args), args)
+    else:
+        if not args.model_path:
+            parser.error("--launch needs --model-path")
+        results = []
+        for profile in [p for p in args.launch.split(",") if p]:
+            if profile not in LAUNCH_PROFILES:
+                parser.error(f"unknown launch profile {profile!r}; choose from {', '.join(LAUNCH_PROFILES)}")
+            print(f"Running {profile} ...")
+            results += bench_launched(profile, lambda port: start_vllm(profile, port, args), args)
+
+    print_report(results)
+    if args.save_result:
+        environment = collect_environment(args.base_url)
+        params = {key: value for key, value in vars(args).items() if key not in ("save_result",)}
+        for r in results:
+            run = r["run"]
+            series = {
+                "ttft": latency_series(run["ttfts"]),
+                "latency": latency_series(run["latencies"]),
+                "throughput": rate_series(windowed_rate(run["end_times"], run["start"])),
+            }
+            path = save_run("prefix_cache", r["metrics"], series, {**params, "config": r["config"],
+                            "sharing": r["sharing"]}, environment, label=f"{r['config']}-s{r['sharing']:g}")
+            print(f"Result saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
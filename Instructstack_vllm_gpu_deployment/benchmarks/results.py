@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+Benchmark Results Store
+
+Saves benchmark runs as versioned JSON files and compares them, so a performance
+regression in the gateway or a config change shows up before it is deployed.
+
+Every result file records:
+    - the metrics and the raw samples they came from (e.g. per-request latencies)
+    - the run's parameters (concurrency, max tokens, ...)
+    - the environment: git SHA and dirty state, host CPU, memory and GPUs, Python
+      version, the vLLM launch settings (VLLM_* variables) and the model served
+
+Runs are written to benchmarks/results/<benchmark>/<UTC time>-<git SHA>[-<label>].json.
+`concurrency_test.py` and `gateway_overhead.py --save-result` use this module.
+
+`compare` diffs a baseline run against one or more candidates. Latency percentiles
+and throughput get a bootstrap confidence interval for the change, and each sample
+series gets a Mann-Whitney U test for a shift in distribution. A change is only
+called a regression when it is statistically significant and larger than
+--threshold, so run-to-run noise does not fail a build.
+
+Usage:
+    python benchmarks/results.py list
+    python benchmarks/results.py compare benchmarks/results/concurrency/A.json benchmarks/results/concurrency/B.json
+    # Against the latest two runs of a benchmark, as HTML, failing on a regression:
+    python benchmarks/results.py compare --latest concurrency --format html --output report.html --fail-on-regression
+"""
+
+import argparse
+import glob
+import html
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "Fastapi_vllm_web", "app")
+# Appended, not prepended: the app's `vllm` config directory must not shadow an installed vLLM
+sys.path.append(APP_DIR)
+
+from services.stats import percentile  # noqa: E402  (re-exported for the benchmarks)
+
+RESULTS_DIR = os.getenv("BENCH_RESULTS_DIR", os.path.join(BENCH_DIR, "results"))
+SCHEMA_VERSION = 1
+
+# Environment variables recorded as launch parameters
+LAUNCH_ENV_PREFIXES = ("VLLM_", "GPU_", "CUDA_VISIBLE_DEVICES", "MAX_MODEL_LEN", "TENSOR_PARALLEL")
+# ... unless they look like credentials
+SECRET_MARKERS = ("KEY", "TOKEN", "SECRET", "PASSWORD")
+
+# Statistics compared for a sample series, by kind
+SERIES_STATS = {"latency": ("p50", "p95", "p99"), "rate": ("mean",)}
+
+
+def _run(cmd: List[str], cwd: Optional[str] = None) -> Optional[str]:
+    try:
+        proc = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+def _git_info() -> Dict:
+    sha = _run(["git", "rev-parse", "HEAD"], cwd=BENCH_DIR)
+    if sha is None:
+        return {}
+    return {
+        "sha": sha,
+        "branch": _run(["git", "rev-parse", "--abbrev-ref", "HEAD"], cwd=BENCH_DIR),
+        "dirty": bool(_run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCH_DIR)),
+    }
+
+
+def _cpu_info() -> Dict:
+    info = {"logical_cpus": os.cpu_count(), "model": platform.processor() or None}
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    info["model"] = line.split(":", 1)[1].strip()
+                    break
+        with open("/proc/meminfo") as f:
+            kib = int(f.readline().split()[1])
+        info["memory_gib"] = round(kib / 1024 ** 2, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return info
+
+
+def _gpu_info() -> List[Dict]:
+    out = _run(["nvidia-smi", "--query-gpu=name,memory.total,driver_version", "--format=csv,noheader,nounits"])
+    gpus = []
+    for line in (out or "").splitlines():
+        name, memory_mib, driver = [part.strip() for part in line.split(",")]
+        gpus.append({"name": name, "memory_mib": int(memory_mib), "driver": driver})
+    return gpus
+
+
+def describe_backend(base_url: str) -> Dict:
+    """
+    Ask a vLLM server which models it serves, for the run's metadata.
+
+    Args:
+        base_url: Server URL, e.g. http://localhost:8000 (a /v1/... path is stripped)
+
+    Returns:
+        Dict: Served model ids and their max_model_len, or {} when unreachable
+    """
+    base_url = base_url.split("/v1/", 1)[0].rstrip("/")
+    try:
+        with urllib.request.urlopen(f"{base_url}/v1/models", timeout=5) as resp:
+            data = json.load(resp).get("data", [])
+    except (OSError, ValueError):
+        return {}
+    return {"url": base_url, "models": [{"id": m.get("id"), "max_model_len": m.get("max_model_len")} for m in data]}
+
+
+def collect_environment(backend_url: Optional[str] = None) -> Dict:
+    """
+    Describe where and on what a benchmark ran.
+
+    Args:
+        backend_url: vLLM server to query for the served models (optional)
+
+    Returns:
+        Dict: Git, host, GPU, Python and launch-parameter metadata
+    """
+    launch = {name: value for name, value in sorted(os.environ.items())
+              if name.startswith(LAUNCH_ENV_PREFIXES) and not any(m in name for m in SECRET_MARKERS)}
+    env = {
+        "git": _git_info(),
+        "host": {"hostname": socket.gethostname(), "os": platform.platform(), "cpu": _cpu_info()},
+        "gpus": _gpu_info(),
+        "python": platform.python_version(),
+        "launch": launch,
+    }
+    if backend_url:
+        env["backend"] = describe_backend(backend_url)
+    return env
+
+
+def latency_series(values_ms: List[float]) -> Dict:
+    """A latency sample series (lower is better; compared on p50/p95/p99)."""
+    return {"kind": "latency", "unit": "ms", "values": list(values_ms)}
+
+
+def rate_series(values: List[float], unit: str = "req/s") -> Dict:
+    """A throughput sample series (higher is better; compared on the mean)."""
+    return {"kind": "rate", "unit": unit, "values": list(values)}
+
+
+def windowed_rate(end_times: List[float], start: float, windows: int = 10) -> List[float]:
+    """
+    Turn completion times into per-window throughput samples.
+
+    Args:
+        end_times: Completion time of every successful request (perf_counter seconds)
+        start: Start of the run, on the same clock
+        windows: Number of equal windows the run is split into
+
+    Returns:
+        List[float]: Completions per second in each window
+    """
+    if not end_times:
+        return []
+    window_s = (max(end_times) - start) / windows
+    if window_s <= 0:
+        return []
+    counts = [0] * windows
+    for t in end_times:
+        counts[min(windows - 1, int((t - start) / window_s))] += 1
+    return [count / window_s for count in counts]
+
+
+def save_run(benchmark: str, metrics: Dict, series: Dict[str, Dict], params: Dict,
+             environment: Optional[Dict] = None, label: Optional[str] = None,
+             results_dir: Optional[str] = None) -> str:
+    """
+    Write a benchmark run to the results store.
+
+    Args:
+        benchmark: Benchmark name, used as the sub-directory (e.g. "concurrency")
+        metrics: Summary numbers of the run
+        series: Raw samples by name, from latency_series() / rate_series()
+        params: The run's parameters
+        environment: From collect_environment(); collected here when omitted
+        label: Optional suffix for the file name, e.g. "prefix-caching-off"
+        results_dir: Store location (default BENCH_RESULTS_DIR or benchmarks/results)
+
+    Returns:
+        str: Path of the file written
+    """
+    environment = environment or collect_environment()
+    created = time.gmtime()
+    sha = environment.get("git", {}).get("sha", "nogit")[:8]
+    name = f"{time.strftime('%Y%m%dT%H%M%SZ', created)}-{sha}" + (f"-{label}" if label else "")
+    directory = os.path.join(results_dir or RESULTS_DIR, benchmark)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.json")
+    run = {
+        "schema_version": SCHEMA_VERSION,
+        "benchmark": benchmark,
+        "label": label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", created),
+        "params": params,
+        "environment": environment,
+        "metrics": metrics,
+        "series": series,
+    }
+    with open(path, "w") as f:
+        json.dump(run, f, indent=2)
+    return path
+
+
+def load_run(path: str) -> Dict:
+    with open(path) as f:
+        run = json.load(f)
+    if run.get("schema_version", 0) > SCHEMA_VERSION:
+        raise ValueError(f"{path} was written by a newer results schema (v{run['schema_version']})")
+    run["path"] = path
+    return run
+
+
+def list_runs(benchmark: Optional[str] = None, results_dir: Optional[str] = None) -> List[str]:
+    """Result files, oldest first (file names start with the UTC time)."""
+    pattern = os.path.join(results_dir or RESULTS_DIR, benchmark or "*", "*.json")
+    return sorted(glob.glob(pattern), key=os.path.basename)
+
+
+# ---------------------------------------------------------------------------
+# Statistics
+# ---------------------------------------------------------------------------
+
+def _stat(values: List[float], name: str) -> float:
+    if name == "mean":
+        return sum(values) / len(values)
+    return percentile(values, float(name[1:]))
+
+
+def bootstrap_change(base: List[float], cand: List[float], stats: Tuple[str, ...], alpha: float = 0.05,
+                     iterations: int = 1000, seed: int = 0) -> Dict[str, Tuple[float, float, float]]:
+    """
+    Bootstrap confidence intervals for the change in each statistic.
+
+    Both samples are resampled with replacement `iterations` times; the interval is
+    the alpha/2 .. 1-alpha/2 quantiles of the candidate-minus-baseline differences.
+
+    Returns:
+        Dict[str, Tuple[float, float, float]]: stat -> (observed difference, CI low, CI high)
+    """
+    rng = random.Random(seed)
+    diffs: Dict[str, List[float]] = {name: [] for name in stats}
+    for _ in range(iterations):
+        b = rng.choices(base, k=len(base))
+        c = rng.choices(cand, k=len(cand))
+        for name in stats:
+            diffs[name].append(_stat(c, name) - _stat(b, name))
+    result = {}
+    for name in stats:
+        ordered = sorted(diffs[name])
+        low = ordered[int(alpha / 2 * (iterations - 1))]
+        high = ordered[int((1 - alpha / 2) * (iterations - 1))]
+        result[name] = (_stat(cand, name) - _stat(base, name), low, high)
+    return result
+
+
+def mann_whitney_p(base: List[float], cand: List[float]) -> float:
+    """
+    Two-sided Mann-Whitney U test p-value (normal approximation with tie correction).
+
+    Returns:
+        float: Probability of a rank difference at least this large if both samples
+            come from the same distribution (1.0 when it cannot be computed)
+    """
+    n1, n2 = len(base), len(cand)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    combined = sorted([(v, 0) for v in base] + [(v, 1) for v in cand])
+    rank_sum = 0.0
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        ties = j - i + 1
+        rank = (i + j) / 2 + 1
+        rank_sum += rank * sum(1 for k in range(i, j + 1) if combined[k][1] == 0)
+        tie_term += ties ** 3 - ties
+        i = j + 1
+    n = n1 + n2
+    u = rank_sum - n1 * (n1 + 1) / 2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return math.erfc(max(z, 0.0) / math.sqrt(2))
+
+
+def compare_runs(base: Dict, cand: Dict, alpha: float = 0.05, threshold: float = 0.05,
+                 iterations: int = 1000) -> List[Dict]:
+    """
+    Compare a candidate run against a baseline.
+
+    Sample series present in both runs are compared statistically. Summary metrics
+    without samples are listed with their relative change only.
+
+    Args:
+        base: Baseline run (from load_run)
+        cand: Candidate run
+        alpha: Significance level
+        threshold: Smallest relative change reported as a regression or improvement
+        iterations: Bootstrap resamples
+
+    Returns:
+        List[Dict]: One row per compared statistic, with a "verdict" of regression,
+            improvement, no change or "-" (not tested)
+    """
+    rows = []
+    for name, series in base.get("series", {}).items():
+        other = cand.get("series", {}).get(name)
+        if not other or not series["values"] or not other["values"]:
+            continue
+        higher_is_better = series["kind"] == "rate"
+        p_value = mann_whitney_p(series["values"], other["values"])
+        stats = SERIES_STATS.get(series["kind"], ("mean",))
+        changes = bootstrap_change(series["values"], other["values"], stats, alpha, iterations)
+        for stat in stats:
+            before = _stat(series["values"], stat)
+            diff, low, high = changes[stat]
+            relative = diff / before if before else 0.0
+            significant = low > 0 or high < 0
+            worse = diff < 0 if higher_is_better else diff > 0
+            verdict = "no change"
+            if significant and abs(relative) >= threshold:
+                verdict = "regression" if worse else "improvement"
+            rows.append({
+                "metric": f"{name} {stat}", "unit": series["unit"], "baseline": before, "candidate": before + diff,
+                "change": relative, "ci": (low, high), "p_value": p_value, "n": (len(series["values"]),
+                                                                                 len(other["values"])),
+                "verdict": verdict,
+            })
+    for name, value in _flatten(base.get("metrics", {})).items():
+        other = _flatten(cand.get("metrics", {})).get(name)
+        if other is None or any(row["metric"].split(" ")[0] == name for row in rows):
+            continue
+        rows.append({"metric": name, "unit": "", "baseline": value, "candidate": other,
+                     "change": (other - value) / value if value else 0.0, "ci": None, "p_value": None,
+                     "n": None, "verdict": "-"})
+    return rows
+
+
+def _flatten(metrics: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = float(value)
+    return flat
+
+
+def environment_diff(runs: List[Dict]) -> List[Tuple[str, List[str]]]:
+    """Environment and parameter fields that differ between the runs."""
+    flat = [_flatten_text({"params": run.get("params", {}), "env": run.get("environment", {})}) for run in runs]
+    keys = sorted(set().union(*flat))
+    return [(key, [f.get(key, "") for f in flat]) for key in keys if len({f.get(key, "") for f in flat}) > 1]
+
+
+def _flatten_text(data, prefix: str = "") -> Dict[str, str]:
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(_flatten_text(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            flat.update(_flatten_text(value, f"{prefix}{i}."))
+    else:
+        flat[prefix.rstrip(".")] = str(data)
+    return flat
+
+
+# ---------------------------------------------------------------------------
+# Reports
+# ---------------------------------------------------------------------------
+
+def _run_title(run: Dict) -> str:
+    sha = run.get("environment", {}).get("git", {}).get("sha", "")[:8] or "nogit"
+    dirty = "+dirty" if run.get("environment", {}).get("git", {}).get("dirty") else ""
+    return f"{run['created']} {sha}{dirty}" + (f" ({run['label']})" if run.get("label") else "")
+
+
+def _cells(row: Dict) -> List[str]:
+    ci = f"[{row['ci'][0]:+.2f}, {row['ci'][1]:+.2f}]" if row["ci"] else ""
+    p_value = f"{row['p_value']:.3g}" if row["p_value"] is not None else ""
+    return [row["metric"], f"{row['baseline']:.2f}", f"{row['candidate']:.2f}", f"{row['change']:+.1%}",
+            ci, p_value, row["verdict"]]
+
+
+HEADERS = ["metric", "baseline", "candidate", "change", "95% CI of diff", "p (Mann-Whitney)", "verdict"]
+
+
+def render_markdown(base: Dict, comparisons: List[Tuple[Dict, List[Dict]]], diff) -> str:
+    lines = [f"# Benchmark comparison: {base['benchmark']}", "", f"Baseline: `{base['path']}` — {_run_title(base)}", ""]
+    for cand, rows in comparisons:
+        lines += [f"## {_run_title(cand)}", "", f"`{cand['path']}`", "",
+                  "| " + " | ".join(HEADERS) + " |", "|" + "---|" * len(HEADERS)]
+        for row in rows:
+            cells = _cells(row)
+            if row["verdict"] == "regression":
+                cells[-1] = "**regression**"
+            lines.append("| " + " | ".join(cells) + " |")
+        lines.append("")
+    if diff:
+        lines += ["## Differences in parameters and environment", "",
+                  "| field | " + " | ".join(["baseline"] + [f"run {i + 1}" for i in range(len(comparisons))]) + " |",
+                  "|" + "---|" * (len(comparisons) + 2)]
+        lines += ["| " + " | ".join([key] + values) + " |" for key, values in diff]
+    return "\n".join(lines) + "\n"
+
+
+def render_html(base: Dict, comparisons: List[Tuple[Dict, List[Dict]]], diff) -> str:
+    esc = html.escape
+    colors = {"regression": "#fdd", "improvement": "#dfd"}
+    parts = ["<!DOCTYPE html><html><head><meta charset='utf-8'>",
+             f"<title>Benchmark comparison: {esc(base['benchmark'])}</title>",
+             "<style>body{font-family:sans-serif}table{border-collapse:collapse;margin-bottom:2em}"
+             "td,th{border:1px solid #ccc;padding:4px 8px;text-align:right}td:first-child{text-align:left}</style>",
+             "</head><body>", f"<h1>Benchmark comparison: {esc(base['benchmark'])}</h1>",
+             f"<p>Baseline: <code>{esc(base['path'])}</code> — {esc(_run_title(base))}</p>"]
+    for cand, rows in comparisons:
+        parts += [f"<h2>{esc(_run_title(cand))}</h2>", f"<p><code>{esc(cand['path'])}</code></p>",
+                  "<table><tr>" + "".join(f"<th>{esc(h)}</th>" for h in HEADERS) + "</tr>"]
+        for row in rows:
+            style = f" style='background:{colors[row['verdict']]}'" if row["verdict"] in colors else ""
+            parts.append(f"<tr{style}>" + "".join(f"<td>{esc(c)}</td>" for c in _cells(row)) + "</tr>")
+        parts.append("</table>")
+    if diff:
+        parts += ["<h2>Differences in parameters and environment</h2>", "<table><tr><th>field</th><th>baseline</th>"
+                  + "".join(f"<th>run {i + 1}</th>" for i in range(len(comparisons))) + "</tr>"]
+        parts += ["<tr>" + "".join(f"<td>{esc(c)}</td>" for c in [key] + values) + "</tr>" for key, values in diff]
+        parts.append("</table>")
+    parts.append("</body></html>")
+    return "\n".join(parts) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List and compare stored benchmark runs")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="Results store location")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = sub.add_parser("list", help="List stored runs")
+    list_parser.add_argument("benchmark", nargs="?", help="Only this benchmark")
+
+    cmp_parser = sub.add_parser("compare", help="Compare a baseline run against one or more candidates")
+    cmp_parser.add_argument("runs", nargs="*", help="Result files: baseline first, then candidates")
+    cmp_parser.add_argument("--latest", metavar="BENCHMARK", help="Compare the two most recent runs of BENCHMARK")
+    cmp_parser.add_argument("--format", choices=("md", "html"), default="md", help="Report format")
+    cmp_parser.add_argument("--output", help="Write the report here instead of stdout")
+    cmp_parser.add_argument("--alpha", type=float, default=0.05, help="Significance level")
+    cmp_parser.add_argument("--threshold", type=float, default=0.05,
+                            help="Smallest relative change that counts as a regression")
+    cmp_parser.add_argument("--iterations", type=int, default=1000, help="Bootstrap resamples")
+    cmp_parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on a regression")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for path in list_runs(args.benchmark, args.results_dir):
+            run = load_run(path)
+            print(f"{os.path.relpath(path)}  {_run_title(run)}")
+        return
+
+    paths = args.runs
+    if args.latest:
+        paths = list_runs(args.latest, args.results_dir)[-2:]
+    if len(paths) < 2:
+        parser.error("compare needs a baseline and at least one candidate run")
+    runs = [load_run(path) for path in paths]
+    base = runs[0]
+    comparisons = [(cand, compare_runs(base, cand, args.alpha, args.threshold, args.iterations)) for cand in runs[1:]]
+    diff = environment_diff(runs)
+    report = (render_html if args.format == "html" else render_markdown)(base, comparisons, diff)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+        print(f"Report written to {args.output}")
+    else:
+        print(report)
+
+    regressions = [row["metric"] for _, rows in comparisons for row in rows if row["verdict"] == "regression"]
+    if regressions:
+        print(f"❌ {len(regressions)} significant regression(s) above {args.threshold:.0%}: {', '.join(regressions)}",
+              file=sys.stderr)
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Semantic Cache Benchmark
+
+Measures the hit rate / precision trade-off of the gateway's semantic cache
+(Fastapi_vllm_web/app/services/semantic_cache.py) across similarity thresholds,
+without a model server.
+
+The question set is grouped by intended SQL: paraphrases in a group should hit
+each other, and near-misses in other groups ("after 2020" / "after 2015",
+"highest" / "lowest") must not. Questions are replayed in a shuffled order; each
+miss stores the question with its group as the "answer", and each hit is correct
+if the cached group matches the question's own group.
+
+    hit rate    hits / lookups that had a correct answer cached (recall)
+    precision   correct hits / hits (a wrong hit is a wrong SQL query served)
+
+The last line is the calibrated threshold: the one with the best hit rate among
+those that served no wrong hit, which is what the embedder's `default_threshold`
+should be.
+
+Usage:
+    python benchmarks/semantic_cache_bench.py
+    python benchmarks/semantic_cache_bench.py --embedder hashing --thresholds 0.7,0.8,0.9
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "Fastapi_vllm_web", "app")
+sys.path.insert(0, APP_DIR)
+
+from services.semantic_cache import SEMANTIC_CACHE_EMBEDDER, SemanticCache, load_embedder  # noqa: E402
+from services.stats import percentile  # noqa: E402
+
+QUESTION_GROUPS: Dict[str, List[str]] = {
+    "all_employees": [
+        "List all employees",
+        "Show me every employee",
+        "Give me all the employees",
+        "Display the employees table",
+    ],
+    "it_department": [
+        "Find employees in the IT department",
+        "Which employees work in the IT department?",
+        "Show employees from the IT department",
+        "List the employees of the IT department",
+    ],
+    "hr_department": [
+        "Find employees in the HR department",
+        "Which employees work in the HR department?",
+        "Show employees from the HR department",
+    ],
+    "salary_over_50000": [
+        "Get employees with salary more than 50000",
+        "Which employees earn more than 50000?",
+        "Show employees whose salary is more than 50000",
+        "List staff earning over 50000",
+    ],
+    "salary_over_100k": [
+        "Show employees with salary over 100k",
+        "Which employees earn more than 100k?",
+    ],
+    "salary_over_50k": [
+        "Show employees with salary over 50k",
+        "Which employees earn more than 50k?",
+    ],
+    "salary_at_least_100k": [
+        "Show employees with salary 100k and above",
+        "Which employees earn at least 100k?",
+        "Employees earning 100k or more",
+    ],
+    "salary_under_50000": [
+        "Get employees with salary less than 50000",
+        "Which employees earn less than 50000?",
+    ],
+    "hired_after_2020": [
+        "Show employees hired after 2020",
+        "Which employees were hired after 2020?",
+        "List employees with a hire date after 2020",
+        "Employees who joined after 2020",
+        "List staff hired post-2020",
+    ],
+    "hired_after_2015": [
+        "Show employees hired after 2015",
+        "Which employees were hired after 2015?",
+    ],
+    "hired_before_2020": [
+        "Show employees hired before 2020",
+        "Which employees were hired before 2020?",
+        "List staff hired pre-2020",
+    ],
+    "hired_since_2020": [
+        "Show employees hired since 2020",
+        "Which employees were hired from 2020 onwards?",
+        "Show employees hired in 2020 or later",
+    ],
+    "more_than_5_projects": [
+        "Employees with more than 5 projects",
+        "Which employees work on more than 5 projects?",
+    ],
+    "at_least_5_projects": [
+        "Employees with 5 or more projects",
+        "Which employees work on at least 5 projects?",
+    ],
+    "avg_salary_by_department": [
+        "Average salary per department",
+        "What is the average salary in each department?",
+        "Show the average salary per department",
+    ],
+    "count_by_department": [
+        "Count employees per department",
+        "How many employees are in each department? Give the count",
+        "Show the employee count per department",
+    ],
+    "highest_salary": [
+        "Who has the highest salary?",
+        "Find the employee with the highest salary",
+        "Which employee has the highest salary",
+    ],
+    "lowest_salary": [
+        "Who has the lowest salary?",
+        "Find the employee with the lowest salary",
+    ],
+    "top_5_salaries": [
+        "List the top 5 highest paid employees",
+        "Show the top 5 employees by highest salary",
+    ],
+    "top_10_salaries": [
+        "List the top 10 highest paid employees",
+        "Show the top 10 employees by highest salary",
+    ],
+    "names_starting_a": [
+        "Show employees whose name starts with 'A'",
+        "List employees with names starting with 'A'",
+    ],
+    "names_starting_b": [
+        "Show employees whose name starts with 'B'",
+        "List employees with names starting with 'B'",
+    ],
+    "not_in_it": [
+        "Show employees not in the IT department",
+        "List employees that are not in the IT department",
+    ],
+}
+
+SCOPE = ("employees-schema", "yasserrmd/Text2SQL-1.5B", 128, 0.0, None)
+
+
+def replay(cache: SemanticCache, questions: List[Tuple[str, str]]) -> Dict[str, float]:
+    stored_groups = set()
+    hits = correct = hittable = 0
+    lookup_ms: List[float] = []
+    for group, question in questions:
+        if group in stored_groups:
+            hittable += 1
+        started = time.perf_counter()
+        hit = cache.lookup(SCOPE, question)
+        lookup_ms.append((time.perf_counter() - started) * 1000)
+        if hit is None:
+            cache.store(SCOPE, question, group)
+            stored_groups.add(group)
+            continue
+        hits += 1
+        correct += hit.answer == group
+    return {
+        "hits": hits,
+        "hit_rate": correct / hittable if hittable else 0.0,
+        "precision": correct / hits if hits else 1.0,
+        "wrong": hits - correct,
+        "p50_ms": percentile(lookup_ms, 50, 0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit rate and precision of the semantic cache by threshold")
+    parser.add_argument("--embedder", default=SEMANTIC_CACHE_EMBEDDER,
+                        help='An embedding model name or "hashing" (default: the gateway\'s SEMANTIC_CACHE_EMBEDDER)')
+    parser.add_argument("--thresholds", default="0.6,0.7,0.75,0.8,0.85,0.9,0.95")
+    parser.add_argument("--rounds", type=int, default=20, help="Shuffled replays averaged per threshold")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    embedder = load_embedder(args.embedder)
+    if hasattr(embedder, "load"):
+        try:
+            embedder.load()
+        except Exception:
+            pass  # Falls back to hashing; the header line shows it
+    questions = [(group, q) for group, qs in QUESTION_GROUPS.items() for q in qs]
+    fallback = " (fell back to hashing)" if getattr(embedder, "fallback", None) is not None else ""
+    print(f"embedder={getattr(embedder, 'name', args.embedder)}{fallback} questions={len(questions)} "
+          f"groups={len(QUESTION_GROUPS)} rounds={args.rounds}\n")
+    print(f"{'threshold':>9} {'hit rate':>9} {'precision':>10} {'wrong hits':>11} {'lookup p50':>11}")
+    best = None
+    for threshold in (float(t) for t in args.thresholds.split(",")):
+        rng = random.Random(args.seed)
+        totals = {"hit_rate": 0.0, "precision": 0.0, "wrong": 0.0, "p50_ms": 0.0}
+        for _ in range(args.rounds):
+            order = questions[:]
+            rng.shuffle(order)
+            result = replay(SemanticCache(embedder, threshold=threshold, ttl=0), order)
+            for key in totals:
+                totals[key] += result[key] / args.rounds
+        print(f"{threshold:>9.2f} {100 * totals['hit_rate']:>8.1f}% {100 * totals['precision']:>9.1f}% "
+              f"{totals['wrong']:>11.1f} {totals['p50_ms']:>9.3f}ms")
+        if totals["wrong"] == 0 and (best is None or totals["hit_rate"] > best[1]):
+            best = (threshold, totals["hit_rate"])
+    if best is None:
+        print("\ncalibrated threshold: none of these served no wrong hits; try higher thresholds")
+    else:
+        print(f"\ncalibrated threshold: {best[0]:.2f} (hit rate {100 * best[1]:.1f}%, no wrong hits)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Gateway Startup Profile
+
+Measures how long a new gateway process takes to serve traffic, against a mock
+vLLM backend (see mock_vllm.py):
+
+    import       `import main` in a fresh interpreter, with the slowest imports
+                 (python -X importtime, cumulative) listed below it
+    /health      process start -> first 200 from /health (listening)
+    /ready       process start -> first 200 from /ready (warm-up finished and a
+                 replica scraped; see services/warmup.py)
+
+Each launch runs in a fresh process; the table shows the median of --runs launches.
+
+Usage:
+    python benchmarks/startup_profile.py
+    python benchmarks/startup_profile.py --runs 5 --top 30
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+from gateway_overhead import APP_DIR, BENCH_DIR, MODEL, free_port, gateway_env, wait_for
+
+
+def import_profile(mock_port: int) -> Tuple[float, List[Tuple[int, str]]]:
+    """Wall time of `import main` and the (cumulative microseconds, module) list from -X importtime."""
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=APP_DIR,
+                          env=gateway_env(mock_port), capture_output=True, text=True, timeout=120)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{proc.stderr}")
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative), name.strip()))
+    return float(proc.stdout.strip().splitlines()[-1]), modules
+
+
+def time_to_serve(mock_port: int, timeout: float) -> Dict[str, float]:
+    """Seconds from launching the gateway to its first 200 on /health and on /ready."""
+    port = free_port()
+    env = gateway_env(mock_port)
+    env["PORT"] = str(port)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "serve.py"], cwd=APP_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1.0) as client:
+            while len(result) < 2 and time.perf_counter() - start < timeout:
+                for path in ("/health", "/ready"):
+                    if path in result:
+                        continue
+                    try:
+                        if client.get(path).status_code == 200:
+                            result[path] = time.perf_counter() - start
+                    except httpx.HTTPError:
+                        pass
+                time.sleep(0.005)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    if len(result) < 2:
+        raise RuntimeError(f"Gateway not ready within {timeout}s: {result}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway import time and time to /health and /ready")
+    parser.add_argument("--runs", type=int, default=3, help="Gateway launches measured")
+    parser.add_argument("--top", type=int, default=15, help="Slowest top-level imports listed")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for /ready")
+    args = parser.parse_args()
+
+    mock_port = free_port()
+    mock = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "mock_vllm.py"), "--port", str(mock_port),
+                             "--model", MODEL], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(f"http://127.0.0.1:{mock_port}/v1/models")
+        imports = [import_profile(mock_port) for _ in range(args.runs)]
+        launches = [time_to_serve(mock_port, args.timeout) for _ in range(args.runs)]
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+
+    print("\n" + "=" * 60)
+    print("GATEWAY STARTUP PROFILE")
+    print("=" * 60)
+    print(f"{'import main':<20} {1000 * statistics.median(t for t, _ in imports):>8.0f} ms")
+    print(f"{'start -> /health':<20} {1000 * statistics.median(r['/health'] for r in launches):>8.0f} ms")
+    print(f"{'start -> /ready':<20} {1000 * statistics.median(r['/ready'] for r in launches):>8.0f} ms")
+
+    # Top-level packages and the app's own modules, by cumulative import time of the last run
+    _, modules = imports[-1]
+    app_packages = ("main", "api", "services", "vllm")
+    top = [(us, name) for us, name in modules
+           if "." not in name or name.split(".")[0] in app_packages]
+    print("\nSlowest imports (cumulative, includes dependencies imported first by them):")
+    for us, name in sorted(top, reverse=True)[:args.top]:
+        print(f"  {us / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
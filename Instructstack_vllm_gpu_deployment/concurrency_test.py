@@ -10,6 +10,10 @@ Usage:
     python concurrency_test.py
     # Or with custom configuration:
     CONCURRENCY=20 REQUESTS_PER_CLIENT=10 python concurrency_test.py
+
+Every run is saved to the benchmark results store (benchmarks/results/concurrency/)
+with its configuration, per-request latencies and environment (git SHA, host, GPUs,
+VLLM_* settings); compare runs with `python benchmarks/results.py compare`.
 """
 
 import asyncio
@@ -22,6 +26,9 @@ from typing import List, Dict, Any
 from dataclasses import dataclass
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+from results import collect_environment, latency_series, percentile, rate_series, save_run, windowed_rate  # noqa: E402
+
 # Configuration - can be overridden by environment variables
 API_URL = os.getenv("VLLM_API_URL", "http://localhost:8000/v1/completions")
 MODEL = os.getenv("VLLM_MODEL", "/models/yasserrmd/Text2SQL-1.5B")
@@ -30,6 +37,8 @@ REQUESTS_PER_CLIENT = int(os.getenv("REQUESTS_PER_CLIENT", "5"))  # Requests per
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "30"))  # Request timeout in seconds
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "128"))  # Maximum tokens in response
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.3"))  # Response temperature
+SAVE_RESULTS = os.getenv("SAVE_RESULTS", "true").lower() == "true"  # Write the run to benchmarks/results/
+RESULTS_LABEL = os.getenv("RESULTS_LABEL", "")  # Suffix for the result file name, e.g. "tp2"
 
 # Shared list of prompts (same schema)
 PROMPT_POOL = [
@@ -203,6 +212,8 @@ class ConcurrencyTest:
                 print(f"  Average: {avg_response_time:.3f}s")
                 print(f"  Minimum: {min_response_time:.3f}s")
                 print(f"  Maximum: {max_response_time:.3f}s")
+                for pct in (50, 95, 99):
+                    print(f"  p{pct}: {percentile(response_times, pct):.3f}s")
                 
                 # Calculate throughput
                 total_time = self.end_time - self.start_time if self.start_time and self.end_time else 0
@@ -221,6 +232,36 @@ class ConcurrencyTest:
             for error_type, count in error_counts.items():
                 print(f"  {error_type}: {count} occurrences")
     
+    def save_results(self) -> None:
+        """Write the run to the benchmark results store (see benchmarks/results.py)."""
+        successes = [r for r in self.results if r.success]
+        total_time = self.end_time - self.start_time
+        latencies = [r.response_time * 1000 for r in successes]
+        metrics = {
+            "requests": len(self.results),
+            "errors": len(self.results) - len(successes),
+            "throughput_rps": len(successes) / total_time if total_time > 0 else 0.0,
+            "p50_ms": percentile(latencies, 50, 0.0),
+            "p95_ms": percentile(latencies, 95, 0.0),
+            "p99_ms": percentile(latencies, 99, 0.0),
+        }
+        series = {
+            "latency": latency_series(latencies),
+            "throughput": rate_series(windowed_rate([r.end_time for r in successes], self.start_time)),
+        }
+        params = {
+            "api_url": API_URL,
+            "model": MODEL,
+            "concurrency": CONCURRENCY,
+            "requests_per_client": REQUESTS_PER_CLIENT,
+            "request_timeout": REQUEST_TIMEOUT,
+            "max_tokens": MAX_TOKENS,
+            "temperature": TEMPERATURE,
+        }
+        path = save_run("concurrency", metrics, series, params, collect_environment(API_URL),
+                        label=RESULTS_LABEL or None)
+        print(f"\nResults saved to {path}")
+    
     async def run_test(self) -> None:
         """Run the main concurrency test."""
         print(f"Starting concurrency test...")
@@ -246,6 +287,8 @@ class ConcurrencyTest:
         
         print("-" * 60)
         self.print_summary()
+        if SAVE_RESULTS and self.results:
+            self.save_results()
 
 async def main():
     """Main entry point for the concurrency test."""
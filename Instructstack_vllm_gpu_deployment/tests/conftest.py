@@ -0,0 +1,60 @@
+"""
+Shared pytest setup: puts the gateway's app directory and the benchmarks on sys.path,
+and configures the gateway for the in-process mock replicas of test_mock_vllm.py.
+
+Run from the deployment directory:
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+
+import atexit
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+
+import pytest
+
+DEPLOY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(DEPLOY_DIR, "Fastapi_vllm_web", "app")
+BENCH_DIR = os.path.join(DEPLOY_DIR, "benchmarks")
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+
+MODEL = "yasserrmd/Text2SQL-1.5B"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="gateway-tests-")
+atexit.register(shutil.rmtree, SCRATCH_DIR, True)
+
+# The gateway reads its configuration at import time, so it is pointed at the mock
+# replicas and at scratch storage before any test module imports it
+os.environ.update({
+    "VLLM_BACKENDS": json.dumps({MODEL: [f"http://127.0.0.1:{_free_port()}" for _ in range(2)]}),
+    "REQUEST_STORE_PATH": os.path.join(SCRATCH_DIR, "requests.db"),
+    "BATCH_DATA_DIR": os.path.join(SCRATCH_DIR, "batch_jobs"),
+    "BATCH_PROMPTS_PER_REQUEST": "4",
+    "LORA_DIR": os.path.join(SCRATCH_DIR, "lora"),
+    "TOKENIZER_DIR": os.path.join(SCRATCH_DIR, "models"),
+})
+os.environ.setdefault("LOGFIRE_SEND_TO_LOGFIRE", "false")
+os.environ.setdefault("LOGFIRE_CONSOLE", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+
+@pytest.fixture
+def metrics_fixture():
+    """Lines of a recorded vLLM `/metrics` response from benchmarks/fixtures ("idle" or "saturated")."""
+    def load(name: str):
+        with open(os.path.join(FIXTURES_DIR, f"vllm_metrics_{name}.prom")) as f:
+            return f.read().splitlines()
+    return load
@@ -0,0 +1,195 @@
+"""Autoscaler decisions: cooldowns, replica bounds, scale-to-zero and registration of new replicas."""
+
+import logging
+from typing import Dict, List, Optional
+
+from services.autoscaler import AUTOSCALER_BOOT_TIMEOUT, Autoscaler, ModelSignals, ScalingPolicy
+from services.capacity import CapacityModel
+
+MODEL = "yasserrmd/Text2SQL-1.5B"
+CONFIGURED = "http://vllm_server:8000"
+
+
+class FakeRuntime:
+    """ContainerRuntime whose replicas become ready when the test says so."""
+
+    def __init__(self, existing: Optional[List[str]] = None):
+        self.existing = existing or []
+        self.started: List[str] = []
+        self.stopped: List[str] = []
+        self.ready: set = set()
+
+    def start_replica(self, model: str) -> str:
+        base_url = f"http://replica-{len(self.started) + 1}:8000"
+        self.started.append(base_url)
+        return base_url
+
+    def replica_ready(self, model: str, base_url: str) -> bool:
+        return base_url in self.ready
+
+    def stop_replica(self, base_url: str) -> None:
+        self.stopped.append(base_url)
+
+    def list_replicas(self, model: str) -> List[str]:
+        return list(self.existing)
+
+
+def make(backends: Dict[str, List[str]], runtime: Optional[FakeRuntime] = None, **policy) -> Autoscaler:
+    policy = {"min_replicas": 1, "max_replicas": 3, "latency_slo_ms": 0, "scale_up_cooldown": 60,
+              "scale_down_cooldown": 300, "idle_timeout": 900, **policy}
+    return Autoscaler(runtime or FakeRuntime(), CapacityModel(backends), ScalingPolicy(**policy),
+                      models=[MODEL], clock=lambda: 0.0)
+
+
+def urls(autoscaler: Autoscaler) -> List[str]:
+    return [r.base_url for r in autoscaler.capacity.replicas[MODEL]]
+
+
+def actions(autoscaler: Autoscaler) -> List[str]:
+    return [e.action for e in autoscaler.events]
+
+
+def overload(autoscaler: Autoscaler, waiting: float = 100.0) -> None:
+    autoscaler.capacity.replicas[MODEL][0].requests_waiting = waiting
+
+
+def test_desired_replicas_stays_within_bounds():
+    policy = ScalingPolicy(min_replicas=1, max_replicas=3, latency_slo_ms=0)
+    assert policy.desired_replicas(ModelSignals(replicas=1, waiting=1000)) == 3
+    assert policy.desired_replicas(ModelSignals(replicas=1, idle_for=0)) == 1
+    assert policy.desired_replicas(ModelSignals(replicas=5)) == 3
+    assert policy.desired_replicas(ModelSignals(replicas=0)) == 1
+
+
+def test_scale_up_is_proportional_and_capped_at_max():
+    autoscaler = make({MODEL: [CONFIGURED]})
+    overload(autoscaler)
+    autoscaler.tick(0)
+    assert autoscaler.runtime.started == ["http://replica-1:8000", "http://replica-2:8000"]
+    assert sorted(autoscaler.pending) == autoscaler.runtime.started
+    # Still overloaded after the cooldown, but already at max_replicas (pending ones included)
+    autoscaler.tick(100)
+    assert len(autoscaler.runtime.started) == 2
+
+
+def test_scale_up_cooldown():
+    autoscaler = make({MODEL: [CONFIGURED]}, max_replicas=5)
+    overload(autoscaler, waiting=3.0)  # 1.5x the target: one more replica
+    autoscaler.tick(0)
+    assert len(autoscaler.runtime.started) == 1
+    overload(autoscaler, waiting=100.0)
+    autoscaler.tick(30)
+    assert len(autoscaler.runtime.started) == 1
+    autoscaler.tick(61)
+    # Configured replica plus four started: max_replicas
+    assert len(autoscaler.runtime.started) == 4
+
+
+def test_new_replica_is_registered_once_ready():
+    autoscaler = make({MODEL: [CONFIGURED]})
+    overload(autoscaler, waiting=3.0)
+    autoscaler.tick(0)
+    new = autoscaler.runtime.started[0]
+    assert urls(autoscaler) == [CONFIGURED]
+    autoscaler.tick(15)
+    assert urls(autoscaler) == [CONFIGURED]
+    autoscaler.runtime.ready.add(new)
+    autoscaler.tick(30)
+    assert urls(autoscaler) == [CONFIGURED, new]
+    assert new not in autoscaler.pending and autoscaler.managed[new] == MODEL
+    assert actions(autoscaler) == ["start", "ready"]
+
+
+def test_replica_that_never_boots_is_stopped():
+    autoscaler = make({MODEL: [CONFIGURED]})
+    overload(autoscaler, waiting=3.0)
+    autoscaler.tick(0)
+    new = autoscaler.runtime.started[0]
+    overload(autoscaler, waiting=0.0)
+    autoscaler.tick(AUTOSCALER_BOOT_TIMEOUT + 1)
+    assert autoscaler.runtime.stopped == [new]
+    assert not autoscaler.pending and new not in autoscaler.managed
+    assert actions(autoscaler) == ["start", "failed"]
+
+
+def test_scale_down_cooldown_then_drain_and_stop():
+    autoscaler = make({MODEL: [CONFIGURED]})
+    overload(autoscaler, waiting=3.0)
+    autoscaler.tick(0)
+    new = autoscaler.runtime.started[0]
+    autoscaler.runtime.ready.add(new)
+    overload(autoscaler, waiting=0.0)
+    autoscaler.tick(100)
+    assert urls(autoscaler) == [CONFIGURED, new]
+    autoscaler.tick(301)
+    # Out of routing first; only the replica the autoscaler started is removed
+    assert urls(autoscaler) == [CONFIGURED]
+    assert new in autoscaler.draining
+    autoscaler.tick(316)
+    assert autoscaler.runtime.stopped == [new]
+    assert actions(autoscaler) == ["start", "ready", "drain", "stop"]
+
+
+def test_draining_waits_for_inflight_requests():
+    autoscaler = make({MODEL: []}, runtime=FakeRuntime(existing=["http://a:8000", "http://b:8000"]))
+    autoscaler.adopt_existing()
+    a, b = autoscaler.capacity.replicas[MODEL]
+    with a.track_inflight(), b.track_inflight():
+        autoscaler.capacity.last_request[MODEL] = 0.0
+        autoscaler.tick(1000)
+        drained = next(iter(autoscaler.draining))
+        autoscaler.tick(1015)
+        assert autoscaler.runtime.stopped == []
+    autoscaler.tick(1030)
+    assert autoscaler.runtime.stopped == [drained]
+
+
+def test_pending_replicas_are_not_counted_when_draining():
+    autoscaler = make({MODEL: []}, runtime=FakeRuntime(existing=["http://a:8000"]))
+    autoscaler.adopt_existing()
+    # A replica started earlier is still booting; the load has gone
+    autoscaler.pending["http://b:8000"] = (MODEL, 990.0)
+    autoscaler.managed["http://b:8000"] = MODEL
+    autoscaler.tick(1000)
+    assert urls(autoscaler) == ["http://a:8000"]
+    assert not autoscaler.draining
+    # Once it is ready, one of the two is drained
+    autoscaler.runtime.ready.add("http://b:8000")
+    autoscaler.tick(1015)
+    assert len(urls(autoscaler)) == 1 and len(autoscaler.draining) == 1
+
+
+def test_scale_to_zero_and_cold_start():
+    autoscaler = make({MODEL: []}, min_replicas=0)
+    autoscaler.tick(0)
+    assert autoscaler.runtime.started == []
+    # A request finds no replica: cold start, without waiting for the scale-up cooldown
+    assert autoscaler.capacity.select_replica(MODEL) is None
+    autoscaler.capacity.last_request[MODEL] = 10.0
+    autoscaler.tick(10)
+    new = autoscaler.runtime.started[0]
+    autoscaler.runtime.ready.add(new)
+    autoscaler.tick(25)
+    assert urls(autoscaler) == [new]
+    # Idle for idle_timeout (and past the scale-down cooldown): drained and stopped
+    autoscaler.tick(10 + 899)
+    assert urls(autoscaler) == [new]
+    autoscaler.tick(10 + 900)
+    assert urls(autoscaler) == []
+    autoscaler.tick(10 + 915)
+    assert autoscaler.runtime.stopped == [new]
+    # The next request starts it again
+    assert autoscaler.capacity.select_replica(MODEL) is None
+    autoscaler.capacity.last_request[MODEL] = 2000.0
+    autoscaler.tick(2000)
+    assert len(autoscaler.runtime.started) == 2
+
+
+def test_scale_to_zero_leaves_configured_replicas(caplog):
+    with caplog.at_level(logging.WARNING, logger="services.autoscaler"):
+        autoscaler = make({MODEL: [CONFIGURED]}, min_replicas=0)
+    assert "Scale-to-zero never stops replicas configured in VLLM_BACKENDS" in caplog.text
+    autoscaler.tick(5000)
+    autoscaler.tick(10000)
+    assert urls(autoscaler) == [CONFIGURED]
+    assert autoscaler.runtime.stopped == [] and autoscaler.events == []
@@ -0,0 +1,143 @@
+"""Capacity model: `/metrics` parsing, replica selection and admission, on recorded vLLM metrics."""
+
+import time
+
+import httpx
+import pytest
+import requests
+
+from services.capacity import CapacityModel, ReplicaCapacity, is_replica_failure, parse_vllm_metrics
+
+MODEL = "yasserrmd/Text2SQL-1.5B"
+
+
+def scraped(replica: ReplicaCapacity, lines) -> ReplicaCapacity:
+    """Apply a recorded `/metrics` response to a replica as a fresh, successful scrape would."""
+    now = time.time()
+    replica.update(parse_vllm_metrics(lines), now)
+    replica.reachable = replica.model_loaded = True
+    replica.last_scrape = now
+    return replica
+
+
+def test_parse_idle_v0_metrics(metrics_fixture):
+    sample = parse_vllm_metrics(metrics_fixture("idle"))
+    assert sample == {
+        "running": 0.0,
+        "waiting": 0.0,
+        "kv_cache_usage": 0.0,  # gpu_ and cpu_cache_usage_perc, both 0
+        "prompt_tokens_total": 48213.0,
+        "generation_tokens_total": 19877.0,
+    }
+
+
+def test_parse_saturated_v1_metrics(metrics_fixture):
+    sample = parse_vllm_metrics(metrics_fixture("saturated"))
+    assert sample["running"] == 64.0
+    assert sample["waiting"] == 37.0
+    assert sample["kv_cache_usage"] == pytest.approx(0.9812)
+    assert sample["prompt_tokens_total"] == 2.871044e06
+    assert sample["generation_tokens_total"] == 1.182377e06
+
+
+def test_parse_sums_label_sets_and_takes_max_kv_usage():
+    sample = parse_vllm_metrics([
+        'vllm:num_requests_running{engine="0"} 3',
+        'vllm:num_requests_running{engine="1"} 4',
+        'vllm:kv_cache_usage_perc{engine="0"} 0.5',
+        'vllm:kv_cache_usage_perc{engine="1"} 0.25',
+        'vllm:num_requests_waiting{engine="0"} not-a-number',
+        'vllm:time_to_first_token_seconds_sum 12.5',
+    ])
+    assert sample == {"running": 7.0, "kv_cache_usage": 0.5}
+
+
+def test_token_rates_from_counter_deltas():
+    replica = ReplicaCapacity(MODEL, "http://r1")
+    replica.update({"prompt_tokens_total": 1000.0, "generation_tokens_total": 500.0}, now=100.0)
+    assert replica.prompt_tokens_per_sec == 0.0
+    replica.update({"prompt_tokens_total": 3000.0, "generation_tokens_total": 900.0}, now=102.0)
+    assert replica.prompt_tokens_per_sec == 1000.0
+    assert replica.generation_tokens_per_sec == 200.0
+    # A counter reset (replica restarted) keeps the last rate instead of going negative
+    replica.update({"prompt_tokens_total": 10.0}, now=104.0)
+    assert replica.prompt_tokens_per_sec == 1000.0
+
+
+def test_saturated_replica_is_not_ready(metrics_fixture):
+    model = CapacityModel({MODEL: ["http://idle", "http://busy"]})
+    idle, busy = model.replicas[MODEL]
+    scraped(idle, metrics_fixture("idle"))
+    scraped(busy, metrics_fixture("saturated"))
+    assert idle.ready and not idle.saturated
+    assert busy.saturated and not busy.ready
+
+
+def test_select_replica_skips_saturated(metrics_fixture):
+    model = CapacityModel({MODEL: ["http://busy", "http://idle"]})
+    busy, idle = model.replicas[MODEL]
+    scraped(busy, metrics_fixture("saturated"))
+    scraped(idle, metrics_fixture("idle"))
+    assert model.select_replica(MODEL) is idle
+    assert model.rejected.get(MODEL, 0) == 0
+    assert MODEL in model.last_request
+
+
+def test_admission_rejects_when_every_replica_is_saturated(metrics_fixture):
+    model = CapacityModel({MODEL: ["http://busy1", "http://busy2"]})
+    for replica in model.replicas[MODEL]:
+        scraped(replica, metrics_fixture("saturated"))
+    assert model.select_replica(MODEL) is None
+    assert model.select_replica(MODEL) is None
+    assert model.rejected[MODEL] == 2
+
+
+def test_replica_without_recent_scrape_is_available(metrics_fixture):
+    model = CapacityModel({MODEL: ["http://new"]})
+    assert model.select_replica(MODEL) is model.replicas[MODEL][0]
+    scraped(model.replicas[MODEL][0], metrics_fixture("saturated"))
+    model.replicas[MODEL][0].last_scrape = time.time() - 3600
+    assert model.select_replica(MODEL) is model.replicas[MODEL][0]
+
+
+def test_select_replica_orders_by_queue_then_inflight():
+    model = CapacityModel({MODEL: ["http://a", "http://b", "http://c"]})
+    a, b, c = model.replicas[MODEL]
+    for replica, waiting in ((a, 3.0), (b, 1.0), (c, 1.0)):
+        scraped(replica, [f"vllm:num_requests_waiting {waiting}"])
+    with b.track_inflight():
+        assert model.select_replica(MODEL) is c
+    assert model.select_replica(MODEL) in (b, c)
+    assert model.select_replica(MODEL, prefer=lambda r: r is a) is a
+
+
+def test_unknown_model_is_not_counted_as_rejection():
+    model = CapacityModel({MODEL: ["http://a"]})
+    assert model.select_replica("other") is None
+    assert model.rejected == {}
+
+
+def _status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://r1/v1/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def _requests_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError("error", response=response)
+
+
+@pytest.mark.parametrize("error, counts", [
+    (_status_error(400), False),
+    (_status_error(429), False),
+    (_status_error(500), True),
+    (_status_error(503), True),
+    (_requests_error(422), False),
+    (_requests_error(502), True),
+    (httpx.ConnectError("refused"), True),
+    (requests.ConnectionError("refused"), True),
+    (ValueError("bad JSON"), True),
+])
+def test_only_replica_faults_count_against_error_rate(error, counts):
+    assert is_replica_failure(error) is counts
@@ -0,0 +1,252 @@
+"""
+The gateway against in-process mock vLLM replicas (benchmarks/mock_vllm.py).
+
+Two mock replicas serve the model. Each reports the `/metrics` text of a file that
+the tests switch between the recorded idle and saturated fixtures, so the load the
+gateway sees is under the test's control; `/mock/faults` injects upstream errors.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import httpx
+import pytest
+import uvicorn
+
+from conftest import APP_DIR, FIXTURES_DIR, MODEL
+from mock_vllm import create_app
+
+REPLICA_URLS = json.loads(os.environ["VLLM_BACKENDS"])[MODEL]
+STATEMENT = "SELECT name FROM employees WHERE hire_date > '2020-01-01';"
+# A model that keeps talking after the statement, as small models do without a stop sequence
+COMPLETION = STATEMENT + "\n\nExplanation: " + " ".join(["this query lists the employees hired recently"] * 20)
+TOKENS_PER_SEC = 500.0
+# Several tokens per SSE event, as vLLM streams with --stream-interval or speculative decoding
+TOKENS_PER_CHUNK = 4
+
+
+class MockReplica:
+    """A mock vLLM server running on its own thread, with switchable `/metrics`."""
+
+    def __init__(self, base_url: str, metrics_path: str):
+        self.base_url = base_url
+        self.metrics_path = metrics_path
+        self.load("idle")
+        app = create_app(model=MODEL, latency_ms=5, tokens_per_sec=TOKENS_PER_SEC, completion=COMPLETION,
+                         metrics_fixture=metrics_path, tokens_per_chunk=TOKENS_PER_CHUNK)
+        port = urlparse(base_url).port
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            assert time.monotonic() < deadline, f"mock replica {self.base_url} did not start"
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+    def load(self, fixture: str) -> None:
+        """Report the recorded "idle" or "saturated" metrics from the next scrape on."""
+        shutil.copyfile(os.path.join(FIXTURES_DIR, f"vllm_metrics_{fixture}.prom"), self.metrics_path)
+
+    def faults(self, **faults) -> None:
+        httpx.post(f"{self.base_url}/mock/faults", json=faults).raise_for_status()
+
+
+@pytest.fixture(scope="module")
+def replicas(tmp_path_factory):
+    metrics_dir = tmp_path_factory.mktemp("metrics")
+    replicas = [MockReplica(url, str(metrics_dir / f"replica{i}.prom")) for i, url in enumerate(REPLICA_URLS)]
+    for replica in replicas:
+        replica.start()
+    yield replicas
+    for replica in replicas:
+        replica.stop()
+
+
+@pytest.fixture(scope="module")
+def gateway(replicas):
+    from fastapi.testclient import TestClient
+    # Static files and templates are mounted relative to the app directory, as in the image
+    cwd = os.getcwd()
+    os.chdir(APP_DIR)
+    try:
+        from main import app
+        with TestClient(app) as client:
+            yield client
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(autouse=True)
+def healthy(replicas, gateway):
+    """Every test starts with both replicas idle and fault-free, as seen by a fresh scrape."""
+    for replica in replicas:
+        replica.load("idle")
+        replica.faults(error_rate=0, slow_rate=0)
+    scrape(gateway)
+    yield
+
+
+def scrape(gateway) -> None:
+    from services.capacity import capacity_model
+    gateway.portal.call(capacity_model.scrape_once)
+
+
+def requests_served(replica: MockReplica) -> int:
+    """Proxied requests the gateway recorded for the replica."""
+    from services.capacity import capacity_model
+    return next(len(r.outcomes) for r in capacity_model.replicas[MODEL] if r.base_url == replica.base_url)
+
+
+def generate(gateway, prompt: str = "list employees", **kwargs) -> httpx.Response:
+    return gateway.post("/api/generate", json={"model": MODEL, "prompt": prompt, "max_tokens": 16}, **kwargs)
+
+
+def test_mock_serves_one_choice_per_prompt(replicas):
+    resp = httpx.post(f"{replicas[0].base_url}/v1/completions",
+                      json={"model": MODEL, "prompt": ["a", "b", "c"], "max_tokens": 4})
+    assert resp.status_code == 200
+    choices = resp.json()["choices"]
+    assert [c["index"] for c in choices] == [0, 1, 2]
+    assert all(c["text"].strip().startswith("SELECT name FROM") for c in choices)
+
+
+def test_routing_avoids_saturated_replica(replicas, gateway):
+    idle, busy = replicas
+    busy.load("saturated")
+    scrape(gateway)
+    before = [requests_served(r) for r in replicas]
+    for _ in range(4):
+        assert generate(gateway).status_code == 200
+    assert [requests_served(r) for r in replicas] == [before[0] + 4, before[1]]
+
+    idle.load("saturated")
+    busy.load("idle")
+    scrape(gateway)
+    for _ in range(2):
+        assert generate(gateway).status_code == 200
+    assert [requests_served(r) for r in replicas] == [before[0] + 4, before[1] + 2]
+
+
+def test_admission_rejects_when_every_replica_is_saturated(replicas, gateway):
+    from services.capacity import capacity_model
+    for replica in replicas:
+        replica.load("saturated")
+    scrape(gateway)
+    rejected = capacity_model.rejected.get(MODEL, 0)
+    resp = generate(gateway)
+    assert resp.status_code == 503
+    assert resp.json()["detail"].startswith("All replicas")
+    assert capacity_model.rejected[MODEL] == rejected + 1
+    assert gateway.get("/ready").status_code == 503
+
+
+def test_client_errors_do_not_count_against_a_replica(replicas, gateway):
+    from services.capacity import capacity_model
+    for replica in replicas:
+        replica.faults(error_rate=1.0, error_status=400)
+    assert generate(gateway).status_code == 502
+    assert all(r.outcomes.count(False) == 0 for r in capacity_model.replicas[MODEL])
+    for replica in replicas:
+        replica.faults(error_status=503)
+    assert generate(gateway).status_code == 502
+    assert sum(r.outcomes.count(False) for r in capacity_model.replicas[MODEL]) == 1
+    for replica in capacity_model.replicas[MODEL]:
+        replica.outcomes.clear()
+
+
+def test_sql_completion_stops_at_end_of_statement(gateway):
+    schema = gateway.post("/schemas", json={"schema": "CREATE TABLE employees (name TEXT, hire_date DATE);"})
+    assert schema.status_code == 201
+    start = time.perf_counter()
+    resp = gateway.post("/generate/sql", json={"model": MODEL, "schema_id": schema.json()["schema_id"],
+                                               "question": "Who was hired after 2020?"})
+    elapsed = time.perf_counter() - start
+    assert resp.status_code == 200
+    assert resp.json()["sql"] == STATEMENT
+    # The stream is closed after the statement instead of decoding the whole budget
+    assert elapsed < len(COMPLETION.split()) / TOKENS_PER_SEC
+
+
+def test_plain_completion_is_not_cut(gateway):
+    resp = gateway.post("/api/generate", json={"model": MODEL, "prompt": "list employees", "max_tokens": 64})
+    assert resp.status_code == 200
+    assert "Explanation:" in resp.json()["response"]
+
+
+def test_idempotent_retries_share_one_generation(replicas, gateway):
+    from services.idempotency import idempotency_store
+    for replica in replicas:
+        replica.faults(slow_rate=1.0, slow_ms=300)
+    absorbed = idempotency_store.stats()["duplicates_absorbed"]
+    headers = {"Idempotency-Key": "retry-test-1"}
+    with ThreadPoolExecutor(2) as pool:
+        first, retry = pool.map(lambda _: generate(gateway, headers=headers), range(2))
+    assert first.status_code == retry.status_code == 200
+    assert first.json() == retry.json()
+    assert sorted(r.headers.get("Idempotent-Replayed", "") for r in (first, retry)) == ["", "true"]
+
+    replay = generate(gateway, headers=headers)
+    assert replay.json() == first.json() and replay.headers["Idempotent-Replayed"] == "true"
+    assert idempotency_store.stats()["duplicates_absorbed"] == absorbed + 2
+    # The same key with a different body is a client bug, not a retry
+    assert generate(gateway, prompt="something else", headers=headers).status_code == 422
+
+
+def test_batch_job_resumes_from_checkpoint(replicas, gateway):
+    from services.batch_jobs import COMPLETED, INTERRUPTED, batch_manager
+    for replica in replicas:
+        replica.faults(slow_rate=1.0, slow_ms=100)
+    prompts = "".join(json.dumps({"id": f"q{i}", "prompt": f"question {i}"}) + "\n" for i in range(1, 25))
+    resp = gateway.post("/batch/jobs", data={"model": MODEL, "max_tokens": "8", "concurrency": "1"},
+                        files={"file": ("prompts.jsonl", prompts)})
+    assert resp.status_code == 202
+    job_id = resp.json()["id"]
+
+    deadline = time.monotonic() + 10
+    while batch_manager.jobs[job_id].processed < 4:
+        assert time.monotonic() < deadline, "batch job made no progress"
+        time.sleep(0.02)
+    # Shut down mid-job, as a gateway restart would
+    gateway.portal.call(batch_manager.stop)
+    job = batch_manager.jobs[job_id]
+    assert job.state == INTERRUPTED and 4 <= job.processed < 24
+    with open(job.output_path) as f:
+        assert len(f.readlines()) == job.processed
+
+    gateway.portal.call(batch_manager.start)
+    deadline = time.monotonic() + 20
+    while batch_manager.jobs[job_id].state != COMPLETED:
+        assert time.monotonic() < deadline, f"batch job ended {batch_manager.jobs[job_id].state}"
+        time.sleep(0.05)
+    results = gateway.get(f"/batch/jobs/{job_id}/results")
+    records = [json.loads(line) for line in results.text.splitlines()]
+    assert [r["id"] for r in records] == [f"q{i}" for i in range(1, 25)]
+    assert [r["line"] for r in records] == list(range(1, 25))
+    assert all("text" in r for r in records)
+
+
+def test_load_test_counts_output_tokens_not_chunks(gateway):
+    from services.load_test import COMPLETED, RUNNING, load_test_manager
+    resp = gateway.post("/load-tests", json={"model": MODEL, "prompts": ["list employees"], "concurrency": 2,
+                                             "requests_per_user": 2, "max_tokens": 10, "stop": []})
+    assert resp.status_code == 202
+    run = load_test_manager.runs[resp.json()["id"]]
+
+    deadline = time.monotonic() + 10
+    while run.state == RUNNING:
+        assert time.monotonic() < deadline, "load test did not finish"
+        time.sleep(0.02)
+    assert run.state == COMPLETED and run.completed == 4 and run.errors == 0
+    # 10 tokens a request in 3 chunks each: the count comes from usage.completion_tokens
+    assert run.output_tokens == 4 * 10
@@ -0,0 +1,29 @@
+"""Access control of the /admin/profiling endpoints."""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import profiling_routes
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(profiling_routes.router)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("enabled, token, sent, status", [
+    (False, "secret", "secret", 404),
+    (True, "", None, 403),          # Enabled without a token: refused, not open
+    (True, "", "anything", 403),
+    (True, "secret", None, 403),
+    (True, "secret", "wrong", 403),
+    (True, "secret", "secret", 200),
+])
+def test_profiling_endpoints_need_a_token(client, monkeypatch, enabled, token, sent, status):
+    monkeypatch.setattr(profiling_routes, "PROFILING_ENABLED", enabled)
+    monkeypatch.setattr(profiling_routes, "PROFILING_TOKEN", token)
+    headers = {"X-Profiling-Token": sent} if sent is not None else {}
+    assert client.get("/admin/profiling", headers=headers).status_code == status
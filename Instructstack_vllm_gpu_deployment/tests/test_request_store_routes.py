@@ -0,0 +1,80 @@
+"""Access control of the /requests endpoints, and opening the request store at startup rather than import."""
+
+import asyncio
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import request_store_routes
+from services.request_store import RequestStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = RequestStore(str(tmp_path / "requests.db"))
+    yield store
+    asyncio.run(store.stop())
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    monkeypatch.setattr(request_store_routes, "request_store", store)
+    app = FastAPI()
+    app.include_router(request_store_routes.router)
+    return TestClient(app)
+
+
+def wait_until_open(store: RequestStore) -> None:
+    deadline = time.monotonic() + 5
+    while not store.available and store.open_error is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("token, sent, status", [
+    ("", None, 403),          # No token configured: refused, not open
+    ("", "anything", 403),
+    ("secret", None, 403),
+    ("secret", "wrong", 403),
+    ("secret", "secret", 200),
+])
+def test_request_store_endpoints_need_a_token(client, store, monkeypatch, token, sent, status):
+    monkeypatch.setattr(request_store_routes, "REQUEST_STORE_TOKEN", token)
+    store.start()
+    wait_until_open(store)
+    headers = {"X-Request-Store-Token": sent} if sent is not None else {}
+    assert client.get("/requests/recent", headers=headers).status_code == status
+
+
+def test_disabled_store_is_not_found(client, monkeypatch):
+    monkeypatch.setattr(request_store_routes, "request_store", None)
+    monkeypatch.setattr(request_store_routes, "REQUEST_STORE_TOKEN", "secret")
+    assert client.get("/requests/recent", headers={"X-Request-Store-Token": "secret"}).status_code == 404
+
+
+def test_database_is_opened_by_start_not_at_construction(client, store, monkeypatch):
+    monkeypatch.setattr(request_store_routes, "REQUEST_STORE_TOKEN", "secret")
+    headers = {"X-Request-Store-Token": "secret"}
+    assert not os.path.exists(store.path)
+    assert client.get("/requests/recent", headers=headers).status_code == 503  # Not opened yet
+
+    store.record(model="m", status="ok", prompt="SELECT 1", completion="1")  # Queued until the database is open
+    store.start()
+    wait_until_open(store)
+    asyncio.run(store.stop())
+    rows = client.get("/requests/recent", headers=headers).json()["requests"]
+    assert [row["prompt"] for row in rows] == ["SELECT 1"]
+
+
+def test_unopenable_database_disables_recording(tmp_path):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    store = RequestStore(str(blocker / "requests.db"))
+    store.start()
+    wait_until_open(store)
+    assert not store.available and store.open_error
+    store.record(model="m", status="ok", prompt="x")
+    assert store.queue.qsize() == 0
+    asyncio.run(store.stop())
@@ -0,0 +1,71 @@
+"""Semantic cache: the constraint guard that keeps near-identical questions with different SQL apart."""
+
+import random
+
+import pytest
+
+from semantic_cache_bench import QUESTION_GROUPS, SCOPE, replay
+from services.semantic_cache import HashingEmbedder, SemanticCache, constraint_tokens
+
+
+class ConstantEmbedder:
+    """Embeds every question identically, so only the constraint guard decides a hit."""
+
+    name = "constant"
+    default_threshold = 0.9
+
+    def embed(self, text):
+        return {0: 1.0}
+
+
+DIFFERENT_SQL = [
+    ("Show employees with salary over 100k", "Show employees with salary over 50k"),
+    ("Employees hired in 2020 or later", "Employees hired after 2020"),
+    ("Orders with 5 or more items", "Orders with more than 5 items"),
+    ("Employees with salary 100k and above", "Employees with salary above 100k"),
+    ("Employees with at least 5 projects", "Employees with more than 5 projects"),
+    ("Employees hired since 2020", "Employees hired after 2020"),
+    ("Products with a discount above 5%", "Products with a discount above 5"),
+    ("Employees with no more than 3 projects", "Employees with less than 3 projects"),
+]
+
+SAME_SQL = [
+    ("Employees hired since 2020", "Employees hired in 2020 or later"),
+    ("Employees with salary 100k and above", "Employees with salary of at least 100k"),
+    ("Staff hired post-2020", "Staff hired after 2020"),
+    ("Employees earning over 10", "Employees earning more than 10"),
+    ("Employees hired on or before 2020", "Employees hired until 2020"),
+]
+
+
+@pytest.mark.parametrize("first,second", DIFFERENT_SQL)
+def test_different_constraints_never_share_an_answer(first, second):
+    assert constraint_tokens(first) != constraint_tokens(second)
+    cache = SemanticCache(ConstantEmbedder(), ttl=0)
+    cache.store(SCOPE, first, "first")
+    assert cache.lookup(SCOPE, second) is None
+
+
+@pytest.mark.parametrize("first,second", SAME_SQL)
+def test_synonymous_constraints_share_an_answer(first, second):
+    assert constraint_tokens(first) == constraint_tokens(second)
+    cache = SemanticCache(ConstantEmbedder(), ttl=0)
+    cache.store(SCOPE, first, "first")
+    assert cache.lookup(SCOPE, second).answer == "first"
+
+
+def test_inclusive_phrases_do_not_add_the_exclusive_constraint():
+    assert constraint_tokens("at least 5 orders") == {"5", "at_least"}  # Not "min" from "least"
+    assert constraint_tokens("no more than 3 orders") == {"3", "at_most"}  # Not "not" or "more"
+
+
+def test_hashing_default_threshold_serves_no_wrong_hits():
+    """The calibration of semantic_cache_bench.py: no shuffled replay of its question set hits a wrong answer."""
+    embedder = HashingEmbedder()
+    questions = [(group, q) for group, qs in QUESTION_GROUPS.items() for q in qs]
+    rng = random.Random(7)
+    for _ in range(10):
+        rng.shuffle(questions)
+        result = replay(SemanticCache(embedder, ttl=0), questions)
+        assert result["wrong"] == 0
+        assert result["hits"] > 0
@@ -0,0 +1,134 @@
+"""Traffic classes: reserved and borrowed slots, the interactive SLO pause, and preemption of batch work."""
+
+import asyncio
+import time
+
+import pytest
+
+from services import vllm_client
+from services.capacity import CapacityModel
+from services.traffic_classes import BATCH, INTERACTIVE, TrafficClass, TrafficController
+
+MODEL = "yasserrmd/Text2SQL-1.5B"
+
+
+def make(slots: int = 4, batch_limit: float = 0.5, slo_ms: float = 50, max_wait_s: float = 5,
+         preempt: bool = True) -> TrafficController:
+    classes = [
+        TrafficClass(INTERACTIVE, priority=0, reserved=0.5, limit=1.0, slo_ms=slo_ms, max_wait_s=max_wait_s),
+        TrafficClass(BATCH, priority=1, reserved=0.0, limit=batch_limit, preemptible=True),
+    ]
+    # One replica, never scraped: it counts as reachable
+    return TrafficController(classes, CapacityModel({MODEL: ["http://replica-1:8000"]}),
+                             slots_per_replica=slots, preempt=preempt, pause_hold=5, check_interval=60)
+
+
+def admissible(controller: TrafficController, name: str, **in_use) -> bool:
+    controller._in_use[MODEL] = dict(in_use)
+    return controller._admissible(MODEL, controller.classes[name], time.monotonic())
+
+
+def test_batch_borrows_idle_slots_up_to_its_limit():
+    controller = make()
+    assert admissible(controller, BATCH)
+    assert admissible(controller, BATCH, batch=1)
+    assert not admissible(controller, BATCH, batch=2)  # limit 0.5 of 4 slots
+
+
+def test_borrowing_leaves_the_other_class_reservation_free():
+    controller = make(batch_limit=1.0)
+    # Interactive reserves 2 of 4 slots; with 2 taken by batch, the other 2 stay interactive's
+    assert admissible(controller, BATCH, batch=1)
+    assert not admissible(controller, BATCH, batch=2)
+    assert admissible(controller, INTERACTIVE, batch=2)
+    # Once interactive uses its reservation, batch may borrow what is left
+    assert admissible(controller, BATCH, batch=1, interactive=2)
+    assert not admissible(controller, BATCH, batch=2, interactive=1)  # The last slot is interactive's
+
+
+def test_interactive_may_use_every_slot_but_not_more():
+    controller = make()
+    assert admissible(controller, INTERACTIVE, interactive=3)
+    assert not admissible(controller, INTERACTIVE, interactive=4)
+    assert not admissible(controller, INTERACTIVE, interactive=2, batch=2)
+
+
+def test_interactive_wait_over_slo_pauses_batch():
+    async def scenario():
+        controller = make(slots=2, preempt=False)
+        held = [await controller.acquire(MODEL, INTERACTIVE) for _ in range(2)]
+        waiting = asyncio.create_task(controller.acquire(MODEL, INTERACTIVE))
+        await asyncio.sleep(0.1)  # Past the 50 ms SLO
+        controller.check_slo()
+        assert controller.status()["classes"][BATCH]["paused"]
+        assert controller.stats[INTERACTIVE].slo_breaches == 1
+
+        # The freed slot goes to the waiting interactive request; batch stays paused
+        controller.release(held[0])
+        lease = await waiting
+        assert lease.traffic_class == INTERACTIVE
+        controller.release(held[1])
+        controller.release(lease)
+        assert controller.status()["classes"][BATCH]["paused"]
+        assert not controller._admissible(MODEL, controller.classes[BATCH], time.monotonic())
+
+    asyncio.run(scenario())
+
+
+def test_slo_breach_preempts_the_newest_batch_request_and_lets_it_requeue():
+    async def scenario():
+        controller = make()
+        held = [await controller.acquire(MODEL, INTERACTIVE) for _ in range(2)]
+        events = []
+
+        async def batch_request(name: str, hold: float):
+            # What batch_jobs does: run in a slot and requeue the work when preempted
+            while True:
+                async with controller.slot(MODEL, BATCH) as lease:
+                    try:
+                        await asyncio.sleep(hold)
+                    finally:
+                        events.append((name, "preempted" if lease.preempted else "done"))
+                if not lease.preempted:
+                    return
+                events.append((name, "requeued"))
+
+        older = asyncio.create_task(batch_request("older", 0.3))
+        await asyncio.sleep(0.01)
+        newer = asyncio.create_task(batch_request("newer", 0.3))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(controller.acquire(MODEL, INTERACTIVE))
+        await asyncio.sleep(0.1)
+
+        controller.check_slo()
+        lease = await asyncio.wait_for(interactive, 1)
+        assert lease.traffic_class == INTERACTIVE
+        assert controller.stats[BATCH].preempted == 1
+        assert events == [("newer", "preempted"), ("newer", "requeued")]
+
+        for interactive_lease in held + [lease]:
+            controller.release(interactive_lease)
+        controller._paused_until.clear()  # Skip the rest of the pause hold
+        controller.check_slo()
+        await asyncio.wait_for(asyncio.gather(older, newer), 2)
+        assert ("older", "done") in events and ("newer", "done") in events
+        assert controller.status()["models"][MODEL]["in_use"] == {INTERACTIVE: 0, BATCH: 0}
+
+    asyncio.run(scenario())
+
+
+def test_call_vllm_async_waits_for_a_slot_before_taking_a_worker_thread(monkeypatch):
+    def unexpected(*args):
+        pytest.fail("call_vllm ran in a worker thread without a slot")
+
+    async def scenario():
+        controller = make(slots=1, max_wait_s=0.1)
+        monkeypatch.setattr(vllm_client, "traffic_control", controller)
+        monkeypatch.setattr(vllm_client, "call_vllm", unexpected)
+        held = await controller.acquire(MODEL, INTERACTIVE)
+        result = await vllm_client.call_vllm_async({"model": MODEL, "prompt": "SELECT", "max_tokens": 8})
+        assert result.startswith("❌ All replicas of")
+        assert vllm_client.error_status(result) == 503
+        controller.release(held)
+
+    asyncio.run(scenario())